@@ -1,27 +1,253 @@
 import socketio
+import socketio.exceptions
 import os
 import platform
 import uuid
 import json
 import hashlib
+import time
 from datetime import datetime
 import argparse
+import logging
 import sys
-import psutil
 import socket
+import threading
+import mmap
+import jsonlog
+from collections import deque
+from contextlib import closing, contextmanager
+from fnmatch import fnmatch
+from stat import S_ISDIR
+from scheduler import TaskScheduler, TaskCancelled, PRIORITY_INTERACTIVE, PRIORITY_HASHING, PRIORITY_SWEEP, current_task, check_cancelled, timed, task_timings
+from governor import ResourceGovernor, parse_rate, throttle_seconds, DEFAULT_PAUSE_TIMEOUT
+from cache import ResultCache
+from watcher import Watch, WatchError, CREATED, MODIFIED, DELETED, RENAMED, DEFAULT_POLL_INTERVAL
+from reconnect import Backoff, CheckpointStore, DEFAULT_BASE_DELAY, DEFAULT_MAX_DELAY
+from profiler import Profiler, ProfileError
+from archives import ArchiveIndexes, looks_like_archive
+from delta import DeltaEncoder, Signatures
+from analytics import Analyzer, iter_strings, map_block_size, ENCODINGS, MIN_BLOCK_SIZE, STRING_WINDOW_SIZE
+
+# Number of entries sent per index_batch event while walking a tree
+INDEX_BATCH_SIZE = 1000
+
+# Minimum seconds between agent_status reports while the queue is changing
+STATUS_REPORT_INTERVAL = 1.0
+# Seconds between agent_status heartbeats when nothing changes
+STATUS_HEARTBEAT_INTERVAL = 15.0
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Chunk size of read_file replies for the hex viewer
+READ_CHUNK_SIZE = 64 * 1024
+# list_directory replies carry at most this many entries, which keeps them under the server's message size limit
+MAX_LIST_PAGE_SIZE = 2000
+# Paths accepted by one get_metadata_batch; directory matches beyond this are truncated
+METADATA_BATCH_MAX_PATHS = 10000
+# get_metadata_batch results are streamed every this many paths or seconds, whichever comes first
+METADATA_FLUSH_SIZE = 100
+METADATA_FLUSH_INTERVAL = 0.5
+
+# Chunk size of acquire_file uploads, under the server's message size limit
+ACQUIRE_CHUNK_SIZE = 512 * 1024
+# Longest run of unchanged blocks referenced by one acquire_chunk of a delta
+# acquisition. The server copies it without yielding, so it is no more than a
+# chunk of data costs it
+DELTA_COPY_REFERENCE_SIZE = ACQUIRE_CHUNK_SIZE
+# Stat fields that must be unchanged for an interrupted acquisition to resume
+SOURCE_IDENTITY_FIELDS = ('size', 'mtime_ns', 'inode', 'device')
+
+# analyze_file reads this much of a file per step and streams the entropy map every
+# ANALYSIS_PART_BLOCKS blocks
+ANALYSIS_GROUP_SIZE = 8 * 1024 * 1024
+ANALYSIS_PART_BLOCKS = 512
+# extract_strings replies carry at most this many strings or characters
+STRINGS_PART_SIZE = 1000
+STRINGS_PART_CHARS = 256 * 1024
+DEFAULT_MAX_STRINGS = 10000
+MAX_STRINGS = 100000
+# Archive members are not mapped; larger ones are not analysed
+ANALYSIS_MEMBER_MAX_SIZE = 256 * 1024 * 1024
+
+# Profile results are uploaded in parts well under the server's message size limit
+PROFILE_PART_SIZE = 256 * 1024
+
+# Seconds between background refreshes of the cached host identity
+IDENTITY_REFRESH_INTERVAL = 6 * 60 * 60
+IDENTITY_FIELDS = ('hostname', 'computer_name', 'domain_name', 'ip_addresses')
+
+logger = logging.getLogger('cif.agent')
+
+def task_log_fields():
+    """Correlation fields for records logged from a scheduler task"""
+    task = current_task()
+    if task is None:
+        return None
+    return {'correlation_id': task.id, 'task': task.name}
+
+def open_source(path):
+    """Open a file for acquisition without updating its access time where the OS allows it"""
+    flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+    noatime = getattr(os, 'O_NOATIME', 0)
+    if noatime:
+        try:
+            return os.fdopen(os.open(path, flags | noatime), 'rb'), True
+        except PermissionError:
+            # O_NOATIME needs file ownership or CAP_FOWNER
+            pass
+    return os.fdopen(os.open(path, flags), 'rb'), False
+
+def source_stat(stat):
+    """Stat of an acquired file as recorded in the chain-of-custody manifest"""
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'ctime_ns': stat.st_ctime_ns,
+        'atime_ns': stat.st_atime_ns,
+        'inode': stat.st_ino,
+        'device': stat.st_dev,
+        'mode': oct(stat.st_mode),
+        'uid': stat.st_uid,
+        'gid': stat.st_gid,
+        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+    }
 
 class CIFAgent:
-    def __init__(self, server_url):
+    def __init__(self, server_url, max_workers=4, governor=None, cache=None, backoff=None, checkpoints=None):
         self.server_url = server_url
+        self.backoff = backoff or Backoff()
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.governor = governor or ResourceGovernor()
+        self.cache = cache or ResultCache()
+        self.archives = ArchiveIndexes(on_read=self.governor.throttle_read)
+        self.watches = {}
         self.agent_id = self.get_or_create_agent_id()
-        self.hostname = platform.node()
         self.platform = platform.system()
-        self.computer_name = self.get_computer_name()
-        self.domain_name = self.get_domain_name()
-        self.ip_addresses = self.get_ip_addresses()
-        self.sio = socketio.Client()
+        # Register with cached (or cheap local) identity; the slow DNS and
+        # interface lookups run in the background once connected
+        self.identity_file = self.get_identity_file()
+        self.apply_identity(self.load_cached_identity() or self.get_quick_identity())
+        self._identity_thread = None
+        self._status_thread = None
+        # Reconnection is handled by connect() so that delays use full jitter
+        self.sio = socketio.Client(reconnection=False)
+        # Set once the server has accepted the registration of the current connection
+        self.registered = False
+        self._status_changed = threading.Event()
+        self.scheduler = TaskScheduler(max_workers=max_workers, on_change=self._status_changed.set)
+        self.profiler = Profiler(on_result=self.send_profile)
+        self.scheduler.add_wrapper(self.profiler.wrap_task)
+        self.resumers = {
+            'index_tree': lambda task_id, state: self.scheduler.submit(
+                'index_tree', self.run_index_tree, state['root'], include_hash=state.get('hash', False),
+                resume=state, priority=PRIORITY_SWEEP, task_id=task_id
+            )
+        }
         self.setup_handlers()
     
+    def on_task(self, event, priority):
+        """Register a Socket.IO handler whose work runs on the task scheduler"""
+        def decorator(func):
+            def handler(data=None):
+                data = data or {}
+                # The server's request id doubles as the task id so logs and cancels line up
+                task_id = data.get('task_id') or data.get('request_id')
+                logger.debug('Command received', extra={'sample': event, 'command': event, 'correlation_id': task_id})
+                self.scheduler.submit(event, func, data, priority=priority, task_id=task_id)
+            self.sio.on(event, handler)
+            return func
+        return decorator
+    
+    def report_status(self):
+        """Send queue depth and running tasks to the server, rate limited"""
+        while True:
+            self._status_changed.wait(STATUS_HEARTBEAT_INTERVAL)
+            self._status_changed.clear()
+            if self.sio.connected:
+                try:
+                    self.sio.emit('agent_status', {
+                        'agent_id': self.agent_id,
+                        'queue': self.scheduler.queue_depth(),
+                        'tasks': self.scheduler.tasks(),
+                        'governor': self.governor.limits(),
+                        'cache': self.cache.stats(),
+                        'profile': self.profiler.active(),
+                        'watches': [{'watch_id': w.id, 'path': w.root, 'mode': w.mode} for w in self.watches.values()]
+                    })
+                except Exception as e:
+                    logger.warning('Could not report agent status', extra={'error': str(e)})
+            time.sleep(STATUS_REPORT_INTERVAL)
+    
+    def get_identity_file(self):
+        """Path of the cached host identity, next to the agent ID file"""
+        if platform.system() == 'Windows':
+            return os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'cif_agent_identity.json')
+        return os.path.expanduser('~/.cif_agent_identity.json')
+    
+    def load_cached_identity(self):
+        """Load the host identity saved by a previous run, if any"""
+        try:
+            with open(self.identity_file, 'r') as f:
+                identity = json.load(f)
+            if all(field in identity for field in IDENTITY_FIELDS):
+                return identity
+        except (OSError, ValueError):
+            pass
+        return None
+    
+    def save_cached_identity(self, identity):
+        try:
+            os.makedirs(os.path.dirname(self.identity_file), exist_ok=True)
+            with open(self.identity_file, 'w') as f:
+                json.dump(dict(identity, gathered_at=time.time()), f)
+        except OSError as e:
+            logger.warning('Could not save host identity', extra={'error': str(e)})
+    
+    def get_quick_identity(self):
+        """Identity that needs no DNS or interface enumeration"""
+        hostname = platform.node()
+        computer_name = os.getenv('COMPUTERNAME', hostname) if platform.system() == 'Windows' else hostname
+        return {
+            'hostname': hostname,
+            'computer_name': computer_name,
+            'domain_name': os.getenv('USERDOMAIN') if platform.system() == 'Windows' else None,
+            'ip_addresses': []
+        }
+    
+    def gather_identity(self):
+        """Full identity lookup; may block on DNS"""
+        return {
+            'hostname': platform.node(),
+            'computer_name': self.get_computer_name(),
+            'domain_name': self.get_domain_name(),
+            'ip_addresses': self.get_ip_addresses()
+        }
+    
+    def apply_identity(self, identity):
+        for field in IDENTITY_FIELDS:
+            setattr(self, field, identity.get(field))
+    
+    def current_identity(self):
+        return {field: getattr(self, field) for field in IDENTITY_FIELDS}
+    
+    def refresh_identity(self):
+        """Gather host identity in the background and send changes to the server"""
+        while True:
+            try:
+                identity = self.gather_identity()
+                changed = identity != self.current_identity()
+                self.apply_identity(identity)
+                self.save_cached_identity(identity)
+                if changed and self.sio.connected:
+                    self.sio.emit('agent_update', dict(identity, agent_id=self.agent_id))
+            except Exception as e:
+                logger.warning('Could not refresh host identity', extra={'error': str(e)})
+            time.sleep(IDENTITY_REFRESH_INTERVAL)
+    
+    def start_identity_refresh(self):
+        if self._identity_thread is None:
+            self._identity_thread = threading.Thread(target=self.refresh_identity, name='cif-identity', daemon=True)
+            self._identity_thread.start()
+    
     def get_computer_name(self):
         """Get computer name"""
         try:
@@ -75,7 +301,7 @@ class CIFAgent:
             
             return None
         except Exception as e:
-            print(f'Warning: Could not determine domain name: {e}')
+            logger.warning('Could not determine domain name', extra={'error': str(e)})
             return None
     
     def get_ip_addresses(self):
@@ -108,7 +334,7 @@ class CIFAgent:
                             if ip and ip not in ip_addresses and not ip.startswith('::1'):
                                 ip_addresses.append(ip)
             except Exception as e:
-                print(f'Warning: Could not enumerate all IP addresses: {e}')
+                logger.warning('Could not enumerate all IP addresses', extra={'error': str(e)})
             
             # Fallback: try connecting to external server to determine public IP
             if not ip_addresses:
@@ -124,7 +350,7 @@ class CIFAgent:
             
             return ip_addresses if ip_addresses else ['Unknown']
         except Exception as e:
-            print(f'Warning: Could not determine IP addresses: {e}')
+            logger.warning('Could not determine IP addresses', extra={'error': str(e)})
             return ['Unknown']
         
     def get_or_create_agent_id(self):
@@ -148,7 +374,7 @@ class CIFAgent:
             with open(agent_id_file, 'w') as f:
                 f.write(agent_id)
         except Exception as e:
-            print(f'Warning: Could not save agent ID: {e}')
+            logger.warning('Could not save agent ID', extra={'error': str(e)})
         return agent_id
     
     def setup_handlers(self):
@@ -156,7 +382,7 @@ class CIFAgent:
         
         @self.sio.on('connect')
         def on_connect():
-            print(f'Connected to server: {self.server_url}')
+            logger.info('Connected to server', extra={'server_url': self.server_url})
             # Register with server
             self.sio.emit('agent_register', {
                 'agent_id': self.agent_id,
@@ -169,84 +395,215 @@ class CIFAgent:
         
         @self.sio.on('disconnect')
         def on_disconnect():
-            print('Disconnected from server')
+            # A pause belongs to the old connection; the new one starts unthrottled
+            self.governor.resume_streams()
+            self.registered = False
+            logger.info('Disconnected from server')
         
         @self.sio.on('registration_success')
         def on_registration_success(data):
-            print(f'Successfully registered as agent: {self.agent_id}')
-            print(f'Hostname: {self.hostname}')
-            print(f'Computer Name: {self.computer_name}')
-            print(f'Domain: {self.domain_name or "N/A"}')
-            print(f'Platform: {self.platform}')
-            print(f'IP Addresses: {", ".join(self.ip_addresses)}')
-        
-        @self.sio.on('list_directory')
-        def on_list_directory(data):
+            self.registered = True
+            self.start_identity_refresh()
+            self.resume_checkpoints()
+            self._status_changed.set()
+            logger.info('Successfully registered with server', extra={
+                'hostname': self.hostname,
+                'computer_name': self.computer_name,
+                'domain_name': self.domain_name,
+                'platform': self.platform,
+                'ip_addresses': self.ip_addresses or 'pending'
+            })
+        
+        @self.sio.on('pause_stream')
+        def on_pause_stream(data):
+            self.governor.pause_streams(data.get('timeout', DEFAULT_PAUSE_TIMEOUT))
+            self._status_changed.set()
+        
+        @self.sio.on('resume_stream')
+        def on_resume_stream(data):
+            self.governor.resume_streams()
+            self._status_changed.set()
+        
+        @self.sio.on('cancel_task')
+        def on_cancel_task(data):
+            task_id = data.get('task_id')
+            self.sio.emit('task_cancelled', {
+                'agent_id': self.agent_id,
+                'task_id': task_id,
+                'cancelled': self.scheduler.cancel(task_id)
+            })
+        
+        # Setting up a watch walks the whole subtree, so it runs on the scheduler
+        @self.on_task('watch_path', PRIORITY_SWEEP)
+        def on_watch_path(data):
             path = data.get('path', '/')
             try:
-                entries = self.list_directory(path)
-                self.sio.emit('filesystem_list', {
+                watch = self.start_watch(
+                    path,
+                    watch_id=data.get('watch_id'),
+                    index=data.get('index', False),
+                    force_polling=data.get('polling', False),
+                    interval=data.get('interval', DEFAULT_POLL_INTERVAL)
+                )
+                self.sio.emit('watch_started', {
+                    'agent_id': self.agent_id,
+                    'watch_id': watch.id,
+                    'path': path,
+                    'mode': watch.mode
+                })
+            except (WatchError, OSError) as e:
+                self.sio.emit('watch_started', {
                     'agent_id': self.agent_id,
+                    'watch_id': data.get('watch_id'),
                     'path': path,
-                    'entries': entries
+                    'error': str(e)
                 })
+        
+        @self.sio.on('unwatch_path')
+        def on_unwatch_path(data):
+            watch_id = data.get('watch_id')
+            self.sio.emit('watch_stopped', {
+                'agent_id': self.agent_id,
+                'watch_id': watch_id,
+                'stopped': self.stop_watch(watch_id)
+            })
+        
+        @self.sio.on('profile')
+        def on_profile(data):
+            profile_id = data.get('profile_id') or str(uuid.uuid4())
+            reply = {'agent_id': self.agent_id, 'profile_id': profile_id, 'request_id': data.get('request_id')}
+            try:
+                session = self.profiler.start(
+                    profile_id,
+                    data.get('mode'),
+                    duration=data.get('duration'),
+                    interval=data.get('interval'),
+                    task_id=data.get('task_id'),
+                    command=data.get('command')
+                )
+                reply.update(session.to_dict())
+            except (ProfileError, TypeError, ValueError) as e:
+                reply['error'] = str(e)
+            self.sio.emit('profile_started', reply)
+            self._status_changed.set()
+        
+        @self.sio.on('stop_profile')
+        def on_stop_profile(data):
+            self.sio.emit('profile_stopped', {
+                'agent_id': self.agent_id,
+                'profile_id': data.get('profile_id'),
+                'stopped': self.profiler.stop(data.get('profile_id'))
+            })
+        
+        @self.on_task('list_directory', PRIORITY_INTERACTIVE)
+        def on_list_directory(data):
+            path = data.get('path', '/')
+            try:
+                with timed('list_directory'):
+                    entries = self.list_directory(path, use_cache=not data.get('refresh', False))
+                page_size = min(max(int(data.get('page_size') or MAX_LIST_PAGE_SIZE), 1), MAX_LIST_PAGE_SIZE)
+                # Large listings go out in pages, so the first entries can be shown while the rest stream
+                for offset in range(0, max(len(entries), 1), page_size):
+                    self.governor.wait_for_stream()
+                    page = {
+                        'agent_id': self.agent_id,
+                        'request_id': data.get('request_id'),
+                        'path': path,
+                        'entries': entries[offset:offset + page_size],
+                        'offset': offset,
+                        'total': len(entries),
+                        'done': offset + page_size >= len(entries)
+                    }
+                    # Timings are per task, so only the last page carries them
+                    if page['done']:
+                        page['timings'] = task_timings()
+                    self.sio.emit('filesystem_list', page)
             except Exception as e:
                 self.sio.emit('filesystem_list', {
                     'agent_id': self.agent_id,
+                    'request_id': data.get('request_id'),
                     'path': path,
                     'error': str(e),
-                    'entries': []
+                    'entries': [],
+                    'offset': 0,
+                    'total': 0,
+                    'done': True
                 })
         
-        @self.sio.on('read_file')
+        @self.on_task('read_file', PRIORITY_INTERACTIVE)
         def on_read_file(data):
             file_path = data.get('path')
             try:
-                # Read file in chunks for large files
-                chunk_size = 1024 * 64  # 64KB chunks
                 chunk_number = data.get('chunk_number', 0)
+                chunk, file_size = self.read_chunk(file_path, chunk_number)
+                hex_data = chunk.hex()
                 
-                with open(file_path, 'rb') as f:
-                    f.seek(chunk_number * chunk_size)
-                    chunk = f.read(chunk_size)
-                    hex_data = chunk.hex()
-                    
-                    self.sio.emit('file_content', {
-                        'agent_id': self.agent_id,
-                        'path': file_path,
-                        'chunk_number': chunk_number,
-                        'hex_data': hex_data,
-                        'size': len(chunk),
-                        'file_size': os.path.getsize(file_path),
-                        'offset': chunk_number * chunk_size
-                    })
+                self.governor.wait_for_stream()
+                self.sio.emit('file_content', {
+                    'agent_id': self.agent_id,
+                    'request_id': data.get('request_id'),
+                    'path': file_path,
+                    'chunk_number': chunk_number,
+                    'hex_data': hex_data,
+                    'size': len(chunk),
+                    'file_size': file_size,
+                    'offset': chunk_number * READ_CHUNK_SIZE,
+                    'timings': task_timings()
+                })
             except Exception as e:
                 self.sio.emit('file_content', {
                     'agent_id': self.agent_id,
+                    'request_id': data.get('request_id'),
                     'path': file_path,
                     'error': str(e)
                 })
         
-        @self.sio.on('get_metadata')
+        @self.on_task('index_tree', PRIORITY_SWEEP)
+        def on_index_tree(data):
+            self.run_index_tree(data.get('path', '/'), include_hash=data.get('hash', False))
+        
+        @self.on_task('get_metadata', PRIORITY_HASHING)
         def on_get_metadata(data):
             file_path = data.get('path')
             try:
-                metadata = self.get_file_metadata(file_path)
+                with timed('metadata'):
+                    metadata = self.get_file_metadata(file_path, use_cache=not data.get('refresh', False))
                 self.sio.emit('file_metadata', {
                     'agent_id': self.agent_id,
+                    'request_id': data.get('request_id'),
                     'path': file_path,
-                    'metadata': metadata
+                    'metadata': metadata,
+                    'throttle_time': throttle_seconds(),
+                    'timings': task_timings()
                 })
             except Exception as e:
                 self.sio.emit('file_metadata', {
                     'agent_id': self.agent_id,
+                    'request_id': data.get('request_id'),
                     'path': file_path,
                     'error': str(e)
                 })
     
-    def list_directory(self, path):
+        @self.on_task('get_metadata_batch', PRIORITY_HASHING)
+        def on_get_metadata_batch(data):
+            self.run_metadata_batch(data)
+        
+        @self.on_task('acquire_file', PRIORITY_HASHING)
+        def on_acquire_file(data):
+            self.acquire_file(data)
+        
+        @self.on_task('analyze_file', PRIORITY_HASHING)
+        def on_analyze_file(data):
+            self.analyze_file(data)
+        
+        @self.on_task('extract_strings', PRIORITY_HASHING)
+        def on_extract_strings(data):
+            self.extract_strings(data)
+    
+    def list_directory(self, path, use_cache=True):
         """List directory contents"""
         entries = []
+        dir_stat = None
         
         try:
             # Normalize path for Windows
@@ -256,11 +613,20 @@ class CIFAgent:
                     path = os.getcwd()
             
             if not os.path.exists(path):
-                return entries
+                # Directories inside zip, tar and gzip archives are listed from the archive's index
+                members = self.archives.list(path)
+                return members if members is not None else entries
             
             if not os.path.isdir(path):
                 return entries
             
+            # A single stat of the directory validates a cached listing
+            dir_stat = os.stat(path)
+            if use_cache:
+                cached = self.cache.get('listing', path, dir_stat)
+                if cached is not None:
+                    return cached
+            
             for item in os.listdir(path):
                 item_path = os.path.join(path, item)
                 try:
@@ -277,6 +643,8 @@ class CIFAgent:
                         'uid': stat.st_uid if hasattr(stat, 'st_uid') else None,
                         'gid': stat.st_gid if hasattr(stat, 'st_gid') else None
                     }
+                    if not entry['is_directory'] and looks_like_archive(item):
+                        entry['archive'] = True
                     entries.append(entry)
                 except PermissionError:
                     entry = {
@@ -295,17 +663,597 @@ class CIFAgent:
                     }
                     entries.append(entry)
         except Exception as e:
-            print(f'Error listing directory {path}: {e}')
+            logger.warning('Error listing directory', extra={'path': path, 'error': str(e)})
             raise
         
-        return sorted(entries, key=lambda x: (not x.get('is_directory', False), x['name'].lower()))
+        entries = sorted(entries, key=lambda x: (not x.get('is_directory', False), x['name'].lower()))
+        if dir_stat is not None:
+            self.cache.put('listing', path, dir_stat, entries, cost=len(entries))
+        return entries
+    
+    def resolve_batch_paths(self, data):
+        """Paths of a get_metadata_batch: an explicit list, or files in a directory matching a pattern"""
+        if data.get('paths') is not None:
+            paths = [path for path in data['paths'] if isinstance(path, str) and path]
+            return paths[:METADATA_BATCH_MAX_PATHS], len(paths) > METADATA_BATCH_MAX_PATHS
+        directory = data.get('directory')
+        if not directory:
+            raise ValueError('get_metadata_batch needs paths or a directory')
+        pattern = data.get('pattern') or '*'
+        if data.get('recursive'):
+            entries = (e for e in self.walk_tree(directory) if not e['is_directory'] and 'error' not in e)
+        else:
+            entries = (e for e in self.list_directory(directory) if not e.get('is_directory') and 'error' not in e)
+        paths = []
+        for entry in entries:
+            if fnmatch(entry['name'], pattern):
+                if len(paths) == METADATA_BATCH_MAX_PATHS:
+                    return sorted(paths), True
+                paths.append(entry['path'])
+        return sorted(paths), False
     
-    def get_file_metadata(self, file_path):
-        """Get comprehensive file metadata"""
+    def run_metadata_batch(self, data):
+        """Resolve a get_metadata_batch and spread it over the hashing workers
+
+        The paths go on a shared queue. This task and up to one helper task per
+        background worker take paths from it, so a helper that is cancelled or
+        never starts leaves nothing behind. Whichever part finishes last sends
+        the final reply with ``done``.
+        """
+        batch_id = current_task().id
+        reply = {'agent_id': self.agent_id, 'request_id': data.get('request_id'), 'batch_id': batch_id}
+        try:
+            with timed('metadata'):
+                paths, truncated = self.resolve_batch_paths(data)
+        except (OSError, ValueError) as e:
+            self.sio.emit('file_metadata_batch', dict(reply, results=[], done=True, error=str(e)))
+            return
+        batch = {
+            'reply': dict(reply, total=len(paths), truncated=truncated),
+            'pending': deque(enumerate(paths)),
+            'refresh': data.get('refresh', False),
+            'lock': threading.Lock(),
+            'active': 1,
+            'done': False,
+            'succeeded': 0,
+            'failed': 0,
+        }
+        helpers = min(self.scheduler.background_limit, len(paths)) - 1
+        for _ in range(helpers):
+            self.scheduler.submit(
+                'get_metadata_batch', self.process_metadata_batch, batch, True,
+                priority=PRIORITY_HASHING, group=batch_id
+            )
+        self.process_metadata_batch(batch)
+    
+    def process_metadata_batch(self, batch, helper=False):
+        """Take paths from a batch's queue until it is empty, streaming results"""
+        if helper:
+            with batch['lock']:
+                if batch['done'] or not batch['pending']:
+                    return
+                batch['active'] += 1
+        results = []
+        flushed = time.monotonic()
+        try:
+            while True:
+                check_cancelled()
+                with batch['lock']:
+                    if not batch['pending']:
+                        break
+                    index, path = batch['pending'].popleft()
+                try:
+                    with timed('metadata'):
+                        metadata = self.get_file_metadata(path, use_cache=not batch['refresh'])
+                    results.append({'index': index, 'path': path, 'metadata': metadata})
+                except Exception as e:
+                    results.append({'index': index, 'path': path, 'error': str(e)})
+                if len(results) >= METADATA_FLUSH_SIZE or time.monotonic() - flushed >= METADATA_FLUSH_INTERVAL:
+                    self.emit_metadata_batch(batch, results)
+                    results = []
+                    flushed = time.monotonic()
+        finally:
+            with batch['lock']:
+                batch['active'] -= 1
+                last = batch['active'] == 0 and not batch['done']
+                if last:
+                    batch['done'] = True
+            if results or last:
+                self.emit_metadata_batch(batch, results, last=last, timings=task_timings())
+    
+    def emit_metadata_batch(self, batch, results, last=False, timings=None):
+        self.governor.wait_for_stream()
+        with batch['lock']:
+            failed = sum(1 for result in results if 'error' in result)
+            batch['failed'] += failed
+            batch['succeeded'] += len(results) - failed
+            reply = dict(batch['reply'], results=results, done=last)
+            if last:
+                task = current_task()
+                reply.update(
+                    succeeded=batch['succeeded'],
+                    failed=batch['failed'],
+                    # Paths left unprocessed because the batch was cancelled
+                    skipped=len(batch['pending']),
+                    cancelled=task is not None and task.cancelled,
+                    throttle_time=throttle_seconds()
+                )
+        if timings:
+            reply['timings'] = timings
+        self.sio.emit('file_metadata_batch', reply)
+    
+    def run_index_tree(self, root, include_hash=False, resume=None):
+        """Walk root and stream it to the server as index_batch events, checkpointing progress"""
+        task_id = current_task().id
+        progress = {'stack': list(resume['stack']) if resume else [root], 'current': None}
+        batch_number = resume['batch_number'] if resume else 0
+        entry_count = resume['entry_count'] if resume else 0
+        batch = []
+        
+        def save_checkpoint(force=False):
+            # The directory being scanned is re-read on resume; the server
+            # upserts index rows, so entries sent twice are harmless
+            pending = progress['stack'] + ([progress['current']] if progress['current'] else [])
+            self.checkpoints.save(task_id, 'index_tree', {
+                'root': root,
+                'hash': include_hash,
+                'stack': pending,
+                'batch_number': batch_number,
+                'entry_count': entry_count
+            }, force=force)
+        
+        save_checkpoint(force=True)
+        try:
+            for entry in self.walk_tree(root, include_hash=include_hash, progress=progress):
+                batch.append(entry)
+                entry_count += 1
+                if len(batch) >= INDEX_BATCH_SIZE:
+                    self.governor.wait_for_stream()
+                    self.sio.emit('index_batch', {
+                        'agent_id': self.agent_id,
+                        'task_id': task_id,
+                        'root': root,
+                        'batch_number': batch_number,
+                        'entries': batch
+                    })
+                    batch = []
+                    batch_number += 1
+                    save_checkpoint()
+            self.sio.emit('index_batch', {
+                'agent_id': self.agent_id,
+                'task_id': task_id,
+                'root': root,
+                'batch_number': batch_number,
+                'entries': batch,
+                'entry_count': entry_count,
+                'throttle_time': throttle_seconds(),
+                'timings': task_timings(),
+                'done': True
+            })
+            self.checkpoints.remove(task_id)
+        except Exception as e:
+            if not isinstance(e, TaskCancelled) and not self.sio.connected:
+                # Lost the server mid-walk: keep the checkpoint and resume after reconnecting
+                logger.warning('Index interrupted by disconnect; will resume', extra={'root': root})
+                raise
+            self.checkpoints.remove(task_id)
+            self.sio.emit('index_batch', {
+                'agent_id': self.agent_id,
+                'task_id': task_id,
+                'root': root,
+                'batch_number': batch_number,
+                'entries': batch,
+                'entry_count': entry_count,
+                'throttle_time': throttle_seconds(),
+                'timings': task_timings(),
+                'error': str(e),
+                'done': True
+            })
+    
+    def resume_checkpoints(self):
+        """Resubmit long-running tasks interrupted by a disconnect or restart"""
+        for checkpoint in self.checkpoints.load_all():
+            task_id = checkpoint.get('task_id')
+            resume = self.resumers.get(checkpoint.get('kind'))
+            if resume is None or self.scheduler.has_task(task_id):
+                continue
+            logger.info('Resuming task from checkpoint', extra={'kind': checkpoint['kind'], 'correlation_id': task_id})
+            resume(task_id, checkpoint['state'])
+    
+    def walk_tree(self, root, include_hash=False, progress=None):
+        """Walk a subtree depth-first, yielding index entries without following symlinks
+
+        ``progress`` may carry a 'stack' of directories to resume from; it is
+        updated in place with the pending stack and the directory being read.
+        """
+        if progress is None:
+            progress = {'stack': [root], 'current': None}
+        stack = progress['stack']
+        while stack:
+            check_cancelled()
+            directory = stack.pop()
+            progress['current'] = directory
+            try:
+                with timed('scan'), os.scandir(directory) as it:
+                    items = list(it)
+                self.governor.throttle_ops(1 + len(items))
+            except OSError:
+                if directory == root:
+                    raise
+                continue
+            for item in items:
+                try:
+                    stat = item.stat(follow_symlinks=False)
+                    is_dir = item.is_dir(follow_symlinks=False)
+                    entry = self.build_index_entry(item.name, item.path, stat, is_dir)
+                    if is_dir:
+                        stack.append(item.path)
+                    elif include_hash and item.is_file(follow_symlinks=False) and stat.st_size < 100 * 1024 * 1024:
+                        try:
+                            entry['md5'] = self.hash_file(item.path)
+                        except OSError as e:
+                            entry['hash_error'] = str(e)
+                except PermissionError:
+                    entry = {
+                        'name': item.name,
+                        'path': item.path,
+                        'is_directory': False,
+                        'error': 'Permission denied'
+                    }
+                except OSError as e:
+                    entry = {
+                        'name': item.name,
+                        'path': item.path,
+                        'is_directory': False,
+                        'error': str(e)
+                    }
+                yield entry
+    
+    def build_index_entry(self, name, path, stat, is_dir):
+        """Build an index entry from an lstat result"""
+        return {
+            'name': name,
+            'path': path,
+            'is_directory': is_dir,
+            'size': stat.st_size if not is_dir else 0,
+            'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'accessed': datetime.fromtimestamp(stat.st_atime).isoformat(),
+            'mode': oct(stat.st_mode)[-3:],
+            'uid': stat.st_uid,
+            'gid': stat.st_gid,
+            'inode': stat.st_ino
+        }
+    
+    def start_watch(self, root, watch_id=None, index=False, force_polling=False, interval=DEFAULT_POLL_INTERVAL):
+        """Start streaming change events for a subtree to the server"""
+        watch_id = watch_id or str(uuid.uuid4())
+        
+        def emit_events(events):
+            for event in events:
+                # Stat at flush time so coalesced events carry the latest state
+                if event['type'] in (CREATED, MODIFIED, RENAMED) and event['path']:
+                    try:
+                        stat = os.lstat(event['path'])
+                    except OSError:
+                        continue
+                    event['entry'] = self.build_index_entry(
+                        os.path.basename(event['path']), event['path'], stat, S_ISDIR(stat.st_mode)
+                    )
+                    self.cache.invalidate(os.path.dirname(event['path']))
+                elif event['type'] == DELETED:
+                    self.cache.invalidate(os.path.dirname(event['path']))
+                if event.get('old_path'):
+                    self.cache.invalidate(os.path.dirname(event['old_path']))
+            if not events:
+                return
+            if not self.registered:
+                # Queued again as an overflow of the root, sent once registered again so the server rewalks the subtree
+                watch.coalescer.overflow(root)
+                return
+            self.sio.emit('watch_events', {
+                'agent_id': self.agent_id,
+                'watch_id': watch_id,
+                'root': root,
+                'index': index,
+                'events': events
+            })
+        
+        watch = Watch(root, emit_events, watch_id=watch_id, force_polling=force_polling, interval=interval)
+        self.watches[watch.id] = watch
+        return watch
+    
+    def stop_watch(self, watch_id):
+        watch = self.watches.pop(watch_id, None)
+        if watch is None:
+            return False
+        watch.stop()
+        return True
+    
+    def send_profile(self, session, data, fmt, summary, error):
+        """Upload a finished profile to the server in parts"""
+        self._status_changed.set()
+        if not self.sio.connected:
+            logger.warning('Not connected; profile result discarded', extra={'profile_id': session.id})
+            return
+        data = data or b''
+        parts = max((len(data) + PROFILE_PART_SIZE - 1) // PROFILE_PART_SIZE, 1)
+        for part in range(parts):
+            reply = {
+                'agent_id': self.agent_id,
+                'profile_id': session.id,
+                'part': part,
+                'parts': parts,
+                'data': data[part * PROFILE_PART_SIZE:(part + 1) * PROFILE_PART_SIZE]
+            }
+            if part == parts - 1:
+                reply.update({
+                    'mode': session.mode,
+                    'format': fmt,
+                    'size': len(data),
+                    'summary': summary,
+                    'error': error,
+                    'profiled_task': session.profiled_task
+                })
+            self.sio.emit('profile_result', reply)
+    
+    def acquire_file(self, data):
+        """Stream a file to the server's evidence store, hashing exactly the bytes sent
+        
+        The file is read once: SHA-256 and MD5 are updated with each chunk as it
+        is emitted, and the server hashes what it stores to verify them. A
+        resumed acquisition (offset > 0) re-hashes the part the server already
+        holds without sending it, after checking the file is the one that was
+        being acquired. The digests also seed the metadata cache, so a later
+        get_metadata does not read the file again.
+        
+        With delta signatures of an earlier acquisition, blocks the server
+        already holds are sent as copy_offset/length references instead of
+        data; see delta.py. Hashing is unchanged, so the digests still cover
+        every byte of the file.
+        """
+        path = data.get('path')
+        offset = data.get('offset', 0)
+        reply = {'agent_id': self.agent_id, 'request_id': data.get('request_id'), 'acquisition_id': data.get('acquisition_id')}
+        try:
+            f, noatime = open_source(path)
+        except OSError as e:
+            self.sio.emit('acquire_started', dict(reply, offset=offset, error=str(e)))
+            return
+        hashes = {'sha256': hashlib.sha256(), 'md5': hashlib.md5()}
+        position = 0
+        try:
+            encoder = DeltaEncoder(Signatures.from_message(data['delta'])) if data.get('delta') else None
+        except (KeyError, TypeError, ValueError) as e:
+            f.close()
+            self.sio.emit('acquire_started', dict(reply, offset=offset, error=f'Invalid delta signatures: {e}'))
+            return
+        try:
+            with f:
+                before = os.fstat(f.fileno())
+                source = source_stat(before)
+                expected = data.get('source')
+                if offset and (not expected or any(expected.get(k) != source[k] for k in SOURCE_IDENTITY_FIELDS)):
+                    raise ValueError('File changed since the acquisition started; acquire it again')
+                with timed('hash'):
+                    while position < offset:
+                        check_cancelled()
+                        block = f.read(min(HASH_CHUNK_SIZE, offset - position))
+                        if not block:
+                            raise ValueError(f'File is shorter than the {offset} bytes already acquired')
+                        self.governor.throttle_read(len(block))
+                        for hasher in hashes.values():
+                            hasher.update(block)
+                        position += len(block)
+                self.sio.emit('acquire_started', dict(reply, offset=offset, source=source, noatime=noatime, delta=encoder is not None))
+                while True:
+                    check_cancelled()
+                    with timed('read'):
+                        chunk = f.read(ACQUIRE_CHUNK_SIZE)
+                    if chunk:
+                        self.governor.throttle_read(len(chunk))
+                        with timed('hash'):
+                            for hasher in hashes.values():
+                                hasher.update(chunk)
+                    if encoder is None:
+                        ops = [('data', chunk)] if chunk else []
+                    else:
+                        with timed('delta'):
+                            ops = encoder.feed(chunk) if chunk else encoder.finish()
+                    for op in ops:
+                        if op[0] == 'copy':
+                            for start in range(0, op[2], DELTA_COPY_REFERENCE_SIZE):
+                                length = min(DELTA_COPY_REFERENCE_SIZE, op[2] - start)
+                                self.governor.wait_for_stream()
+                                self.sio.emit('acquire_chunk', dict(reply, offset=position, copy_offset=op[1] + start, length=length))
+                                position += length
+                            continue
+                        for start in range(0, len(op[1]), ACQUIRE_CHUNK_SIZE):
+                            piece = op[1][start:start + ACQUIRE_CHUNK_SIZE]
+                            self.governor.wait_for_stream()
+                            self.sio.emit('acquire_chunk', dict(reply, offset=position, data=piece))
+                            position += len(piece)
+                    if not chunk:
+                        break
+                after = source_stat(os.fstat(f.fileno()))
+        except TaskCancelled:
+            self.sio.emit('acquire_complete', dict(reply, error='Acquisition cancelled'))
+            raise
+        except (OSError, ValueError) as e:
+            self.sio.emit('acquire_complete', dict(reply, error=str(e)))
+            return
+        
+        digests = {name: hasher.hexdigest() for name, hasher in hashes.items()}
+        changed = any(source[k] != after[k] for k in SOURCE_IDENTITY_FIELDS) or position != source['size']
+        if not changed:
+            try:
+                # Not from the cache, which would return an entry still valid but without the digests
+                self.get_file_metadata(path, use_cache=False, digests=digests)
+            except OSError:
+                pass
+        self.sio.emit('acquire_complete', dict(
+            reply, size=position, changed=changed, source_after=after if changed else None,
+            throttle_time=throttle_seconds(), timings=task_timings(), **digests
+        ))
+    
+    @contextmanager
+    def analysis_source(self, path):
+        """The contents of a file as a memory map, or of an archive member read into memory"""
+        if not os.path.exists(path):
+            metadata = self.archives.metadata(path)
+            if metadata is None:
+                raise FileNotFoundError(f"File not found: {path}")
+            if metadata['is_directory'] or metadata['size'] > ANALYSIS_MEMBER_MAX_SIZE:
+                raise ValueError(f'Only archive members up to {ANALYSIS_MEMBER_MAX_SIZE} bytes can be analysed')
+            yield b''.join(self.archives.iter_member(path, HASH_CHUNK_SIZE))
+            return
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                yield b''
+                return
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapping
+        finally:
+            mapping.close()
+    
+    def analyze_file(self, data):
+        """Stream the entropy map and byte histogram of a whole file as file_analysis parts"""
+        path = data.get('path')
+        reply = {'agent_id': self.agent_id, 'request_id': data.get('request_id'), 'path': path}
+        try:
+            with self.analysis_source(path) as source:
+                size = len(source)
+                block_size = int(data.get('block_size') or map_block_size(size))
+                if block_size < MIN_BLOCK_SIZE:
+                    raise ValueError(f'block_size must be at least {MIN_BLOCK_SIZE}')
+                analyzer = Analyzer(block_size)
+                reply.update(size=size, block_size=block_size, vectorized=analyzer.numpy is not None)
+                group_size = max(ANALYSIS_GROUP_SIZE // block_size, 1) * block_size
+                entropies = []
+                first_block = 0
+                for offset in range(0, size, group_size):
+                    check_cancelled()
+                    group = source[offset:offset + group_size]
+                    self.governor.throttle_read(len(group))
+                    with timed('analyze'):
+                        entropies.extend(analyzer.add(group))
+                    if len(entropies) >= ANALYSIS_PART_BLOCKS:
+                        self.governor.wait_for_stream()
+                        self.sio.emit('file_analysis', dict(reply, first_block=first_block, entropy=[round(e, 3) for e in entropies], done=False))
+                        first_block += len(entropies)
+                        entropies = []
+        except TaskCancelled:
+            self.sio.emit('file_analysis', dict(reply, error='Analysis cancelled', done=True))
+            raise
+        except (OSError, ValueError, MemoryError) as e:
+            self.sio.emit('file_analysis', dict(reply, error=str(e), done=True))
+            return
+        self.sio.emit('file_analysis', dict(
+            reply, first_block=first_block, entropy=[round(e, 3) for e in entropies], done=True,
+            histogram=analyzer.histogram, file_entropy=round(analyzer.entropy(), 3),
+            throttle_time=throttle_seconds(), timings=task_timings()
+        ))
+    
+    def extract_strings(self, data):
+        """Stream the ASCII and UTF-16LE strings of a whole file as file_strings parts
+        
+        At most max_strings are returned; when that many are found the last
+        reply carries next_offset, from which a further request continues.
+        """
+        path = data.get('path')
+        reply = {'agent_id': self.agent_id, 'request_id': data.get('request_id'), 'path': path}
+        try:
+            min_length = min(max(int(data.get('min_length') or 4), 2), 256)
+            max_strings = min(int(data.get('max_strings') or DEFAULT_MAX_STRINGS), MAX_STRINGS)
+            encodings = [e for e in (data.get('encodings') or ENCODINGS) if e in ENCODINGS]
+            start = int(data.get('offset') or 0)
+        except (TypeError, ValueError) as e:
+            self.sio.emit('file_strings', dict(reply, strings=[], error=f'Invalid parameters: {e}', done=True))
+            return
+        count = 0
+        next_offset = None
+        try:
+            with self.analysis_source(path) as source:
+                reply['size'] = len(source)
+                part = []
+                chars = 0
+                
+                def pause():
+                    check_cancelled()
+                    self.governor.throttle_read(min(STRING_WINDOW_SIZE, len(source)))
+                
+                with timed('strings'), closing(iter_strings(source, min_length, encodings, start, pause)) as strings:
+                    for offset, encoding, text, truncated in strings:
+                        if count == max_strings:
+                            next_offset = offset
+                            break
+                        part.append([offset, encoding, text, truncated])
+                        chars += len(text)
+                        count += 1
+                        if len(part) >= STRINGS_PART_SIZE or chars >= STRINGS_PART_CHARS:
+                            self.governor.wait_for_stream()
+                            self.sio.emit('file_strings', dict(reply, strings=part, done=False))
+                            part = []
+                            chars = 0
+        except TaskCancelled:
+            self.sio.emit('file_strings', dict(reply, strings=[], error='String extraction cancelled', done=True))
+            raise
+        except (OSError, ValueError) as e:
+            self.sio.emit('file_strings', dict(reply, strings=[], error=str(e), done=True))
+            return
+        self.sio.emit('file_strings', dict(
+            reply, strings=part, done=True, count=count, next_offset=next_offset,
+            throttle_time=throttle_seconds(), timings=task_timings()
+        ))
+    
+    def read_chunk(self, file_path, chunk_number, chunk_size=None):
+        """Read one chunk of a file for the hex viewer, returning the bytes and the file size"""
+        chunk_size = chunk_size or READ_CHUNK_SIZE
         if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
+            with timed('read'):
+                member = self.archives.read(file_path, chunk_number * chunk_size, chunk_size)
+            if member is not None:
+                return member
+        with open(file_path, 'rb') as f:
+            with timed('read'):
+                f.seek(chunk_number * chunk_size)
+                chunk = f.read(chunk_size)
+            self.governor.throttle_read(len(chunk))
+            return chunk, os.fstat(f.fileno()).st_size
+    
+    def hash_file(self, file_path):
+        """Calculate the MD5 hash of a file"""
+        md5_hash = hashlib.md5()
+        with timed('hash'), open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                # The governor only checks for cancellation when it sleeps
+                check_cancelled()
+                self.governor.throttle_read(len(chunk))
+                md5_hash.update(chunk)
+        return md5_hash.hexdigest()
+    
+    def get_file_metadata(self, file_path, use_cache=True, digests=None):
+        """Get comprehensive file metadata; digests already computed for the file's current contents skip hashing it"""
+        if not os.path.exists(file_path):
+            metadata = self.archives.metadata(file_path)
+            if metadata is None:
+                raise FileNotFoundError(f"File not found: {file_path}")
+            if not metadata['is_directory'] and metadata['size'] < 100 * 1024 * 1024:
+                md5_hash = hashlib.md5()
+                with timed('hash'):
+                    for block in self.archives.iter_member(file_path, HASH_CHUNK_SIZE):
+                        check_cancelled()
+                        md5_hash.update(block)
+                metadata['md5'] = md5_hash.hexdigest()
+            return metadata
         
         stat = os.stat(file_path)
+        if use_cache:
+            cached = self.cache.get('metadata', file_path, stat)
+            if cached is not None:
+                return cached
         
         metadata = {
             'path': file_path,
@@ -323,13 +1271,11 @@ class CIFAgent:
         }
         
         # Calculate MD5 hash for files
-        if os.path.isfile(file_path) and stat.st_size < 100 * 1024 * 1024:  # Only for files < 100MB
+        if digests:
+            metadata.update(digests)
+        elif os.path.isfile(file_path) and stat.st_size < 100 * 1024 * 1024:  # Only for files < 100MB
             try:
-                md5_hash = hashlib.md5()
-                with open(file_path, 'rb') as f:
-                    for chunk in iter(lambda: f.read(4096), b""):
-                        md5_hash.update(chunk)
-                metadata['md5'] = md5_hash.hexdigest()
+                metadata['md5'] = self.hash_file(file_path)
             except Exception as e:
                 metadata['hash_error'] = str(e)
         
@@ -360,32 +1306,65 @@ class CIFAgent:
             except Exception as e:
                 metadata['windows_metadata_error'] = str(e)
         
+        self.cache.put('metadata', file_path, stat, metadata)
         return metadata
     
     def connect(self):
-        """Connect to the server"""
+        """Connect to the server, reconnecting with jittered exponential backoff"""
+        logger.info('Connecting to server', extra={'server_url': self.server_url})
+        if self._status_thread is None:
+            self._status_thread = threading.Thread(target=self.report_status, name='cif-status', daemon=True)
+            self._status_thread.start()
         try:
-            print(f'Connecting to server: {self.server_url}')
-            print(f'Agent ID: {self.agent_id}')
-            self.sio.connect(self.server_url)
-            print(f'Agent started. Waiting for commands...')
-            self.sio.wait()
+            while True:
+                try:
+                    self.sio.connect(self.server_url)
+                    self.backoff.reset()
+                    logger.info('Agent started. Waiting for commands...')
+                    self.sio.wait()
+                except socketio.exceptions.ConnectionError as e:
+                    logger.warning('Failed to connect to server', extra={'error': str(e)})
+                delay = self.backoff.next_delay()
+                logger.info('Reconnecting', extra={'delay': round(delay, 1)})
+                time.sleep(delay)
         except KeyboardInterrupt:
-            print('\nShutting down agent...')
+            logger.info('Shutting down agent...')
+            for watch_id in list(self.watches):
+                self.stop_watch(watch_id)
+            self.scheduler.shutdown()
             self.sio.disconnect()
             sys.exit(0)
-        except Exception as e:
-            print(f'Failed to connect to server: {e}')
-            sys.exit(1)
 
 def main():
     parser = argparse.ArgumentParser(description='CIF Agent - Endpoint agent for Computer Investigations Framework')
     parser.add_argument('--server-url', required=True, help='Server URL (e.g., http://localhost:5000)')
     parser.add_argument('--register', action='store_true', help='Register with server (default behavior)')
+    parser.add_argument('--max-workers', type=int, default=4, help='Worker threads for command execution (default: 4)')
+    parser.add_argument('--max-read-bps', help='Cap on file read bandwidth, e.g. 20M (default: unlimited)')
+    parser.add_argument('--max-iops', type=int, help='Cap on read and stat operations per second (default: unlimited)')
+    parser.add_argument('--max-cpu-percent', type=float, help='Cap on agent CPU usage in percent of one core (default: unlimited)')
+    parser.add_argument('--backoff-load', type=float, default=85.0, help='Host CPU percent above which I/O caps are scaled down (default: 85)')
+    parser.add_argument('--cache-entries', type=int, default=250000, help='Maximum directory entries held in the listing/metadata cache (default: 250000)')
+    parser.add_argument('--cache-ttl', type=float, default=30.0, help='Seconds a cached listing or metadata result stays valid (default: 30)')
+    parser.add_argument('--reconnect-delay', type=float, default=DEFAULT_BASE_DELAY, help='Initial reconnect backoff ceiling in seconds (default: 2)')
+    parser.add_argument('--reconnect-delay-max', type=float, default=DEFAULT_MAX_DELAY, help='Maximum reconnect backoff ceiling in seconds (default: 300)')
+    parser.add_argument('--log-level', default='INFO', help='Log level, optionally with per-logger overrides, e.g. INFO,cif.watcher=DEBUG (default: INFO)')
+    parser.add_argument('--log-format', choices=['json', 'text'], default='json', help='Log output format (default: json)')
+    parser.add_argument('--log-sample-rate', type=int, default=jsonlog.DEFAULT_SAMPLE_RATE, help='Maximum high-frequency log records per second per event (default: 10)')
     
     args = parser.parse_args()
+    jsonlog.configure(level=args.log_level, fmt=args.log_format, sample_rate=args.log_sample_rate, context=task_log_fields)
     
-    agent = CIFAgent(args.server_url)
+    governor = ResourceGovernor(
+        max_read_bps=parse_rate(args.max_read_bps),
+        max_iops=args.max_iops,
+        max_cpu_percent=args.max_cpu_percent,
+        backoff_load_percent=args.backoff_load
+    )
+    cache = ResultCache(max_entries=args.cache_entries, ttl=args.cache_ttl)
+    backoff = Backoff(base=args.reconnect_delay, maximum=args.reconnect_delay_max)
+    agent = CIFAgent(args.server_url, max_workers=args.max_workers, governor=governor, cache=cache, backoff=backoff)
+    jsonlog.set_fields(agent_id=agent.agent_id)
     agent.connect()
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+"""Whole-file analytics: entropy map, byte histogram and strings.
+
+``Analyzer`` takes a file in groups of fixed-size blocks and returns the
+Shannon entropy of each block (0 to 8 bits per byte), keeping a histogram of
+the whole file as it goes. Packed, compressed and encrypted regions show as
+runs of blocks near 8; text and code sit well below.
+
+With NumPy installed (``pip install cif-agent[analytics]``) every byte of a
+group is offset by 256 times its block number and the whole group is
+counted with one ``bincount``, giving a row of counts per block; the
+entropies of the group are then worked out at once. NumPy is imported the
+first time a file is analysed, not when the agent starts. Without it each
+block is counted with ``collections.Counter``, which counts in C but is
+several times slower.
+
+``iter_strings`` finds runs of printable ASCII and of printable UTF-16LE
+characters with two compiled regular expressions. They search the mapping
+in place a window at a time, so cancellation is checked between windows
+without copying the file. A run that reaches the end of a window is matched
+again from its start without the bound, so no string is split.
+
+Files are memory-mapped where possible; the callers pass slices of the
+mapping, or blocks read from an archive member, so nothing here opens files.
+"""
+
+import functools
+import heapq
+import math
+import re
+from collections import Counter
+
+# Entropy maps have at most this many blocks, so a map stays small whatever the file size
+MAX_MAP_BLOCKS = 4096
+MIN_BLOCK_SIZE = 4096
+# Longest string returned; longer runs are cut and flagged
+MAX_STRING_LENGTH = 1024
+STRING_WINDOW_SIZE = 8 * 1024 * 1024
+# Printable ASCII plus tab
+PRINTABLE = rb'[\x20-\x7e\t]'
+ENCODINGS = ('ascii', 'utf-16le')
+
+def map_block_size(size):
+    """Entropy block size for a file of this size: MIN_BLOCK_SIZE or larger, a multiple of 4KB"""
+    block_size = max(MIN_BLOCK_SIZE, -(-size // MAX_MAP_BLOCKS))
+    return -(-block_size // 4096) * 4096
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """The numpy module, or None if it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def entropy(counts, total):
+    """Shannon entropy in bits per byte of a 256-entry histogram"""
+    if not total:
+        return 0.0
+    return max(0.0, -sum(count / total * math.log2(count / total) for count in counts if count))
+
+class Analyzer:
+    """Entropy per block and the histogram of everything added so far"""
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.histogram = [0] * 256
+        self.size = 0
+        self.numpy = load_numpy()
+
+    def add(self, data):
+        """Entropies of the blocks in data, whose length is a multiple of block_size except at the end of the file"""
+        self.size += len(data)
+        if self.numpy is not None:
+            return self._add_numpy(data)
+        entropies = []
+        for start in range(0, len(data), self.block_size):
+            block = data[start:start + self.block_size]
+            counts = Counter(block)
+            for value, count in counts.items():
+                self.histogram[value] += count
+            entropies.append(entropy(counts.values(), len(block)))
+        return entropies
+
+    def _add_numpy(self, data):
+        numpy = self.numpy
+        values = numpy.frombuffer(data, dtype=numpy.uint8)
+        full = len(values) // self.block_size
+        # Byte value plus 256 times the block number, so one bincount counts every block
+        keys = values[:full * self.block_size].reshape(full, self.block_size).astype(numpy.int32)
+        keys += (numpy.arange(full, dtype=numpy.int32) * 256)[:, None]
+        counts = numpy.bincount(keys.ravel(), minlength=full * 256).reshape(full, 256)
+        if len(values) % self.block_size:
+            tail = numpy.bincount(values[full * self.block_size:], minlength=256)
+            counts = numpy.vstack([counts, tail])
+        if not len(counts):
+            return []
+        totals = counts.sum(axis=1, keepdims=True)
+        probabilities = counts / totals
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            terms = numpy.where(counts > 0, probabilities * numpy.log2(probabilities), 0.0)
+        histogram = counts.sum(axis=0)
+        for value in numpy.flatnonzero(histogram):
+            self.histogram[value] += int(histogram[value])
+        return [float(e) for e in -terms.sum(axis=1)]
+
+    def entropy(self):
+        """Entropy of the whole file so far"""
+        return entropy(self.histogram, self.size)
+
+def string_patterns(min_length, encodings=ENCODINGS):
+    """Compiled patterns for the requested encodings, by encoding name"""
+    patterns = {}
+    if 'ascii' in encodings:
+        patterns['ascii'] = re.compile(PRINTABLE + rb'{%d,}' % min_length)
+    if 'utf-16le' in encodings:
+        patterns['utf-16le'] = re.compile(rb'(?:' + PRINTABLE + rb'\x00){%d,}' % min_length)
+    return patterns
+
+def _iter_runs(pattern, encoding, data, min_length, start, pause):
+    unit = 2 if encoding == 'utf-16le' else 1
+    # A run cut short by the end of a window is found again by the next one, which
+    # starts this far back; anything shorter than a string cannot match twice
+    overlap = min_length * unit - 1
+    size = len(data)
+    position = start
+    while position < size:
+        if pause is not None:
+            pause()
+        end = min(position + STRING_WINDOW_SIZE, size)
+        for match in pattern.finditer(data, position, end):
+            run_end = match.end()
+            if run_end >= end - 1 and end < size:
+                # The run may continue past the window, so match it again without the bound
+                run_end = pattern.match(data, match.start()).end()
+                end = max(end, run_end)
+            offset = match.start()
+            raw = data[offset:min(run_end, offset + MAX_STRING_LENGTH * unit)]
+            yield offset, encoding, raw.decode(encoding), run_end - offset > MAX_STRING_LENGTH * unit
+        position = end if end == size else max(end - overlap, position + 1)
+
+def iter_strings(data, min_length=4, encodings=ENCODINGS, start=0, pause=None):
+    """Yield (offset, encoding, text, truncated) for the strings in data from start, in offset order
+
+    data is a bytes-like object, typically a memory map; it is searched in
+    place. pause, if given, is called between windows (to check for cancellation).
+    """
+    runs = [_iter_runs(pattern, encoding, data, min_length, start, pause) for encoding, pattern in string_patterns(min_length, encodings).items()]
+    return heapq.merge(*runs)
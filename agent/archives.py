@@ -0,0 +1,513 @@
+"""Browsing zip, tar and gzip files as read-only virtual directories.
+
+A member of an archive is addressed by the archive's path, ``!`` and the
+member's path inside it: ``/evidence/logs.tar.gz!/var/log/syslog``. The
+archive itself lists as ``/evidence/logs.tar.gz!``. Real paths always win,
+so a ``!`` in an existing file or directory name is left alone.
+
+Opening an archive builds an index of its members, kept per archive and
+validated by stat like the listing cache:
+
+* zip -- read from the central directory; no member is decompressed.
+* tar -- the member headers, found by seeking past each member's data.
+* gzip and tar.gz -- one decompressing pass over the stream, which also
+  records the tar headers and the uncompressed size.
+
+Deflate streams (gzip files and deflated zip members) cannot be read from
+the middle, so ``InflateStream`` keeps a copy of the decompressor every
+``CHECKPOINT_INTERVAL`` bytes of output. A read then decompresses from the
+nearest checkpoint before it instead of from the start, and sequential reads
+continue from where the previous one stopped. bzip2 and xz streams have no
+copyable decompressor state, so tar.bz2 and tar.xz are not indexed.
+"""
+
+import bisect
+import io
+import os
+import stat as stat_module
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from cache import stat_validator
+
+ARCHIVE_SEPARATOR = '!'
+# File names offered as browsable archives in directory listings
+ARCHIVE_EXTENSIONS = ('.zip', '.jar', '.tar', '.tgz', '.gz')
+KIND_ZIP = 'zip'
+KIND_TAR = 'tar'
+KIND_TAR_GZ = 'tar.gz'
+KIND_GZIP = 'gzip'
+
+GZIP_WBITS = 31
+RAW_DEFLATE_WBITS = -15
+# Compressed bytes read from disk per decompression step
+INFLATE_BLOCK_SIZE = 64 * 1024
+# Uncompressed bytes between decompressor checkpoints; each one holds about 40KB of zlib state
+CHECKPOINT_INTERVAL = 16 * 1024 * 1024
+# Archive indexes kept at once; the least recently used is dropped first
+DEFAULT_MAX_ARCHIVES = 8
+# Deflated zip members with a cached checkpoint stream, per archive
+MAX_MEMBER_STREAMS = 64
+TAR_MAGIC_OFFSET = 257
+LOCAL_HEADER = struct.Struct('<26xHH')
+
+
+class ArchiveError(Exception):
+    """Raised when an archive or a member cannot be read"""
+
+
+def looks_like_archive(name):
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def split_archive_path(path):
+    """(archive, member) for a path inside an archive, or None for any other path"""
+    index = path.find(ARCHIVE_SEPARATOR)
+    while index != -1:
+        rest = path[index + 1:]
+        if (not rest or rest[0] in '/\\') and os.path.isfile(path[:index]):
+            return path[:index], rest.replace('\\', '/').strip('/')
+        index = path.find(ARCHIVE_SEPARATOR, index + 1)
+    return None
+
+
+class _Cursor:
+    """Decompressor state after the last read, with the output it produced from the read's offset"""
+
+    def __init__(self, out_offset, in_offset, decompressor, between_members=False):
+        self.buf = bytearray()
+        self.buf_start = out_offset
+        self.in_offset = in_offset
+        self.decompressor = decompressor
+        # Set after a gzip member ended, until the next one produces output
+        self.between_members = between_members
+        self.eof = False
+
+    @property
+    def out_offset(self):
+        return self.buf_start + len(self.buf)
+
+    def discard_before(self, offset):
+        drop = min(max(offset - self.buf_start, 0), len(self.buf))
+        del self.buf[:drop]
+        self.buf_start += drop
+
+
+class InflateStream:
+    """Random access to a deflate or gzip stream stored in a file, through decompressor checkpoints"""
+
+    def __init__(self, start=0, length=None, wbits=GZIP_WBITS, on_read=None):
+        self.start = start
+        self.end = start + length if length is not None else None
+        self.wbits = wbits
+        self.on_read = on_read
+        # Uncompressed size, known once the end of the stream has been decompressed
+        self.size = None
+        self._offsets = [0]
+        self._checkpoints = [(start, zlib.decompressobj(wbits), False)]
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    def checkpoints(self):
+        return len(self._offsets)
+
+    def read(self, f, offset, length):
+        """Bytes [offset, offset + length) of the uncompressed stream, read through file object f"""
+        with self._lock:
+            cursor = self._cursor
+            index = bisect.bisect_right(self._offsets, offset) - 1
+            # Start again from the nearest checkpoint when seeking back, or forward past one
+            if cursor is None or offset < cursor.buf_start or self._offsets[index] > cursor.out_offset:
+                in_offset, decompressor, between_members = self._checkpoints[index]
+                cursor = _Cursor(self._offsets[index], in_offset, decompressor.copy(), between_members)
+            cursor.discard_before(offset)
+            while cursor.out_offset < offset + length and not cursor.eof:
+                self._advance(f, cursor)
+                cursor.discard_before(offset)
+            self._cursor = cursor
+            start = offset - cursor.buf_start
+            return bytes(cursor.buf[start:start + length]) if start >= 0 else b''
+
+    def measure(self, f):
+        """Decompress to the end of the stream, if not done yet, and return its size"""
+        if self.size is None:
+            self.read(f, 1 << 62, 0)
+        return self.size
+
+    def _advance(self, f, cursor):
+        """Decompress one block of input, adding a checkpoint when past the interval"""
+        count = INFLATE_BLOCK_SIZE if self.end is None else min(INFLATE_BLOCK_SIZE, self.end - cursor.in_offset)
+        block = b''
+        if count > 0:
+            f.seek(cursor.in_offset)
+            block = f.read(count)
+        if block and self.on_read:
+            self.on_read(len(block))
+        cursor.in_offset += len(block)
+        ended = not block
+        try:
+            if block:
+                produced = cursor.out_offset
+                cursor.buf += cursor.decompressor.decompress(block)
+                cursor.between_members = cursor.between_members and cursor.out_offset == produced
+            # A gzip file may hold several members back to back
+            while self.wbits == GZIP_WBITS and cursor.decompressor.eof:
+                unused = cursor.decompressor.unused_data
+                cursor.decompressor = zlib.decompressobj(self.wbits)
+                cursor.between_members = True
+                if not unused:
+                    break
+                produced = cursor.out_offset
+                cursor.buf += cursor.decompressor.decompress(unused)
+                cursor.between_members = cursor.out_offset == produced
+        except zlib.error as e:
+            if not cursor.between_members:
+                raise ArchiveError(f'Corrupt compressed data at byte {cursor.in_offset - len(block)}: {e}')
+            # Padding or garbage after the last gzip member
+            ended = True
+        if ended or (self.wbits != GZIP_WBITS and cursor.decompressor.eof):
+            cursor.eof = True
+            self.size = cursor.out_offset
+            return
+        if cursor.out_offset - self._offsets[-1] >= CHECKPOINT_INTERVAL:
+            self._offsets.append(cursor.out_offset)
+            self._checkpoints.append((cursor.in_offset, cursor.decompressor.copy(), cursor.between_members))
+
+
+class _StreamFile(io.RawIOBase):
+    """Seekable file object over an InflateStream, for tarfile to read headers from"""
+
+    def __init__(self, stream, f):
+        self.stream = stream
+        self.f = f
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.stream.measure(self.f)
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer):
+        data = self.stream.read(self.f, self.position, len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class ArchiveMember:
+    """A file or directory inside an archive"""
+
+    __slots__ = ('path', 'is_directory', 'size', 'mtime', 'mode', 'uid', 'gid', 'offset',
+                 'compressed_size', 'compress_type', 'encrypted', 'link', 'info')
+
+    def __init__(self, path, is_directory=False, size=0, mtime=None, mode=None, uid=None, gid=None,
+                 offset=None, compressed_size=None, compress_type=None, encrypted=False, link=None, info=None):
+        self.path = path
+        self.is_directory = is_directory
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.offset = offset
+        self.compressed_size = compressed_size
+        self.compress_type = compress_type
+        self.encrypted = encrypted
+        self.link = link
+        # The ZipInfo of a zip member, whose data offset is only known after reading its local header
+        self.info = info
+
+
+def _member_path(name):
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    return '/'.join(parts)
+
+
+class ArchiveIndex:
+    """Members of one archive by path, and the children of each directory inside it"""
+
+    def __init__(self, path, kind, on_read=None):
+        self.path = path
+        self.kind = kind
+        self.on_read = on_read
+        self.members = {'': ArchiveMember('', is_directory=True)}
+        self.children = {'': {}}
+        # The whole-file stream of a gzip or tar.gz archive
+        self.stream = None
+        self._member_streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, member):
+        member.path = _member_path(member.path)
+        if not member.path:
+            return
+        parent, _, name = member.path.rpartition('/')
+        self._add_directory(parent)
+        self.members[member.path] = member
+        self.children[parent][name] = member
+        if member.is_directory:
+            self.children.setdefault(member.path, {})
+
+    def _add_directory(self, path):
+        if path in self.members:
+            return
+        parent, _, name = path.rpartition('/')
+        self._add_directory(parent)
+        directory = ArchiveMember(path, is_directory=True)
+        self.members[path] = directory
+        self.children[parent][name] = directory
+        self.children[path] = {}
+
+    def virtual_path(self, member_path):
+        return f'{self.path}{ARCHIVE_SEPARATOR}/{member_path}' if member_path else self.path + ARCHIVE_SEPARATOR
+
+    def entry(self, member):
+        """Listing entry in the same shape as CIFAgent.list_directory"""
+        modified = datetime.fromtimestamp(member.mtime).isoformat() if member.mtime else None
+        entry = {
+            'name': member.path.rpartition('/')[2],
+            'path': self.virtual_path(member.path),
+            'is_directory': member.is_directory,
+            'size': 0 if member.is_directory else member.size,
+            'created': None,
+            'modified': modified,
+            'accessed': None,
+            'mode': oct(member.mode)[-3:] if member.mode else 'N/A',
+            'uid': member.uid,
+            'gid': member.gid,
+            'archive_member': True,
+        }
+        if member.compressed_size is not None and not member.is_directory:
+            entry['compressed_size'] = member.compressed_size
+        if member.link:
+            entry['link'] = member.link
+        if member.encrypted:
+            entry['error'] = 'Encrypted member'
+        return entry
+
+    def list(self, member_path):
+        if member_path not in self.children:
+            if member_path in self.members:
+                raise ArchiveError(f'Not a directory in {self.path}: {member_path}')
+            raise FileNotFoundError(f'No such member in {self.path}: {member_path}')
+        members = self.children[member_path].values()
+        return [self.entry(member) for member in sorted(members, key=lambda m: (not m.is_directory, m.path.lower()))]
+
+    def member(self, member_path):
+        member = self.members.get(member_path)
+        if member is None:
+            raise FileNotFoundError(f'No such member in {self.path}: {member_path}')
+        if member.is_directory:
+            raise IsADirectoryError(f'Is a directory in {self.path}: {member_path}')
+        if member.encrypted:
+            raise ArchiveError(f'Encrypted member: {member_path}')
+        return member
+
+    def read(self, f, member, offset, length):
+        """Bytes of a member, read through the archive file object f"""
+        length = max(min(length, member.size - offset), 0)
+        if length == 0:
+            return b''
+        if self.kind in (KIND_GZIP, KIND_TAR_GZ):
+            return self.stream.read(f, member.offset + offset, length)
+        if self.kind == KIND_TAR or member.compress_type == zipfile.ZIP_STORED:
+            f.seek(self._data_offset(f, member) + offset)
+            data = f.read(length)
+            if self.on_read:
+                self.on_read(len(data))
+            return data
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            return self._member_stream(f, member).read(f, offset, length)
+        # bzip2 and lzma members are rare; zipfile decompresses them up to the offset
+        with zipfile.ZipFile(f) as archive, archive.open(member.info) as source:
+            source.seek(offset)
+            return source.read(length)
+
+    def _data_offset(self, f, member):
+        """Where a member's data starts; for zip, after its local header"""
+        if member.offset is None:
+            f.seek(member.info.header_offset)
+            header = f.read(LOCAL_HEADER.size)
+            if len(header) < LOCAL_HEADER.size:
+                raise ArchiveError(f'Truncated local header: {member.path}')
+            name_length, extra_length = LOCAL_HEADER.unpack(header)
+            member.offset = member.info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+        return member.offset
+
+    def _member_stream(self, f, member):
+        with self._lock:
+            stream = self._member_streams.get(member.path)
+            if stream is None:
+                stream = InflateStream(self._data_offset(f, member), member.compressed_size,
+                                       wbits=RAW_DEFLATE_WBITS, on_read=self.on_read)
+                self._member_streams[member.path] = stream
+                if len(self._member_streams) > MAX_MEMBER_STREAMS:
+                    self._member_streams.popitem(last=False)
+            else:
+                self._member_streams.move_to_end(member.path)
+            return stream
+
+
+def _detect(f, on_read=None):
+    head = f.read(INFLATE_BLOCK_SIZE)
+    if on_read:
+        on_read(len(head))
+    if head[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return KIND_ZIP
+    if head[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + 5] == b'ustar':
+        return KIND_TAR
+    if head[:2] == b'\x1f\x8b':
+        try:
+            start = zlib.decompressobj(GZIP_WBITS).decompress(head, tarfile.BLOCKSIZE)
+        except zlib.error:
+            start = b''
+        return KIND_TAR_GZ if start[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + 5] == b'ustar' else KIND_GZIP
+    return None
+
+
+def _zip_mtime(info):
+    try:
+        return time.mktime(info.date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+
+def build_index(path, on_read=None):
+    """Read an archive's members; gzip and tar.gz archives are decompressed once to do so"""
+    with open(path, 'rb') as f:
+        kind = _detect(f, on_read)
+        if kind is None:
+            raise ArchiveError(f'Not a zip, tar or gzip archive: {path}')
+        index = ArchiveIndex(path, kind, on_read=on_read)
+        f.seek(0)
+        try:
+            if kind == KIND_ZIP:
+                with zipfile.ZipFile(f) as archive:
+                    for info in archive.infolist():
+                        mode = info.external_attr >> 16
+                        index.add(ArchiveMember(
+                            info.filename, is_directory=info.is_dir(), size=info.file_size,
+                            mtime=_zip_mtime(info), mode=stat_module.S_IMODE(mode) if mode else None,
+                            compressed_size=info.compress_size, compress_type=info.compress_type,
+                            encrypted=bool(info.flag_bits & 0x1), info=info
+                        ))
+            elif kind == KIND_GZIP:
+                index.stream = InflateStream(on_read=on_read)
+                name = os.path.basename(path)
+                if name.lower().endswith('.gz'):
+                    name = name[:-3]
+                elif name.lower().endswith('.tgz'):
+                    name = name[:-4] + '.tar'
+                index.add(ArchiveMember(name, size=index.stream.measure(f), mtime=os.fstat(f.fileno()).st_mtime, offset=0))
+            else:
+                source = f
+                if kind == KIND_TAR_GZ:
+                    index.stream = InflateStream(on_read=on_read)
+                    source = _StreamFile(index.stream, f)
+                with tarfile.open(fileobj=source, mode='r:') as archive:
+                    info = archive.next()
+                    while info is not None:
+                        index.add(ArchiveMember(
+                            info.name, is_directory=info.isdir(), size=info.size if info.isreg() else 0,
+                            mtime=info.mtime, mode=info.mode, uid=info.uid, gid=info.gid,
+                            offset=info.offset_data, link=info.linkname or None
+                        ))
+                        # tarfile would otherwise keep every TarInfo as well
+                        archive.members = []
+                        info = archive.next()
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, struct.error) as e:
+            raise ArchiveError(f'Cannot read {kind} archive {path}: {e}')
+    return index
+
+
+class ArchiveIndexes:
+    """Member indexes of recently browsed archives, validated by the archive's stat"""
+
+    def __init__(self, max_archives=DEFAULT_MAX_ARCHIVES, on_read=None):
+        self.max_archives = max_archives
+        self.on_read = on_read
+        self._indexes = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def get(self, archive_path):
+        validator = stat_validator(os.stat(archive_path))
+        with self._lock:
+            item = self._indexes.get(archive_path)
+            if item is not None and item[0] == validator:
+                self._indexes.move_to_end(archive_path)
+                return item[1]
+            building = self._building.setdefault(archive_path, threading.Lock())
+        # One thread indexes an archive while others asking for it wait for the result
+        with building:
+            with self._lock:
+                item = self._indexes.get(archive_path)
+                if item is not None and item[0] == validator:
+                    return item[1]
+            index = build_index(archive_path, on_read=self.on_read)
+            with self._lock:
+                self._indexes[archive_path] = (validator, index)
+                self._indexes.move_to_end(archive_path)
+                while len(self._indexes) > self.max_archives:
+                    self._indexes.popitem(last=False)
+                self._building.pop(archive_path, None)
+        return index
+
+    def list(self, path):
+        """Entries of a directory inside an archive, or None if path is not inside one"""
+        located = split_archive_path(path)
+        if located is None:
+            return None
+        archive_path, member_path = located
+        return self.get(archive_path).list(member_path)
+
+    def read(self, path, offset, length):
+        """Bytes of an archive member and the member's size, or None if path is not inside an archive"""
+        located = split_archive_path(path)
+        if located is None:
+            return None
+        archive_path, member_path = located
+        index = self.get(archive_path)
+        member = index.member(member_path)
+        with open(archive_path, 'rb') as f:
+            return index.read(f, member, offset, length), member.size
+
+    def iter_member(self, path, block_size):
+        """Contents of an archive member in blocks"""
+        archive_path, member_path = split_archive_path(path)
+        index = self.get(archive_path)
+        member = index.member(member_path)
+        with open(archive_path, 'rb') as f:
+            for offset in range(0, member.size, block_size):
+                yield index.read(f, member, offset, block_size)
+
+    def metadata(self, path):
+        """Metadata of an archive member, or None if path is not inside an archive"""
+        located = split_archive_path(path)
+        if located is None:
+            return None
+        archive_path, member_path = located
+        index = self.get(archive_path)
+        if member_path not in index.members:
+            raise FileNotFoundError(f'No such member in {archive_path}: {member_path}')
+        entry = index.entry(index.members[member_path])
+        entry.update({'archive': archive_path, 'archive_type': index.kind, 'member': member_path})
+        return entry
@@ -0,0 +1,93 @@
+"""Short-lived cache for directory listings and file metadata.
+
+Entries are keyed by kind and path and validated against the current
+``os.stat`` of the directory or file (mtime, size and inode), so a hit costs a
+single stat instead of re-statting every child. A directory's mtime changes
+when entries are added, removed or renamed but not when a child file is
+rewritten in place, so entries also expire after a short TTL.
+
+The cache is bounded by the total number of cached entries: a listing costs
+one unit per child, a metadata result costs one unit. The least recently
+used results are evicted first.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 250000
+DEFAULT_TTL = 30.0
+
+
+def stat_validator(stat):
+    """Cheap fingerprint of a file or directory from its stat result"""
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class ResultCache:
+    """LRU cache of listing and metadata results validated by stat"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, path, stat):
+        """Return the cached value if it is still valid for this stat, else None"""
+        key = (kind, path)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            validator, stored_at, cost, value = item
+            if validator != stat_validator(stat) or time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                self.size -= cost
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, kind, path, stat, value, cost=1):
+        """Store a result, evicting least recently used results to stay within bounds"""
+        cost = max(cost, 1)
+        if cost > self.max_entries:
+            return
+        key = (kind, path)
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= previous[2]
+            self._items[key] = (stat_validator(stat), time.monotonic(), cost, value)
+            self.size += cost
+            while self.size > self.max_entries:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= evicted[2]
+
+    def invalidate(self, path=None):
+        """Drop cached results for one path, or everything when path is None"""
+        with self._lock:
+            if path is None:
+                self._items.clear()
+                self.size = 0
+                return
+            for kind in ('listing', 'metadata'):
+                item = self._items.pop((kind, path), None)
+                if item is not None:
+                    self.size -= item[2]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'results': len(self._items),
+                'entries': self.size,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
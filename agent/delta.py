@@ -0,0 +1,156 @@
+"""Matching a file against block signatures of an earlier copy of it.
+
+A delta acquisition starts with the server sending signatures of the copy
+it already holds: the file cut into ``block_size`` blocks, each with an
+Adler-32 checksum and a 16-byte BLAKE2b digest. ``DeltaEncoder`` reads the
+current file and turns it into operations the server can rebuild it from:
+
+* ``('copy', base_offset, length)`` -- bytes the server already has.
+* ``('data', bytes)`` -- bytes it does not, sent as they are.
+
+Blocks are first tried where they would be if nothing moved, which costs one
+BLAKE2b digest per block, so an unchanged or appended-to file is matched at
+hashing speed. Where that fails, the window is slid one byte at a time
+like rsync until a block matches again. Adler-32 is a rolling checksum: the
+checksums of every window in a span are worked out from two prefix sums with
+``accumulate`` and ``map`` rather than summed window by window, and only
+windows whose checksum is in the signature set are hashed with BLAKE2b. The
+sliding search is still far slower than the aligned one, which is the price
+of sending fewer bytes over a slow link.
+
+A match only means the server can supply the bytes; the SHA-256 and MD5 of
+the acquisition still cover every byte read, so a digest collision would
+fail verification rather than go unnoticed.
+"""
+
+import hashlib
+import struct
+from array import array
+from itertools import accumulate, repeat
+from operator import lshift, mod, mul, or_, sub
+
+STRONG_DIGEST_SIZE = 16
+ADLER_MODULUS = 65521
+# Longest span of windows checksummed in one pass of the rolling search
+MAX_SCAN_SPAN = 1024 * 1024
+
+def strong_digest(block):
+    return hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE).digest()
+
+class Signatures:
+    """Block signatures of the server's copy, as sent with acquire_file"""
+
+    def __init__(self, block_size, weak, strong):
+        if block_size <= 0 or len(weak) % 4 or len(strong) != len(weak) // 4 * STRONG_DIGEST_SIZE:
+            raise ValueError('Malformed delta signatures')
+        self.block_size = block_size
+        # Adler-32 is (b + size) << 16 | (a + 1), both modulo 65521; the offsets are
+        # taken out here so search() does not add them to every window
+        self.rolling = {
+            (((value >> 16) - block_size) % ADLER_MODULUS) << 16 | ((value & 0xffff) - 1) % ADLER_MODULUS
+            for (value,) in struct.iter_unpack('<I', weak)
+        }
+        self.blocks = {}
+        for index in range(len(weak) // 4):
+            digest = bytes(strong[index * STRONG_DIGEST_SIZE:(index + 1) * STRONG_DIGEST_SIZE])
+            self.blocks.setdefault(digest, index)
+
+    @classmethod
+    def from_message(cls, data):
+        return cls(int(data['block_size']), data['weak'], data['strong'])
+
+    def find(self, block):
+        """Index of the block with these exact contents, or None"""
+        return self.blocks.get(strong_digest(block))
+
+    def search(self, buffer, start, end):
+        """First offset in [start, end] where a full block of buffer matches a signature, or None"""
+        size = self.block_size
+        span = buffer[start:end + size]
+        count = end - start + 1
+        # With p the prefix sums of span and r those of p, the window at k has
+        # a = p[k + size] - p[k] and b = r[k + size] - r[k] - size * p[k]
+        sums = array('q', accumulate(span, initial=0))
+        sums_of_sums = array('q', accumulate(sums))
+        a = map(sub, sums[size:], sums[:count])
+        b = map(sub, map(sub, sums_of_sums[size:], sums_of_sums[:count]), map(mul, sums[:count], repeat(size)))
+        keys = map(or_, map(lshift, map(mod, b, repeat(ADLER_MODULUS)), repeat(16)), map(mod, a, repeat(ADLER_MODULUS)))
+        weak = self.rolling
+        for k, key in enumerate(keys):
+            if key in weak and strong_digest(span[k:k + size]) in self.blocks:
+                return start + k
+        return None
+
+class DeltaEncoder:
+    """Turns the bytes of a file, fed in order, into copy and data operations"""
+
+    def __init__(self, signatures):
+        self.signatures = signatures
+        self.buffer = bytearray()
+        self.copy = None
+        self.span = signatures.block_size * 4
+        self.copied = 0
+        self.literal = 0
+
+    def feed(self, data):
+        """Add the next bytes of the file, returning the operations now settled"""
+        self.buffer += data
+        if len(self.buffer) < MAX_SCAN_SPAN + 2 * self.signatures.block_size:
+            return []
+        return self._encode(final=False)
+
+    def finish(self):
+        """Operations for the rest of the file, once it has all been fed"""
+        ops = self._encode(final=True)
+        if self.copy:
+            ops.append(('copy',) + tuple(self.copy))
+            self.copy = None
+        return ops
+
+    def _encode(self, final):
+        signatures = self.signatures
+        size = signatures.block_size
+        buffer = self.buffer
+        ops = []
+        position = literal = 0
+        while len(buffer) - position >= size:
+            index = signatures.find(buffer[position:position + size])
+            if index is not None:
+                if position > literal:
+                    self._data(ops, buffer[literal:position])
+                self._copy(ops, index * size, size)
+                position = literal = position + size
+                self.span = size * 4
+                continue
+            last = len(buffer) - size
+            if not final and last - position < self.span:
+                break
+            end = min(last, position + self.span)
+            match = signatures.search(buffer, position + 1, end)
+            if match is None:
+                position = end + 1
+                self.span = min(self.span * 2, MAX_SCAN_SPAN)
+            else:
+                position = match
+        if final:
+            position = len(buffer)
+        if position > literal:
+            self._data(ops, buffer[literal:position])
+        del buffer[:position]
+        return ops
+
+    def _copy(self, ops, offset, length):
+        self.copied += length
+        if self.copy and self.copy[0] + self.copy[1] == offset:
+            self.copy[1] += length
+            return
+        if self.copy:
+            ops.append(('copy',) + tuple(self.copy))
+        self.copy = [offset, length]
+
+    def _data(self, ops, data):
+        self.literal += len(data)
+        if self.copy:
+            ops.append(('copy',) + tuple(self.copy))
+            self.copy = None
+        ops.append(('data', bytes(data)))
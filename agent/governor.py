@@ -0,0 +1,207 @@
+"""Resource governor for agent disk I/O and CPU usage.
+
+Reads and metadata operations are charged against token buckets for bytes
+per second and operations per second. Background tasks wait for tokens;
+interactive tasks are charged but never wait, so browsing stays responsive
+while the debt they create slows background work down to the cap.
+
+When host-wide CPU load is above the backoff threshold the configured read
+and IOPS rates are scaled down multiplicatively and recover gradually once
+load drops. Time spent waiting is accumulated on the running task so it can
+be reported in results.
+
+The server can also ask the agent to pause streaming replies while it is
+short on memory. Background tasks then hold their next reply until the
+server resumes them (or the pause times out); interactive replies wait at
+most a couple of seconds.
+"""
+
+import threading
+import time
+
+from scheduler import PRIORITY_INTERACTIVE, current_task, check_cancelled
+
+# Seconds between CPU samples; psutil needs a gap to compute a percentage
+CPU_SAMPLE_INTERVAL = 0.25
+# Longest single sleep, so cancellation is noticed promptly
+MAX_SLEEP_SLICE = 0.1
+MIN_BACKOFF_FACTOR = 0.1
+# Longest an interactive reply waits on a server-requested pause
+INTERACTIVE_PAUSE_WAIT = 2.0
+DEFAULT_PAUSE_TIMEOUT = 60.0
+
+
+def parse_rate(value):
+    """Parse a rate such as '512K', '20M' or '1G' into a number (None for empty/0)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value or None
+    value = value.strip().upper()
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in multipliers:
+        result = float(value[:-1]) * multipliers[value[-1]]
+    else:
+        result = float(value)
+    return result or None
+
+
+class TokenBucket:
+    """Token bucket whose balance may go negative when charged without waiting"""
+
+    def __init__(self, rate, burst_seconds=1.0):
+        self.rate = rate
+        self.capacity = rate * burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, rate):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def charge(self, amount, rate_factor=1.0):
+        """Take tokens and return how long the caller should wait to stay within the rate"""
+        rate = self.rate * rate_factor
+        with self.lock:
+            self._refill(rate)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / rate
+
+
+class ResourceGovernor:
+    """Enforce read bandwidth, IOPS and CPU caps for agent tasks"""
+
+    def __init__(self, max_read_bps=None, max_iops=None, max_cpu_percent=None, backoff_load_percent=85.0):
+        self.read_bucket = TokenBucket(max_read_bps) if max_read_bps else None
+        self.iops_bucket = TokenBucket(max_iops) if max_iops else None
+        self.max_cpu_percent = max_cpu_percent
+        self.backoff_load_percent = backoff_load_percent
+        self.backoff_factor = 1.0
+        self.total_throttle_seconds = 0.0
+        self._psutil = None
+        self._process = None
+        self._last_sample = 0.0
+        self._process_cpu = 0.0
+        self._sample_lock = threading.Lock()
+        self._stream_resumed = threading.Event()
+        self._stream_resumed.set()
+        self._pause_deadline = 0.0
+
+    def pause_streams(self, timeout=DEFAULT_PAUSE_TIMEOUT):
+        """Hold streamed replies until resume_streams() or timeout seconds pass"""
+        self._pause_deadline = time.monotonic() + timeout
+        self._stream_resumed.clear()
+
+    def resume_streams(self):
+        self._stream_resumed.set()
+
+    @property
+    def streams_paused(self):
+        if self._stream_resumed.is_set():
+            return False
+        if time.monotonic() >= self._pause_deadline:
+            self._stream_resumed.set()
+            return False
+        return True
+
+    def wait_for_stream(self):
+        """Block before emitting a streamed reply while the server has paused us"""
+        if not self.streams_paused:
+            return
+        task = current_task()
+        interactive = task is None or task.priority == PRIORITY_INTERACTIVE
+        limit = time.monotonic() + INTERACTIVE_PAUSE_WAIT if interactive else self._pause_deadline
+        started = time.monotonic()
+        while self.streams_paused and time.monotonic() < limit:
+            check_cancelled()
+            self._stream_resumed.wait(MAX_SLEEP_SLICE)
+        waited = time.monotonic() - started
+        if task is not None:
+            task.stats['throttle_seconds'] = task.stats.get('throttle_seconds', 0.0) + waited
+        self.total_throttle_seconds += waited
+
+    def limits(self):
+        return {
+            'max_read_bps': self.read_bucket.rate if self.read_bucket else None,
+            'max_iops': self.iops_bucket.rate if self.iops_bucket else None,
+            'max_cpu_percent': self.max_cpu_percent,
+            'backoff_load_percent': self.backoff_load_percent,
+            'backoff_factor': round(self.backoff_factor, 3),
+            'total_throttle_seconds': round(self.total_throttle_seconds, 3),
+            'streams_paused': self.streams_paused,
+        }
+
+    def _sample(self):
+        """Refresh process CPU usage and the host-load backoff factor"""
+        if not self.max_cpu_percent and not self.backoff_load_percent:
+            return
+        now = time.monotonic()
+        with self._sample_lock:
+            if now - self._last_sample < CPU_SAMPLE_INTERVAL:
+                return
+            self._last_sample = now
+            if self._psutil is None:
+                # Imported on first use so agent startup does not pay for it;
+                # the first cpu_percent() calls only prime the counters
+                import psutil
+                self._psutil = psutil
+                self._process = psutil.Process()
+                self._process.cpu_percent(None)
+                psutil.cpu_percent(None)
+                return
+            self._process_cpu = self._process.cpu_percent(None)
+            if self.backoff_load_percent:
+                host_load = self._psutil.cpu_percent(None)
+                if host_load > self.backoff_load_percent:
+                    self.backoff_factor = max(self.backoff_factor * 0.5, MIN_BACKOFF_FACTOR)
+                else:
+                    self.backoff_factor = min(self.backoff_factor * 1.25, 1.0)
+
+    def _wait(self, seconds):
+        task = current_task()
+        if task is None or task.priority == PRIORITY_INTERACTIVE or seconds <= 0:
+            return
+        remaining = seconds
+        while remaining > 0:
+            check_cancelled()
+            step = min(remaining, MAX_SLEEP_SLICE)
+            time.sleep(step)
+            remaining -= step
+        task.stats['throttle_seconds'] = task.stats.get('throttle_seconds', 0.0) + seconds
+        self.total_throttle_seconds += seconds
+
+    def _cpu_delay(self):
+        if not self.max_cpu_percent or self._process_cpu <= self.max_cpu_percent:
+            return 0.0
+        # Sleep long enough that busy time over the sample window matches the cap
+        return CPU_SAMPLE_INTERVAL * (self._process_cpu / self.max_cpu_percent - 1)
+
+    def throttle_read(self, nbytes, ops=1):
+        """Account for a read of nbytes and wait if a cap is exceeded"""
+        self._sample()
+        delay = self._cpu_delay()
+        if self.read_bucket:
+            delay = max(delay, self.read_bucket.charge(nbytes, self.backoff_factor))
+        if self.iops_bucket:
+            delay = max(delay, self.iops_bucket.charge(ops, self.backoff_factor))
+        self._wait(delay)
+
+    def throttle_ops(self, ops=1):
+        """Account for metadata operations (stat, directory reads)"""
+        self._sample()
+        delay = self._cpu_delay()
+        if self.iops_bucket:
+            delay = max(delay, self.iops_bucket.charge(ops, self.backoff_factor))
+        self._wait(delay)
+
+
+def throttle_seconds():
+    """Throttle time accumulated by the task running on this thread"""
+    task = current_task()
+    if task is None:
+        return 0.0
+    return round(task.stats.get('throttle_seconds', 0.0), 3)
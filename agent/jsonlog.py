@@ -0,0 +1,224 @@
+"""Structured JSON-lines logging with a non-blocking queue handler.
+
+Code logs through the standard ``logging`` module under the ``cif`` logger.
+Records are placed on a bounded queue and formatted and written by a single
+listener thread, so a slow or blocked stdout never stalls a handler that is
+relaying file chunks. When the queue is full a record is dropped and
+counted instead of being waited for.
+
+High-frequency events can be sampled: a record logged with
+``extra={'sample': key}`` is written at most ``sample_rate`` times per second
+for that key, and the next record written for the key carries a
+``suppressed`` count.
+
+Fields set with ``set_fields()`` or ``log_context()``, and those returned by
+the optional ``context`` callable passed to ``configure``, are attached to
+every record, which is how agent ids and correlation ids reach each line.
+
+This is the only copy: the agent ships it, and the server imports it from
+the agent directory of the same checkout.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_SAMPLE_RATE = 10
+ROOT_LOGGER = 'cif'
+
+_context = contextvars.ContextVar('cif_log_context', default={})
+# Fields attached to every record from every thread, such as the agent id
+_fields = {}
+
+# Attributes every LogRecord has; anything else came from extra= or the context
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'sample'}
+
+_handler = None
+_listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields to every record logged inside the block"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def set_fields(**fields):
+    """Attach fields to every record logged from now on"""
+    _fields.update(fields)
+
+
+def parse_levels(spec):
+    """Parse 'INFO' or 'INFO,cif.admission=DEBUG' into a base level and per-logger overrides"""
+    base = 'INFO'
+    overrides = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' in part:
+            name, level = part.split('=', 1)
+            overrides[name.strip()] = level.strip().upper()
+        else:
+            base = part.upper()
+    return base, overrides
+
+
+def _extra_fields(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with structured fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            # Keep fields on the first line, ahead of any traceback
+            head, newline, tail = line.partition('\n')
+            line = head + ' ' + ' '.join(f'{key}={value}' for key, value in fields.items()) + newline + tail
+        return line
+
+
+class ContextFilter(logging.Filter):
+    """Copy log_context() fields, and those of an optional callable, onto each record"""
+
+    def __init__(self, context=None):
+        super().__init__()
+        self.context = context
+
+    def filter(self, record):
+        fields = dict(_fields)
+        if self.context is not None:
+            fields.update(self.context() or {})
+        fields.update(_context.get())
+        for key, value in fields.items():
+            if key not in record.__dict__:
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Let through at most `rate` records per second for each sample key"""
+
+    def __init__(self, rate=DEFAULT_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or not self.rate:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= 1.0:
+                started, count = now, 0
+            if count >= self.rate:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            self._windows[key] = (started, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only resolve the message here; formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure(level='INFO', fmt='json', stream=None, sample_rate=DEFAULT_SAMPLE_RATE,
+              queue_size=DEFAULT_QUEUE_SIZE, context=None):
+    """Route the cif loggers through a queue to a JSON (or text) stream handler"""
+    global _handler, _listener
+    shutdown()
+    base, overrides = parse_levels(level)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    _handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    # Sample first so suppressed records cost as little as possible
+    _handler.addFilter(SamplingFilter(sample_rate))
+    _handler.addFilter(ContextFilter(context))
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = [_handler]
+    logger.setLevel(base)
+    logger.propagate = False
+    for name, name_level in overrides.items():
+        logging.getLogger(name).setLevel(name_level)
+    return _handler
+
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
+
+
+def shutdown():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,299 @@
+"""Runtime profiling of the agent, started and stopped from the server.
+
+Two kinds of profile can be taken without restarting or redeploying the
+agent:
+
+* ``task`` -- cProfile around a single scheduler task: the task with a given
+  id, or the next one started for a given command (``get_metadata``,
+  ``index_tree``, ...). It gives exact call counts and times for that task
+  only, and the result is a pstats file readable with ``python -m pstats``
+  or snakeviz.
+* ``sample`` -- a background thread records the stack of every thread every
+  ``interval`` seconds for ``duration`` seconds. Its overhead depends on the
+  sampling rate rather than on how many calls the agent makes, and it also
+  sees the Socket.IO and watcher threads and tasks that were already
+  running. The result is in collapsed-stack format (one
+  ``thread;frame;frame count`` line per distinct stack), readable by
+  flamegraph.pl and speedscope. Samples of threads that used less than a
+  fifth of the interval in CPU time (blocked in ``sleep``, a socket read or
+  a lock) end in an ``[idle]`` frame and are left out of the summary.
+
+Only one profile runs at a time. Each result carries a short summary of the
+hottest functions and is handed to ``on_result`` to be uploaded.
+"""
+
+import cProfile
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+MODE_TASK = 'task'
+MODE_SAMPLE = 'sample'
+MODES = (MODE_TASK, MODE_SAMPLE)
+
+FORMAT_PSTATS = 'pstats'
+FORMAT_COLLAPSED = 'collapsed'
+
+DEFAULT_SAMPLE_DURATION = 30.0
+MAX_SAMPLE_DURATION = 600.0
+DEFAULT_SAMPLE_INTERVAL = 0.01
+MIN_SAMPLE_INTERVAL = 0.001
+# Seconds a task profile waits for a matching task to start
+DEFAULT_TASK_TIMEOUT = 300.0
+MAX_TASK_TIMEOUT = 3600.0
+MAX_STACK_DEPTH = 128
+# Functions listed in a result's summary
+SUMMARY_LIMIT = 25
+# Share of a sampling interval a thread must spend on the CPU to count as busy
+BUSY_CPU_SHARE = 0.2
+IDLE_FRAME = '[idle]'
+# Leaf functions treated as idle where per-thread CPU clocks are unavailable
+IDLE_FUNCTIONS = ('wait', 'select', 'poll', 'sleep', '_wait_for_tstate_lock')
+
+logger = logging.getLogger('cif.profiler')
+
+
+class ProfileError(Exception):
+    """Raised when a profile cannot be started"""
+
+
+def frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def thread_cpu_clock(ident):
+    """CPU-time clock of a thread, or None where the platform has none"""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+class _IdleDetector:
+    """Decide whether a sampled thread was working, from its CPU time since the last sample"""
+
+    def __init__(self):
+        self._clocks = {}
+        self._cpu = {}
+
+    def idle(self, ident, leaf, elapsed):
+        if ident not in self._clocks:
+            self._clocks[ident] = thread_cpu_clock(ident)
+        clock = self._clocks[ident]
+        if clock is not None:
+            try:
+                now = time.clock_gettime(clock)
+            except OSError:
+                now = None
+            if now is not None:
+                previous = self._cpu.get(ident)
+                self._cpu[ident] = now
+                if previous is not None:
+                    return now - previous < elapsed * BUSY_CPU_SHARE
+        return leaf.split(' ', 1)[0] in IDLE_FUNCTIONS
+
+
+class ProfileSession:
+    """One requested profile and the task it ended up profiling"""
+
+    def __init__(self, profile_id, mode, duration, interval, task_id=None, command=None):
+        self.id = profile_id
+        self.mode = mode
+        self.duration = duration
+        self.interval = interval
+        self.task_id = task_id
+        self.command = command
+        self.started_at = time.time()
+        self.profiled_task = None
+        self.stopped = threading.Event()
+
+    def to_dict(self):
+        return {
+            'profile_id': self.id,
+            'mode': self.mode,
+            'duration': self.duration,
+            'interval': self.interval,
+            'task_id': self.task_id,
+            'command': self.command,
+            'started_at': self.started_at,
+            'profiled_task': self.profiled_task,
+        }
+
+
+class Profiler:
+    """Runs at most one task or sampling profile and reports its result"""
+
+    def __init__(self, on_result):
+        self.on_result = on_result
+        self._session = None
+        self._lock = threading.Lock()
+
+    def active(self):
+        with self._lock:
+            return self._session.to_dict() if self._session is not None else None
+
+    def start(self, profile_id, mode, duration=None, interval=None, task_id=None, command=None):
+        """Start a profile; raises ProfileError if the request is invalid or one is running"""
+        if mode not in MODES:
+            raise ProfileError(f'Unknown profile mode: {mode}')
+        if mode == MODE_TASK and not (task_id or command):
+            raise ProfileError('A task profile needs a task_id or a command')
+        if mode == MODE_TASK:
+            duration = min(float(duration or DEFAULT_TASK_TIMEOUT), MAX_TASK_TIMEOUT)
+        else:
+            duration = min(float(duration or DEFAULT_SAMPLE_DURATION), MAX_SAMPLE_DURATION)
+        interval = max(float(interval or DEFAULT_SAMPLE_INTERVAL), MIN_SAMPLE_INTERVAL)
+        session = ProfileSession(profile_id, mode, duration, interval, task_id=task_id, command=command)
+        with self._lock:
+            if self._session is not None:
+                raise ProfileError(f'Profile {self._session.id} is already running')
+            self._session = session
+        target = self._sample if mode == MODE_SAMPLE else self._expire
+        threading.Thread(target=target, args=(session,), name=f'cif-profiler-{profile_id[:8]}', daemon=True).start()
+        logger.info('Profile started', extra={'profile_id': profile_id, 'mode': mode, 'duration': duration})
+        return session
+
+    def stop(self, profile_id):
+        """End a profile early; a running task profile still finishes with its task"""
+        with self._lock:
+            session = self._session
+        if session is None or session.id != profile_id:
+            return False
+        session.stopped.set()
+        return True
+
+    @contextmanager
+    def wrap_task(self, task):
+        """Scheduler wrapper that profiles the task a task profile is waiting for"""
+        with self._lock:
+            session = self._session
+            matches = (
+                session is not None and session.mode == MODE_TASK and session.profiled_task is None
+                and not session.stopped.is_set()
+                and (task.id == session.task_id or (not session.task_id and task.name == session.command))
+            )
+            if matches:
+                session.profiled_task = {'task_id': task.id, 'name': task.name}
+        if not matches:
+            yield
+            return
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            session.profiled_task['seconds'] = round(time.perf_counter() - started, 6)
+            self._finish_task(session, profile)
+
+    def _expire(self, session):
+        """Give up on a task profile whose task never started"""
+        session.stopped.wait(session.duration)
+        with self._lock:
+            if self._session is not session or session.profiled_task is not None:
+                return
+            self._session = None
+        reason = 'stopped' if session.stopped.is_set() else f'timed out after {session.duration:g}s'
+        self._report(session, None, None, error=f'No matching task started; {reason}')
+
+    def _finish_task(self, session, profile):
+        with self._lock:
+            if self._session is session:
+                self._session = None
+        try:
+            stats = pstats.Stats(profile)
+            summary = {'task': session.profiled_task, 'functions': self._pstats_summary(stats)}
+            data = marshal.dumps(stats.stats)
+        except Exception as e:
+            logger.exception('Could not collect task profile')
+            self._report(session, None, None, error=str(e))
+            return
+        self._report(session, data, FORMAT_PSTATS, summary=summary)
+
+    def _pstats_summary(self, stats):
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:SUMMARY_LIMIT]
+        return [
+            {
+                'function': f'{name} ({os.path.basename(filename)}:{line})',
+                'calls': calls,
+                'total_seconds': round(total, 6),
+                'cumulative_seconds': round(cumulative, 6),
+            }
+            for (filename, line, name), (_, calls, total, cumulative, _) in rows
+        ]
+
+    def _sample(self, session):
+        stacks = Counter()
+        samples = 0
+        me = threading.get_ident()
+        detector = _IdleDetector()
+        last = time.monotonic()
+        deadline = last + session.duration
+        try:
+            while not session.stopped.wait(session.interval) and time.monotonic() < deadline:
+                now = time.monotonic()
+                elapsed, last = now - last, now
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    labels = []
+                    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                        labels.append(frame_label(frame.f_code))
+                        frame = frame.f_back
+                    if labels and detector.idle(ident, labels[0], elapsed):
+                        labels.insert(0, IDLE_FRAME)
+                    labels.append(names.get(ident, f'thread-{ident}'))
+                    stacks[';'.join(reversed(labels))] += 1
+                samples += 1
+        except Exception as e:
+            logger.exception('Sampling profiler failed')
+            error = str(e)
+        else:
+            error = None
+        with self._lock:
+            self._session = None
+        if error:
+            self._report(session, None, None, error=error)
+            return
+        data = ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common()).encode()
+        self._report(session, data, FORMAT_COLLAPSED, summary=self._sample_summary(stacks, samples, session))
+
+    def _sample_summary(self, stacks, samples, session):
+        own = Counter()
+        inclusive = Counter()
+        busy = 0
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            leaf = frames[-1]
+            if leaf == IDLE_FRAME:
+                continue
+            busy += count
+            own[leaf] += count
+            for label in set(frames[1:]):
+                inclusive[label] += count
+        return {
+            'samples': samples,
+            'busy_samples': busy,
+            'seconds': round(time.time() - session.started_at, 3),
+            'functions': [
+                {'function': label, 'own_samples': count, 'total_samples': inclusive[label]}
+                for label, count in own.most_common(SUMMARY_LIMIT)
+            ],
+        }
+
+    def _report(self, session, data, fmt, summary=None, error=None):
+        logger.info('Profile finished', extra={
+            'profile_id': session.id, 'mode': session.mode, 'bytes': len(data) if data else 0, 'error': error
+        })
+        try:
+            self.on_result(session, data, fmt, summary, error)
+        except Exception:
+            logger.exception('Could not deliver profile result', extra={'profile_id': session.id})
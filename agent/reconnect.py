@@ -0,0 +1,98 @@
+"""Reconnect backoff and task checkpoints for the agent.
+
+After a server restart every agent loses its connection at the same moment.
+Reconnecting on a fixed schedule makes them all hit the server together, so
+delays grow exponentially and are drawn uniformly from zero up to the
+current ceiling ("full jitter"), which spreads a fleet across the window.
+
+Long-running tasks save their progress to a CheckpointStore so they can be
+resumed, rather than restarted, after a reconnect or an agent restart.
+"""
+
+import json
+import logging
+import os
+import platform
+import random
+import time
+
+DEFAULT_BASE_DELAY = 2.0
+DEFAULT_MAX_DELAY = 300.0
+# Seconds between checkpoint writes for a single task
+CHECKPOINT_INTERVAL = 5.0
+
+logger = logging.getLogger('cif.reconnect')
+
+
+class Backoff:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, base=DEFAULT_BASE_DELAY, maximum=DEFAULT_MAX_DELAY, factor=2.0):
+        self.base = base
+        self.maximum = maximum
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self):
+        ceiling = min(self.maximum, self.base * (self.factor ** self.attempt))
+        self.attempt += 1
+        return random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempt = 0
+
+
+def default_checkpoint_dir():
+    if platform.system() == 'Windows':
+        return os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'cif_agent_checkpoints')
+    return os.path.expanduser('~/.cif_agent_checkpoints')
+
+
+class CheckpointStore:
+    """Persist resumable task state as one JSON file per task"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_checkpoint_dir()
+        self._last_saved = {}
+
+    def _path(self, task_id):
+        return os.path.join(self.directory, f'{task_id}.json')
+
+    def save(self, task_id, kind, state, force=False):
+        """Write a checkpoint, at most once per CHECKPOINT_INTERVAL unless forced"""
+        now = time.monotonic()
+        if not force and now - self._last_saved.get(task_id, 0) < CHECKPOINT_INTERVAL:
+            return False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(task_id) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'task_id': task_id, 'kind': kind, 'saved_at': time.time(), 'state': state}, f)
+            os.replace(tmp_path, self._path(task_id))
+            self._last_saved[task_id] = now
+            return True
+        except OSError as e:
+            logger.warning('Could not save checkpoint', extra={'correlation_id': task_id, 'error': str(e)})
+            return False
+
+    def remove(self, task_id):
+        self._last_saved.pop(task_id, None)
+        try:
+            os.remove(self._path(task_id))
+        except OSError:
+            pass
+
+    def load_all(self):
+        """Return every readable checkpoint"""
+        checkpoints = []
+        if not os.path.isdir(self.directory):
+            return checkpoints
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    checkpoints.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning('Ignoring unreadable checkpoint', extra={'file': name, 'error': str(e)})
+        return checkpoints
@@ -0,0 +1,256 @@
+"""Priority task scheduler for agent commands.
+
+Socket.IO handlers submit work here instead of running it on the client's
+event thread. A bounded pool of worker threads always picks the highest
+priority task first, and background classes may never occupy the workers
+reserved for interactive browsing, so a long sweep cannot starve
+``list_directory`` or ``read_file``.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_HASHING = 1
+PRIORITY_SWEEP = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_HASHING: 'hashing',
+    PRIORITY_SWEEP: 'sweep',
+}
+
+_local = threading.local()
+
+logger = logging.getLogger('cif.scheduler')
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task once it has been cancelled"""
+
+
+def current_task():
+    """Return the Task running on this thread, or None outside the scheduler"""
+    return getattr(_local, 'task', None)
+
+
+def check_cancelled():
+    """Raise TaskCancelled if the task running on this thread was cancelled"""
+    task = current_task()
+    if task is not None:
+        task.check_cancelled()
+
+
+@contextmanager
+def timed(operation):
+    """Add the wall time of the block to the running task's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        task = current_task()
+        if task is not None:
+            timings = task.stats.setdefault('timings', {})
+            timings[operation] = timings.get(operation, 0.0) + time.perf_counter() - start
+
+
+def task_timings():
+    """Timings accumulated by the task running on this thread, for inclusion in replies"""
+    task = current_task()
+    if task is None:
+        return {}
+    return {operation: round(seconds, 6) for operation, seconds in task.stats.get('timings', {}).items()}
+
+
+class Task:
+    """A unit of work queued on the scheduler"""
+
+    def __init__(self, name, func, args, kwargs, priority, task_id=None, group=None):
+        self.id = task_id or str(uuid.uuid4())
+        # Id shared by the parts of one command; cancelling it cancels them all
+        self.group = group
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.state = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stats = {}
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise TaskCancelled(f'Task {self.id} was cancelled')
+
+    def to_dict(self):
+        return {
+            'task_id': self.id,
+            'group': self.group,
+            'name': self.name,
+            'priority': PRIORITY_NAMES.get(self.priority, self.priority),
+            'state': self.state,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+        }
+
+
+class TaskScheduler:
+    """Bounded worker pool that runs tasks by priority class"""
+
+    def __init__(self, max_workers=4, reserved_interactive=1, on_change=None):
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.max_workers = max_workers
+        # Background tasks may use every worker except the reserved ones
+        self.background_limit = max(max_workers - reserved_interactive, 1)
+        self.on_change = on_change
+        self._queue = []
+        self._counter = itertools.count()
+        self._tasks = {}
+        self._running_background = 0
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._wrappers = []
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker, name=f'cif-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, name, func, *args, priority=PRIORITY_INTERACTIVE, task_id=None, group=None, **kwargs):
+        """Queue func(*args, **kwargs) and return its Task"""
+        task = Task(name, func, args, kwargs, priority, task_id=task_id, group=group)
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('Scheduler is shut down')
+            self._tasks[task.id] = task
+            heapq.heappush(self._queue, (priority, next(self._counter), task))
+            self._condition.notify()
+        self._notify_change()
+        return task
+
+    def add_wrapper(self, wrapper):
+        """Run every task inside wrapper(task), a context manager factory such as a profiler hook"""
+        self._wrappers.append(wrapper)
+
+    def cancel(self, task_id):
+        """Cancel a queued or running task, or every task in a group; returns False for unknown ids"""
+        with self._condition:
+            matching = [task for task in self._tasks.values() if task.id == task_id or task.group == task_id]
+            if not matching:
+                return False
+            dropped = False
+            for task in matching:
+                task.cancel()
+                if task.state == 'queued':
+                    task.state = 'cancelled'
+                    del self._tasks[task.id]
+                    dropped = True
+            if dropped:
+                # Drop queued tasks now so queue depth reflects the cancellation
+                self._queue = [item for item in self._queue if item[2].state != 'cancelled']
+                heapq.heapify(self._queue)
+            self._condition.notify_all()
+        self._notify_change()
+        return True
+
+    def queue_depth(self):
+        """Return queued and running counts per priority class"""
+        with self._condition:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            running = {name: 0 for name in PRIORITY_NAMES.values()}
+            for task in self._tasks.values():
+                name = PRIORITY_NAMES.get(task.priority, str(task.priority))
+                if task.state == 'running':
+                    running[name] = running.get(name, 0) + 1
+                else:
+                    queued[name] = queued.get(name, 0) + 1
+            return {
+                'queued': queued,
+                'running': running,
+                'max_workers': self.max_workers,
+            }
+
+    def has_task(self, task_id):
+        with self._condition:
+            return any(task.id == task_id or task.group == task_id for task in self._tasks.values())
+
+    def tasks(self):
+        with self._condition:
+            return [task.to_dict() for task in self._tasks.values()]
+
+    def shutdown(self, cancel_running=True):
+        with self._condition:
+            self._shutdown = True
+            if cancel_running:
+                for task in self._tasks.values():
+                    task.cancel()
+            self._condition.notify_all()
+
+    def _next_task(self):
+        """Pop the next runnable task, honouring the background worker limit"""
+        while not self._shutdown:
+            if self._queue:
+                priority = self._queue[0][0]
+                if priority == PRIORITY_INTERACTIVE or self._running_background < self.background_limit:
+                    task = heapq.heappop(self._queue)[2]
+                    if priority != PRIORITY_INTERACTIVE:
+                        self._running_background += 1
+                    return task
+            self._condition.wait()
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                if task is None:
+                    return
+                task.state = 'running'
+                task.started_at = time.time()
+            self._notify_change()
+
+            _local.task = task
+            try:
+                task.check_cancelled()
+                with ExitStack() as stack:
+                    for wrapper in self._wrappers:
+                        stack.enter_context(wrapper(task))
+                    task.func(*task.args, **task.kwargs)
+                task.state = 'done'
+            except TaskCancelled:
+                task.state = 'cancelled'
+            except Exception as e:
+                task.state = 'failed'
+                logger.exception('Task failed', extra={'error': str(e)})
+            finally:
+                _local.task = None
+                task.finished_at = time.time()
+                with self._condition:
+                    if task.priority != PRIORITY_INTERACTIVE:
+                        self._running_background -= 1
+                    self._tasks.pop(task.id, None)
+                    self._condition.notify_all()
+                self._notify_change()
+
+    def _notify_change(self):
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.warning('Scheduler change callback failed', extra={'error': str(e)})
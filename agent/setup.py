@@ -5,7 +5,7 @@ setup(
     version='0.1.0',
     description='Computer Investigations Framework Agent',
     author='CIF Team',
-    py_modules=['agent'],
+    py_modules=['agent', 'scheduler', 'governor', 'cache', 'watcher', 'reconnect', 'jsonlog', 'profiler', 'archives', 'delta', 'analytics'],
     install_requires=[
         'python-socketio==5.10.0',
         'psutil==5.9.6',
@@ -13,6 +13,8 @@ setup(
     # Optional Windows-specific dependencies
     extras_require={
         'windows': ['pywin32>=306'],
+        # Vectorized entropy maps and histograms for analyze_file
+        'analytics': ['numpy>=1.24'],
     },
     entry_points={
         'console_scripts': [
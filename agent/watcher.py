@@ -0,0 +1,392 @@
+"""Live change feed for a watched subtree.
+
+On Linux the subtree is watched with inotify through ctypes; every directory
+gets its own watch and new directories are added as they appear. Where
+inotify is unavailable (other platforms, or the per-user watch limit is
+exhausted) a polling watcher re-stats the tree at a fixed interval and
+diffs it against the previous pass. fanotify is not used: it needs
+CAP_SYS_ADMIN, which the agent cannot assume.
+
+Raw events from either backend go through an EventCoalescer, which merges
+repeated events for the same path over a short window (create+modify is a
+create, create+delete is nothing) and caps how many events are sent per
+second. When the cap is exceeded the excess is dropped and an ``overflow``
+event tells the server to rescan instead.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import platform
+import select
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger('cif.watcher')
+
+CREATED = 'created'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+RENAMED = 'renamed'
+OVERFLOW = 'overflow'
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+DEFAULT_WINDOW = 0.5
+DEFAULT_MAX_EVENTS_PER_SECOND = 1000
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+class WatchError(Exception):
+    """Raised when a watch cannot be established"""
+
+
+class EventCoalescer:
+    """Merge and rate-limit raw change events before they are sent"""
+
+    def __init__(self, emit, window=DEFAULT_WINDOW, max_events_per_second=DEFAULT_MAX_EVENTS_PER_SECOND):
+        self.emit = emit
+        self.window = window
+        self.max_events_per_second = max_events_per_second
+        self._pending = OrderedDict()
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cif-watch-flush', daemon=True)
+        self._thread.start()
+
+    def add(self, kind, path, old_path=None):
+        with self._lock:
+            if kind == RENAMED:
+                previous = self._pending.pop(old_path, None)
+                if previous and previous[0] == CREATED:
+                    # Created and renamed inside one window: only the new name matters
+                    self._pending[path] = (CREATED, None)
+                else:
+                    self._pending[path] = (RENAMED, old_path)
+                return
+
+            previous = self._pending.get(path)
+            if previous is None:
+                self._pending[path] = (kind, old_path)
+            elif previous[0] == CREATED and kind == DELETED:
+                del self._pending[path]
+            elif previous[0] in (CREATED, RENAMED) and kind == MODIFIED:
+                pass
+            elif previous[0] == DELETED and kind == CREATED:
+                self._pending[path] = (MODIFIED, None)
+            else:
+                self._pending[path] = (kind, old_path)
+
+    def overflow(self, path):
+        """Record that events were lost and the subtree must be rescanned"""
+        with self._lock:
+            self._pending[path] = (OVERFLOW, None)
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            self.flush()
+
+    def flush(self):
+        budget = max(int(self.max_events_per_second * self.window), 1)
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = OrderedDict()
+        events = []
+        for path, (kind, old_path) in pending.items():
+            if len(events) >= budget:
+                self._dropped += 1
+                continue
+            events.append({'type': kind, 'path': path, 'old_path': old_path})
+        if self._dropped:
+            events.append({'type': OVERFLOW, 'path': None, 'dropped': self._dropped})
+            self._dropped = 0
+        self.emit(events)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.window * 2)
+        self.flush()
+
+
+class _Libc:
+    """Thin ctypes wrapper over the inotify syscalls"""
+
+    def __init__(self):
+        name = ctypes.util.find_library('c') or 'libc.so.6'
+        libc = ctypes.CDLL(name, use_errno=True)
+        self.init1 = libc.inotify_init1
+        self.init1.argtypes = [ctypes.c_int]
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rm_watch = libc.inotify_rm_watch
+        self.rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+class InotifyWatcher:
+    """Watch a subtree with one inotify watch per directory"""
+
+    mode = 'inotify'
+
+    def __init__(self, root, coalescer):
+        if platform.system() != 'Linux':
+            raise WatchError('inotify is only available on Linux')
+        try:
+            self._libc = _Libc()
+        except (OSError, AttributeError) as e:
+            raise WatchError(f'inotify is not available: {e}')
+        self.root = root.rstrip('/') or '/'
+        self.coalescer = coalescer
+        self._fd = self._libc.init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError(f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+        self._paths = {}
+        self._moves = {}
+        self._stop = threading.Event()
+        try:
+            self._add_tree(self.root, report=False)
+        except WatchError:
+            os.close(self._fd)
+            raise
+        self._thread = threading.Thread(target=self._run, name='cif-inotify', daemon=True)
+        self._thread.start()
+
+    def _add_watch(self, path):
+        wd = self._libc.add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatchError('inotify watch limit reached (fs.inotify.max_user_watches)')
+            if err in (errno.ENOENT, errno.EACCES, errno.ENOTDIR):
+                return
+            raise WatchError(f'inotify_add_watch failed for {path}: {os.strerror(err)}')
+        self._paths[wd] = path
+
+    def _add_tree(self, top, report):
+        """Watch top and every directory below it; report=True emits creates for its contents"""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            self._add_watch(directory)
+            try:
+                with os.scandir(directory) as it:
+                    for item in it:
+                        if report:
+                            self.coalescer.add(CREATED, item.path)
+                        if item.is_dir(follow_symlinks=False):
+                            stack.append(item.path)
+            except OSError:
+                continue
+
+    def _rename_subtree(self, old, new):
+        """Rewrite watched paths after a directory moved inside the tree"""
+        for wd, path in list(self._paths.items()):
+            if path == old or path.startswith(old + '/'):
+                self._paths[wd] = new + path[len(old):]
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                readable, _, _ = select.select([self._fd], [], [], 0.5)
+            except (OSError, ValueError):
+                break
+            if readable:
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    break
+                self._handle(data)
+            self._expire_moves()
+
+    def _expire_moves(self, max_age=0.5):
+        # A MOVED_FROM without a matching MOVED_TO left the tree: treat as a delete
+        now = time.monotonic()
+        for cookie, (path, is_dir, seen) in list(self._moves.items()):
+            if now - seen > max_age:
+                del self._moves[cookie]
+                self.coalescer.add(DELETED, path)
+                if is_dir:
+                    self._forget_subtree(path)
+
+    def _forget_subtree(self, top):
+        for wd, path in list(self._paths.items()):
+            if path == top or path.startswith(top + '/'):
+                self._libc.rm_watch(self._fd, wd)
+                self._paths.pop(wd, None)
+
+    def _handle(self, data):
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.coalescer.overflow(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # Reported through the parent's DELETE / MOVED_FROM
+                continue
+
+            path = os.path.join(directory, os.fsdecode(raw_name)) if raw_name else directory
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & IN_CREATE:
+                self.coalescer.add(CREATED, path)
+                if is_dir:
+                    self._add_tree_safely(path)
+            elif mask & IN_DELETE:
+                self.coalescer.add(DELETED, path)
+            elif mask & IN_MOVED_FROM:
+                self._moves[cookie] = (path, is_dir, time.monotonic())
+            elif mask & IN_MOVED_TO:
+                moved = self._moves.pop(cookie, None)
+                if moved is not None:
+                    self.coalescer.add(RENAMED, path, old_path=moved[0])
+                    if is_dir:
+                        self._rename_subtree(moved[0], path)
+                else:
+                    self.coalescer.add(CREATED, path)
+                    if is_dir:
+                        self._add_tree_safely(path)
+            elif mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB):
+                self.coalescer.add(MODIFIED, path)
+
+    def _add_tree_safely(self, path):
+        try:
+            self._add_tree(path, report=True)
+        except WatchError:
+            self.coalescer.overflow(path)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+
+class PollingWatcher:
+    """Watch a subtree by re-statting it every interval and diffing the results"""
+
+    mode = 'polling'
+
+    def __init__(self, root, coalescer, interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.coalescer = coalescer
+        self.interval = interval
+        self._state = self._scan()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cif-poll-watch', daemon=True)
+        self._thread.start()
+
+    def _scan(self):
+        state = {}
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for item in it:
+                        try:
+                            stat = item.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        is_dir = item.is_dir(follow_symlinks=False)
+                        state[item.path] = (stat.st_mtime_ns, stat.st_size if not is_dir else 0, stat.st_ino, is_dir)
+                        if is_dir:
+                            stack.append(item.path)
+            except OSError:
+                continue
+        return state
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            current = self._scan()
+            previous = self._state
+            self._state = current
+
+            removed = {path: info for path, info in previous.items() if path not in current}
+            removed_by_inode = {info[2]: path for path, info in removed.items()}
+            for path, info in current.items():
+                old = previous.get(path)
+                if old is None:
+                    old_path = removed_by_inode.pop(info[2], None)
+                    if old_path is not None:
+                        del removed[old_path]
+                        self.coalescer.add(RENAMED, path, old_path=old_path)
+                    else:
+                        self.coalescer.add(CREATED, path)
+                elif old != info:
+                    self.coalescer.add(MODIFIED, path)
+            for path in removed:
+                self.coalescer.add(DELETED, path)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval + 1)
+
+
+class Watch:
+    """A running watch: backend watcher plus its coalescer"""
+
+    def __init__(self, root, emit, watch_id=None, force_polling=False, interval=DEFAULT_POLL_INTERVAL,
+                 window=DEFAULT_WINDOW, max_events_per_second=DEFAULT_MAX_EVENTS_PER_SECOND):
+        if not os.path.isdir(root):
+            raise WatchError(f'Not a directory: {root}')
+        self.id = watch_id or str(uuid.uuid4())
+        self.root = root
+        self.coalescer = EventCoalescer(emit, window=window, max_events_per_second=max_events_per_second)
+        self.watcher = None
+        if not force_polling and platform.system() == 'Linux':
+            try:
+                self.watcher = InotifyWatcher(root, self.coalescer)
+            except WatchError as e:
+                logger.warning('Falling back to polling', extra={'root': root, 'error': str(e)})
+        if self.watcher is None:
+            self.watcher = PollingWatcher(root, self.coalescer, interval=interval)
+
+    @property
+    def mode(self):
+        return self.watcher.mode
+
+    def stop(self):
+        self.watcher.stop()
+        self.coalescer.stop()
@@ -0,0 +1,315 @@
+"""Admission control and backpressure for agent responses.
+
+Agent replies such as ``file_content`` and ``filesystem_list`` used to be
+re-broadcast the moment they arrived, so a few agents streaming at once could
+fill the server's memory faster than browsers drained it. Replies now pass
+through two limits:
+
+* ``AdmissionController`` counts the bytes each agent has in flight, from the
+  moment a reply is received until it has been handed to every analyst's
+  transport. When an agent or the server as a whole goes over its budget the
+  agent is told to ``pause_stream``; it is told to ``resume_stream`` once the
+  backlog has drained below half the budget. Replies that would push past
+  twice the budget are rejected outright.
+* ``Relay`` keeps one bounded outbound queue per analyst socket and drains
+  them on a background task, skipping analysts whose transport is still
+  backed up. Under the ``drop`` policy a full queue discards its oldest
+  replies; under ``slow`` it holds on to them and the in-flight budget
+  slows the agents down instead.
+"""
+
+import threading
+from collections import deque
+
+DEFAULT_AGENT_BUDGET = 32 * 1024 * 1024
+DEFAULT_GLOBAL_BUDGET = 256 * 1024 * 1024
+DEFAULT_QUEUE_BYTES = 16 * 1024 * 1024
+# Paused agents resume once in-flight bytes fall below this share of the budget
+RESUME_RATIO = 0.5
+# Replies that would take in-flight bytes past this multiple of the budget are rejected
+HARD_LIMIT_RATIO = 2.0
+# Rough per-entry cost of a filesystem_list entry once serialised
+ENTRY_SIZE_ESTIMATE = 256
+# Engine.IO packets still waiting for a slow analyst before we stop feeding it
+MAX_TRANSPORT_BACKLOG = 16
+# Messages sent to one analyst before moving on to the next
+DRAIN_BURST = 8
+IDLE_WAIT = 1.0
+
+POLICY_DROP = 'drop'
+POLICY_SLOW = 'slow'
+POLICIES = (POLICY_DROP, POLICY_SLOW)
+
+
+def parse_size(value):
+    """Parse a byte count such as '512K', '32M' or '1G'"""
+    if isinstance(value, int):
+        return value
+    value = value.strip().upper()
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def payload_size(data):
+    """Estimate the in-memory size of an agent reply without serialising it"""
+    size = 256
+    for value in data.values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif isinstance(value, (list, tuple)):
+            size += len(value) * ENTRY_SIZE_ESTIMATE
+        elif isinstance(value, dict):
+            size += len(value) * 64
+    return size
+
+
+class AdmissionController:
+    """Per-agent and global in-flight byte budgets"""
+
+    def __init__(self, agent_budget=DEFAULT_AGENT_BUDGET, global_budget=DEFAULT_GLOBAL_BUDGET,
+                 on_pause=None, on_resume=None):
+        self.agent_budget = agent_budget
+        self.global_budget = global_budget
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.in_flight = 0
+        self.rejected = 0
+        self._agents = {}
+        self._paused = set()
+        self._lock = threading.Lock()
+
+    def admit(self, agent_id, nbytes):
+        """Account for a reply; returns False if it must be rejected"""
+        pause = False
+        with self._lock:
+            agent_bytes = self._agents.get(agent_id, 0)
+            # An agent with nothing in flight may always send one reply, however large
+            over_hard_limit = agent_bytes > 0 and (
+                agent_bytes + nbytes > self.agent_budget * HARD_LIMIT_RATIO
+                or self.in_flight + nbytes > self.global_budget * HARD_LIMIT_RATIO
+            )
+            if over_hard_limit:
+                self.rejected += 1
+                accepted = False
+            else:
+                agent_bytes += nbytes
+                self._agents[agent_id] = agent_bytes
+                self.in_flight += nbytes
+                accepted = True
+            if agent_bytes > self.agent_budget or self.in_flight > self.global_budget:
+                if agent_id not in self._paused:
+                    self._paused.add(agent_id)
+                    pause = True
+        if pause and self.on_pause is not None:
+            self.on_pause(agent_id)
+        return accepted
+
+    def release(self, agent_id, nbytes):
+        """Return bytes once a reply has left the server"""
+        resumed = []
+        with self._lock:
+            remaining = self._agents.get(agent_id, 0) - nbytes
+            if remaining > 0:
+                self._agents[agent_id] = remaining
+            else:
+                self._agents.pop(agent_id, None)
+            self.in_flight = max(self.in_flight - nbytes, 0)
+            if self._paused and self.in_flight <= self.global_budget * RESUME_RATIO:
+                for paused_id in list(self._paused):
+                    if self._agents.get(paused_id, 0) <= self.agent_budget * RESUME_RATIO:
+                        self._paused.discard(paused_id)
+                        resumed.append(paused_id)
+        if self.on_resume is not None:
+            for paused_id in resumed:
+                self.on_resume(paused_id)
+
+    def forget(self, agent_id):
+        """Drop pause state for a disconnected agent; its queued bytes are still released normally"""
+        with self._lock:
+            self._paused.discard(agent_id)
+
+    def is_paused(self, agent_id):
+        with self._lock:
+            return agent_id in self._paused
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight_bytes': self.in_flight,
+                'global_budget': self.global_budget,
+                'agent_budget': self.agent_budget,
+                'agents': dict(self._agents),
+                'paused_agents': sorted(self._paused),
+                'rejected': self.rejected,
+            }
+
+
+class _Message:
+    __slots__ = ('event', 'data', 'nbytes', 'agent_id', 'pending')
+
+    def __init__(self, event, data, nbytes, agent_id, pending):
+        self.event = event
+        self.data = data
+        self.nbytes = nbytes
+        self.agent_id = agent_id
+        self.pending = pending
+
+
+class AnalystQueue:
+    """Bounded FIFO of replies waiting to be sent to one analyst socket"""
+
+    def __init__(self, max_bytes=DEFAULT_QUEUE_BYTES, policy=POLICY_SLOW):
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.size = 0
+        self.dropped = 0
+        self._items = deque()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, message):
+        """Queue a message and return any messages evicted to make room"""
+        self._items.append(message)
+        self.size += message.nbytes
+        # 'slow' holds replies until the in-flight budget throttles the agents,
+        # but never lets one analyst pin more than the hard limit
+        limit = self.max_bytes if self.policy == POLICY_DROP else self.max_bytes * HARD_LIMIT_RATIO
+        evicted = []
+        while self.size > limit and len(self._items) > 1:
+            oldest = self._items.popleft()
+            self.size -= oldest.nbytes
+            self.dropped += 1
+            evicted.append(oldest)
+        return evicted
+
+    def pop(self):
+        if not self._items:
+            return None
+        message = self._items.popleft()
+        self.size -= message.nbytes
+        return message
+
+    def clear(self):
+        items = list(self._items)
+        self._items.clear()
+        self.size = 0
+        return items
+
+
+class Relay:
+    """Fan agent replies out to analyst sockets through bounded per-socket queues"""
+
+    def __init__(self, socketio, admission, max_queue_bytes=DEFAULT_QUEUE_BYTES,
+                 policy=POLICY_SLOW, namespace='/'):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown queue policy: {policy}')
+        self.socketio = socketio
+        self.admission = admission
+        self.max_queue_bytes = max_queue_bytes
+        self.policy = policy
+        self.namespace = namespace
+        self._queues = {}
+        self._wakeup = None
+        self._task = None
+
+    def add_client(self, sid):
+        self._queues.setdefault(sid, AnalystQueue(self.max_queue_bytes, self.policy))
+
+    def remove_client(self, sid):
+        queue = self._queues.pop(sid, None)
+        if queue is not None:
+            for message in queue.clear():
+                self._settle(message)
+
+    def publish(self, event, data, agent_id):
+        """Queue a reply for every analyst; returns False if admission rejected it"""
+        nbytes = payload_size(data)
+        if not self.admission.admit(agent_id, nbytes):
+            return False
+        queues = list(self._queues.items())
+        if not queues:
+            self.admission.release(agent_id, nbytes)
+            return True
+        message = _Message(event, data, nbytes, agent_id, len(queues))
+        for sid, queue in queues:
+            evicted = queue.put(message)
+            for dropped in evicted:
+                self._settle(dropped)
+            if evicted:
+                # Let the analyst re-request what it lost instead of waiting forever
+                self.socketio.emit('stream_dropped', {
+                    'dropped': [
+                        {'event': m.event, 'agent_id': m.agent_id, 'path': m.data.get('path'),
+                         'chunk_number': m.data.get('chunk_number')}
+                        for m in evicted
+                    ]
+                }, to=sid, namespace=self.namespace)
+        self._ensure_started()
+        self._wakeup.set()
+        return True
+
+    def notify(self, event, data):
+        """Send a small control message to every analyst, bypassing the queues"""
+        for sid in list(self._queues):
+            self.socketio.emit(event, data, to=sid, namespace=self.namespace)
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'max_queue_bytes': self.max_queue_bytes,
+            'analysts': {
+                sid: {'queued': len(queue), 'bytes': queue.size, 'dropped': queue.dropped}
+                for sid, queue in self._queues.items()
+            },
+        }
+
+    def _settle(self, message):
+        message.pending -= 1
+        if message.pending == 0:
+            self.admission.release(message.agent_id, message.nbytes)
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = self.socketio.server.eio.create_event()
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _transport_backlog(self, sid):
+        """Packets Engine.IO has not yet written to this analyst's transport"""
+        try:
+            server = self.socketio.server
+            eio_sid = server.manager.eio_sid_from_sid(sid, self.namespace)
+            return server.eio.sockets[eio_sid].queue.qsize()
+        except (AttributeError, KeyError, NotImplementedError):
+            return 0
+
+    def _run(self):
+        while True:
+            # Cleared before scanning so a publish during the scan is not missed
+            self._wakeup.clear()
+            sent = 0
+            waiting = False
+            for sid, queue in list(self._queues.items()):
+                if not len(queue):
+                    continue
+                if self._transport_backlog(sid) > MAX_TRANSPORT_BACKLOG:
+                    waiting = True
+                    continue
+                for _ in range(DRAIN_BURST):
+                    message = queue.pop()
+                    if message is None:
+                        break
+                    self.socketio.emit(message.event, message.data, to=sid, namespace=self.namespace)
+                    self._settle(message)
+                    sent += 1
+                if len(queue):
+                    waiting = True
+            if sent:
+                self.socketio.sleep(0)
+            elif waiting:
+                # Every analyst with queued replies is still flushing its transport
+                self.socketio.sleep(0.05)
+            else:
+                self._wakeup.wait(IDLE_WAIT)
@@ -0,0 +1,942 @@
+"""Read-only analysis of raw (dd) disk images on the server.
+
+A ``DiskImage`` memory-maps an image file and finds its volumes: the
+partitions of a GPT or MBR partition table (following the chain of logical
+partitions in an extended partition), or a single filesystem covering the
+whole image. ext2/3/4 and FAT12/16/32 volumes are read directly from the
+mapping, so listings and file reads run at local disk speed with no agent.
+
+Paths inside an image start with the volume: ``/p1/etc/hostname`` is on the
+first partition and ``/p0/...`` on an image with no partition table.
+Listing entries have the same shape as an agent's. Directories also list the
+deleted entries still present in their on-disk records, marked ``deleted``
+and, where the contents can still be read back, ``recoverable``:
+
+* FAT keeps a deleted file's first cluster and size. The contents are read
+  back by assuming the file was contiguous, which is only trusted while
+  those clusters are still free.
+* ext2 keeps a deleted inode's block map. ext3 and ext4 clear the block map
+  and size on delete, so only the name, inode number and times remain.
+
+A deleted name that clashes with another entry in the same directory is
+listed with a `` (deleted)`` suffix.
+"""
+
+import mmap
+import os
+import struct
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+SECTOR_SIZE = 512
+# Parsed directories kept per filesystem; the least recently listed is dropped first
+DIRECTORY_CACHE_SIZE = 256
+# Block or cluster maps of recently read files
+RUNS_CACHE_SIZE = 256
+MAX_GPT_ENTRIES = 1024
+MAX_LOGICAL_PARTITIONS = 128
+MAX_EXTENT_DEPTH = 5
+# Larger directories are taken to be corrupt rather than read into memory
+MAX_DIRECTORY_SIZE = 256 * 1024 * 1024
+
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+MBR_GPT_PROTECTIVE = 0xEE
+MBR_TYPES = {
+    0x01: 'FAT12', 0x04: 'FAT16', 0x06: 'FAT16', 0x07: 'NTFS/exFAT', 0x0B: 'FAT32', 0x0C: 'FAT32 (LBA)',
+    0x0E: 'FAT16 (LBA)', 0x82: 'Linux swap', 0x83: 'Linux', 0x8E: 'Linux LVM', 0xA5: 'FreeBSD', 0xAF: 'HFS+',
+    0xEF: 'EFI System', 0xFD: 'Linux RAID',
+}
+GPT_TYPES = {
+    'c12a7328-f81f-11d2-ba4b-00a0c93ec93b': 'EFI System',
+    'e3c9e316-0b5c-4db8-817d-f92df00215ae': 'Microsoft reserved',
+    'ebd0a0a2-b9e5-4433-87c0-68b6b72699c7': 'Microsoft basic data',
+    'de94bba4-06d1-4d40-a16a-bfd50179d6ac': 'Windows recovery',
+    '0fc63daf-8483-4772-8e79-3d69d8477de4': 'Linux filesystem',
+    '0657fd6d-a4ab-43c4-84e5-0933c84b4f4f': 'Linux swap',
+    'e6d6d379-f507-44c2-a23c-238f2a3df928': 'Linux LVM',
+    '4f68bce3-e8cd-4db1-96e7-fbcaf984b709': 'Linux root (x86-64)',
+    '21686148-6449-6e6f-744e-656564454649': 'BIOS boot',
+}
+
+EXT_MAGIC = 0xEF53
+EXT_ROOT_INODE = 2
+EXT_INCOMPAT_FILETYPE = 0x2
+EXT_INCOMPAT_EXTENTS = 0x40
+EXT_INCOMPAT_64BIT = 0x80
+EXT_INCOMPAT_FLEX_BG = 0x200
+EXT_COMPAT_JOURNAL = 0x4
+EXT_INDEX_FL = 0x1000
+EXT_EXTENTS_FL = 0x80000
+EXT_INLINE_DATA_FL = 0x10000000
+EXT_EXTENT_MAGIC = 0xF30A
+EXT_DIR_CSUM_TYPE = 0xDE
+EXT_FTYPE_DIR = 2
+S_IFMT = 0xF000
+S_IFDIR = 0x4000
+S_IFLNK = 0xA000
+
+FAT_ATTR_LFN = 0x0F
+FAT_ATTR_VOLUME = 0x08
+FAT_ATTR_DIRECTORY = 0x10
+FAT_DELETED = 0xE5
+FAT_KANJI_E5 = 0x05
+
+
+class DiskImageError(Exception):
+    """Raised when an image, volume or path inside it cannot be read"""
+
+
+def _iso(timestamp):
+    """ISO time of a Unix timestamp stored on an ext volume, or None if unset"""
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _fat_time(date, time=0, hundredths=0):
+    """ISO time of a FAT date and time, which are local time of the host that wrote them"""
+    if not date:
+        return None
+    try:
+        value = datetime(1980 + (date >> 9), (date >> 5) & 0xF, date & 0x1F,
+                         time >> 11, (time >> 5) & 0x3F, (time & 0x1F) * 2)
+    except ValueError:
+        return None
+    return (value + timedelta(milliseconds=hundredths * 10)).isoformat()
+
+
+def _lfn_checksum(short_name):
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+class Node:
+    """A file or directory on a volume, live or deleted"""
+
+    __slots__ = ('name', 'ref', 'is_directory', 'size', 'created', 'modified', 'accessed',
+                 'mode', 'uid', 'gid', 'inode', 'link', 'deleted', 'recoverable', 'deleted_at')
+
+    def __init__(self, name, ref, is_directory, size=0, deleted=False):
+        self.name = name
+        self.ref = ref
+        self.is_directory = is_directory
+        self.size = size
+        self.created = self.modified = self.accessed = None
+        self.mode = self.uid = self.gid = self.inode = self.link = None
+        self.deleted = deleted
+        self.recoverable = not deleted
+        self.deleted_at = None
+
+
+class Runs:
+    """Where the contents of a file lie in the image, as runs of blocks"""
+
+    def __init__(self, unit, runs):
+        # (first logical block, byte offset in the image, block count, reads as zeros)
+        self.unit = unit
+        self.runs = sorted(runs)
+        self.starts = [run[0] for run in self.runs]
+
+    def read(self, image, offset, length):
+        out = bytearray(length)
+        end = offset + length
+        index = max(bisect_right(self.starts, offset // self.unit) - 1, 0)
+        for logical, physical, count, zero in self.runs[index:]:
+            run_start = logical * self.unit
+            if run_start >= end:
+                break
+            run_end = run_start + count * self.unit
+            if run_end <= offset or zero:
+                continue
+            start = max(offset, run_start)
+            stop = min(end, run_end)
+            data = image.read(physical + start - run_start, stop - start)
+            out[start - offset:start - offset + len(data)] = data
+        return bytes(out)
+
+
+class Filesystem:
+    """Directory tree of one volume; subclasses parse the on-disk structures"""
+
+    kind = None
+
+    def __init__(self, image, offset, size):
+        self.image = image
+        self.offset = offset
+        self.size = size
+        self.label = None
+        self._directories = OrderedDict()
+        self._runs = OrderedDict()
+
+    def root(self):
+        raise NotImplementedError
+
+    def read_directory(self, node):
+        """Nodes of a directory, live and deleted, in on-disk order"""
+        raise NotImplementedError
+
+    def read(self, node, offset, length):
+        raise NotImplementedError
+
+    def children(self, node):
+        """A directory's nodes by unique name, directories first and then by name"""
+        key = (node.ref, node.deleted)
+        cached = self._directories.get(key)
+        if cached is not None:
+            self._directories.move_to_end(key)
+            return cached
+        named = {}
+        # Live entries first, so a deleted entry is the one renamed when names clash
+        for child in sorted(self.read_directory(node), key=lambda c: c.deleted):
+            name = child.name
+            suffix = 1
+            while name in named:
+                name = f'{child.name} (deleted)' if suffix == 1 else f'{child.name} (deleted {suffix})'
+                suffix += 1
+            child.name = name
+            named[name] = child
+        children = OrderedDict(
+            (name, named[name]) for name in sorted(named, key=lambda n: (not named[n].is_directory, n.lower()))
+        )
+        self._directories[key] = children
+        while len(self._directories) > DIRECTORY_CACHE_SIZE:
+            self._directories.popitem(last=False)
+        return children
+
+    def resolve(self, parts):
+        node = self.root()
+        for part in parts:
+            if not node.is_directory:
+                raise NotADirectoryError(f'Not a directory: {node.name}')
+            child = self.children(node).get(part)
+            if child is None:
+                raise FileNotFoundError(f'No such file or directory: {part}')
+            node = child
+        return node
+
+    def cached_runs(self, key, build):
+        runs = self._runs.get(key)
+        if runs is None:
+            runs = self._runs[key] = build()
+            while len(self._runs) > RUNS_CACHE_SIZE:
+                self._runs.popitem(last=False)
+        else:
+            self._runs.move_to_end(key)
+        return runs
+
+    def entry(self, node, path):
+        """Listing entry in the same shape as CIFAgent.list_directory"""
+        entry = {
+            'name': node.name,
+            'path': path,
+            'is_directory': node.is_directory,
+            'size': 0 if node.is_directory else node.size,
+            'created': node.created,
+            'modified': node.modified,
+            'accessed': node.accessed,
+            'mode': f'{node.mode & 0o777:03o}' if node.mode is not None else 'N/A',
+            'uid': node.uid,
+            'gid': node.gid,
+            'inode': node.inode,
+        }
+        if node.link is not None:
+            entry['link'] = node.link
+        if node.deleted:
+            entry['deleted'] = True
+            entry['recoverable'] = node.recoverable
+            if node.deleted_at:
+                entry['deleted_at'] = node.deleted_at
+        return entry
+
+
+class FatFilesystem(Filesystem):
+    """FAT12, FAT16 and FAT32"""
+
+    def __init__(self, image, offset, size):
+        super().__init__(image, offset, size)
+        boot = image.read(offset, SECTOR_SIZE)
+        (bytes_per_sector, sectors_per_cluster, reserved, fat_count, root_entries,
+         total16, _, fat_size16) = struct.unpack_from('<HBHBHHBH', boot, 11)
+        total = total16 or struct.unpack_from('<I', boot, 32)[0]
+        fat_size = fat_size16 or struct.unpack_from('<I', boot, 36)[0]
+        if not sectors_per_cluster or not fat_size or not total:
+            raise DiskImageError('Invalid FAT boot sector')
+        self.cluster_size = bytes_per_sector * sectors_per_cluster
+        self.fat_offset = offset + reserved * bytes_per_sector
+        self.root_offset = self.fat_offset + fat_count * fat_size * bytes_per_sector
+        self.root_entries = root_entries
+        root_sectors = (root_entries * 32 + bytes_per_sector - 1) // bytes_per_sector
+        self.data_offset = self.root_offset + root_sectors * bytes_per_sector
+        data_sectors = total - (reserved + fat_count * fat_size + root_sectors)
+        self.cluster_count = max(data_sectors, 0) // sectors_per_cluster
+        if self.cluster_count < 4085:
+            self.kind, self.end_of_chain = 'FAT12', 0xFF8
+        elif self.cluster_count < 65525:
+            self.kind, self.end_of_chain = 'FAT16', 0xFFF8
+        else:
+            self.kind, self.end_of_chain = 'FAT32', 0x0FFFFFF8
+        self.root_cluster = struct.unpack_from('<I', boot, 44)[0] if self.kind == 'FAT32' else None
+        label = boot[71:82] if self.kind == 'FAT32' else boot[43:54]
+        self.label = label.decode('cp437').strip() or None
+        self.fat = image.read(self.fat_offset, fat_size * bytes_per_sector)
+
+    def root(self):
+        return Node('', 'root', True)
+
+    def next_cluster(self, cluster):
+        if self.kind == 'FAT12':
+            value = struct.unpack_from('<H', self.fat, cluster + cluster // 2)[0]
+            return value >> 4 if cluster & 1 else value & 0xFFF
+        if self.kind == 'FAT16':
+            return struct.unpack_from('<H', self.fat, cluster * 2)[0]
+        return struct.unpack_from('<I', self.fat, cluster * 4)[0] & 0x0FFFFFFF
+
+    def valid_cluster(self, cluster):
+        return 2 <= cluster < self.cluster_count + 2
+
+    def cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+    def chain(self, cluster):
+        """Clusters of a live file, stopping at the end mark or at a loop or bad link"""
+        clusters = []
+        seen = set()
+        while self.valid_cluster(cluster) and cluster not in seen:
+            seen.add(cluster)
+            clusters.append(cluster)
+            cluster = self.next_cluster(cluster)
+            if cluster >= self.end_of_chain:
+                break
+        return clusters
+
+    def recoverable(self, cluster, size, is_directory):
+        """Whether a deleted file's contiguous clusters are all still free"""
+        count = 1 if is_directory else -(-size // self.cluster_size)
+        if count == 0:
+            return True
+        if not self.valid_cluster(cluster) or not self.valid_cluster(cluster + count - 1):
+            return False
+        return all(self.next_cluster(c) == 0 for c in range(cluster, cluster + count))
+
+    def runs(self, node):
+        def build():
+            if node.deleted:
+                count = 1 if node.is_directory else -(-node.size // self.cluster_size)
+                return Runs(self.cluster_size, [(0, self.cluster_offset(node.ref), count, False)] if count else [])
+            runs = []
+            for logical, cluster in enumerate(self.chain(node.ref)):
+                if runs and runs[-1][0] + runs[-1][2] == logical and cluster == runs[-1][3] + runs[-1][2]:
+                    runs[-1][2] += 1
+                else:
+                    runs.append([logical, self.cluster_offset(cluster), 1, cluster])
+            return Runs(self.cluster_size, [(run[0], run[1], run[2], False) for run in runs])
+        return self.cached_runs((node.ref, node.deleted, node.size), build)
+
+    def directory_bytes(self, node):
+        if node.ref == 'root' and self.root_cluster is None:
+            return self.image.read(self.root_offset, self.root_entries * 32)
+        if node.ref == 'root':
+            node = Node('', self.root_cluster, True)
+        if node.deleted and not node.recoverable:
+            return b''
+        runs = self.runs(node)
+        length = sum(run[2] for run in runs.runs) * self.cluster_size
+        return runs.read(self.image, 0, length)
+
+    def long_name(self, parts, short, deleted):
+        """Name spelled by the LFN entries before a short entry, and the short name with a deleted entry's first byte restored"""
+        if not parts or len({part[13] for part in parts}) != 1:
+            return None, short
+        checksum = parts[0][13]
+        if deleted:
+            # The checksum covers the overwritten first byte, and only one value of it matches
+            first = next((b for b in range(0x21, 0x100) if _lfn_checksum(bytes([b]) + short[1:]) == checksum), None)
+            if first is None or first == FAT_DELETED:
+                return None, short
+            short = bytes([first]) + short[1:]
+        else:
+            ordinals = [part[0] & 0x1F for part in parts]
+            if _lfn_checksum(short) != checksum or not parts[0][0] & 0x40 or ordinals != list(range(len(parts), 0, -1)):
+                return None, short
+        raw = b''.join(part[1:11] + part[14:26] + part[28:32] for part in reversed(parts))
+        name = raw.decode('utf-16-le', errors='replace').split('\x00', 1)[0].replace('￿', '')
+        return name or None, short
+
+    @staticmethod
+    def short_name(short, flags, deleted):
+        base, ext = short[:8].rstrip(b' '), short[8:].rstrip(b' ')
+        if base[:1] == bytes([FAT_KANJI_E5]):
+            base = b'\xe5' + base[1:]
+        base, ext = base.decode('cp437'), ext.decode('cp437')
+        if deleted and short[0] == FAT_DELETED:
+            base = '_' + base[1:]
+        if flags & 0x08:
+            base = base.lower()
+        if flags & 0x10:
+            ext = ext.lower()
+        return f'{base}.{ext}' if ext else base
+
+    def read_directory(self, node):
+        data = self.directory_bytes(node)
+        nodes = []
+        parts = []
+        for pos in range(0, len(data) - 31, 32):
+            raw = data[pos:pos + 32]
+            if raw[0] == 0:
+                break
+            attributes = raw[11]
+            if attributes & 0x3F == FAT_ATTR_LFN:
+                parts.append(raw)
+                continue
+            parts, lfn = [], parts
+            deleted = raw[0] == FAT_DELETED
+            if attributes & (FAT_ATTR_VOLUME | 0xC0) or raw[:1] == b'.':
+                continue
+            if any(b < 0x20 for b in raw[1:11]) or (not deleted and raw[0] < 0x20 and raw[0] != FAT_KANJI_E5):
+                continue
+            name, short = self.long_name(lfn, raw[:11], deleted)
+            if name is None or '/' in name:
+                name = self.short_name(short, raw[12], deleted)
+            cluster = struct.unpack_from('<H', raw, 26)[0]
+            if self.kind == 'FAT32':
+                cluster |= struct.unpack_from('<H', raw, 20)[0] << 16
+            is_directory = bool(attributes & FAT_ATTR_DIRECTORY)
+            size = struct.unpack_from('<I', raw, 28)[0]
+            child = Node(name, cluster, is_directory, 0 if is_directory else size, deleted)
+            create_time, create_date, access_date, _, write_time, write_date = struct.unpack_from('<HHHHHH', raw, 14)
+            child.created = _fat_time(create_date, create_time, raw[13])
+            child.modified = _fat_time(write_date, write_time)
+            child.accessed = _fat_time(access_date)
+            child.inode = cluster
+            if deleted:
+                child.recoverable = self.recoverable(cluster, size, is_directory)
+            nodes.append(child)
+        return nodes
+
+    def read(self, node, offset, length):
+        if node.deleted and not node.recoverable:
+            raise DiskImageError('Clusters of this deleted file have been reused; contents are not recoverable')
+        length = max(min(length, node.size - offset), 0)
+        return self.runs(node).read(self.image, offset, length) if length else b''
+
+
+class ExtInode:
+    __slots__ = ('number', 'mode', 'uid', 'gid', 'size', 'atime', 'ctime', 'mtime', 'dtime', 'crtime',
+                 'links', 'flags', 'block')
+
+    @property
+    def in_use(self):
+        return self.links > 0 and not self.dtime
+
+
+class ExtFilesystem(Filesystem):
+    """ext2, ext3 and ext4"""
+
+    def __init__(self, image, offset, size):
+        super().__init__(image, offset, size)
+        sb = image.read(offset + 1024, 1024)
+        if len(sb) < 1024 or struct.unpack_from('<H', sb, 56)[0] != EXT_MAGIC:
+            raise DiskImageError('Invalid ext superblock')
+        self.inodes_count, blocks_lo = struct.unpack_from('<II', sb, 0)
+        first_data_block, log_block_size = struct.unpack_from('<II', sb, 20)
+        self.blocks_per_group = struct.unpack_from('<I', sb, 32)[0]
+        self.inodes_per_group = struct.unpack_from('<I', sb, 40)[0]
+        revision = struct.unpack_from('<I', sb, 76)[0]
+        self.inode_size = struct.unpack_from('<H', sb, 88)[0] if revision else 128
+        compat, incompat = struct.unpack_from('<II', sb, 92)
+        if log_block_size > 6 or not self.blocks_per_group or not self.inodes_per_group:
+            raise DiskImageError('Invalid ext superblock')
+        self.block_size = 1024 << log_block_size
+        self.has_filetype = bool(incompat & EXT_INCOMPAT_FILETYPE)
+        desc_size = 32
+        blocks = blocks_lo
+        if incompat & EXT_INCOMPAT_64BIT:
+            desc_size = struct.unpack_from('<H', sb, 254)[0] or 32
+            blocks |= struct.unpack_from('<I', sb, 0x150)[0] << 32
+        if incompat & (EXT_INCOMPAT_EXTENTS | EXT_INCOMPAT_FLEX_BG | EXT_INCOMPAT_64BIT):
+            self.kind = 'ext4'
+        else:
+            self.kind = 'ext3' if compat & EXT_COMPAT_JOURNAL else 'ext2'
+        self.label = sb[120:136].split(b'\x00', 1)[0].decode('utf-8', errors='replace') or None
+        self.uuid = str(uuid.UUID(bytes=sb[104:120]))
+        self.blocks_count = blocks
+        groups = -(-(blocks - first_data_block) // self.blocks_per_group)
+        table = image.read(offset + (first_data_block + 1) * self.block_size, groups * desc_size)
+        self.inode_tables = []
+        for group in range(groups):
+            base = group * desc_size
+            location = struct.unpack_from('<I', table, base + 8)[0]
+            if desc_size >= 64:
+                location |= struct.unpack_from('<I', table, base + 0x28)[0] << 32
+            self.inode_tables.append(location)
+
+    def root(self):
+        return Node('', EXT_ROOT_INODE, True)
+
+    def block(self, number):
+        return self.image.read(self.offset + number * self.block_size, self.block_size)
+
+    def inode(self, number):
+        if not 1 <= number <= self.inodes_count:
+            raise DiskImageError(f'Inode {number} out of range')
+        group, index = divmod(number - 1, self.inodes_per_group)
+        raw = self.image.read(
+            self.offset + self.inode_tables[group] * self.block_size + index * self.inode_size, self.inode_size
+        )
+        inode = ExtInode()
+        inode.number = number
+        (inode.mode, uid, size_lo, inode.atime, inode.ctime, inode.mtime, inode.dtime,
+         gid, inode.links) = struct.unpack_from('<HHIIIIIHH', raw, 0)
+        inode.flags = struct.unpack_from('<I', raw, 32)[0]
+        inode.block = raw[40:100]
+        inode.size = size_lo | struct.unpack_from('<I', raw, 108)[0] << 32
+        uid_hi, gid_hi = struct.unpack_from('<HH', raw, 120)
+        inode.uid = uid | uid_hi << 16
+        inode.gid = gid | gid_hi << 16
+        inode.crtime = None
+        if self.inode_size > 128 and 128 + struct.unpack_from('<H', raw, 128)[0] >= 0x98:
+            inode.crtime = struct.unpack_from('<I', raw, 0x90)[0]
+        return inode
+
+    def extent_runs(self, node, runs, visited, depth=0):
+        magic, entries, _, tree_depth = struct.unpack_from('<HHHH', node, 0)
+        if magic != EXT_EXTENT_MAGIC or depth > MAX_EXTENT_DEPTH:
+            raise DiskImageError('Corrupt extent tree')
+        for index in range(entries):
+            position = 12 + 12 * index
+            if tree_depth == 0:
+                logical, length, start_hi, start_lo = struct.unpack_from('<IHHI', node, position)
+                uninitialized = length > 32768
+                if uninitialized:
+                    length -= 32768
+                physical = self.offset + (start_hi << 32 | start_lo) * self.block_size
+                runs.append((logical, physical, length, uninitialized))
+            else:
+                _, leaf_lo, leaf_hi = struct.unpack_from('<IIH', node, position)
+                leaf = leaf_hi << 32 | leaf_lo
+                if leaf in visited or leaf >= self.blocks_count:
+                    raise DiskImageError('Corrupt extent tree')
+                visited.add(leaf)
+                self.extent_runs(self.block(leaf), runs, visited, depth + 1)
+        return runs
+
+    def block_map_runs(self, inode):
+        """Runs of a classic (ext2/ext3) direct and indirect block map"""
+        needed = -(-inode.size // self.block_size)
+        per_block = self.block_size // 4
+        runs = []
+
+        def walk(pointer, level, logical):
+            if logical >= needed or not pointer:
+                return
+            if level == 0:
+                if runs and runs[-1][0] + runs[-1][2] == logical and runs[-1][3] + runs[-1][2] == pointer:
+                    runs[-1][2] += 1
+                else:
+                    runs.append([logical, None, 1, pointer])
+                return
+            if pointer >= self.blocks_count:
+                raise DiskImageError('Corrupt block map')
+            span = per_block ** (level - 1)
+            for index, child in enumerate(struct.unpack_from(f'<{per_block}I', self.block(pointer))):
+                walk(child, level - 1, logical + index * span)
+
+        pointers = struct.unpack_from('<15I', inode.block)
+        for index, pointer in enumerate(pointers[:12]):
+            walk(pointer, 0, index)
+        logical = 12
+        for level, pointer in enumerate(pointers[12:], 1):
+            walk(pointer, level, logical)
+            logical += per_block ** level
+        return [(run[0], self.offset + run[3] * self.block_size, run[2], False) for run in runs]
+
+    def runs(self, inode):
+        def build():
+            if inode.flags & EXT_EXTENTS_FL:
+                return Runs(self.block_size, self.extent_runs(inode.block, [], set()))
+            return Runs(self.block_size, self.block_map_runs(inode))
+        return self.cached_runs((inode.number, inode.mtime, inode.ctime, inode.size), build)
+
+    def inline_data(self, inode):
+        """Contents kept in the inode itself: inline data and short symlink targets"""
+        if inode.flags & EXT_INLINE_DATA_FL:
+            return inode.block[:inode.size]
+        if inode.mode & S_IFMT == S_IFLNK and inode.size < 60 and not inode.flags & EXT_EXTENTS_FL:
+            return inode.block[:inode.size]
+        return None
+
+    def read_inode(self, inode, offset, length):
+        length = max(min(length, inode.size - offset), 0)
+        if not length:
+            return b''
+        inline = self.inline_data(inode)
+        if inline is not None:
+            return inline[offset:offset + length]
+        return self.runs(inode).read(self.image, offset, length)
+
+    def node(self, name, number, deleted=False, file_type=0):
+        if number is None:
+            child = Node(name, None, file_type == EXT_FTYPE_DIR, 0, deleted)
+            child.recoverable = False
+            return child
+        inode = self.inode(number)
+        if deleted and inode.in_use:
+            # The inode now belongs to another file (or the name was left behind by a rename)
+            child = Node(name, number, file_type == EXT_FTYPE_DIR, 0, deleted)
+            child.inode = number
+            child.recoverable = False
+            return child
+        is_directory = inode.mode & S_IFMT == S_IFDIR if inode.mode else file_type == EXT_FTYPE_DIR
+        child = Node(name, number, is_directory, 0 if is_directory else inode.size, deleted)
+        child.created = _iso(inode.crtime)
+        child.modified = _iso(inode.mtime)
+        child.accessed = _iso(inode.atime)
+        child.mode = inode.mode
+        child.uid = inode.uid
+        child.gid = inode.gid
+        child.inode = number
+        if inode.mode & S_IFMT == S_IFLNK:
+            child.link = self.read_inode(inode, 0, 4096).decode('utf-8', errors='replace')
+        if deleted:
+            child.deleted_at = _iso(inode.dtime)
+            child.recoverable = bool(inode.size) and (
+                self.inline_data(inode) is not None or bool(self.runs(inode).runs)
+            )
+        return child
+
+    def scan_slack(self, block, start, end, found):
+        """Entries left in the unused tail of a live entry after the ones following it were deleted"""
+        position = (start + 3) & ~3
+        while position + 8 <= end:
+            number, rec_len, name_len, file_type = struct.unpack_from('<IHBB', block, position)
+            if (0 < number <= self.inodes_count and name_len and position + 8 + name_len <= end
+                    and rec_len >= 8 + name_len and not rec_len & 3
+                    and (1 <= file_type <= 7 if self.has_filetype else file_type == 0)):
+                raw = block[position + 8:position + 8 + name_len]
+                if b'\x00' not in raw and b'/' not in raw and raw not in (b'.', b'..'):
+                    found.append((raw.decode('utf-8', errors='replace'), number, file_type, True))
+                    position += (8 + name_len + 3) & ~3
+                    continue
+            position += 4
+
+    def directory_entries(self, inode):
+        if inode.size > MAX_DIRECTORY_SIZE:
+            raise DiskImageError(f'Directory inode {inode.number} is implausibly large')
+        data = self.read_inode(inode, 0, inode.size)
+        indexed = inode.flags & EXT_INDEX_FL
+        found = []
+        for block_start in range(0, len(data), self.block_size):
+            block = data[block_start:block_start + self.block_size]
+            position = 0
+            while position + 8 <= len(block):
+                number, rec_len, name_len, file_type = struct.unpack_from('<IHBB', block, position)
+                if rec_len < 8 or rec_len & 3 or position + rec_len > len(block):
+                    break
+                if not number and not name_len and (file_type == EXT_DIR_CSUM_TYPE or rec_len == len(block)):
+                    # Checksum tail, or an htree node disguised as one empty entry
+                    break
+                used = (8 + name_len + 3) & ~3
+                name = block[position + 8:position + 8 + name_len]
+                if name_len and name not in (b'.', b'..'):
+                    found.append((name.decode('utf-8', errors='replace'), number or None, file_type, not number))
+                # The tail of '..' in the first block of an htree directory holds the index root
+                if not (indexed and block_start == 0) and rec_len >= used + 8 + 4:
+                    self.scan_slack(block, position + used, position + rec_len, found)
+                position += rec_len
+        return found
+
+    def read_directory(self, node):
+        if node.ref is None:
+            return []
+        inode = self.inode(node.ref)
+        if node.deleted and (inode.in_use or not node.recoverable):
+            return []
+        nodes = []
+        seen = set()
+        for name, number, file_type, deleted in self.directory_entries(inode):
+            if deleted:
+                if (name, number) in seen:
+                    continue
+                seen.add((name, number))
+            try:
+                nodes.append(self.node(name, number, deleted, file_type))
+            except DiskImageError:
+                if not deleted:
+                    raise
+        return nodes
+
+    def read(self, node, offset, length):
+        if node.deleted and not node.recoverable:
+            raise DiskImageError('The block map of this deleted file was cleared; contents are not recoverable')
+        return self.read_inode(self.inode(node.ref), offset, length)
+
+
+def open_filesystem(image, offset, size):
+    """The filesystem at offset, None if none is recognised, or an error for unsupported ones"""
+    boot = image.read(offset, SECTOR_SIZE)
+    superblock = image.read(offset + 1024, 64)
+    if len(superblock) >= 58 and struct.unpack_from('<H', superblock, 56)[0] == EXT_MAGIC:
+        return ExtFilesystem(image, offset, size)
+    if len(boot) < SECTOR_SIZE:
+        return None
+    if boot[3:11] == b'NTFS    ':
+        raise DiskImageError('NTFS volumes are not supported')
+    if boot[3:11] == b'EXFAT   ':
+        raise DiskImageError('exFAT volumes are not supported')
+    if looks_like_fat(boot):
+        return FatFilesystem(image, offset, size)
+    return None
+
+
+def looks_like_fat(boot):
+    if boot[510:512] != b'\x55\xaa' or boot[0] not in (0xEB, 0xE9):
+        return False
+    bytes_per_sector, sectors_per_cluster, reserved, fat_count = struct.unpack_from('<HBHB', boot, 11)
+    fat_size = struct.unpack_from('<H', boot, 22)[0] or struct.unpack_from('<I', boot, 36)[0]
+    return (bytes_per_sector in (512, 1024, 2048, 4096) and sectors_per_cluster
+            and not sectors_per_cluster & (sectors_per_cluster - 1)
+            and reserved and fat_count in (1, 2) and fat_size)
+
+
+class Volume:
+    """A partition, or the whole image when it holds a single filesystem"""
+
+    def __init__(self, index, offset, size, scheme, partition_type=None, name=None):
+        self.index = index
+        self.offset = offset
+        self.size = size
+        self.scheme = scheme
+        self.partition_type = partition_type
+        self.name = name
+        self.filesystem = None
+        self.error = None
+
+    def to_dict(self):
+        filesystem = self.filesystem
+        return {
+            'name': f'p{self.index}',
+            'offset': self.offset,
+            'size': self.size,
+            'scheme': self.scheme,
+            'partition_type': self.partition_type,
+            'partition_name': self.name,
+            'filesystem': filesystem.kind if filesystem else None,
+            'label': filesystem.label if filesystem else None,
+            'error': self.error,
+        }
+
+
+def gpt_partitions(image):
+    for sector_size in (SECTOR_SIZE, 4096):
+        header = image.read(sector_size, 92)
+        if header[:8] != b'EFI PART':
+            continue
+        entries_lba, count, entry_size = struct.unpack_from('<QII', header, 72)
+        if entry_size < 128:
+            return []
+        table = image.read(entries_lba * sector_size, min(count, MAX_GPT_ENTRIES) * entry_size)
+        partitions = []
+        for index in range(len(table) // entry_size):
+            entry = table[index * entry_size:(index + 1) * entry_size]
+            if not any(entry[:16]):
+                continue
+            type_guid = str(uuid.UUID(bytes_le=entry[:16]))
+            first, last = struct.unpack_from('<QQ', entry, 32)
+            name = entry[56:128].decode('utf-16-le', errors='replace').split('\x00', 1)[0] or None
+            partitions.append(Volume(index + 1, first * sector_size, (last - first + 1) * sector_size, 'gpt',
+                                     GPT_TYPES.get(type_guid, type_guid), name))
+        return partitions
+    return None
+
+
+def mbr_partitions(image):
+    mbr = image.read(0, SECTOR_SIZE)
+    if len(mbr) < SECTOR_SIZE or mbr[510:512] != b'\x55\xaa':
+        return None
+    partitions = []
+    for slot in range(4):
+        partition_type, start, count = struct.unpack_from('<4xB3xII', mbr, 446 + 16 * slot)
+        if not partition_type or not count or partition_type == MBR_GPT_PROTECTIVE:
+            continue
+        if partition_type in MBR_EXTENDED_TYPES:
+            partitions.extend(logical_partitions(image, start))
+            continue
+        partitions.append(Volume(slot + 1, start * SECTOR_SIZE, count * SECTOR_SIZE, 'mbr',
+                                 MBR_TYPES.get(partition_type, f'0x{partition_type:02x}')))
+    return partitions
+
+
+def logical_partitions(image, extended_start):
+    """Logical partitions chained through the extended boot records, numbered from 5"""
+    partitions = []
+    record = extended_start
+    seen = set()
+    while record not in seen and len(partitions) < MAX_LOGICAL_PARTITIONS:
+        seen.add(record)
+        ebr = image.read(record * SECTOR_SIZE, SECTOR_SIZE)
+        if len(ebr) < SECTOR_SIZE or ebr[510:512] != b'\x55\xaa':
+            break
+        partition_type, start, count = struct.unpack_from('<4xB3xII', ebr, 446)
+        if partition_type and count:
+            partitions.append(Volume(5 + len(partitions), (record + start) * SECTOR_SIZE, count * SECTOR_SIZE,
+                                     'mbr', MBR_TYPES.get(partition_type, f'0x{partition_type:02x}')))
+        next_type, next_start = struct.unpack_from('<4xB3xI', ebr, 462)
+        if next_type not in MBR_EXTENDED_TYPES or not next_start:
+            break
+        record = extended_start + next_start
+    return partitions
+
+
+class DiskImage:
+    """A raw disk image, mapped read-only, and the volumes found on it"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            if not self.size:
+                raise DiskImageError('Image is empty')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.volumes = self.find_volumes()
+        except Exception:
+            self.close()
+            raise
+        if not self.volumes:
+            self.close()
+            raise DiskImageError('No partition table or supported filesystem found')
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def read(self, offset, length):
+        if offset < 0 or length <= 0:
+            return b''
+        return self._map[offset:offset + length]
+
+    def find_volumes(self):
+        volumes = gpt_partitions(self)
+        if volumes is None:
+            try:
+                filesystem = open_filesystem(self, 0, self.size)
+            except DiskImageError:
+                filesystem = None
+            if filesystem is not None:
+                volume = Volume(0, 0, self.size, 'none')
+                volume.filesystem = filesystem
+                return [volume]
+            volumes = mbr_partitions(self) or []
+        for volume in volumes:
+            if volume.offset + volume.size > self.size:
+                volume.error = 'Partition extends past the end of the image'
+                volume.size = max(self.size - volume.offset, 0)
+            try:
+                volume.filesystem = open_filesystem(self, volume.offset, volume.size)
+                if volume.filesystem is None and not volume.error:
+                    volume.error = 'No supported filesystem found'
+            except (DiskImageError, struct.error, ValueError, IndexError) as e:
+                volume.error = str(e)
+        return volumes
+
+    def _locate(self, path):
+        parts = [part for part in path.replace('\\', '/').split('/') if part]
+        if not parts:
+            return None, None, []
+        volume = next((v for v in self.volumes if f'p{v.index}' == parts[0]), None)
+        if volume is None:
+            raise FileNotFoundError(f'No such volume: {parts[0]}')
+        if volume.filesystem is None:
+            raise DiskImageError(volume.error or 'No supported filesystem found')
+        try:
+            return volume, volume.filesystem.resolve(parts[1:]), parts
+        except (struct.error, IndexError, ValueError) as e:
+            raise DiskImageError(f'Corrupt filesystem structure: {e}')
+
+    def volume_entry(self, volume):
+        entry = {
+            'name': f'p{volume.index}',
+            'path': f'/p{volume.index}',
+            'is_directory': True,
+            'size': 0,
+            'created': None,
+            'modified': None,
+            'accessed': None,
+            'volume': volume.to_dict(),
+        }
+        if volume.error:
+            entry['error'] = volume.error
+        return entry
+
+    def list(self, path):
+        """Listing entries of a directory, live and deleted, directories first"""
+        volume, node, parts = self._locate(path)
+        if volume is None:
+            return [self.volume_entry(v) for v in self.volumes]
+        if not node.is_directory:
+            raise NotADirectoryError(f'Not a directory: {path}')
+        base = '/' + '/'.join(parts)
+        try:
+            children = volume.filesystem.children(node)
+            return [volume.filesystem.entry(child, f'{base}/{name}') for name, child in children.items()]
+        except (struct.error, IndexError, ValueError) as e:
+            raise DiskImageError(f'Corrupt filesystem structure: {e}')
+
+    def walk(self, path='/'):
+        """Entries of every directory below path, depth first"""
+        stack = [path]
+        seen = set()
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = self.list(directory)
+            except (DiskImageError, OSError):
+                continue
+            for entry in entries:
+                yield entry
+                if entry['is_directory'] and not entry.get('error'):
+                    key = (entry['path'].split('/')[1], entry.get('inode'), entry.get('deleted', False))
+                    if entry.get('inode') is None or key not in seen:
+                        seen.add(key)
+                        stack.append(entry['path'])
+
+    def read_file(self, path, offset, length):
+        """Bytes of a file on a volume and the file's size"""
+        volume, node, _ = self._locate(path)
+        if volume is None or node.is_directory:
+            raise IsADirectoryError(f'Is a directory: {path}')
+        try:
+            return volume.filesystem.read(node, offset, length), node.size
+        except (struct.error, IndexError, ValueError) as e:
+            raise DiskImageError(f'Corrupt filesystem structure: {e}')
+
+    def iter_file(self, path, block_size):
+        offset = 0
+        while True:
+            data, size = self.read_file(path, offset, block_size)
+            if not data:
+                return
+            yield data
+            offset += len(data)
+            if offset >= size:
+                return
+
+    def metadata(self, path):
+        """Metadata of a file or directory, with the volume it is on"""
+        volume, node, parts = self._locate(path)
+        if volume is None:
+            return {'path': '/', 'name': '', 'is_directory': True, 'size': self.size,
+                    'volumes': [v.to_dict() for v in self.volumes]}
+        metadata = volume.filesystem.entry(node, '/' + '/'.join(parts))
+        metadata.update({'name': parts[-1] if node.name == '' else node.name,
+                         'volume': volume.to_dict(), 'filesystem': volume.filesystem.kind})
+        return metadata
+
+    def volume_info(self):
+        return [volume.to_dict() for volume in self.volumes]
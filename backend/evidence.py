@@ -0,0 +1,228 @@
+"""Verified storage of acquired files and their chain-of-custody manifests.
+
+An agent acquiring a file reads it once and hashes (SHA-256 and MD5) exactly
+the bytes it streams. The server appends those bytes to the evidence file
+and hashes them again as they arrive, so the two digests compare the source
+as read on the host with the copy stored here. Chunks must arrive in order:
+one whose offset is not the number of bytes already stored is refused.
+
+Each acquisition has a JSON manifest next to its evidence file recording the
+source host and path, the source file's stat, the digests computed on each
+side, whether they match, and a timestamped log of what happened (requested,
+started, resumed, completed). The manifest is rewritten atomically on every
+change and the SHA-256 of its latest version is kept in the database, so an
+edit made outside the server is detectable.
+
+An interrupted acquisition keeps its ``.part`` file. When it resumes, the
+hash state is rebuilt by reading the part file back and the agent is asked
+to continue from its size.
+
+A file acquired before can be re-acquired as a delta of that earlier copy.
+``block_signatures`` cuts the stored copy into blocks and gives each an
+Adler-32 checksum and a BLAKE2b digest; the agent sends references to the
+blocks it finds unchanged instead of their bytes, and the server copies them
+from the earlier evidence file as it appends. The new file is still hashed
+as it is written, so it is verified against the agent's digests like any
+other acquisition.
+
+Finished evidence files are read-only and never change, so ``EvidenceMaps``
+keeps them memory-mapped. Viewer pages are then slices of the mapping and
+are served without the agent or a per-request open and seek.
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import stat as stat_module
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+HASH_ALGORITHMS = ('sha256', 'md5')
+READ_BLOCK_SIZE = 1024 * 1024
+MANIFEST_VERSION = 1
+# Evidence files kept mapped at once; the least recently read is unmapped first
+DEFAULT_MAPPED_FILES = 64
+# Delta blocks are about the square root of the file size, like rsync, within
+# these bounds; the block count is capped so signatures stay well under the
+# agent's message size limit (20 bytes per block)
+DELTA_MIN_BLOCK_SIZE = 2 * 1024
+DELTA_MAX_BLOCKS = 16384
+DELTA_DIGEST_SIZE = 16
+
+
+class EvidenceError(Exception):
+    """Raised when received bytes cannot be appended to an evidence file"""
+
+
+class EvidenceFile:
+    """An evidence file written strictly in order and hashed as it grows"""
+
+    def __init__(self, path):
+        self.path = path
+        self.part_path = path + '.part'
+        self.size = 0
+        self._hashes = None
+
+    def open(self, pause=None):
+        """Create the part file, or pick up one left by an interrupted acquisition; pause, if given, is called between reads"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._hashes = {name: hashlib.new(name) for name in HASH_ALGORITHMS}
+        self.size = 0
+        if not os.path.exists(self.part_path):
+            open(self.part_path, 'wb').close()
+            return self
+        with open(self.part_path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                self._update(block)
+                if pause is not None:
+                    pause()
+        return self
+
+    def write(self, offset, data):
+        """Append data that the agent read at offset"""
+        if offset != self.size:
+            raise EvidenceError(f'Chunk at offset {offset} does not follow the {self.size} bytes stored')
+        with open(self.part_path, 'ab') as f:
+            f.write(data)
+        self._update(data)
+
+    def digests(self):
+        return {name: hasher.hexdigest() for name, hasher in self._hashes.items()}
+
+    def finalize(self):
+        """Move the part file into place read-only and return its digests"""
+        os.replace(self.part_path, self.path)
+        os.chmod(self.path, stat_module.S_IRUSR | stat_module.S_IRGRP)
+        return self.digests()
+
+    def discard(self):
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def _update(self, data):
+        for hasher in self._hashes.values():
+            hasher.update(data)
+        self.size += len(data)
+
+
+class EvidenceMaps:
+    """Read-only memory maps of finished evidence files"""
+
+    def __init__(self, limit=DEFAULT_MAPPED_FILES):
+        self.limit = limit
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, path, offset, length):
+        """Bytes [offset, offset + length) of an evidence file and the file's size"""
+        with self._lock:
+            mapping = self._maps.get(path)
+            if mapping is None:
+                mapping = self._open(path)
+                self._maps[path] = mapping
+                while len(self._maps) > self.limit:
+                    _, evicted = self._maps.popitem(last=False)
+                    if evicted is not None:
+                        evicted.close()
+            else:
+                self._maps.move_to_end(path)
+            if mapping is None:
+                return b'', 0
+            return mapping[offset:offset + length], len(mapping)
+
+    def _open(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def delta_block_size(size):
+    """Block size of the delta signatures of a file of this size"""
+    block_size = max(math.isqrt(size), DELTA_MIN_BLOCK_SIZE, -(-size // DELTA_MAX_BLOCKS))
+    return -(-block_size // 1024) * 1024
+
+
+def block_signatures(path, block_size, pause=None):
+    """Adler-32 checksums and BLAKE2b digests of each full block of a file
+
+    Returns (weak, strong): the checksums as little-endian 32-bit integers
+    and the digests concatenated. A trailing partial block has no signature.
+    pause, if given, is called between reads so a long file does not hold up
+    the caller's event loop.
+    """
+    weak = bytearray()
+    strong = bytearray()
+    blocks_per_read = max(READ_BLOCK_SIZE // block_size, 1)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block_size * blocks_per_read)
+            for start in range(0, len(data) - block_size + 1, block_size):
+                block = data[start:start + block_size]
+                weak += zlib.adler32(block).to_bytes(4, 'little')
+                strong += hashlib.blake2b(block, digest_size=DELTA_DIGEST_SIZE).digest()
+            if len(data) < block_size * blocks_per_read:
+                break
+            if pause is not None:
+                pause()
+    return bytes(weak), bytes(strong)
+
+
+def timestamp():
+    return datetime.now().astimezone().isoformat()
+
+
+def new_manifest(acquisition_id, agent, path, requested_by):
+    """Manifest for a newly requested acquisition; agent is a dict describing the host"""
+    return {
+        'manifest_version': MANIFEST_VERSION,
+        'acquisition_id': acquisition_id,
+        'agent': agent,
+        'source': {'path': path},
+        'requested_by': requested_by,
+        'requested_at': timestamp(),
+        'started_at': None,
+        'completed_at': None,
+        'status': 'requested',
+        'bytes': 0,
+        'resumes': 0,
+        'agent_hashes': None,
+        'server_hashes': None,
+        'verified': None,
+        'events': [{'time': timestamp(), 'event': 'requested'}],
+    }
+
+
+def add_event(manifest, event, **details):
+    manifest['events'].append(dict({'time': timestamp(), 'event': event}, **details))
+
+
+def verify(manifest, size, agent_hashes, server_hashes):
+    """Record both sides' digests and return whether they and the sizes agree"""
+    manifest['agent_hashes'] = {name: agent_hashes.get(name) for name in HASH_ALGORITHMS}
+    manifest['server_hashes'] = server_hashes
+    manifest['verified'] = (
+        size == manifest['bytes'] and all(agent_hashes.get(name) == server_hashes[name] for name in HASH_ALGORITHMS)
+    )
+    return manifest['verified']
+
+
+def write_manifest(path, manifest):
+    """Atomically replace the manifest and return the SHA-256 of what was written"""
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_manifest(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return json.loads(data), hashlib.sha256(data).hexdigest()
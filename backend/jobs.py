@@ -0,0 +1,190 @@
+"""Durable jobs: commands queued in the database for every agent a selector matches.
+
+A job is one command (``index_tree``, ``get_metadata_batch``, ``analyze_file``
+and so on) with its parameters and a selector naming the agents it is for,
+either by id or with the filters of the agent list (status, platform,
+domain, name prefix). The selector is resolved when the job is created and
+each matching agent gets a run. Runs wait in the database until their agent
+is connected, so a job outlives agents going offline and the server
+restarting.
+
+The server's dispatcher sends pending runs to connected agents, at most a
+few per agent and a bounded number across the fleet. A run that fails,
+times out or is cut off by a disconnect is tried again after a backoff,
+until the job's attempts are used up. A walk with ``index_tree`` is left
+running across a disconnect instead, because the agent resumes it from its
+checkpoint.
+
+Replies are matched to runs by correlation id. Item lists such as metadata
+results or strings are appended to a result file per run, the counts go
+into the run's progress, and the summary fields of the final reply become
+its result. Index entries are not copied, since they are stored in the index
+already.
+
+A schedule creates a job every ``interval`` seconds. With ``spread`` set,
+each agent's run is held back by a slot within that many seconds, derived
+from the agent id. An overnight sweep of the whole fleet is then spread over
+the night, and each agent keeps the same slot every night.
+"""
+
+import hashlib
+import random
+from collections import namedtuple
+from datetime import timedelta
+
+RUN_STATUSES = ('pending', 'running', 'complete', 'failed', 'cancelled')
+FINISHED_RUN_STATUSES = ('complete', 'failed', 'cancelled')
+FINISHED_JOB_STATUSES = ('complete', 'failed', 'cancelled')
+DEFAULT_MAX_ATTEMPTS = 3
+MAX_ATTEMPTS_LIMIT = 20
+# Seconds a run may take before it is cancelled and retried
+DEFAULT_TIMEOUT = 3600
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+MIN_SCHEDULE_INTERVAL = 60
+SELECTOR_FIELDS = ('agent_ids', 'status', 'platform', 'domain', 'name')
+
+# reply: agent event answering the command
+# streamed: the command is answered in parts, the last one with done
+# items: list field of each part counted in the progress
+# store: items are appended to the run's result file
+# summary: fields of the final reply kept as the run's result
+# resumes: the agent carries on with the command itself after reconnecting
+# params: fields accepted from the job; required: fields that must be set
+JobCommand = namedtuple('JobCommand', ['reply', 'streamed', 'items', 'store', 'summary', 'resumes', 'params', 'required'])
+
+JOB_COMMANDS = {
+    'index_tree': JobCommand(
+        'index_batch', True, 'entries', False, ('root', 'entry_count'), True,
+        ('path', 'hash'), ('path',)
+    ),
+    'get_metadata': JobCommand(
+        'file_metadata', False, None, False, ('path', 'metadata'), False,
+        ('path', 'refresh'), ('path',)
+    ),
+    'get_metadata_batch': JobCommand(
+        'file_metadata_batch', True, 'results', True, ('total', 'truncated', 'succeeded', 'failed', 'skipped'), False,
+        ('paths', 'directory', 'pattern', 'recursive', 'refresh'), ()
+    ),
+    'analyze_file': JobCommand(
+        'file_analysis', True, 'entropy', True, ('path', 'size', 'block_size', 'histogram', 'file_entropy'), False,
+        ('path', 'block_size'), ('path',)
+    ),
+    'extract_strings': JobCommand(
+        'file_strings', True, 'strings', True, ('path', 'size', 'count', 'next_offset'), False,
+        ('path', 'min_length', 'max_strings', 'encodings', 'offset'), ('path',)
+    ),
+    # Runs as an acquisition; its result is the acquisition's id and digests
+    'acquire_file': JobCommand(
+        None, False, None, False, (), False,
+        ('path', 'delta'), ('path',)
+    ),
+}
+
+
+def _positive_int(body, field, default, limit=None):
+    value = body.get(field, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be an integer')
+    if value < 0 or (value == 0 and default):
+        raise ValueError(f'{field} must be positive')
+    return min(value, limit) if limit else value
+
+
+def parse_selector(selector):
+    """Normalise a job's agent selector; the filters take the same form as the agent list's query string"""
+    if selector is None:
+        return {}
+    if not isinstance(selector, dict) or set(selector) - set(SELECTOR_FIELDS):
+        raise ValueError(f'selector must be an object with any of: {", ".join(SELECTOR_FIELDS)}')
+    result = {}
+    agent_ids = selector.get('agent_ids')
+    if agent_ids is not None:
+        if not isinstance(agent_ids, list) or not all(isinstance(agent_id, str) for agent_id in agent_ids):
+            raise ValueError('selector.agent_ids must be a list of strings')
+        result['agent_ids'] = agent_ids
+    status = selector.get('status')
+    if isinstance(status, list):
+        status = ','.join(status)
+    if status:
+        result['status'] = status
+    for field in ('platform', 'domain', 'name'):
+        if selector.get(field):
+            result[field] = str(selector[field])
+    return result
+
+
+def parse_job(body, max_batch_paths):
+    """Validated settings of a job or schedule request; raises ValueError"""
+    command = body.get('command')
+    spec = JOB_COMMANDS.get(command)
+    if spec is None:
+        raise ValueError(f'command must be one of: {", ".join(JOB_COMMANDS)}')
+    params = body.get('params') or {}
+    if not isinstance(params, dict):
+        raise ValueError('params must be an object')
+    unknown = set(params) - set(spec.params)
+    if unknown:
+        raise ValueError(f'Unknown params for {command}: {", ".join(sorted(unknown))}')
+    missing = [field for field in spec.required if not params.get(field)]
+    if missing:
+        raise ValueError(f'{command} requires params: {", ".join(missing)}')
+    if command == 'get_metadata_batch':
+        paths = params.get('paths')
+        if paths is None and not params.get('directory'):
+            raise ValueError('get_metadata_batch requires params paths or directory')
+        if paths is not None and (not isinstance(paths, list) or not all(isinstance(p, str) for p in paths)):
+            raise ValueError('paths must be a list of strings')
+        if paths is not None and len(paths) > max_batch_paths:
+            raise ValueError(f'At most {max_batch_paths} paths per batch')
+    return {
+        'name': str(body.get('name') or command),
+        'command': command,
+        'params': params,
+        'selector': parse_selector(body.get('selector')),
+        'max_attempts': _positive_int(body, 'max_attempts', DEFAULT_MAX_ATTEMPTS, MAX_ATTEMPTS_LIMIT),
+        'timeout': _positive_int(body, 'timeout', DEFAULT_TIMEOUT),
+        'spread': _positive_int(body, 'spread', 0),
+    }
+
+
+def parse_schedule(body, max_batch_paths):
+    """parse_job plus the interval a schedule repeats at"""
+    settings = parse_job(body, max_batch_paths)
+    settings['interval'] = _positive_int(body, 'interval', MIN_SCHEDULE_INTERVAL)
+    if settings['interval'] < MIN_SCHEDULE_INTERVAL:
+        raise ValueError(f'interval must be at least {MIN_SCHEDULE_INTERVAL} seconds')
+    if settings['spread'] > settings['interval']:
+        raise ValueError('spread must not exceed interval')
+    return settings
+
+
+def spread_offset(agent_id, spread):
+    """An agent's slot within a spread window, the same for every job"""
+    if not spread:
+        return timedelta(0)
+    fraction = int.from_bytes(hashlib.sha1(agent_id.encode()).digest()[:8], 'big') / 2 ** 64
+    return timedelta(seconds=fraction * spread)
+
+
+def retry_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Wait before retrying a run that has failed attempt times: exponential, capped, with jitter"""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    # Half fixed and half random, so runs that failed together are not retried together
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def next_run_time(previous, interval, now):
+    """The first time after now on the schedule's grid, skipping runs missed while the server was down"""
+    step = timedelta(seconds=interval)
+    if previous > now:
+        return previous
+    missed = (now - previous) // step
+    return previous + (missed + 1) * step
+
+
+def reply_summary(spec, data):
+    """Fields of a final reply kept as a run's result"""
+    return {field: data[field] for field in spec.summary if field in data}
@@ -1,13 +1,40 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import functools
+import hashlib
 import json
+import logging
 import os
+import sys
+import time
 import uuid
-from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer
+from collections import OrderedDict
+from sqlalchemy import create_engine, event, func, literal_column, or_, select, update, Column, String, DateTime, Text, Integer, Index, insert
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import sessionmaker
+from snapshot import SnapshotReader, SnapshotWriter, SnapshotError, entry_from_dict, entry_to_dict
+from snapshot_diff import diff_entries, change_to_dict, empty_summary
+from admission import AdmissionController, Relay, parse_size, payload_size
+from metrics import Registry, CONTENT_TYPE, SIZE_BUCKETS
+from evidence import EvidenceFile, EvidenceError, EvidenceMaps, new_manifest, add_event, verify, write_manifest, read_manifest, timestamp, block_signatures, delta_block_size
+from diskimage import DiskImage, DiskImageError
+from jobs import JOB_COMMANDS, RUN_STATUSES, FINISHED_JOB_STATUSES, parse_job, parse_schedule, spread_offset, retry_delay, next_run_time, reply_summary
+import transport
+# jsonlog is shared with the agent, which ships it; appended so server modules come first
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'agent'))
+import jsonlog
+from jsonlog import log_context
+
+jsonlog.configure(
+    level=os.environ.get('CIF_LOG_LEVEL', 'INFO'),
+    fmt=os.environ.get('CIF_LOG_FORMAT', 'json'),
+    sample_rate=int(os.environ.get('CIF_LOG_SAMPLE_RATE', jsonlog.DEFAULT_SAMPLE_RATE))
+)
+logger = logging.getLogger('cif.server')
 
 Base = declarative_base()
 
@@ -17,13 +44,17 @@ class Agent(Base):
     id = Column(String, primary_key=True)
     hostname = Column(String)
     computer_name = Column(String)
-    domain_name = Column(String)
-    platform = Column(String)
+    domain_name = Column(String, index=True)
+    platform = Column(String, index=True)
     ip_address = Column(String)  # Primary IP address
     ip_addresses = Column(Text)  # JSON array of all IP addresses
     registered_at = Column(DateTime)
-    last_seen = Column(DateTime)
-    status = Column(String)  # active, offline, error
+    last_seen = Column(DateTime, index=True)
+    status = Column(String, index=True)  # active, offline, error, image
+
+# Sort and name-prefix key of the agent list; the literal '' keeps queries matching the index expression
+AGENT_NAME_KEY = func.lower(func.coalesce(Agent.computer_name, literal_column("''")))
+Index('ix_agents_name_key', AGENT_NAME_KEY, Agent.id)
 
 class FileSystemEntry(Base):
     __tablename__ = 'filesystem_entries'
@@ -37,54 +68,833 @@ class FileSystemEntry(Base):
     created_at = Column(DateTime)
     modified_at = Column(DateTime)
     accessed_at = Column(DateTime)
-    metadata = Column(Text)  # JSON string
+    # 'metadata' is reserved by the declarative API, so map the column under another name
+    entry_metadata = Column('metadata', Text)  # JSON string
+
+# Subtree queries and snapshot exports read one agent's rows in path order
+Index('ix_filesystem_entries_agent_path', FileSystemEntry.agent_id, FileSystemEntry.path)
+
+class Snapshot(Base):
+    __tablename__ = 'snapshots'
+    
+    id = Column(String, primary_key=True)
+    agent_id = Column(String)
+    root = Column(String)
+    file_path = Column(String)
+    created_at = Column(DateTime)
+    entry_count = Column(Integer)
+    size_bytes = Column(Integer)
+
+class Profile(Base):
+    __tablename__ = 'profiles'
+    
+    id = Column(String, primary_key=True)
+    agent_id = Column(String)
+    mode = Column(String)  # task, sample
+    target = Column(String)  # command or task id profiled in task mode
+    format = Column(String)  # pstats, collapsed
+    status = Column(String)  # requested, running, complete, failed
+    error = Column(Text)
+    requested_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    file_path = Column(String)
+    size_bytes = Column(Integer)
+    summary = Column(Text)  # JSON hottest functions reported by the agent
+
+class Acquisition(Base):
+    __tablename__ = 'acquisitions'
+    
+    id = Column(String, primary_key=True)
+    agent_id = Column(String)
+    path = Column(String)
+    status = Column(String)  # requested, running, complete, mismatch, failed
+    request_id = Column(String)  # latest acquire_file command; older replies are ignored
+    error = Column(Text)
+    requested_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    size = Column(Integer)
+    sha256 = Column(String)  # computed by the server over the stored bytes
+    md5 = Column(String)
+    agent_sha256 = Column(String)  # computed by the agent over the bytes it sent
+    agent_md5 = Column(String)
+    verified = Column(Integer)  # 0 or 1
+    file_path = Column(String)
+    manifest_path = Column(String)
+    manifest_sha256 = Column(String)
+
+class Image(Base):
+    __tablename__ = 'images'
+    
+    id = Column(String, primary_key=True)  # also the id of the virtual agent serving the image
+    name = Column(String)
+    file_path = Column(String)
+    acquisition_id = Column(String)  # set when the image is stored evidence
+    size = Column(Integer)
+    sha256 = Column(String)
+    status = Column(String)  # indexing, ready, failed
+    error = Column(Text)
+    volumes = Column(Text)  # JSON partitions and filesystems found on the image
+    entry_count = Column(Integer)
+    added_at = Column(DateTime)
+    indexed_at = Column(DateTime)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    
+    id = Column(String, primary_key=True)
+    name = Column(String)
+    command = Column(String)
+    params = Column(Text)  # JSON command data sent to each agent
+    selector = Column(Text)  # JSON agent filters resolved when the job was created
+    schedule_id = Column(String, index=True)  # set for jobs created by a schedule
+    status = Column(String, index=True)  # queued, running, complete, failed, cancelled
+    max_attempts = Column(Integer)
+    timeout = Column(Integer)  # seconds a run may take before it is retried
+    spread = Column(Integer)  # seconds over which the runs' start is spread
+    run_count = Column(Integer)
+    created_at = Column(DateTime, index=True)
+    finished_at = Column(DateTime)
+
+class JobRun(Base):
+    __tablename__ = 'job_runs'
+    
+    id = Column(String, primary_key=True)
+    job_id = Column(String, index=True)
+    agent_id = Column(String, index=True)
+    status = Column(String)  # pending, running, complete, failed, cancelled
+    attempts = Column(Integer)
+    not_before = Column(DateTime)  # the agent's spread slot, the end of a retry backoff, or when it was retried
+    request_id = Column(String)  # command of the current attempt; older replies are ignored
+    acquisition_id = Column(String)  # current attempt of an acquire_file job
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    progress = Column(Text)  # JSON reply and item counts
+    result = Column(Text)  # JSON summary of the final reply
+    result_path = Column(String)  # items streamed by the agent, one JSON document per line
+    error = Column(Text)
+
+Index('ix_job_runs_status_not_before', JobRun.status, JobRun.not_before)
+
+class JobSchedule(Base):
+    __tablename__ = 'job_schedules'
+    
+    id = Column(String, primary_key=True)
+    name = Column(String)
+    command = Column(String)
+    params = Column(Text)
+    selector = Column(Text)
+    max_attempts = Column(Integer)
+    timeout = Column(Integer)
+    spread = Column(Integer)
+    interval = Column(Integer)  # seconds between jobs
+    enabled = Column(Integer)  # 0 or 1
+    created_at = Column(DateTime)
+    next_run_at = Column(DateTime)
+    last_run_at = Column(DateTime)
+    last_job_id = Column(String)
 
 app = Flask(__name__)
-CORS(app)
+# Evidence downloads can be handed to a fronting nginx/Apache with X-Sendfile (zero-copy)
+app.config['USE_X_SENDFILE'] = os.environ.get('CIF_USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+CORS(app, expose_headers=['Content-Range', 'ETag', 'X-File-Size', 'X-Page-Offset'])
 socketio = SocketIO(app, cors_allowed_origins="*")
+transport.install()
 
 # Database setup
 engine = create_engine('sqlite:///cif.db', echo=False)
 Base.metadata.create_all(engine)
+# create_all skips tables that already exist, so add indexes introduced since
+with engine.begin() as connection:
+    for index in Agent.__table__.indexes | FileSystemEntry.__table__.indexes | JobRun.__table__.indexes:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    # No agent is connected yet; rows left active by a server that stopped without disconnects are stale
+    connection.execute(update(Agent).where(Agent.status == 'active').values(status='offline'))
 Session = sessionmaker(bind=engine)
 
 # Store active agent connections
 active_agents = {}
 
+# Latest queue depth / running task report from each agent
+agent_status = {}
+
+# Snapshot files live outside the database
+SNAPSHOT_DIR = os.environ.get('CIF_SNAPSHOT_DIR', 'snapshots')
+INDEX_BATCH_SIZE = 5000
+DIFF_BATCH_SIZE = 500
+
+# Agent list paging and caching
+AGENT_LIST_DEFAULT_LIMIT = 500
+AGENT_LIST_MAX_LIMIT = 5000
+AGENT_LIST_CACHE_ENTRIES = 256
+# Changed agents are pushed to analysts in one message at most this often
+AGENT_PUSH_INTERVAL = 1.0
+# Serialized /api/agents responses by query string, dropped whenever an agent changes
+agent_list_cache = OrderedDict()
+agents_version = 0
+# Agents changed since the last push, by id
+changed_agents = {}
+agent_push_task = None
+
+# Largest get_metadata_batch accepted; agents cap directory matches at the same size
+METADATA_BATCH_MAX_PATHS = 10000
+
+# Profiles uploaded by agents, one file per profile
+PROFILE_DIR = os.environ.get('CIF_PROFILE_DIR', 'profiles')
+PROFILE_MODES = ('task', 'sample')
+PROFILE_EXTENSIONS = {'pstats': '.pstats', 'collapsed': '.collapsed.txt'}
+
+# Acquired files and their chain-of-custody manifests (see evidence.py)
+EVIDENCE_DIR = os.environ.get('CIF_EVIDENCE_DIR', 'evidence')
+ACQUISITION_PROGRESS_BYTES = 8 * 1024 * 1024
+# Viewer pages read from stored evidence; matches the agent's read_file chunk size by default
+EVIDENCE_PAGE_SIZE = 64 * 1024
+MAX_EVIDENCE_PAGE_SIZE = 1024 * 1024
+evidence_maps = EvidenceMaps()
+# Evidence files being written, by acquisition id
+active_acquisitions = {}
+# Acquisitions whose stored bytes are being hashed again after a server restart
+reopening_acquisitions = set()
+# Delta signatures of recently used base acquisitions, which never change once stored
+DELTA_SIGNATURE_CACHE_SIZE = 8
+delta_signature_cache = OrderedDict()
+# Bytes copied from a base acquisition per write; the agent bounds each reference
+DELTA_COPY_PIECE_SIZE = 1024 * 1024
+
+# Smallest entropy block an agent accepts (its analytics.MIN_BLOCK_SIZE)
+ANALYSIS_MIN_BLOCK_SIZE = 4096
+
+# Raw disk images analysed on the server (see diskimage.py); images not taken
+# from stored evidence must be placed under IMAGE_DIR first
+IMAGE_DIR = os.environ.get('CIF_IMAGE_DIR', 'images')
+IMAGE_PLATFORM = 'Disk image'
+# Same page and chunk sizes as an agent's replies
+IMAGE_LIST_PAGE_SIZE = 2000
+IMAGE_READ_CHUNK_SIZE = 64 * 1024
+IMAGE_HASH_BLOCK_SIZE = 1024 * 1024
+IMAGE_HASH_MAX_SIZE = 100 * 1024 * 1024
+# Open images by id, so their mappings and parsed directories are reused
+open_images = {}
+
+# Durable jobs (see jobs.py); items streamed back by runs are kept in files
+JOB_RESULT_DIR = os.environ.get('CIF_JOB_RESULT_DIR', 'job_results')
+# Runs in progress at once on one agent, and across all agents
+JOB_AGENT_CONCURRENCY = int(os.environ.get('CIF_JOB_AGENT_CONCURRENCY', '1'))
+JOB_MAX_RUNNING = int(os.environ.get('CIF_JOB_MAX_RUNNING', '200'))
+JOB_DISPATCH_INTERVAL = 2.0
+# Pending runs considered per dispatch pass
+JOB_DISPATCH_BATCH = 1000
+JOB_LIST_DEFAULT_LIMIT = 100
+JOB_LIST_MAX_LIMIT = 1000
+JOB_RUNS_PAGE_SIZE = 1000
+# Run id and command of each outstanding job command, by correlation id
+job_requests = {}
+# Reply and item counts of running runs, written to the database when they finish
+job_progress = {}
+# Jobs whose status or run counts changed since the last job_changed push
+changed_jobs = set()
+job_dispatcher_task = None
+
+# Backpressure for agent replies relayed to analysts (see admission.py)
+AGENT_INFLIGHT_BYTES = parse_size(os.environ.get('CIF_AGENT_INFLIGHT_BYTES', '32M'))
+GLOBAL_INFLIGHT_BYTES = parse_size(os.environ.get('CIF_GLOBAL_INFLIGHT_BYTES', '256M'))
+ANALYST_QUEUE_BYTES = parse_size(os.environ.get('CIF_ANALYST_QUEUE_BYTES', '16M'))
+ANALYST_QUEUE_POLICY = os.environ.get('CIF_ANALYST_QUEUE_POLICY', 'slow')
+# Agents resume on their own if a resume_stream is lost
+STREAM_PAUSE_TIMEOUT = 60
+
+admission = AdmissionController(
+    agent_budget=AGENT_INFLIGHT_BYTES,
+    global_budget=GLOBAL_INFLIGHT_BYTES,
+    on_pause=lambda agent_id: socketio.emit('pause_stream', {'agent_id': agent_id, 'timeout': STREAM_PAUSE_TIMEOUT}, room=agent_id),
+    on_resume=lambda agent_id: socketio.emit('resume_stream', {'agent_id': agent_id}, room=agent_id)
+)
+relay = Relay(socketio, admission, max_queue_bytes=ANALYST_QUEUE_BYTES, policy=ANALYST_QUEUE_POLICY)
+
+def agent_task_counts():
+    """Queued and running commands of all agents by state and priority, from the latest status reports"""
+    # Not labelled by agent, which would make series for every agent in the fleet; /api/agents/<id>/tasks has those
+    counts = {}
+    for status in list(agent_status.values()):
+        queue = status.get('queue') or {}
+        for state in ('queued', 'running'):
+            for priority, count in (queue.get(state) or {}).items():
+                counts[(state, priority)] = counts.get((state, priority), 0) + count
+    return counts
+
+def analyst_queue_totals():
+    queues = relay.stats()['analysts'].values()
+    return {('messages',): sum(q['queued'] for q in queues), ('bytes',): sum(q['bytes'] for q in queues)}
+
+metrics = Registry()
+EVENTS_RECEIVED = metrics.counter('cif_socket_events_total', 'Socket.IO events handled', ('event',))
+EVENT_ERRORS = metrics.counter('cif_socket_event_errors_total', 'Socket.IO handlers that raised', ('event',))
+EVENT_LATENCY = metrics.histogram('cif_socket_event_seconds', 'Socket.IO handler latency', ('event',))
+EVENT_PAYLOAD = metrics.histogram('cif_socket_event_payload_bytes', 'Estimated size of received Socket.IO payloads', ('event',), buckets=SIZE_BUCKETS)
+COMMANDS_SENT = metrics.counter('cif_commands_sent_total', 'Commands sent to agents', ('command',))
+DB_QUERY_TIME = metrics.histogram('cif_db_query_seconds', 'Database statement execution time', ('operation',))
+AGENT_OPERATION_TIME = metrics.histogram('cif_agent_operation_seconds', 'Agent-side timings reported in replies', ('operation',))
+metrics.gauge('cif_active_agents', 'Agents currently connected', function=lambda: len(active_agents))
+metrics.gauge('cif_agent_commands_in_flight', 'Commands queued or running on agents, as last reported',
+              ('state', 'priority'), function=agent_task_counts)
+metrics.gauge('cif_inflight_bytes', 'Agent reply bytes received but not yet sent to analysts',
+              function=lambda: admission.stats()['in_flight_bytes'])
+metrics.gauge('cif_paused_agents', 'Agents currently asked to pause streaming',
+              function=lambda: len(admission.stats()['paused_agents']))
+metrics.gauge('cif_analyst_queue_depth', 'Replies waiting in analyst outbound queues', ('unit',),
+              function=analyst_queue_totals)
+REPLIES_REJECTED = metrics.counter('cif_rejected_replies_total', 'Agent replies rejected for exceeding the in-flight budget', ('event',))
+JOB_RUNS_STARTED = metrics.counter('cif_job_runs_started_total', 'Job run attempts sent to agents', ('command',))
+JOB_RUNS_FINISHED = metrics.counter('cif_job_runs_finished_total', 'Job run attempts finished', ('command', 'status'))
+
+@event.listens_for(engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    DB_QUERY_TIME.observe(elapsed, operation=statement.split(None, 1)[0].upper())
+
+def instrumented(event_name):
+    """Record count, latency, payload size and agent timings for a Socket.IO handler"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args):
+            data = args[0] if args and isinstance(args[0], dict) else None
+            EVENTS_RECEIVED.inc(event=event_name)
+            context = {'event': event_name}
+            if data is not None:
+                EVENT_PAYLOAD.observe(payload_size(data), event=event_name)
+                for operation, seconds in (data.get('timings') or {}).items():
+                    AGENT_OPERATION_TIME.observe(seconds, operation=operation)
+                if data.get('agent_id'):
+                    context['agent_id'] = data['agent_id']
+                correlation_id = data.get('request_id') or data.get('task_id')
+                if correlation_id:
+                    context['correlation_id'] = correlation_id
+            start = time.perf_counter()
+            with log_context(**context):
+                try:
+                    return handler(*args)
+                except Exception:
+                    EVENT_ERRORS.inc(event=event_name)
+                    logger.exception('Socket.IO handler failed')
+                    raise
+                finally:
+                    EVENT_LATENCY.observe(time.perf_counter() - start, event=event_name)
+        return wrapper
+    return decorator
+
+def send_command(agent_id, command, data):
+    """Emit a command to an agent's room and return its correlation id"""
+    request_id = data.setdefault('request_id', str(uuid.uuid4()))
+    COMMANDS_SENT.inc(command=command)
+    socketio.emit(command, data, room=agent_id)
+    logger.debug('Command sent', extra={'command': command, 'agent_id': agent_id, 'correlation_id': request_id})
+    return request_id
+
+def dispatch_command(agent_id, command, data):
+    """Send a command to a connected agent, or run it on the server for a disk image; None if neither"""
+    if agent_id in active_agents:
+        return send_command(agent_id, command, data)
+    if not is_image(agent_id):
+        return None
+    request_id = data.setdefault('request_id', str(uuid.uuid4()))
+    COMMANDS_SENT.inc(command=command)
+    socketio.start_background_task(run_image_command, agent_id, command, data)
+    return request_id
+
+def entry_row_id(agent_id, path):
+    """Deterministic row id so re-indexing a path replaces the previous row"""
+    return f'{agent_id}:{path}'
+
+def parse_timestamp(value):
+    """Parse an ISO timestamp sent by an agent"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def entry_to_row(agent_id, entry):
+    """Convert an agent listing entry into a filesystem_entries row"""
+    extra = {
+        key: entry[key]
+        for key in ('inode', 'mode', 'uid', 'gid', 'md5', 'error', 'link', 'deleted', 'recoverable', 'deleted_at')
+        if entry.get(key) is not None
+    }
+    return {
+        'id': entry_row_id(agent_id, entry['path']),
+        'agent_id': agent_id,
+        'path': entry['path'],
+        'name': entry.get('name'),
+        'size': entry.get('size', 0),
+        'is_directory': 1 if entry.get('is_directory') else 0,
+        'created_at': parse_timestamp(entry.get('created')),
+        'modified_at': parse_timestamp(entry.get('modified')),
+        'accessed_at': parse_timestamp(entry.get('accessed')),
+        'metadata': json.dumps(extra),
+    }
+
+def row_to_entry(row):
+    """Convert a filesystem_entries row back into an agent listing entry"""
+    entry = json.loads(row.entry_metadata) if row.entry_metadata else {}
+    entry.update({
+        'name': row.name,
+        'path': row.path,
+        'size': row.size or 0,
+        'is_directory': bool(row.is_directory),
+        'created': row.created_at.isoformat() if row.created_at else None,
+        'modified': row.modified_at.isoformat() if row.modified_at else None,
+        'accessed': row.accessed_at.isoformat() if row.accessed_at else None,
+    })
+    return entry
+
+def path_filter(query, root):
+    """Restrict a FileSystemEntry query to root and everything below it"""
+    if not root or root == '/':
+        return query
+    prefix = root.rstrip('/\\')
+    # A range on the (agent_id, path) index instead of LIKE, which scans; ']' sorts after
+    # both separators, and siblings such as prefix + '-old' are dropped by the separator test
+    return query.filter(
+        FileSystemEntry.path >= prefix,
+        FileSystemEntry.path < prefix + ']',
+        or_(FileSystemEntry.path == prefix, func.substr(FileSystemEntry.path, len(prefix) + 1, 1).in_(('/', '\\')))
+    )
+
+def resolve_diff_snapshots(session, agent_id, base_id=None, target_id=None, since=None):
+    """Pick the base and target snapshots for a diff request
+
+    ``since`` selects the newest snapshot taken at or before that time as the
+    base; a missing target defaults to the newest snapshot of the agent.
+    """
+    query = session.query(Snapshot).filter_by(agent_id=agent_id)
+    if target_id:
+        target = query.filter_by(id=target_id).first()
+    else:
+        target = query.order_by(Snapshot.created_at.desc()).first()
+    
+    if base_id:
+        base = query.filter_by(id=base_id).first()
+    elif since:
+        since_time = parse_timestamp(since)
+        if since_time is None:
+            raise ValueError(f'Invalid since timestamp: {since}')
+        base = query.filter(Snapshot.created_at <= since_time).order_by(Snapshot.created_at.desc()).first()
+    else:
+        base = None
+    return base, target
+
+def iter_snapshot_diff(base, target):
+    """Yield serialized changes between two snapshot rows"""
+    with SnapshotReader(base.file_path) as base_reader, SnapshotReader(target.file_path) as target_reader:
+        for change in diff_entries(base_reader, target_reader):
+            yield change_to_dict(change)
+
+def upsert_entries(session, agent_id, entries):
+    """Insert or replace index rows for a list of agent entries"""
+    if entries:
+        rows = [entry_to_row(agent_id, entry) for entry in entries]
+        session.execute(insert(FileSystemEntry.__table__).prefix_with('OR REPLACE'), rows)
+
+def rename_indexed_path(session, agent_id, old_path, new_path):
+    """Move an indexed path and everything below it to a new location"""
+    old_prefix = old_path.rstrip('/\\')
+    rows = path_filter(session.query(FileSystemEntry).filter_by(agent_id=agent_id), old_path).all()
+    for row in rows:
+        row.path = new_path + row.path[len(old_prefix):]
+        row.id = entry_row_id(agent_id, row.path)
+        row.name = os.path.basename(row.path)
+
+def apply_watch_events(session, agent_id, root, events):
+    """Apply a batch of watch events to the index; returns paths that need a rescan"""
+    rescan = []
+    for change in events:
+        kind = change.get('type')
+        path = change.get('path')
+        if kind == 'deleted':
+            path_filter(session.query(FileSystemEntry).filter_by(agent_id=agent_id), path).delete(synchronize_session=False)
+        elif kind == 'renamed':
+            path_filter(session.query(FileSystemEntry).filter_by(agent_id=agent_id), path).delete(synchronize_session=False)
+            rename_indexed_path(session, agent_id, change['old_path'], path)
+            session.flush()
+            upsert_entries(session, agent_id, [change['entry']] if change.get('entry') else [])
+        elif kind in ('created', 'modified'):
+            upsert_entries(session, agent_id, [change['entry']] if change.get('entry') else [])
+        elif kind == 'overflow':
+            rescan.append(path or root)
+    return rescan
+
+def relay_reply(event, data):
+    """Queue an agent reply for analysts, reporting an error if the server is over budget"""
+    if relay.publish(event, data, data.get('agent_id')):
+        return
+    REPLIES_REJECTED.inc(event=event)
+    relay.notify(event, {
+        'agent_id': data.get('agent_id'),
+        'path': data.get('path'),
+        'chunk_number': data.get('chunk_number'),
+        'error': 'Server is busy relaying other replies; retry shortly',
+        'busy': True
+    })
+    logger.warning('Rejected agent reply: in-flight budget exhausted', extra={'sample': 'rejected', 'reply': event, 'path': data.get('path')})
+
+def snapshot_to_dict(snapshot):
+    return {
+        'id': snapshot.id,
+        'agent_id': snapshot.agent_id,
+        'root': snapshot.root,
+        'created_at': snapshot.created_at.isoformat() if snapshot.created_at else None,
+        'entry_count': snapshot.entry_count,
+        'size_bytes': snapshot.size_bytes,
+    }
+
+def profile_to_dict(profile):
+    return {
+        'id': profile.id,
+        'agent_id': profile.agent_id,
+        'mode': profile.mode,
+        'target': profile.target,
+        'format': profile.format,
+        'status': profile.status,
+        'error': profile.error,
+        'requested_at': profile.requested_at.isoformat() if profile.requested_at else None,
+        'finished_at': profile.finished_at.isoformat() if profile.finished_at else None,
+        'size_bytes': profile.size_bytes,
+        'summary': json.loads(profile.summary) if profile.summary else None,
+    }
+
+def acquisition_to_dict(acquisition):
+    return {
+        'id': acquisition.id,
+        'agent_id': acquisition.agent_id,
+        'path': acquisition.path,
+        'status': acquisition.status,
+        'error': acquisition.error,
+        'requested_at': acquisition.requested_at.isoformat() if acquisition.requested_at else None,
+        'completed_at': acquisition.completed_at.isoformat() if acquisition.completed_at else None,
+        'size': acquisition.size,
+        'sha256': acquisition.sha256,
+        'md5': acquisition.md5,
+        'agent_sha256': acquisition.agent_sha256,
+        'agent_md5': acquisition.agent_md5,
+        'verified': None if acquisition.verified is None else bool(acquisition.verified),
+        'manifest_sha256': acquisition.manifest_sha256,
+    }
+
+def agent_identity(agent):
+    """Host details recorded in an acquisition's manifest"""
+    return {
+        'agent_id': agent.id,
+        'hostname': agent.hostname,
+        'computer_name': agent.computer_name,
+        'domain_name': agent.domain_name,
+        'platform': agent.platform,
+        'ip_addresses': json.loads(agent.ip_addresses) if agent.ip_addresses else [],
+    }
+
+def load_manifest(acquisition):
+    """Read an acquisition's manifest, noting in it if it was changed outside the server"""
+    manifest, digest = read_manifest(acquisition.manifest_path)
+    if digest != acquisition.manifest_sha256:
+        logger.warning('Acquisition manifest changed outside the server', extra={'acquisition_id': acquisition.id})
+        add_event(manifest, 'manifest_altered', expected_sha256=acquisition.manifest_sha256, found_sha256=digest)
+    return manifest
+
+def save_manifest(acquisition, manifest):
+    acquisition.manifest_sha256 = write_manifest(acquisition.manifest_path, manifest)
+
+def delta_signatures(base):
+    """Block signatures of a stored acquisition for a delta re-acquisition, cached by acquisition id"""
+    signatures = delta_signature_cache.get(base.id)
+    if signatures is None:
+        block_size = delta_block_size(base.size or 0)
+        weak, strong = block_signatures(base.file_path, block_size, pause=lambda: socketio.sleep(0))
+        signatures = {'block_size': block_size, 'weak': weak, 'strong': strong}
+        delta_signature_cache[base.id] = signatures
+        while len(delta_signature_cache) > DELTA_SIGNATURE_CACHE_SIZE:
+            delta_signature_cache.popitem(last=False)
+    else:
+        delta_signature_cache.move_to_end(base.id)
+    return signatures
+
+def delta_base(acquisition, manifest):
+    """The stored acquisition a delta acquisition copies unchanged blocks from, if it is still there"""
+    delta = manifest.get('delta')
+    if not delta:
+        return None
+    return stored_evidence(acquisition.agent_id, delta['base_acquisition_id'])
+
+def request_acquisition(acquisition, offset=0, source=None, base=None):
+    """Send (or resend, from offset) the acquire_file command for an acquisition"""
+    previous = acquisition.request_id
+    if previous:
+        # A task left over from before a reconnect must not keep sending chunks
+        send_command(acquisition.agent_id, 'cancel_task', {'task_id': previous})
+    acquisition.request_id = send_command(acquisition.agent_id, 'acquire_file', {
+        'acquisition_id': acquisition.id,
+        'path': acquisition.path,
+        'offset': offset,
+        'source': source,
+        'delta': delta_signatures(base) if base else None
+    })
+
+def latest_evidence(session, agent_id, path):
+    """The newest verified acquisition of a path still in the evidence store, or None"""
+    for candidate in session.query(Acquisition).filter_by(agent_id=agent_id, path=path, status='complete').order_by(
+        Acquisition.completed_at.desc()
+    ):
+        if os.path.exists(candidate.file_path):
+            return candidate
+    return None
+
+def create_acquisition(session, agent_id, path, requested_by, base=None):
+    """Record a new acquisition, write its manifest and send acquire_file; the caller commits"""
+    agent = session.query(Agent).filter_by(id=agent_id).first()
+    acquisition_id = str(uuid.uuid4())
+    acquisition = Acquisition(
+        id=acquisition_id,
+        agent_id=agent_id,
+        path=path,
+        status='requested',
+        requested_at=datetime.now(),
+        file_path=os.path.join(EVIDENCE_DIR, agent_id, f'{acquisition_id}.bin'),
+        manifest_path=os.path.join(EVIDENCE_DIR, agent_id, f'{acquisition_id}.manifest.json')
+    )
+    manifest = new_manifest(acquisition_id, agent_identity(agent), path, requested_by)
+    if base is not None:
+        manifest['delta'] = {
+            'base_acquisition_id': base.id,
+            'base_sha256': base.sha256,
+            'block_size': delta_block_size(base.size or 0),
+            'bytes_sent': 0,
+            'bytes_copied': 0
+        }
+    save_manifest(acquisition, manifest)
+    request_acquisition(acquisition, base=base)
+    session.add(acquisition)
+    return acquisition
+
+def record_delta_transfer(manifest, state):
+    """Add the bytes sent and copied while a delta acquisition ran to its manifest"""
+    if manifest.get('delta') and state:
+        manifest['delta']['bytes_sent'] += state['bytes_sent']
+        manifest['delta']['bytes_copied'] += state['bytes_copied']
+
+def acquisition_state(writer, agent_id, request_id=None, base_path=None):
+    """In-memory state of an acquisition; chunks are only taken for request_id"""
+    return {
+        'writer': writer, 'agent_id': agent_id, 'request_id': request_id,
+        'base_path': base_path, 'bytes_sent': 0, 'bytes_copied': 0
+    }
+
+def resume_acquisition(acquisition, state):
+    """Resend acquire_file from the end of the stored bytes; the caller commits"""
+    writer = state['writer']
+    manifest = load_manifest(acquisition)
+    record_delta_transfer(manifest, state)
+    add_event(manifest, 'resume_requested', offset=writer.size)
+    save_manifest(acquisition, manifest)
+    # Kept for acquire_started, but no chunks are taken until the agent has answered the new command
+    active_acquisitions[acquisition.id] = acquisition_state(writer, acquisition.agent_id)
+    request_acquisition(
+        acquisition, offset=writer.size, source=manifest['source'] if writer.size else None,
+        base=delta_base(acquisition, manifest)
+    )
+    logger.info('Resuming acquisition', extra={'acquisition_id': acquisition.id, 'agent_id': acquisition.agent_id, 'offset': writer.size})
+
+def reopen_acquisition(acquisition_id):
+    """Hash the bytes an acquisition stored before the server restarted, yielding between blocks, then resume it"""
+    session = Session()
+    try:
+        file_path = session.query(Acquisition.file_path).filter_by(id=acquisition_id).scalar()
+        # No transaction is held open while hashing, so writers are not locked out
+        session.commit()
+        writer = EvidenceFile(file_path).open(pause=lambda: socketio.sleep(0))
+        acquisition = session.query(Acquisition).filter_by(id=acquisition_id).first()
+        if acquisition is not None and acquisition.status in ('requested', 'running') and acquisition.agent_id in active_agents:
+            resume_acquisition(acquisition, acquisition_state(writer, acquisition.agent_id))
+            session.commit()
+    except Exception:
+        session.rollback()
+        logger.exception('Reopening acquisition failed', extra={'acquisition_id': acquisition_id})
+    finally:
+        reopening_acquisitions.discard(acquisition_id)
+        session.close()
+
+def resume_acquisitions(session, agent_id):
+    """Continue an agent's unfinished acquisitions from the bytes already stored"""
+    for acquisition in session.query(Acquisition).filter(
+        Acquisition.agent_id == agent_id, Acquisition.status.in_(('requested', 'running'))
+    ):
+        state = active_acquisitions.pop(acquisition.id, None)
+        if state is not None:
+            resume_acquisition(acquisition, state)
+        elif acquisition.id not in reopening_acquisitions:
+            reopening_acquisitions.add(acquisition.id)
+            socketio.start_background_task(reopen_acquisition, acquisition.id)
+    session.commit()
+
+def agent_to_dict(agent):
+    return {
+        'id': agent.id,
+        'hostname': agent.hostname,
+        'computer_name': agent.computer_name,
+        'domain_name': agent.domain_name,
+        'platform': agent.platform,
+        'ip_address': agent.ip_address,
+        'ip_addresses': json.loads(agent.ip_addresses) if agent.ip_addresses else [],
+        'registered_at': agent.registered_at.isoformat() if agent.registered_at else None,
+        'last_seen': agent.last_seen.isoformat() if agent.last_seen else None,
+        'status': agent.status
+    }
+
+def encode_cursor(name_key, agent_id):
+    return base64.urlsafe_b64encode(json.dumps([name_key, agent_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        name_key, agent_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    return name_key, agent_id
+
+def agent_conditions(args):
+    """SQL conditions for the agent list's status, platform, domain, name and last_seen filters"""
+    conditions = []
+    statuses = [status for status in args.get('status', '').split(',') if status]
+    if statuses:
+        conditions.append(Agent.status.in_(statuses))
+    if args.get('platform'):
+        conditions.append(Agent.platform == args['platform'])
+    if args.get('domain'):
+        conditions.append(Agent.domain_name == args['domain'])
+    if args.get('name'):
+        # A range on the indexed key instead of LIKE, which SQLite cannot answer from the index
+        prefix = args['name'].lower()
+        conditions.extend([AGENT_NAME_KEY >= prefix, AGENT_NAME_KEY < prefix + '\U0010ffff'])
+    for arg in ('seen_after', 'seen_before'):
+        if args.get(arg):
+            value = parse_timestamp(args[arg])
+            if value is None:
+                raise ValueError(f'{arg} must be an ISO timestamp')
+            conditions.append(Agent.last_seen >= value if arg == 'seen_after' else Agent.last_seen < value)
+    return conditions
+
+def query_agents(args):
+    """One page of agents matching the request's filters, ordered by name, with the cursor of the next page"""
+    try:
+        limit = int(args.get('limit', AGENT_LIST_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    limit = min(max(limit, 1), AGENT_LIST_MAX_LIMIT)
+    
+    conditions = agent_conditions(args)
+    page = select(Agent, AGENT_NAME_KEY.label('name_key')).where(*conditions)
+    if args.get('cursor'):
+        name_key, agent_id = decode_cursor(args['cursor'])
+        # The leading range lets SQLite seek in the index; a row-value comparison makes it scan
+        page = page.where(AGENT_NAME_KEY >= name_key, or_(AGENT_NAME_KEY > name_key, Agent.id > agent_id))
+    session = Session()
+    total = session.execute(select(func.count()).select_from(Agent).where(*conditions)).scalar()
+    rows = session.execute(page.order_by(AGENT_NAME_KEY, Agent.id).limit(limit + 1)).all()
+    result = {
+        'agents': [agent_to_dict(agent) for agent, _ in rows[:limit]],
+        'next_cursor': encode_cursor(rows[limit - 1].name_key, rows[limit - 1].Agent.id) if len(rows) > limit else None,
+        'total': total
+    }
+    session.close()
+    return result
+
+def agent_changed(agent):
+    """Invalidate cached agent lists and queue the agent for the next push to analysts"""
+    global agents_version, agent_push_task
+    agents_version += 1
+    agent_list_cache.clear()
+    changed_agents[agent.id] = agent_to_dict(agent)
+    if agent_push_task is None:
+        agent_push_task = socketio.start_background_task(push_agent_changes)
+
+def push_agent_changes():
+    """Send analysts the agents changed in each interval as one agents_changed message"""
+    while True:
+        socketio.sleep(AGENT_PUSH_INTERVAL)
+        if changed_agents:
+            agents = list(changed_agents.values())
+            changed_agents.clear()
+            relay.notify('agents_changed', {'agents': agents})
+
 @app.route('/api/agents', methods=['GET'])
 def get_agents():
-    """Get list of all registered agents"""
-    session = Session()
-    agents = session.query(Agent).all()
-    result = [{
-        'id': a.id,
-        'hostname': a.hostname,
-        'computer_name': a.computer_name,
-        'domain_name': a.domain_name,
-        'platform': a.platform,
-        'ip_address': a.ip_address,
-        'ip_addresses': json.loads(a.ip_addresses) if a.ip_addresses else [],
-        'registered_at': a.registered_at.isoformat() if a.registered_at else None,
-        'last_seen': a.last_seen.isoformat() if a.last_seen else None,
-        'status': a.status
-    } for a in agents]
+    """List registered agents, filtered by status, platform, domain, name prefix and last_seen range, in pages
+
+    Responses are cached until an agent registers, updates or disconnects,
+    and carry an ETag so unchanged lists are answered with 304.
+    """
+    key = request.query_string.decode()
+    cached = agent_list_cache.get(key)
+    if cached is None:
+        version = agents_version
+        try:
+            result = query_agents(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        body = json.dumps(result).encode()
+        cached = (f'"{hashlib.sha1(body).hexdigest()}"', body)
+        # Skip caching if an agent changed while the query ran
+        if version == agents_version:
+            agent_list_cache[key] = cached
+            while len(agent_list_cache) > AGENT_LIST_CACHE_ENTRIES:
+                agent_list_cache.popitem(last=False)
+    else:
+        agent_list_cache.move_to_end(key)
+    
+    etag, body = cached
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
+@app.route('/api/agents/<agent_id>', methods=['GET'])
+def get_agent(agent_id):
+    """Get one registered agent"""
+    session = Session()
+    agent = session.query(Agent).filter_by(id=agent_id).first()
+    result = agent_to_dict(agent) if agent else None
     session.close()
+    if result is None:
+        return jsonify({'error': 'Agent not found'}), 404
     return jsonify(result)
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose server metrics in the Prometheus text format"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/admission', methods=['GET'])
+def get_admission():
+    """Get in-flight byte usage and analyst queue depths"""
+    return jsonify(dict(admission.stats(), relay=relay.stats()))
+
 @app.route('/api/agents/<agent_id>/filesystem', methods=['GET'])
 def get_filesystem(agent_id):
     """Get file system listing for an agent"""
     path = request.args.get('path', '/')
     
-    if agent_id not in active_agents:
+    # The listing arrives as filesystem_list_response, in pages of page_size entries when given
+    command = {'path': path, 'refresh': request.args.get('refresh', 'false').lower() == 'true'}
+    page_size = request.args.get('page_size', type=int)
+    if page_size is not None:
+        if page_size < 1:
+            return jsonify({'error': 'page_size must be a positive integer'}), 400
+        command['page_size'] = page_size
+    request_id = dispatch_command(agent_id, 'list_directory', command)
+    if request_id is None:
         return jsonify({'error': 'Agent not connected'}), 404
     
-    # Request file system listing from agent via WebSocket
-    socketio.emit('list_directory', {'path': path}, room=agent_id)
-    
-    # This would typically be handled via WebSocket callback
-    # For now, return a placeholder response
-    return jsonify({'message': 'Request sent to agent', 'path': path})
+    return jsonify({'message': 'Request sent to agent', 'path': path, 'request_id': request_id})
 
 @app.route('/api/agents/<agent_id>/file', methods=['GET'])
 def get_file(agent_id):
@@ -93,13 +903,13 @@ def get_file(agent_id):
     if not file_path:
         return jsonify({'error': 'Path parameter required'}), 400
     
-    if agent_id not in active_agents:
-        return jsonify({'error': 'Agent not connected'}), 404
-    
     # Request file content from agent
-    socketio.emit('read_file', {'path': file_path}, room=agent_id)
+    chunk_number = request.args.get('chunk_number', 0, type=int)
+    request_id = dispatch_command(agent_id, 'read_file', {'path': file_path, 'chunk_number': chunk_number})
+    if request_id is None:
+        return jsonify({'error': 'Agent not connected'}), 404
     
-    return jsonify({'message': 'File request sent to agent', 'path': file_path})
+    return jsonify({'message': 'File request sent to agent', 'path': file_path, 'chunk_number': chunk_number, 'request_id': request_id})
 
 @app.route('/api/agents/<agent_id>/metadata', methods=['GET'])
 def get_file_metadata(agent_id):
@@ -108,19 +918,1312 @@ def get_file_metadata(agent_id):
     if not file_path:
         return jsonify({'error': 'Path parameter required'}), 400
     
+    request_id = dispatch_command(agent_id, 'get_metadata', {'path': file_path})
+    if request_id is None:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    return jsonify({'message': 'Metadata request sent to agent', 'path': file_path, 'request_id': request_id})
+
+@app.route('/api/agents/<agent_id>/metadata/batch', methods=['POST'])
+def get_file_metadata_batch(agent_id):
+    """Get metadata for many paths, or for the files in a directory matching a pattern"""
+    body = request.get_json(silent=True) or {}
+    paths = body.get('paths')
+    
+    if paths is not None:
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            return jsonify({'error': 'paths must be a list of strings'}), 400
+        if len(paths) > METADATA_BATCH_MAX_PATHS:
+            return jsonify({'error': f'At most {METADATA_BATCH_MAX_PATHS} paths per batch'}), 400
+        command = {'paths': paths}
+    elif body.get('directory'):
+        command = {
+            'directory': body['directory'],
+            'pattern': body.get('pattern', '*'),
+            'recursive': bool(body.get('recursive', False))
+        }
+    else:
+        return jsonify({'error': 'paths or directory required'}), 400
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    command['refresh'] = bool(body.get('refresh', False))
+    request_id = send_command(agent_id, 'get_metadata_batch', command)
+    
+    # Results arrive as file_metadata_batch_response events; cancel with the tasks endpoint
+    return jsonify({'message': 'Metadata batch sent to agent', 'request_id': request_id}), 202
+
+@app.route('/api/agents/<agent_id>/analysis', methods=['POST'])
+def analyze_file(agent_id):
+    """Compute a file's entropy map and byte histogram on the agent"""
+    body = request.get_json(silent=True) or {}
+    if not body.get('path'):
+        return jsonify({'error': 'path is required'}), 400
+    try:
+        block_size = int(body.get('block_size') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'block_size must be an integer'}), 400
+    if body.get('block_size') and block_size < ANALYSIS_MIN_BLOCK_SIZE:
+        return jsonify({'error': f'block_size must be at least {ANALYSIS_MIN_BLOCK_SIZE}'}), 400
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    command = {'path': body['path']}
+    if block_size:
+        command['block_size'] = block_size
+    request_id = send_command(agent_id, 'analyze_file', command)
+    
+    # Results arrive as file_analysis_response events; cancel with the tasks endpoint
+    return jsonify({'message': 'Analysis sent to agent', 'path': body['path'], 'request_id': request_id}), 202
+
+@app.route('/api/agents/<agent_id>/strings', methods=['POST'])
+def extract_strings(agent_id):
+    """Extract the ASCII and UTF-16LE strings of a file on the agent"""
+    body = request.get_json(silent=True) or {}
+    if not body.get('path'):
+        return jsonify({'error': 'path is required'}), 400
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    command = {key: body[key] for key in ('path', 'min_length', 'max_strings', 'encodings', 'offset') if body.get(key) is not None}
+    request_id = send_command(agent_id, 'extract_strings', command)
+    
+    # Results arrive as file_strings_response events; a reply with next_offset means more strings remain
+    return jsonify({'message': 'String extraction sent to agent', 'path': body['path'], 'request_id': request_id}), 202
+
+@app.route('/api/agents/<agent_id>/tasks', methods=['GET'])
+def get_agent_tasks(agent_id):
+    """Get the last reported task queue of an agent"""
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    return jsonify(agent_status.get(agent_id, {'queue': None, 'tasks': []}))
+
+@app.route('/api/agents/<agent_id>/tasks/<task_id>', methods=['DELETE'])
+def cancel_agent_task(agent_id, task_id):
+    """Cancel a queued or running task on an agent"""
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    send_command(agent_id, 'cancel_task', {'task_id': task_id})
+    
+    return jsonify({'message': 'Cancel request sent to agent', 'task_id': task_id})
+
+@app.route('/api/agents/<agent_id>/index', methods=['POST'])
+def index_tree(agent_id):
+    """Ask an agent to walk a subtree and stream it into the index"""
+    body = request.get_json(silent=True) or {}
+    path = body.get('path') or request.args.get('path', '/')
+    
+    request_id = dispatch_command(agent_id, 'index_tree', {'path': path, 'hash': bool(body.get('hash', False))})
+    if request_id is None:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    # The agent runs the sweep under this id, so it can be passed to the cancel endpoint
+    return jsonify({'message': 'Index request sent to agent', 'path': path, 'request_id': request_id})
+
+@app.route('/api/agents/<agent_id>/watches', methods=['POST'])
+def watch_path(agent_id):
+    """Start a live change feed for a subtree on an agent"""
+    body = request.get_json(silent=True) or {}
+    path = body.get('path', '/')
+    
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    watch_id = str(uuid.uuid4())
+    send_command(agent_id, 'watch_path', {
+        'watch_id': watch_id,
+        'path': path,
+        'index': bool(body.get('index', False)),
+        'polling': bool(body.get('polling', False))
+    })
+    
+    return jsonify({'message': 'Watch request sent to agent', 'watch_id': watch_id, 'path': path})
+
+@app.route('/api/agents/<agent_id>/watches/<watch_id>', methods=['DELETE'])
+def unwatch_path(agent_id, watch_id):
+    """Stop a live change feed"""
     if agent_id not in active_agents:
         return jsonify({'error': 'Agent not connected'}), 404
     
-    socketio.emit('get_metadata', {'path': file_path}, room=agent_id)
+    send_command(agent_id, 'unwatch_path', {'watch_id': watch_id})
     
-    return jsonify({'message': 'Metadata request sent to agent', 'path': file_path})
+    return jsonify({'message': 'Unwatch request sent to agent', 'watch_id': watch_id})
+
+@app.route('/api/agents/<agent_id>/snapshots', methods=['GET'])
+def list_snapshots(agent_id):
+    """List stored snapshots for an agent, newest first"""
+    session = Session()
+    snapshots = session.query(Snapshot).filter_by(agent_id=agent_id).order_by(Snapshot.created_at.desc()).all()
+    result = [snapshot_to_dict(s) for s in snapshots]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/agents/<agent_id>/snapshots', methods=['POST'])
+def create_snapshot(agent_id):
+    """Export the indexed tree of an agent into a snapshot file"""
+    body = request.get_json(silent=True) or {}
+    root = body.get('path', '/')
+    snapshot_id = str(uuid.uuid4())
+    created_at = datetime.now()
+    
+    os.makedirs(os.path.join(SNAPSHOT_DIR, agent_id), exist_ok=True)
+    file_path = os.path.join(SNAPSHOT_DIR, agent_id, f'{snapshot_id}.cifsnap')
+    
+    session = Session()
+    query = path_filter(session.query(FileSystemEntry).filter_by(agent_id=agent_id), root)
+    meta = {'id': snapshot_id, 'agent_id': agent_id, 'root': root, 'created_at': created_at.isoformat()}
+    saved = False
+    try:
+        with SnapshotWriter(file_path, meta=meta) as writer:
+            last_path = None
+            while True:
+                # Pages by path, each in its own short read, so agents can keep writing to the index
+                page = query if last_path is None else query.filter(FileSystemEntry.path > last_path)
+                rows = page.order_by(FileSystemEntry.path).limit(INDEX_BATCH_SIZE).all()
+                for row in rows:
+                    writer.add(entry_from_dict(row_to_entry(row)))
+                if len(rows) < INDEX_BATCH_SIZE:
+                    break
+                last_path = rows[-1].path
+                session.commit()
+                socketio.sleep(0)
+        
+        snapshot = Snapshot(
+            id=snapshot_id,
+            agent_id=agent_id,
+            root=root,
+            file_path=file_path,
+            created_at=created_at,
+            entry_count=writer.entry_count,
+            size_bytes=os.path.getsize(file_path)
+        )
+        session.add(snapshot)
+        session.commit()
+        result = snapshot_to_dict(snapshot)
+        saved = True
+    except SnapshotError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        session.close()
+        if not saved and os.path.exists(file_path):
+            os.remove(file_path)
+    return jsonify(result), 201
+
+@app.route('/api/agents/<agent_id>/snapshots/diff', methods=['GET'])
+def diff_snapshots(agent_id):
+    """Diff two snapshots of an agent, streamed as NDJSON unless format=json"""
+    session = Session()
+    try:
+        base, target = resolve_diff_snapshots(
+            session, agent_id,
+            base_id=request.args.get('base'),
+            target_id=request.args.get('target'),
+            since=request.args.get('since')
+        )
+    except ValueError as e:
+        session.close()
+        return jsonify({'error': str(e)}), 400
+    session.close()
+    if not base or not target:
+        return jsonify({'error': 'Snapshot not found'}), 404
+    
+    if request.args.get('format') == 'json':
+        limit = request.args.get('limit', 10000, type=int)
+        summary = empty_summary()
+        changes = []
+        for change in iter_snapshot_diff(base, target):
+            summary[change['type']] += 1
+            if len(changes) < limit:
+                changes.append(change)
+        return jsonify({
+            'base': snapshot_to_dict(base),
+            'target': snapshot_to_dict(target),
+            'summary': summary,
+            'changes': changes,
+            'truncated': sum(summary.values()) > len(changes)
+        })
+    
+    def generate():
+        summary = empty_summary()
+        for change in iter_snapshot_diff(base, target):
+            summary[change['type']] += 1
+            yield json.dumps(change) + '\n'
+        yield json.dumps({'type': 'summary', 'summary': summary}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/agents/<agent_id>/snapshots/<snapshot_id>', methods=['GET'])
+def get_snapshot_entries(agent_id, snapshot_id):
+    """Read entries from a snapshot with optional prefix/mtime/size filters"""
+    session = Session()
+    snapshot = session.query(Snapshot).filter_by(id=snapshot_id, agent_id=agent_id).first()
+    session.close()
+    if not snapshot:
+        return jsonify({'error': 'Snapshot not found'}), 404
+    
+    limit = request.args.get('limit', 1000, type=int)
+    min_size = request.args.get('min_size', type=int)
+    max_size = request.args.get('max_size', type=int)
+    entries = []
+    with SnapshotReader(snapshot.file_path) as reader:
+        for entry in reader.iter_entries(
+            prefix=request.args.get('prefix'),
+            modified_after=request.args.get('modified_after'),
+            modified_before=request.args.get('modified_before'),
+            min_size=min_size,
+            max_size=max_size
+        ):
+            entries.append(entry_to_dict(entry))
+            if len(entries) >= limit:
+                break
+    
+    return jsonify({'snapshot': snapshot_to_dict(snapshot), 'entries': entries})
+
+@app.route('/api/agents/<agent_id>/snapshots/<snapshot_id>/import', methods=['POST'])
+def import_snapshot(agent_id, snapshot_id):
+    """Replace the indexed tree of an agent with the contents of a snapshot"""
+    session = Session()
+    snapshot = session.query(Snapshot).filter_by(id=snapshot_id, agent_id=agent_id).first()
+    if not snapshot:
+        session.close()
+        return jsonify({'error': 'Snapshot not found'}), 404
+    
+    path_filter(session.query(FileSystemEntry).filter_by(agent_id=agent_id), snapshot.root).delete(synchronize_session=False)
+    # Committed with each batch, so agents are not locked out of the index while this yields
+    session.commit()
+    imported = 0
+    batch = []
+    try:
+        with SnapshotReader(snapshot.file_path) as reader:
+            for entry in reader:
+                batch.append(entry_to_row(agent_id, entry_to_dict(entry)))
+                if len(batch) >= INDEX_BATCH_SIZE:
+                    session.execute(insert(FileSystemEntry.__table__), batch)
+                    session.commit()
+                    imported += len(batch)
+                    batch = []
+                    socketio.sleep(0)
+        if batch:
+            session.execute(insert(FileSystemEntry.__table__), batch)
+            imported += len(batch)
+        session.commit()
+    except SnapshotError as e:
+        session.rollback()
+        return jsonify({'error': str(e), 'entries': imported}), 400
+    finally:
+        session.close()
+    
+    return jsonify({'message': 'Snapshot imported', 'entries': imported})
+
+@app.route('/api/agents/<agent_id>/profiles', methods=['GET'])
+def list_profiles(agent_id):
+    """List profiles taken on an agent, newest first"""
+    session = Session()
+    profiles = session.query(Profile).filter_by(agent_id=agent_id).order_by(Profile.requested_at.desc()).all()
+    result = [profile_to_dict(p) for p in profiles]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/agents/<agent_id>/profiles', methods=['POST'])
+def start_profile(agent_id):
+    """Ask an agent to profile one task or sample all its threads for a while"""
+    body = request.get_json(silent=True) or {}
+    mode = body.get('mode', 'sample')
+    
+    if mode not in PROFILE_MODES:
+        return jsonify({'error': f"mode must be one of {', '.join(PROFILE_MODES)}"}), 400
+    if mode == 'task' and not (body.get('command') or body.get('task_id')):
+        return jsonify({'error': 'A task profile needs a command or a task_id'}), 400
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    profile_id = str(uuid.uuid4())
+    session = Session()
+    profile = Profile(
+        id=profile_id,
+        agent_id=agent_id,
+        mode=mode,
+        target=body.get('task_id') or body.get('command'),
+        status='requested',
+        requested_at=datetime.now()
+    )
+    session.add(profile)
+    session.commit()
+    result = profile_to_dict(profile)
+    session.close()
+    
+    result['request_id'] = send_command(agent_id, 'profile', {
+        'profile_id': profile_id,
+        'mode': mode,
+        'duration': body.get('duration'),
+        'interval': body.get('interval'),
+        'command': body.get('command'),
+        'task_id': body.get('task_id')
+    })
+    return jsonify(result), 202
+
+@app.route('/api/agents/<agent_id>/profiles/<profile_id>', methods=['GET'])
+def get_profile(agent_id, profile_id):
+    """Status and summary of one profile"""
+    session = Session()
+    profile = session.query(Profile).filter_by(id=profile_id, agent_id=agent_id).first()
+    session.close()
+    if not profile:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(profile_to_dict(profile))
+
+@app.route('/api/agents/<agent_id>/profiles/<profile_id>/stop', methods=['POST'])
+def stop_profile(agent_id, profile_id):
+    """End a running profile early; the agent uploads what it has collected"""
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    send_command(agent_id, 'stop_profile', {'profile_id': profile_id})
+    
+    return jsonify({'message': 'Stop request sent to agent', 'profile_id': profile_id})
+
+@app.route('/api/agents/<agent_id>/profiles/<profile_id>/download', methods=['GET'])
+def download_profile(agent_id, profile_id):
+    """Download the raw profile (pstats or collapsed stacks)"""
+    session = Session()
+    profile = session.query(Profile).filter_by(id=profile_id, agent_id=agent_id).first()
+    session.close()
+    if not profile or profile.status != 'complete' or not os.path.exists(profile.file_path):
+        return jsonify({'error': 'Profile not available'}), 404
+    return send_file(
+        os.path.abspath(profile.file_path),
+        mimetype='text/plain' if profile.format == 'collapsed' else 'application/octet-stream',
+        as_attachment=True,
+        download_name=os.path.basename(profile.file_path)
+    )
+
+@app.route('/api/agents/<agent_id>/acquisitions', methods=['GET'])
+def list_acquisitions(agent_id):
+    """List files acquired from an agent, newest first, optionally by source path or status"""
+    session = Session()
+    query = session.query(Acquisition).filter_by(agent_id=agent_id)
+    if request.args.get('path'):
+        query = query.filter_by(path=request.args['path'])
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    acquisitions = query.order_by(Acquisition.requested_at.desc()).all()
+    result = [acquisition_to_dict(a) for a in acquisitions]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/agents/<agent_id>/acquisitions', methods=['POST'])
+def start_acquisition(agent_id):
+    """Ask an agent to stream a file into the evidence store
+    
+    With "delta": true the newest verified acquisition of the same path is
+    the base, or "base_id" names one; the agent then sends only the blocks
+    that differ from it. Without a stored base the whole file is sent.
+    """
+    body = request.get_json(silent=True) or {}
+    path = body.get('path')
+    
+    if not path:
+        return jsonify({'error': 'path is required'}), 400
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    
+    session = Session()
+    base = None
+    if body.get('base_id'):
+        base = stored_evidence(agent_id, body['base_id'])
+        if base is None:
+            session.close()
+            return jsonify({'error': 'Base acquisition not found or not verified'}), 404
+    elif body.get('delta'):
+        base = latest_evidence(session, agent_id, path)
+    acquisition = create_acquisition(session, agent_id, path, {
+        'address': request.remote_addr,
+        'user_agent': request.headers.get('User-Agent')
+    }, base=base)
+    session.commit()
+    result = acquisition_to_dict(acquisition)
+    result['request_id'] = acquisition.request_id
+    session.close()
+    return jsonify(result), 202
+
+@app.route('/api/agents/<agent_id>/acquisitions/<acquisition_id>', methods=['GET'])
+def get_acquisition(agent_id, acquisition_id):
+    """Status, digests and chain-of-custody manifest of one acquisition"""
+    session = Session()
+    acquisition = session.query(Acquisition).filter_by(id=acquisition_id, agent_id=agent_id).first()
+    session.close()
+    if not acquisition:
+        return jsonify({'error': 'Acquisition not found'}), 404
+    result = acquisition_to_dict(acquisition)
+    result['manifest'] = load_manifest(acquisition)
+    state = active_acquisitions.get(acquisition_id)
+    if state:
+        result['bytes_received'] = state['writer'].size
+    return jsonify(result)
+
+@app.route('/api/agents/<agent_id>/acquisitions/<acquisition_id>/manifest', methods=['GET'])
+def download_acquisition_manifest(agent_id, acquisition_id):
+    """Download the manifest exactly as stored; its SHA-256 is in the acquisition record"""
+    session = Session()
+    acquisition = session.query(Acquisition).filter_by(id=acquisition_id, agent_id=agent_id).first()
+    session.close()
+    if not acquisition or not os.path.exists(acquisition.manifest_path):
+        return jsonify({'error': 'Acquisition not found'}), 404
+    return send_file(
+        os.path.abspath(acquisition.manifest_path),
+        mimetype='application/json',
+        as_attachment=True,
+        download_name=os.path.basename(acquisition.manifest_path)
+    )
+
+def stored_evidence(agent_id, acquisition_id):
+    """A verified acquisition whose evidence file is on disk, or None"""
+    session = Session()
+    acquisition = session.query(Acquisition).filter_by(id=acquisition_id, agent_id=agent_id, status='complete').first()
+    session.close()
+    if acquisition is None or not os.path.exists(acquisition.file_path):
+        return None
+    return acquisition
+
+@app.route('/api/agents/<agent_id>/acquisitions/<acquisition_id>/content', methods=['GET'])
+def download_evidence(agent_id, acquisition_id):
+    """Serve stored evidence with Range and conditional request support"""
+    acquisition = stored_evidence(agent_id, acquisition_id)
+    if acquisition is None:
+        return jsonify({'error': 'Evidence not available'}), 404
+    response = send_file(
+        os.path.abspath(acquisition.file_path),
+        mimetype='application/octet-stream',
+        as_attachment=True,
+        download_name=f'{acquisition.id}-{os.path.basename(acquisition.path)}',
+        conditional=True,
+        etag=acquisition.sha256
+    )
+    response.headers['Digest'] = 'sha-256=' + base64.b64encode(bytes.fromhex(acquisition.sha256)).decode()
+    return response
+
+@app.route('/api/agents/<agent_id>/acquisitions/<acquisition_id>/pages/<int:page>', methods=['GET'])
+def get_evidence_page(agent_id, acquisition_id, page):
+    """One page of stored evidence as raw bytes, for the hex viewer"""
+    try:
+        page_size = int(request.args.get('page_size', EVIDENCE_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'page_size must be an integer'}), 400
+    if not 0 < page_size <= MAX_EVIDENCE_PAGE_SIZE:
+        return jsonify({'error': f'page_size must be between 1 and {MAX_EVIDENCE_PAGE_SIZE}'}), 400
+    acquisition = stored_evidence(agent_id, acquisition_id)
+    if acquisition is None:
+        return jsonify({'error': 'Evidence not available'}), 404
+    
+    # Evidence never changes, so a page is identified by the file's digest and its position
+    etag = f'"{acquisition.sha256}:{page}:{page_size}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=31536000, immutable'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    offset = page * page_size
+    data, file_size = evidence_maps.read(acquisition.file_path, offset, page_size)
+    headers.update({'X-Page-Offset': str(offset), 'X-File-Size': str(file_size)})
+    return Response(data, mimetype='application/octet-stream', headers=headers)
+
+@app.route('/api/agents/<agent_id>/acquisitions/<acquisition_id>/cancel', methods=['POST'])
+def cancel_acquisition(agent_id, acquisition_id):
+    """Stop an acquisition in progress; the agent reports it as failed"""
+    if agent_id not in active_agents:
+        return jsonify({'error': 'Agent not connected'}), 404
+    session = Session()
+    acquisition = session.query(Acquisition).filter_by(id=acquisition_id, agent_id=agent_id).first()
+    session.close()
+    if not acquisition or acquisition.status not in ('requested', 'running'):
+        return jsonify({'error': 'Acquisition not in progress'}), 404
+    
+    send_command(agent_id, 'cancel_task', {'task_id': acquisition.request_id})
+    
+    return jsonify({'message': 'Cancel request sent to agent', 'acquisition_id': acquisition_id})
+
+def image_to_dict(image):
+    return {
+        'id': image.id,
+        'name': image.name,
+        'acquisition_id': image.acquisition_id,
+        'size': image.size,
+        'sha256': image.sha256,
+        'status': image.status,
+        'error': image.error,
+        'volumes': json.loads(image.volumes) if image.volumes else [],
+        'entry_count': image.entry_count,
+        'added_at': image.added_at.isoformat() if image.added_at else None,
+        'indexed_at': image.indexed_at.isoformat() if image.indexed_at else None,
+    }
+
+def is_image(agent_id):
+    """Whether an agent id is the virtual agent of a disk image"""
+    if agent_id in open_images:
+        return True
+    session = Session()
+    found = session.query(Image.id).filter_by(id=agent_id).first() is not None
+    session.close()
+    return found
+
+def load_image(image_id):
+    """The open DiskImage of an image, mapping it on first use"""
+    disk = open_images.get(image_id)
+    if disk is None:
+        session = Session()
+        image = session.query(Image).filter_by(id=image_id).first()
+        session.close()
+        if image is None:
+            raise DiskImageError('Image not found')
+        disk = open_images[image_id] = DiskImage(image.file_path)
+    return disk
+
+def image_md5(disk, path):
+    """MD5 of a file on an image, yielding to other greenthreads after every block"""
+    md5_hash = hashlib.md5()
+    for block in disk.iter_file(path, IMAGE_HASH_BLOCK_SIZE):
+        md5_hash.update(block)
+        socketio.sleep(0)
+    return md5_hash.hexdigest()
+
+def run_image_command(image_id, command, data):
+    """Answer a command for a disk image with the same replies an agent sends"""
+    path = data.get('path', '/')
+    reply = {'agent_id': image_id, 'request_id': data['request_id'], 'path': path}
+    try:
+        disk = load_image(image_id)
+        if command == 'list_directory':
+            entries = disk.list(path)
+            page_size = min(int(data.get('page_size') or IMAGE_LIST_PAGE_SIZE), IMAGE_LIST_PAGE_SIZE)
+            for offset in range(0, max(len(entries), 1), page_size):
+                relay_reply('filesystem_list_response', dict(
+                    reply,
+                    entries=entries[offset:offset + page_size],
+                    offset=offset,
+                    total=len(entries),
+                    done=offset + page_size >= len(entries)
+                ))
+                socketio.sleep(0)
+        elif command == 'read_file':
+            chunk_number = data.get('chunk_number', 0)
+            reply['chunk_number'] = chunk_number
+            chunk, file_size = disk.read_file(path, chunk_number * IMAGE_READ_CHUNK_SIZE, IMAGE_READ_CHUNK_SIZE)
+            relay_reply('file_content_response', dict(
+                reply,
+                hex_data=chunk.hex(),
+                size=len(chunk),
+                file_size=file_size,
+                offset=chunk_number * IMAGE_READ_CHUNK_SIZE
+            ))
+        elif command == 'get_metadata':
+            metadata = disk.metadata(path)
+            if not metadata['is_directory'] and metadata.get('recoverable', True) and metadata['size'] < IMAGE_HASH_MAX_SIZE:
+                metadata['md5'] = image_md5(disk, path)
+            relay_reply('file_metadata_response', dict(reply, metadata=metadata))
+        elif command == 'index_tree':
+            index_image(image_id, path, include_hash=data.get('hash', False))
+    except (DiskImageError, OSError) as e:
+        event = {
+            'list_directory': 'filesystem_list_response',
+            'read_file': 'file_content_response',
+            'get_metadata': 'file_metadata_response',
+        }.get(command)
+        if event == 'filesystem_list_response':
+            reply.update({'entries': [], 'offset': 0, 'total': 0, 'done': True})
+        if event:
+            relay_reply(event, dict(reply, error=str(e)))
+        else:
+            logger.warning('Image command failed', extra={'image_id': image_id, 'command': command, 'error': str(e)})
+
+def index_image(image_id, root='/', include_hash=False):
+    """Walk a disk image into filesystem_entries, as an agent's index_tree sweep does"""
+    session = Session()
+    entry_count = 0
+    error = None
+    try:
+        disk = load_image(image_id)
+        # Drop whatever was indexed under root before, as for an agent's first batch
+        path_filter(session.query(FileSystemEntry).filter_by(agent_id=image_id), root).delete(synchronize_session=False)
+        # Not left open while hashing yields, which would lock agents out of the index
+        session.commit()
+        batch = []
+        for entry in disk.walk(root):
+            if include_hash and not entry['is_directory'] and entry.get('recoverable', True) and entry['size'] < IMAGE_HASH_MAX_SIZE:
+                try:
+                    entry['md5'] = image_md5(disk, entry['path'])
+                except (DiskImageError, OSError) as e:
+                    entry['error'] = str(e)
+                socketio.sleep(0)
+            batch.append(entry)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                upsert_entries(session, image_id, batch)
+                session.commit()
+                entry_count += len(batch)
+                batch = []
+                socketio.sleep(0)
+        upsert_entries(session, image_id, batch)
+        entry_count += len(batch)
+        session.commit()
+    except (DiskImageError, OSError) as e:
+        session.rollback()
+        error = str(e)
+    
+    if root == '/':
+        image = session.query(Image).filter_by(id=image_id).first()
+        if image is not None:
+            image.status = 'failed' if error else 'ready'
+            image.error = error
+            image.entry_count = entry_count
+            image.indexed_at = datetime.now()
+            session.commit()
+    session.close()
+    
+    socketio.emit('index_complete', {'agent_id': image_id, 'root': root, 'entry_count': entry_count, 'error': error})
+    logger.info('Image index complete', extra={'image_id': image_id, 'root': root, 'entry_count': entry_count, 'error': error})
+
+@app.route('/api/images', methods=['GET'])
+def list_images():
+    """List disk images analysed on the server, newest first"""
+    session = Session()
+    images = session.query(Image).order_by(Image.added_at.desc()).all()
+    result = [image_to_dict(i) for i in images]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/images', methods=['POST'])
+def add_image():
+    """Open a raw disk image and serve it as a virtual agent
+
+    The image is either verified evidence (``acquisition_id``) or a file
+    under IMAGE_DIR (``path``). Its files are listed and read through the
+    usual agent endpoints using the returned id, and the whole image is
+    indexed into filesystem_entries in the background.
+    """
+    body = request.get_json(silent=True) or {}
+    session = Session()
+    acquisition = None
+    if body.get('acquisition_id'):
+        acquisition = session.query(Acquisition).filter_by(id=body['acquisition_id'], status='complete').first()
+        if acquisition is None or not os.path.exists(acquisition.file_path):
+            session.close()
+            return jsonify({'error': 'Evidence not available'}), 404
+        file_path = acquisition.file_path
+        name = body.get('name') or os.path.basename(acquisition.path.replace('\\', '/'))
+    elif body.get('path'):
+        image_dir = os.path.realpath(IMAGE_DIR)
+        file_path = os.path.realpath(os.path.join(image_dir, body['path']))
+        if os.path.commonpath([image_dir, file_path]) != image_dir or not os.path.isfile(file_path):
+            session.close()
+            return jsonify({'error': f'No such image under {IMAGE_DIR}'}), 404
+        name = body.get('name') or os.path.basename(file_path)
+    else:
+        session.close()
+        return jsonify({'error': 'acquisition_id or path required'}), 400
+    
+    image_id = str(uuid.uuid4())
+    try:
+        disk = DiskImage(file_path)
+    except (DiskImageError, OSError) as e:
+        session.close()
+        return jsonify({'error': str(e)}), 400
+    open_images[image_id] = disk
+    
+    now = datetime.now()
+    image = Image(
+        id=image_id,
+        name=name,
+        file_path=file_path,
+        acquisition_id=acquisition.id if acquisition else None,
+        size=disk.size,
+        sha256=acquisition.sha256 if acquisition else None,
+        status='indexing',
+        volumes=json.dumps(disk.volume_info()),
+        added_at=now
+    )
+    agent = Agent(
+        id=image_id,
+        hostname=name,
+        computer_name=name,
+        platform=IMAGE_PLATFORM,
+        ip_addresses=json.dumps([]),
+        registered_at=now,
+        last_seen=now,
+        status='image'
+    )
+    session.add_all([image, agent])
+    session.commit()
+    agent_changed(agent)
+    result = image_to_dict(image)
+    session.close()
+    
+    socketio.start_background_task(index_image, image_id)
+    logger.info('Disk image added', extra={'image_id': image_id, 'image_name': name, 'volumes': len(disk.volumes)})
+    return jsonify(result), 201
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """Status, volumes and index progress of one disk image"""
+    session = Session()
+    image = session.query(Image).filter_by(id=image_id).first()
+    result = image_to_dict(image) if image else None
+    session.close()
+    if result is None:
+        return jsonify({'error': 'Image not found'}), 404
+    return jsonify(result)
+
+def job_to_dict(job, counts):
+    return {
+        'id': job.id,
+        'name': job.name,
+        'command': job.command,
+        'params': json.loads(job.params) if job.params else {},
+        'selector': json.loads(job.selector) if job.selector else {},
+        'schedule_id': job.schedule_id,
+        'status': job.status,
+        'max_attempts': job.max_attempts,
+        'timeout': job.timeout,
+        'spread': job.spread,
+        'run_count': job.run_count,
+        'runs': counts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+def job_run_to_dict(run):
+    progress = job_progress.get(run.id) if run.status == 'running' else None
+    return {
+        'id': run.id,
+        'job_id': run.job_id,
+        'agent_id': run.agent_id,
+        'status': run.status,
+        'attempts': run.attempts,
+        'not_before': run.not_before.isoformat() if run.not_before else None,
+        'started_at': run.started_at.isoformat() if run.started_at else None,
+        'finished_at': run.finished_at.isoformat() if run.finished_at else None,
+        'request_id': run.request_id,
+        'acquisition_id': run.acquisition_id,
+        'progress': progress or (json.loads(run.progress) if run.progress else None),
+        'result': json.loads(run.result) if run.result else None,
+        'has_result_file': bool(run.result_path),
+        'error': run.error,
+    }
+
+def schedule_to_dict(schedule):
+    return {
+        'id': schedule.id,
+        'name': schedule.name,
+        'command': schedule.command,
+        'params': json.loads(schedule.params) if schedule.params else {},
+        'selector': json.loads(schedule.selector) if schedule.selector else {},
+        'max_attempts': schedule.max_attempts,
+        'timeout': schedule.timeout,
+        'spread': schedule.spread,
+        'interval': schedule.interval,
+        'enabled': bool(schedule.enabled),
+        'created_at': schedule.created_at.isoformat() if schedule.created_at else None,
+        'next_run_at': schedule.next_run_at.isoformat() if schedule.next_run_at else None,
+        'last_run_at': schedule.last_run_at.isoformat() if schedule.last_run_at else None,
+        'last_job_id': schedule.last_job_id,
+    }
+
+def job_run_counts(session, job_ids):
+    """Runs in each status of each job, by job id"""
+    counts = {job_id: dict.fromkeys(RUN_STATUSES, 0) for job_id in job_ids}
+    for job_id, status, count in session.query(JobRun.job_id, JobRun.status, func.count()).filter(
+        JobRun.job_id.in_(job_ids)
+    ).group_by(JobRun.job_id, JobRun.status):
+        counts[job_id][status] = count
+    return counts
+
+def job_result_path(job_id, run_id):
+    return os.path.join(JOB_RESULT_DIR, job_id, f'{run_id}.jsonl')
+
+def queue_job(session, settings, schedule_id=None):
+    """Record a job and a pending run for each agent its selector matches; the caller commits"""
+    now = datetime.now()
+    selector = settings['selector']
+    # Disk images are analysed on the server and never connect, so jobs are for live agents only
+    conditions = agent_conditions(selector) + [Agent.status != 'image']
+    if 'agent_ids' in selector:
+        conditions.append(Agent.id.in_(selector['agent_ids']))
+    agent_ids = session.execute(select(Agent.id).where(*conditions)).scalars().all()
+    job = Job(
+        id=str(uuid.uuid4()),
+        name=settings['name'],
+        command=settings['command'],
+        params=json.dumps(settings['params']),
+        selector=json.dumps(selector),
+        schedule_id=schedule_id,
+        status='queued' if agent_ids else 'complete',
+        max_attempts=settings['max_attempts'],
+        timeout=settings['timeout'],
+        spread=settings['spread'],
+        run_count=len(agent_ids),
+        created_at=now,
+        finished_at=None if agent_ids else now
+    )
+    session.add(job)
+    if agent_ids:
+        session.execute(insert(JobRun), [{
+            'id': str(uuid.uuid4()),
+            'job_id': job.id,
+            'agent_id': agent_id,
+            'status': 'pending',
+            'attempts': 0,
+            'not_before': now + spread_offset(agent_id, settings['spread'])
+        } for agent_id in agent_ids])
+    changed_jobs.add(job.id)
+    logger.info('Job queued', extra={'job_id': job.id, 'command': job.command, 'runs': len(agent_ids), 'schedule_id': schedule_id})
+    return job
+
+def start_job_run(session, job, run):
+    """Send the next attempt of a run to its (connected) agent"""
+    params = json.loads(job.params)
+    # A retry starts its items afresh
+    path = job_result_path(job.id, run.id)
+    if os.path.exists(path):
+        os.remove(path)
+    run.result_path = None
+    run.attempts += 1
+    run.status = 'running'
+    run.started_at = datetime.now()
+    run.error = None
+    if job.command == 'acquire_file':
+        base = latest_evidence(session, run.agent_id, params['path']) if params.get('delta') else None
+        acquisition = create_acquisition(session, run.agent_id, params['path'], {'job_id': job.id, 'job_run_id': run.id}, base=base)
+        run.acquisition_id = acquisition.id
+    else:
+        run.request_id = send_command(run.agent_id, job.command, dict(params))
+        job_requests[run.request_id] = (run.id, job.id, job.command)
+        job_progress[run.id] = {'replies': 0, 'items': 0}
+    if job.status == 'queued':
+        job.status = 'running'
+    changed_jobs.add(job.id)
+    JOB_RUNS_STARTED.inc(command=job.command)
+    logger.info('Job run started', extra={
+        'job_id': job.id, 'agent_id': run.agent_id, 'attempt': run.attempts, 'correlation_id': run.request_id
+    })
+
+def stop_job_run(session, run):
+    """Detach a run from its current attempt, cancelling the command if the agent is connected"""
+    if run.acquisition_id:
+        acquisition = session.query(Acquisition).filter_by(id=run.acquisition_id).first()
+        run.acquisition_id = None
+        if acquisition is not None and acquisition.status in ('requested', 'running'):
+            if run.agent_id in active_agents and acquisition.request_id:
+                send_command(run.agent_id, 'cancel_task', {'task_id': acquisition.request_id})
+            fail_acquisition(session, acquisition, 'Stopped by its job')
+    elif run.request_id:
+        job_requests.pop(run.request_id, None)
+        if run.agent_id in active_agents:
+            send_command(run.agent_id, 'cancel_task', {'task_id': run.request_id})
+    run.request_id = None
+
+def settle_job(session, job):
+    """Mark a job finished once none of its runs are pending or running"""
+    if job.status in FINISHED_JOB_STATUSES:
+        return
+    session.flush()
+    counts = job_run_counts(session, [job.id])[job.id]
+    if counts['pending'] or counts['running']:
+        return
+    job.status = 'failed' if counts['failed'] else 'complete'
+    job.finished_at = datetime.now()
+    logger.info('Job finished', extra={'job_id': job.id, 'status': job.status, 'failed': counts['failed']})
+
+def finish_job_run(session, job, run, status, result=None, error=None):
+    """Record a run's outcome and, after the last run, the job's; the caller commits"""
+    progress = job_progress.pop(run.id, None)
+    if progress is not None:
+        run.progress = json.dumps(progress)
+    path = job_result_path(job.id, run.id)
+    run.result_path = path if os.path.exists(path) else None
+    run.status = status
+    run.finished_at = datetime.now()
+    run.result = json.dumps(result) if result is not None else None
+    run.error = error
+    JOB_RUNS_FINISHED.inc(command=job.command, status=status)
+    changed_jobs.add(job.id)
+    settle_job(session, job)
+
+def retry_job_run(session, job, run, error, backoff=True):
+    """Queue a failed attempt again after a backoff, or fail the run once its attempts are used up"""
+    if run.request_id:
+        job_requests.pop(run.request_id, None)
+    if run.attempts >= job.max_attempts:
+        finish_job_run(session, job, run, 'failed', error=error)
+        logger.warning('Job run failed', extra={'job_id': job.id, 'agent_id': run.agent_id, 'attempts': run.attempts, 'error': error})
+        return
+    job_progress.pop(run.id, None)
+    JOB_RUNS_FINISHED.inc(command=job.command, status='retried')
+    run.status = 'pending'
+    run.request_id = None
+    run.acquisition_id = None
+    run.error = error
+    run.not_before = datetime.now() + (retry_delay(run.attempts) if backoff else timedelta(0))
+    changed_jobs.add(job.id)
+    logger.warning('Job run will be retried', extra={
+        'job_id': job.id, 'agent_id': run.agent_id, 'attempts': run.attempts, 'error': error,
+        'not_before': run.not_before.isoformat() if run.not_before else None
+    })
+
+def record_job_reply(data):
+    """Count an agent reply towards the job run it answers, finishing the run on the last one
+
+    Returns False for replies to commands no job sent.
+    """
+    request_id = data.get('request_id') or data.get('task_id')
+    outstanding = job_requests.get(request_id)
+    if outstanding is None:
+        return False
+    run_id, job_id, command = outstanding
+    spec = JOB_COMMANDS[command]
+    progress = job_progress.setdefault(run_id, {'replies': 0, 'items': 0})
+    progress['replies'] += 1
+    items = (data.get(spec.items) or []) if spec.items else []
+    progress['items'] += len(items)
+    if spec.store and items:
+        path = job_result_path(job_id, run_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            f.writelines(json.dumps(item) + '\n' for item in items)
+    if spec.streamed and not data.get('done'):
+        return True
+    
+    del job_requests[request_id]
+    session = Session()
+    run = session.query(JobRun).filter_by(id=run_id).first()
+    job = session.query(Job).filter_by(id=job_id).first()
+    if run is not None and job is not None and run.status == 'running':
+        if data.get('error'):
+            retry_job_run(session, job, run, data['error'])
+        else:
+            finish_job_run(session, job, run, 'complete', result=reply_summary(spec, data))
+        session.commit()
+    session.close()
+    return True
+
+def finish_job_acquisition(session, acquisition):
+    """Complete or retry the job run an acquisition was started for, if any"""
+    run = session.query(JobRun).filter_by(acquisition_id=acquisition.id, status='running').first()
+    if run is None:
+        return
+    job = session.query(Job).filter_by(id=run.job_id).first()
+    if acquisition.status == 'complete':
+        finish_job_run(session, job, run, 'complete', result={
+            'acquisition_id': acquisition.id,
+            'size': acquisition.size,
+            'sha256': acquisition.sha256,
+            'md5': acquisition.md5
+        })
+    else:
+        retry_job_run(session, job, run, acquisition.error or f'Acquisition {acquisition.status}')
+    session.commit()
+
+def interrupt_job_runs(session, agent_id):
+    """Queue again the running runs of an agent that lost its connection
+
+    Replies sent while the agent was away are lost, so the attempt is
+    started over. Index walks and acquisitions are left alone: the agent
+    resumes a walk from its checkpoint and the server resumes acquisitions.
+    """
+    for run, job in session.query(JobRun, Job).join(Job, Job.id == JobRun.job_id).filter(
+        JobRun.agent_id == agent_id, JobRun.status == 'running'
+    ).all():
+        if job.command == 'acquire_file' or JOB_COMMANDS[job.command].resumes:
+            continue
+        stop_job_run(session, run)
+        retry_job_run(session, job, run, 'Interrupted by agent disconnect', backoff=False)
+    session.commit()
+
+def cancel_job_runs(session, job):
+    """Cancel a job's pending runs and stop its running ones; the caller commits"""
+    job.status = 'cancelled'
+    job.finished_at = datetime.now()
+    for run in session.query(JobRun).filter(JobRun.job_id == job.id, JobRun.status.in_(('pending', 'running'))).all():
+        if run.status == 'running':
+            stop_job_run(session, run)
+        finish_job_run(session, job, run, 'cancelled', error='Job cancelled')
+
+def start_due_schedules(session):
+    """Queue a job for each schedule that is due, unless its previous job is still going"""
+    now = datetime.now()
+    for schedule in session.query(JobSchedule).filter(JobSchedule.enabled == 1, JobSchedule.next_run_at <= now).all():
+        schedule.next_run_at = next_run_time(schedule.next_run_at, schedule.interval, now)
+        previous = session.query(Job).filter_by(id=schedule.last_job_id).first() if schedule.last_job_id else None
+        if previous is not None and previous.status not in FINISHED_JOB_STATUSES:
+            logger.warning('Skipping scheduled job: the previous one is still running', extra={
+                'schedule_id': schedule.id, 'job_id': previous.id
+            })
+            continue
+        job = queue_job(session, {
+            'name': schedule.name,
+            'command': schedule.command,
+            'params': json.loads(schedule.params),
+            'selector': json.loads(schedule.selector),
+            'max_attempts': schedule.max_attempts,
+            'timeout': schedule.timeout,
+            'spread': schedule.spread
+        }, schedule_id=schedule.id)
+        schedule.last_run_at = now
+        schedule.last_job_id = job.id
+    session.commit()
+
+def expire_job_runs(session):
+    """Stop and retry runs that have been running longer than their job's timeout"""
+    now = datetime.now()
+    for run, job in session.query(JobRun, Job).join(Job, Job.id == JobRun.job_id).filter(JobRun.status == 'running').all():
+        if run.started_at + timedelta(seconds=job.timeout) > now:
+            continue
+        stop_job_run(session, run)
+        retry_job_run(session, job, run, f'Timed out after {job.timeout} seconds')
+    session.commit()
+
+def dispatch_job_runs(session):
+    """Start pending runs of connected agents, longest due first, within the per-agent and global limits"""
+    running = dict(session.query(JobRun.agent_id, func.count()).filter(JobRun.status == 'running').group_by(JobRun.agent_id).all())
+    available = JOB_MAX_RUNNING - sum(running.values())
+    if available <= 0 or not active_agents:
+        return
+    # At most JOB_MAX_RUNNING agents are busy, so their ids make a short list
+    busy = [agent_id for agent_id, count in running.items() if count >= JOB_AGENT_CONCURRENCY]
+    # Walked in (status, not_before) index order, so runs of offline agents are passed over rather than sorted
+    query = session.query(JobRun, Job).join(Job, Job.id == JobRun.job_id).join(Agent, Agent.id == JobRun.agent_id).filter(
+        JobRun.status == 'pending',
+        JobRun.not_before <= datetime.now(),
+        Agent.status == 'active'
+    )
+    if busy:
+        query = query.filter(JobRun.agent_id.notin_(busy))
+    candidates = query.order_by(JobRun.not_before).limit(JOB_DISPATCH_BATCH).all()
+    for run, job in candidates:
+        if running.get(run.agent_id, 0) >= JOB_AGENT_CONCURRENCY or run.agent_id not in active_agents:
+            continue
+        start_job_run(session, job, run)
+        # Committed one at a time, so a reply is never matched to a run still pending in the database
+        session.commit()
+        running[run.agent_id] = running.get(run.agent_id, 0) + 1
+        available -= 1
+        if available == 0:
+            break
+
+def push_job_changes(session):
+    """Send analysts the jobs changed since the last pass as one jobs_changed message"""
+    if not changed_jobs:
+        return
+    job_ids = list(changed_jobs)
+    changed_jobs.clear()
+    counts = job_run_counts(session, job_ids)
+    jobs = session.query(Job).filter(Job.id.in_(job_ids)).all()
+    relay.notify('jobs_changed', {'jobs': [job_to_dict(job, counts[job.id]) for job in jobs]})
+
+def run_job_dispatcher():
+    """Queue due schedules, retry timed-out runs and dispatch pending ones, every JOB_DISPATCH_INTERVAL"""
+    while True:
+        session = Session()
+        try:
+            start_due_schedules(session)
+            expire_job_runs(session)
+            dispatch_job_runs(session)
+            push_job_changes(session)
+        except Exception:
+            session.rollback()
+            logger.exception('Job dispatch pass failed')
+        finally:
+            session.close()
+        socketio.sleep(JOB_DISPATCH_INTERVAL)
+
+def ensure_job_dispatcher():
+    """Start the dispatcher on first use, picking up the commands of runs left running by a previous server"""
+    global job_dispatcher_task
+    if job_dispatcher_task is not None:
+        return
+    session = Session()
+    for run, command in session.query(JobRun, Job.command).join(Job, Job.id == JobRun.job_id).filter(
+        JobRun.status == 'running', JobRun.request_id.isnot(None)
+    ).all():
+        job_requests.setdefault(run.request_id, (run.id, run.job_id, command))
+    session.close()
+    job_dispatcher_task = socketio.start_background_task(run_job_dispatcher)
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List jobs, newest first, optionally by status or schedule"""
+    try:
+        limit = min(max(int(request.args.get('limit', JOB_LIST_DEFAULT_LIMIT)), 1), JOB_LIST_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    session = Session()
+    query = session.query(Job)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    if request.args.get('schedule_id'):
+        query = query.filter_by(schedule_id=request.args['schedule_id'])
+    jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+    counts = job_run_counts(session, [job.id for job in jobs])
+    result = [job_to_dict(job, counts[job.id]) for job in jobs]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a command for every agent a selector matches; each run starts once its agent is connected
+
+    Body: command, params (the command's fields), selector (agent_ids and/or
+    the agent list's status, platform, domain and name filters; empty for
+    every agent), and optionally name, max_attempts, timeout (seconds per
+    attempt) and spread (seconds over which the runs' start is spread).
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        settings = parse_job(body, METADATA_BATCH_MAX_PATHS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    session = Session()
+    job = queue_job(session, settings)
+    session.commit()
+    result = job_to_dict(job, job_run_counts(session, [job.id])[job.id])
+    session.close()
+    ensure_job_dispatcher()
+    return jsonify(result), 201
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """A job with a page of its runs, optionally by run status"""
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+    session = Session()
+    job = session.query(Job).filter_by(id=job_id).first()
+    if not job:
+        session.close()
+        return jsonify({'error': 'Job not found'}), 404
+    runs = session.query(JobRun).filter_by(job_id=job_id)
+    if request.args.get('status'):
+        runs = runs.filter_by(status=request.args['status'])
+    result = job_to_dict(job, job_run_counts(session, [job_id])[job_id])
+    result['run_list'] = [job_run_to_dict(run) for run in runs.order_by(JobRun.agent_id).offset(offset).limit(JOB_RUNS_PAGE_SIZE)]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a job's pending runs and stop those in progress"""
+    session = Session()
+    job = session.query(Job).filter_by(id=job_id).first()
+    if not job or job.status in FINISHED_JOB_STATUSES:
+        session.close()
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    cancel_job_runs(session, job)
+    session.commit()
+    result = job_to_dict(job, job_run_counts(session, [job_id])[job_id])
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/jobs/<job_id>/runs/<run_id>/result', methods=['GET'])
+def download_job_result(job_id, run_id):
+    """Download the items a run streamed back (metadata results, strings...), one JSON document per line"""
+    session = Session()
+    run = session.query(JobRun).filter_by(id=run_id, job_id=job_id).first()
+    session.close()
+    if not run or not run.result_path or not os.path.exists(run.result_path):
+        return jsonify({'error': 'Result not available'}), 404
+    return send_file(
+        os.path.abspath(run.result_path),
+        mimetype='application/x-ndjson',
+        as_attachment=True,
+        download_name=f'{run.agent_id}.jsonl'
+    )
+
+@app.route('/api/schedules', methods=['GET'])
+def list_schedules():
+    """List recurring job schedules"""
+    session = Session()
+    result = [schedule_to_dict(s) for s in session.query(JobSchedule).order_by(JobSchedule.created_at)]
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/schedules', methods=['POST'])
+def create_schedule():
+    """Queue a job every interval seconds, from start (an ISO timestamp) or now
+
+    Takes the same fields as POST /api/jobs plus interval and start. The
+    selector is resolved again for each job, so new agents are included.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        settings = parse_schedule(body, METADATA_BATCH_MAX_PATHS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    start = datetime.now()
+    if body.get('start'):
+        start = parse_timestamp(body['start'])
+        if start is None:
+            return jsonify({'error': 'start must be an ISO timestamp'}), 400
+    
+    session = Session()
+    schedule = JobSchedule(
+        id=str(uuid.uuid4()),
+        name=settings['name'],
+        command=settings['command'],
+        params=json.dumps(settings['params']),
+        selector=json.dumps(settings['selector']),
+        max_attempts=settings['max_attempts'],
+        timeout=settings['timeout'],
+        spread=settings['spread'],
+        interval=settings['interval'],
+        enabled=1,
+        created_at=datetime.now(),
+        next_run_at=start
+    )
+    session.add(schedule)
+    session.commit()
+    result = schedule_to_dict(schedule)
+    session.close()
+    ensure_job_dispatcher()
+    return jsonify(result), 201
+
+@app.route('/api/schedules/<schedule_id>', methods=['PATCH'])
+def update_schedule(schedule_id):
+    """Enable or disable a schedule"""
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body.get('enabled'), bool):
+        return jsonify({'error': 'enabled must be true or false'}), 400
+    session = Session()
+    schedule = session.query(JobSchedule).filter_by(id=schedule_id).first()
+    if not schedule:
+        session.close()
+        return jsonify({'error': 'Schedule not found'}), 404
+    schedule.enabled = int(body['enabled'])
+    if body['enabled'] and schedule.next_run_at < datetime.now():
+        schedule.next_run_at = next_run_time(schedule.next_run_at, schedule.interval, datetime.now())
+    session.commit()
+    result = schedule_to_dict(schedule)
+    session.close()
+    return jsonify(result)
+
+@app.route('/api/schedules/<schedule_id>', methods=['DELETE'])
+def delete_schedule(schedule_id):
+    """Delete a schedule; jobs it already queued are kept"""
+    session = Session()
+    deleted = session.query(JobSchedule).filter_by(id=schedule_id).delete()
+    session.commit()
+    session.close()
+    if not deleted:
+        return jsonify({'error': 'Schedule not found'}), 404
+    return jsonify({'message': 'Schedule deleted', 'schedule_id': schedule_id})
 
 @socketio.on('connect')
 def handle_connect():
     """Handle agent connection"""
-    print('Client connected')
+    # Every client is treated as an analyst until it registers as an agent
+    relay.add_client(request.sid)
+    logger.info('Client connected', extra={'sid': request.sid})
 
 @socketio.on('agent_register')
+@instrumented('agent_register')
 def handle_agent_register(data):
     """Handle agent registration"""
     session = Session()
@@ -164,16 +2267,51 @@ def handle_agent_register(data):
         agent.ip_addresses = ip_addresses_json
     
     session.commit()
+    agent_changed(agent)
     session.close()
     
     active_agents[agent_id] = request.sid
+    relay.remove_client(request.sid)
     join_room(agent_id)
     emit('registration_success', {'agent_id': agent_id})
     
+    session = Session()
+    resume_acquisitions(session, agent_id)
+    # Runs still marked running were cut off by a server restart
+    interrupt_job_runs(session, agent_id)
+    session.close()
+    ensure_job_dispatcher()
+    
     display_name = f"{domain_name}\\{computer_name}" if domain_name else computer_name
-    print(f'Agent registered: {agent_id} ({display_name}) - {ip_address}')
+    logger.info('Agent registered', extra={'agent_id': agent_id, 'display_name': display_name, 'ip_address': ip_address})
+
+@socketio.on('agent_update')
+@instrumented('agent_update')
+def handle_agent_update(data):
+    """Handle host identity gathered by the agent after it registered"""
+    session = Session()
+    agent = session.query(Agent).filter_by(id=data.get('agent_id')).first()
+    if not agent:
+        session.close()
+        return
+    
+    ip_addresses = [ip for ip in data.get('ip_addresses', []) if ip and ip != 'Unknown']
+    if ip_addresses:
+        agent.ip_address = ip_addresses[0]
+        agent.ip_addresses = json.dumps(ip_addresses)
+    if data.get('hostname'):
+        agent.hostname = data['hostname']
+    if data.get('computer_name'):
+        agent.computer_name = data['computer_name']
+    if 'domain_name' in data:
+        agent.domain_name = data['domain_name']
+    agent.last_seen = datetime.now()
+    session.commit()
+    agent_changed(agent)
+    session.close()
 
 @socketio.on('agent_disconnect')
+@instrumented('agent_disconnect')
 def handle_agent_disconnect():
     """Handle agent disconnection"""
     # Find and update agent status
@@ -185,35 +2323,421 @@ def handle_agent_disconnect():
                 agent.status = 'offline'
                 agent.last_seen = datetime.now()
                 session.commit()
+                agent_changed(agent)
             del active_agents[agent_id]
+            agent_status.pop(agent_id, None)
+            admission.forget(agent_id)
+            interrupt_job_runs(session, agent_id)
             break
     session.close()
 
 @socketio.on('filesystem_list')
+@instrumented('filesystem_list')
 def handle_filesystem_list(data):
     """Handle file system listing response from agent"""
-    socketio.emit('filesystem_list_response', data, broadcast=True)
-    print(f'Received filesystem listing: {data.get("path")}')
+    relay_reply('filesystem_list_response', data)
+    logger.debug('Received filesystem listing', extra={'sample': 'filesystem_list', 'path': data.get('path')})
 
 @socketio.on('file_content')
+@instrumented('file_content')
 def handle_file_content(data):
     """Handle file content response from agent"""
-    socketio.emit('file_content_response', data, broadcast=True)
-    print(f'Received file content: {data.get("path")}')
+    relay_reply('file_content_response', data)
+    logger.debug('Received file content', extra={'sample': 'file_content', 'path': data.get('path')})
 
 @socketio.on('file_metadata')
+@instrumented('file_metadata')
 def handle_file_metadata(data):
     """Handle file metadata response from agent"""
-    socketio.emit('file_metadata_response', data, broadcast=True)
-    print(f'Received file metadata: {data.get("path")}')
+    if record_job_reply(data):
+        return
+    relay_reply('file_metadata_response', data)
+    logger.debug('Received file metadata', extra={'sample': 'file_metadata', 'path': data.get('path')})
+
+@socketio.on('file_metadata_batch')
+@instrumented('file_metadata_batch')
+def handle_file_metadata_batch(data):
+    """Handle a streamed part of a metadata batch from agent"""
+    if record_job_reply(data):
+        return
+    relay_reply('file_metadata_batch_response', data)
+    logger.debug('Received metadata batch', extra={
+        'sample': 'file_metadata_batch', 'results': len(data.get('results', [])), 'done': data.get('done')
+    })
+
+@socketio.on('file_analysis')
+@instrumented('file_analysis')
+def handle_file_analysis(data):
+    """Handle a streamed part of a file's entropy map from agent"""
+    if record_job_reply(data):
+        return
+    relay_reply('file_analysis_response', data)
+    logger.debug('Received file analysis', extra={'sample': 'file_analysis', 'path': data.get('path'), 'done': data.get('done')})
+
+@socketio.on('file_strings')
+@instrumented('file_strings')
+def handle_file_strings(data):
+    """Handle a streamed part of a file's strings from agent"""
+    if record_job_reply(data):
+        return
+    relay_reply('file_strings_response', data)
+    logger.debug('Received file strings', extra={
+        'sample': 'file_strings', 'strings': len(data.get('strings', [])), 'done': data.get('done')
+    })
+
+@socketio.on('agent_status')
+@instrumented('agent_status')
+def handle_agent_status(data):
+    """Handle queue depth report from agent"""
+    agent_id = data.get('agent_id')
+    agent_status[agent_id] = {
+        'queue': data.get('queue'),
+        'tasks': data.get('tasks', []),
+        'reported_at': datetime.now().isoformat()
+    }
+    socketio.emit('agent_status_response', data)
+
+@socketio.on('watch_started')
+@instrumented('watch_started')
+def handle_watch_started(data):
+    """Handle watch start acknowledgement from agent"""
+    socketio.emit('watch_started_response', data)
+
+@socketio.on('watch_stopped')
+@instrumented('watch_stopped')
+def handle_watch_stopped(data):
+    """Handle watch stop acknowledgement from agent"""
+    socketio.emit('watch_stopped_response', data)
+
+@socketio.on('watch_events')
+@instrumented('watch_events')
+def handle_watch_events(data):
+    """Handle coalesced change events from an agent watch"""
+    agent_id = data.get('agent_id')
+    root = data.get('root', '/')
+    if data.get('index'):
+        session = Session()
+        rescan = apply_watch_events(session, agent_id, root, data.get('events', []))
+        session.commit()
+        session.close()
+        # Events were dropped under load; rewalk only the affected subtree
+        for path in rescan:
+            send_command(agent_id, 'index_tree', {'path': path})
+    socketio.emit('watch_events_response', data)
+
+@socketio.on('profile_started')
+@instrumented('profile_started')
+def handle_profile_started(data):
+    """Handle profile start acknowledgement from agent"""
+    session = Session()
+    profile = session.query(Profile).filter_by(id=data.get('profile_id'), agent_id=data.get('agent_id')).first()
+    if profile is not None and profile.status == 'requested':
+        if data.get('error'):
+            profile.status = 'failed'
+            profile.error = data['error']
+            profile.finished_at = datetime.now()
+        else:
+            profile.status = 'running'
+        session.commit()
+    session.close()
+    socketio.emit('profile_started_response', data)
+
+@socketio.on('profile_stopped')
+@instrumented('profile_stopped')
+def handle_profile_stopped(data):
+    """Handle profile stop acknowledgement from agent"""
+    socketio.emit('profile_stopped_response', data)
+
+@socketio.on('profile_result')
+@instrumented('profile_result')
+def handle_profile_result(data):
+    """Store one uploaded part of a profile; the last part completes it"""
+    agent_id = data.get('agent_id')
+    session = Session()
+    # Only profiles this server requested are accepted, so ids never come from the agent alone
+    profile = session.query(Profile).filter_by(id=data.get('profile_id'), agent_id=agent_id).first()
+    if profile is None or profile.status in ('complete', 'failed'):
+        session.close()
+        logger.warning('Ignoring result for unknown or finished profile', extra={'profile_id': data.get('profile_id')})
+        return
+    
+    part = data.get('part', 0)
+    parts = data.get('parts', 1)
+    if part == 0:
+        os.makedirs(os.path.join(PROFILE_DIR, agent_id), exist_ok=True)
+        profile.file_path = os.path.join(PROFILE_DIR, agent_id, f'{profile.id}.part')
+        session.commit()
+    elif not profile.file_path:
+        session.close()
+        logger.warning('Ignoring profile part without its first part', extra={'profile_id': profile.id, 'part': part})
+        return
+    with open(profile.file_path, 'wb' if part == 0 else 'ab') as f:
+        f.write(data.get('data') or b'')
+    
+    if part == parts - 1:
+        profile.finished_at = datetime.now()
+        profile.summary = json.dumps(data.get('summary')) if data.get('summary') else None
+        if data.get('error'):
+            os.remove(profile.file_path)
+            profile.status = 'failed'
+            profile.error = data['error']
+            profile.file_path = None
+        else:
+            profile.format = data.get('format')
+            final_path = os.path.join(PROFILE_DIR, agent_id, profile.id + PROFILE_EXTENSIONS.get(profile.format, '.bin'))
+            os.replace(profile.file_path, final_path)
+            profile.file_path = final_path
+            profile.size_bytes = os.path.getsize(final_path)
+            profile.status = 'complete'
+        session.commit()
+        socketio.emit('profile_complete', profile_to_dict(profile))
+        logger.info('Profile received', extra={'profile_id': profile.id, 'status': profile.status, 'size_bytes': profile.size_bytes})
+    session.close()
+
+def current_acquisition(session, data):
+    """The acquisition an agent reply belongs to, or None if it is unknown, finished or superseded"""
+    acquisition = session.query(Acquisition).filter_by(id=data.get('acquisition_id'), agent_id=data.get('agent_id')).first()
+    if acquisition is None or acquisition.status not in ('requested', 'running') or data.get('request_id') != acquisition.request_id:
+        logger.warning('Ignoring reply for unknown, finished or superseded acquisition', extra={'acquisition_id': data.get('acquisition_id')})
+        return None
+    return acquisition
+
+def fail_acquisition(session, acquisition, error):
+    state = active_acquisitions.pop(acquisition.id, None)
+    if state:
+        state['writer'].discard()
+    else:
+        EvidenceFile(acquisition.file_path).discard()
+    manifest = load_manifest(acquisition)
+    manifest['status'] = 'failed'
+    manifest['completed_at'] = timestamp()
+    add_event(manifest, 'failed', error=error)
+    save_manifest(acquisition, manifest)
+    acquisition.status = 'failed'
+    acquisition.error = error
+    acquisition.completed_at = datetime.now()
+    session.commit()
+    socketio.emit('acquisition_complete', acquisition_to_dict(acquisition))
+    logger.warning('Acquisition failed', extra={'acquisition_id': acquisition.id, 'error': error})
+    finish_job_acquisition(session, acquisition)
+
+@socketio.on('acquire_started')
+@instrumented('acquire_started')
+def handle_acquire_started(data):
+    """Open (or reopen) the evidence file once the agent has opened the source"""
+    session = Session()
+    acquisition = current_acquisition(session, data)
+    if acquisition is None:
+        session.close()
+        return
+    if data.get('error'):
+        fail_acquisition(session, acquisition, data['error'])
+        session.close()
+        return
+    
+    state = active_acquisitions.get(acquisition.id)
+    writer = state['writer'] if state else EvidenceFile(acquisition.file_path).open()
+    offset = data.get('offset', 0)
+    if offset != writer.size:
+        fail_acquisition(session, acquisition, f'Agent resumed at {offset} but {writer.size} bytes are stored')
+        session.close()
+        return
+    manifest = load_manifest(acquisition)
+    base = delta_base(acquisition, manifest) if data.get('delta') else None
+    active_acquisitions[acquisition.id] = acquisition_state(
+        writer, acquisition.agent_id, acquisition.request_id, base.file_path if base else None
+    )
+    
+    manifest['status'] = acquisition.status = 'running'
+    manifest['started_at'] = manifest['started_at'] or timestamp()
+    manifest['source'].update(data.get('source') or {})
+    manifest['noatime'] = data.get('noatime')
+    if offset:
+        manifest['resumes'] += 1
+        add_event(manifest, 'resumed', offset=offset)
+    else:
+        add_event(manifest, 'started')
+    save_manifest(acquisition, manifest)
+    session.commit()
+    result = acquisition_to_dict(acquisition)
+    session.close()
+    socketio.emit('acquisition_started', result)
+
+@socketio.on('acquire_chunk')
+@instrumented('acquire_chunk')
+def handle_acquire_chunk(data):
+    """Append one acquired chunk to its evidence file"""
+    state = active_acquisitions.get(data.get('acquisition_id'))
+    if state is None or state['agent_id'] != data.get('agent_id') or state['request_id'] != data.get('request_id'):
+        # Chunks from a superseded command, or after the acquisition failed
+        logger.debug('Ignoring chunk for inactive acquisition', extra={'acquisition_id': data.get('acquisition_id')})
+        return
+    writer = state['writer']
+    start = writer.size
+    try:
+        if data.get('copy_offset') is not None:
+            copy_from_base(state, data.get('offset'), data['copy_offset'], data.get('length') or 0)
+        else:
+            chunk = data.get('data') or b''
+            writer.write(data.get('offset'), chunk)
+            state['bytes_sent'] += len(chunk)
+    except (EvidenceError, OSError) as e:
+        send_command(state['agent_id'], 'cancel_task', {'task_id': state['request_id']})
+        session = Session()
+        acquisition = session.query(Acquisition).filter_by(id=data['acquisition_id']).first()
+        fail_acquisition(session, acquisition, str(e))
+        session.close()
+        return
+    if writer.size // ACQUISITION_PROGRESS_BYTES != start // ACQUISITION_PROGRESS_BYTES:
+        socketio.emit('acquisition_progress', {
+            'agent_id': state['agent_id'],
+            'acquisition_id': data['acquisition_id'],
+            'bytes_received': writer.size
+        })
+
+def copy_from_base(state, offset, base_offset, length):
+    """Append length bytes of a delta acquisition's base, starting at base_offset"""
+    if state['base_path'] is None:
+        raise EvidenceError('Block reference in an acquisition that has no base')
+    writer = state['writer']
+    end = base_offset + length
+    while base_offset < end:
+        piece, base_size = evidence_maps.read(state['base_path'], base_offset, min(DELTA_COPY_PIECE_SIZE, end - base_offset))
+        if not piece:
+            raise EvidenceError(f'Block reference at {base_offset} is beyond the {base_size} bytes of the base')
+        writer.write(offset, piece)
+        offset += len(piece)
+        base_offset += len(piece)
+        state['bytes_copied'] += len(piece)
+
+@socketio.on('acquire_complete')
+@instrumented('acquire_complete')
+def handle_acquire_complete(data):
+    """Verify a finished acquisition against the agent's digests and seal its manifest"""
+    session = Session()
+    acquisition = current_acquisition(session, data)
+    if acquisition is None:
+        session.close()
+        return
+    if data.get('error'):
+        fail_acquisition(session, acquisition, data['error'])
+        session.close()
+        return
+    
+    state = active_acquisitions.pop(acquisition.id, None)
+    writer = state['writer'] if state else EvidenceFile(acquisition.file_path).open()
+    manifest = load_manifest(acquisition)
+    record_delta_transfer(manifest, state)
+    manifest['bytes'] = writer.size
+    server_hashes = writer.finalize()
+    verified = verify(manifest, data.get('size'), {'sha256': data.get('sha256'), 'md5': data.get('md5')}, server_hashes)
+    manifest['source_changed'] = bool(data.get('changed'))
+    if data.get('changed'):
+        # The bytes are verified, but they may mix the file's contents before and after the change
+        manifest['source_after'] = data.get('source_after')
+    manifest['status'] = 'complete' if verified else 'mismatch'
+    manifest['completed_at'] = timestamp()
+    add_event(manifest, 'completed', verified=verified, bytes=writer.size)
+    save_manifest(acquisition, manifest)
+    
+    acquisition.status = manifest['status']
+    acquisition.completed_at = datetime.now()
+    acquisition.size = writer.size
+    acquisition.sha256 = server_hashes['sha256']
+    acquisition.md5 = server_hashes['md5']
+    acquisition.agent_sha256 = data.get('sha256')
+    acquisition.agent_md5 = data.get('md5')
+    acquisition.verified = int(verified)
+    if not verified:
+        acquisition.error = 'Digest computed by the server does not match the agent\'s'
+    session.commit()
+    finish_job_acquisition(session, acquisition)
+    result = acquisition_to_dict(acquisition)
+    session.close()
+    socketio.emit('acquisition_complete', result)
+    logger.info('Acquisition complete', extra={
+        'acquisition_id': result['id'], 'size': result['size'], 'verified': verified, 'source_changed': bool(data.get('changed'))
+    })
+
+@socketio.on('task_cancelled')
+@instrumented('task_cancelled')
+def handle_task_cancelled(data):
+    """Handle task cancellation acknowledgement from agent"""
+    socketio.emit('task_cancelled_response', data)
+
+@socketio.on('index_batch')
+@instrumented('index_batch')
+def handle_index_batch(data):
+    """Store a batch of entries streamed by an agent walking a subtree"""
+    agent_id = data.get('agent_id')
+    root = data.get('root', '/')
+    entries = data.get('entries', [])
+    
+    session = Session()
+    if data.get('batch_number', 0) == 0:
+        # First batch of a fresh walk: drop whatever was indexed under root before
+        path_filter(session.query(FileSystemEntry).filter_by(agent_id=agent_id), root).delete(synchronize_session=False)
+    upsert_entries(session, agent_id, entries)
+    session.commit()
+    session.close()
+    record_job_reply(data)
+    
+    if data.get('done'):
+        socketio.emit('index_complete', {
+            'agent_id': agent_id,
+            'root': root,
+            'entry_count': data.get('entry_count', 0),
+            'error': data.get('error')
+        })
+        logger.info('Index complete', extra={'root': root, 'entry_count': data.get('entry_count', 0), 'error': data.get('error')})
+
+@socketio.on('diff_snapshots')
+@instrumented('diff_snapshots')
+def handle_diff_snapshots(data):
+    """Stream a snapshot diff to the requesting client in batches"""
+    agent_id = data.get('agent_id')
+    session = Session()
+    try:
+        base, target = resolve_diff_snapshots(
+            session, agent_id,
+            base_id=data.get('base'),
+            target_id=data.get('target'),
+            since=data.get('since')
+        )
+    except ValueError as e:
+        session.close()
+        emit('snapshot_diff_complete', {'agent_id': agent_id, 'error': str(e)})
+        return
+    session.close()
+    if not base or not target:
+        emit('snapshot_diff_complete', {'agent_id': agent_id, 'error': 'Snapshot not found'})
+        return
+    
+    summary = empty_summary()
+    batch = []
+    for change in iter_snapshot_diff(base, target):
+        summary[change['type']] += 1
+        batch.append(change)
+        if len(batch) >= DIFF_BATCH_SIZE:
+            emit('snapshot_diff_batch', {'agent_id': agent_id, 'changes': batch})
+            batch = []
+            socketio.sleep(0)
+    if batch:
+        emit('snapshot_diff_batch', {'agent_id': agent_id, 'changes': batch})
+    emit('snapshot_diff_complete', {
+        'agent_id': agent_id,
+        'base': snapshot_to_dict(base),
+        'target': snapshot_to_dict(target),
+        'summary': summary
+    })
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
+    relay.remove_client(request.sid)
     handle_agent_disconnect()
-    print('Client disconnected')
+    logger.info('Client disconnected', extra={'sid': request.sid})
 
 if __name__ == '__main__':
-    print('Starting Computer Investigations Framework Server...')
-    print('Server running on http://localhost:5000')
+    logger.info('Starting Computer Investigations Framework Server on http://localhost:5000')
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,463 @@
+"""Compact columnar snapshot format for indexed filesystem trees.
+
+A snapshot holds one host's tree sorted by path. Entries are grouped into
+blocks; inside a block every column is stored contiguously so zlib can
+compress similar values together:
+
+    prefix_len  uint16[n]   bytes shared with the previous path (front coding)
+    suffix_len  uint16[n]   length of the remaining path bytes
+    size        int64[n]
+    mtime       int64[n]    microseconds since the epoch
+    ctime       int64[n]
+    atime       int64[n]
+    inode       uint64[n]
+    mode        uint32[n]
+    flags       uint8[n]    FLAG_* bits
+    md5         16 bytes[n] zero-filled when FLAG_HASH is not set
+    suffixes    the concatenated path suffixes
+
+The block index at the end of the file records per-block min/max size and
+mtime plus the first and last path, so range queries can skip blocks without
+decompressing them. Files are read through mmap.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime
+
+MAGIC = b'CIFSNAP1'
+INDEX_MAGIC = b'CIFSIDX1'
+VERSION = 1
+DEFAULT_BLOCK_SIZE = 4096
+
+FLAG_DIRECTORY = 0x01
+FLAG_HASH = 0x02
+FLAG_ERROR = 0x04
+
+_HEADER = struct.Struct('<8sII')             # magic, version, meta length
+_BLOCK = struct.Struct('<QIIIIqqqq')          # offset, comp len, raw len, count, crc, size min/max, mtime min/max
+_TRAILER = struct.Struct('<QI8s')             # index offset, block count, magic
+_PATH_LEN = struct.Struct('<H')
+
+_NEEDS_SWAP = sys.byteorder != 'little'
+
+SnapshotEntry = namedtuple(
+    'SnapshotEntry',
+    ['path', 'size', 'mtime', 'ctime', 'atime', 'inode', 'mode', 'is_directory', 'md5', 'error'],
+)
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is malformed or used incorrectly"""
+
+
+def _to_micros(value):
+    """Convert a datetime, ISO string or epoch seconds to integer microseconds"""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return int(round(value.timestamp() * 1000000))
+    return int(round(float(value) * 1000000))
+
+
+def micros_to_iso(value):
+    """Convert integer microseconds back to an ISO timestamp (None when unset)"""
+    if not value:
+        return None
+    return datetime.fromtimestamp(value / 1000000).isoformat()
+
+
+def entry_from_dict(data):
+    """Build a SnapshotEntry from an agent listing entry or index row dict; raises SnapshotError for bad values"""
+    mode = data.get('mode')
+    if isinstance(mode, str):
+        try:
+            mode = int(mode, 8)
+        except ValueError:
+            mode = 0
+    md5 = data.get('md5') or None
+    try:
+        if md5 is not None and len(bytes.fromhex(md5)) != 16:
+            raise ValueError('md5 must be 32 hex digits')
+        return SnapshotEntry(
+            path=data['path'],
+            size=int(data.get('size') or 0),
+            mtime=_to_micros(data.get('modified')),
+            ctime=_to_micros(data.get('created')),
+            atime=_to_micros(data.get('accessed')),
+            inode=int(data.get('inode') or 0),
+            mode=int(mode or 0),
+            is_directory=bool(data.get('is_directory')),
+            md5=md5,
+            error=bool(data.get('error')),
+        )
+    except (TypeError, ValueError) as e:
+        raise SnapshotError(f"Invalid entry {data.get('path')!r}: {e}")
+
+
+def entry_to_dict(entry):
+    """Render a SnapshotEntry in the same shape as an agent listing entry"""
+    result = {
+        'name': os.path.basename(entry.path.rstrip('/\\')) or entry.path,
+        'path': entry.path,
+        'is_directory': entry.is_directory,
+        'size': entry.size,
+        'created': micros_to_iso(entry.ctime),
+        'modified': micros_to_iso(entry.mtime),
+        'accessed': micros_to_iso(entry.atime),
+        'inode': entry.inode or None,
+        'mode': oct(entry.mode)[-3:] if entry.mode else 'N/A',
+    }
+    if entry.md5:
+        result['md5'] = entry.md5
+    if entry.error:
+        result['error'] = 'Unreadable at index time'
+    return result
+
+
+def _encode_path(path):
+    return path.encode('utf-8', 'surrogateescape')
+
+
+def _decode_path(raw):
+    return raw.decode('utf-8', 'surrogateescape')
+
+
+def _pack(typecode, values):
+    column = array(typecode, values)
+    if _NEEDS_SWAP:
+        column.byteswap()
+    return column.tobytes()
+
+
+def _unpack(typecode, raw, offset, count):
+    column = array(typecode)
+    end = offset + column.itemsize * count
+    column.frombytes(raw[offset:end])
+    if _NEEDS_SWAP:
+        column.byteswap()
+    return column, end
+
+
+class SnapshotWriter:
+    """Stream sorted entries into a snapshot file"""
+
+    def __init__(self, path, meta=None, block_size=DEFAULT_BLOCK_SIZE, level=6):
+        self.path = path
+        self.block_size = block_size
+        self.level = level
+        self.meta = dict(meta or {})
+        self.entry_count = 0
+        self._pending = []
+        self._blocks = []
+        self._last_path = None
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        # The meta block is rewritten on close once the entry count is known,
+        # so reserve a fixed amount of space for it up front.
+        self._meta_reserved = 4096
+        self._file.write(b'\0' * (_HEADER.size + self._meta_reserved))
+
+    def add(self, entry):
+        """Append one entry; entries must arrive in ascending path order"""
+        if self._last_path is not None and entry.path <= self._last_path:
+            raise SnapshotError(f'Entries must be sorted and unique by path: {entry.path!r}')
+        self._last_path = entry.path
+        self._pending.append(entry)
+        self.entry_count += 1
+        if len(self._pending) >= self.block_size:
+            self._flush_block()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def _flush_block(self):
+        entries = self._pending
+        if not entries:
+            return
+        self._pending = []
+
+        prefixes = []
+        suffix_lens = []
+        suffixes = []
+        previous = b''
+        for entry in entries:
+            encoded = _encode_path(entry.path)
+            limit = min(len(previous), len(encoded), 0xFFFF)
+            shared = 0
+            while shared < limit and previous[shared] == encoded[shared]:
+                shared += 1
+            suffix = encoded[shared:]
+            if len(suffix) > 0xFFFF:
+                raise SnapshotError(f'Path too long for snapshot: {entry.path!r}')
+            prefixes.append(shared)
+            suffix_lens.append(len(suffix))
+            suffixes.append(suffix)
+            previous = encoded
+
+        flags = []
+        hashes = []
+        for entry in entries:
+            flag = 0
+            if entry.is_directory:
+                flag |= FLAG_DIRECTORY
+            if entry.error:
+                flag |= FLAG_ERROR
+            if entry.md5:
+                flag |= FLAG_HASH
+                hashes.append(bytes.fromhex(entry.md5))
+            else:
+                hashes.append(b'\0' * 16)
+            flags.append(flag)
+
+        sizes = [e.size for e in entries]
+        mtimes = [e.mtime for e in entries]
+        raw = b''.join((
+            _pack('H', prefixes),
+            _pack('H', suffix_lens),
+            _pack('q', sizes),
+            _pack('q', mtimes),
+            _pack('q', [e.ctime for e in entries]),
+            _pack('q', [e.atime for e in entries]),
+            _pack('Q', [e.inode for e in entries]),
+            _pack('I', [e.mode for e in entries]),
+            bytes(flags),
+            b''.join(hashes),
+            b''.join(suffixes),
+        ))
+        compressed = zlib.compress(raw, self.level)
+        offset = self._file.tell()
+        self._file.write(compressed)
+        self._blocks.append((
+            offset, len(compressed), len(raw), len(entries), zlib.crc32(raw),
+            min(sizes), max(sizes), min(mtimes), max(mtimes),
+            entries[0].path, entries[-1].path,
+        ))
+
+    def close(self):
+        """Write the block index and move the finished file into place"""
+        self._flush_block()
+        index_offset = self._file.tell()
+        for block in self._blocks:
+            self._file.write(_BLOCK.pack(*block[:9]))
+            for path in block[9:]:
+                encoded = _encode_path(path)
+                self._file.write(_PATH_LEN.pack(len(encoded)))
+                self._file.write(encoded)
+        self._file.write(_TRAILER.pack(index_offset, len(self._blocks), INDEX_MAGIC))
+
+        self.meta.update({
+            'entry_count': self.entry_count,
+            'block_size': self.block_size,
+        })
+        meta = json.dumps(self.meta).encode('utf-8')
+        if len(meta) > self._meta_reserved:
+            raise SnapshotError('Snapshot metadata is too large')
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(meta)))
+        self._file.write(meta)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self.meta
+
+    def abort(self):
+        """Discard a partially written snapshot"""
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def write_snapshot(path, entries, meta=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Write an iterable of entries (sorted by path) to a snapshot file"""
+    with SnapshotWriter(path, meta=meta, block_size=block_size) as writer:
+        writer.extend(entries)
+    return writer.meta
+
+
+class SnapshotReader:
+    """Memory-mapped reader for snapshot files"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f'Empty snapshot file: {path}')
+
+        magic, version, meta_len = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotError(f'Not a snapshot file: {path}')
+        if version != VERSION:
+            self.close()
+            raise SnapshotError(f'Unsupported snapshot version {version}')
+        self.meta = json.loads(bytes(self._map[_HEADER.size:_HEADER.size + meta_len]))
+
+        index_offset, block_count, index_magic = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+        if index_magic != INDEX_MAGIC:
+            self.close()
+            raise SnapshotError(f'Snapshot index is missing or truncated: {path}')
+
+        self.blocks = []
+        position = index_offset
+        for _ in range(block_count):
+            block = list(_BLOCK.unpack_from(self._map, position))
+            position += _BLOCK.size
+            for _ in range(2):
+                (length,) = _PATH_LEN.unpack_from(self._map, position)
+                position += _PATH_LEN.size
+                block.append(_decode_path(bytes(self._map[position:position + length])))
+                position += length
+            self.blocks.append(tuple(block))
+        self._first_paths = [block[9] for block in self.blocks]
+
+    @property
+    def entry_count(self):
+        return self.meta.get('entry_count', 0)
+
+    def __len__(self):
+        return self.entry_count
+
+    def _decode_block(self, block):
+        offset, comp_len, raw_len, count, crc = block[:5]
+        raw = zlib.decompress(self._map[offset:offset + comp_len])
+        if len(raw) != raw_len or zlib.crc32(raw) != crc:
+            raise SnapshotError(f'Corrupt block at offset {offset} in {self.path}')
+
+        position = 0
+        prefixes, position = _unpack('H', raw, position, count)
+        suffix_lens, position = _unpack('H', raw, position, count)
+        sizes, position = _unpack('q', raw, position, count)
+        mtimes, position = _unpack('q', raw, position, count)
+        ctimes, position = _unpack('q', raw, position, count)
+        atimes, position = _unpack('q', raw, position, count)
+        inodes, position = _unpack('Q', raw, position, count)
+        modes, position = _unpack('I', raw, position, count)
+        flags = raw[position:position + count]
+        position += count
+        hashes = raw[position:position + 16 * count]
+        position += 16 * count
+
+        entries = []
+        previous = b''
+        for i in range(count):
+            suffix_end = position + suffix_lens[i]
+            encoded = previous[:prefixes[i]] + raw[position:suffix_end]
+            position = suffix_end
+            previous = encoded
+            flag = flags[i]
+            entries.append(SnapshotEntry(
+                path=_decode_path(encoded),
+                size=sizes[i],
+                mtime=mtimes[i],
+                ctime=ctimes[i],
+                atime=atimes[i],
+                inode=inodes[i],
+                mode=modes[i],
+                is_directory=bool(flag & FLAG_DIRECTORY),
+                md5=hashes[16 * i:16 * i + 16].hex() if flag & FLAG_HASH else None,
+                error=bool(flag & FLAG_ERROR),
+            ))
+        return entries
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from self._decode_block(block)
+
+    def iter_entries(self, prefix=None, modified_after=None, modified_before=None, min_size=None, max_size=None):
+        """Iterate entries matching the filters, skipping blocks by their min/max stats
+
+        ``modified_after``/``modified_before`` accept the same values as
+        entry timestamps (datetime, ISO string or epoch seconds).
+        """
+        after = _to_micros(modified_after) if modified_after is not None else None
+        before = _to_micros(modified_before) if modified_before is not None else None
+        start = 0
+        if prefix:
+            start = max(bisect.bisect_right(self._first_paths, prefix) - 1, 0)
+
+        for block in self.blocks[start:]:
+            size_min, size_max, mtime_min, mtime_max, first_path, last_path = block[5:]
+            if prefix and first_path > prefix and not first_path.startswith(prefix):
+                break
+            if prefix and last_path < prefix:
+                continue
+            if after is not None and mtime_max < after:
+                continue
+            if before is not None and mtime_min > before:
+                continue
+            if min_size is not None and size_max < min_size:
+                continue
+            if max_size is not None and size_min > max_size:
+                continue
+            for entry in self._decode_block(block):
+                if prefix and not entry.path.startswith(prefix):
+                    continue
+                if after is not None and entry.mtime < after:
+                    continue
+                if before is not None and entry.mtime > before:
+                    continue
+                if min_size is not None and entry.size < min_size:
+                    continue
+                if max_size is not None and entry.size > max_size:
+                    continue
+                yield entry
+
+    def get(self, path):
+        """Look up a single entry by exact path (None when absent)"""
+        index = bisect.bisect_right(self._first_paths, path) - 1
+        if index < 0:
+            return None
+        block = self.blocks[index]
+        if path > block[10]:
+            return None
+        for entry in self._decode_block(block):
+            if entry.path == path:
+                return entry
+        return None
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def read_meta(path):
+    """Read only the header metadata of a snapshot file"""
+    with open(path, 'rb') as f:
+        magic, version, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise SnapshotError(f'Not a snapshot file: {path}')
+        return json.loads(f.read(meta_len))
@@ -0,0 +1,147 @@
+"""Diff two snapshots of the same host.
+
+Both snapshots are already sorted by path, so a single merge pass finds
+added, removed and modified entries in O(n + m) without loading either tree
+into memory. Renames are paired afterwards by sorting only the added and
+removed sets by inode (and size/hash) and merging them the same way.
+"""
+
+from collections import namedtuple
+
+from snapshot import entry_to_dict
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+RENAMED = 'renamed'
+
+Change = namedtuple('Change', ['type', 'old', 'new', 'fields'])
+
+
+def changed_fields(old, new):
+    """Return the names of the fields that differ between two entries for the same path"""
+    fields = []
+    if old.is_directory != new.is_directory:
+        fields.append('type')
+    if old.inode and new.inode and old.inode != new.inode:
+        fields.append('inode')
+    if not new.is_directory:
+        if old.size != new.size:
+            fields.append('size')
+        if old.md5 and new.md5 and old.md5 != new.md5:
+            fields.append('hash')
+    if old.mtime != new.mtime:
+        fields.append('mtime')
+    if old.mode != new.mode:
+        fields.append('mode')
+    return fields
+
+
+def _rename_key(entry):
+    return (entry.inode, entry.is_directory, entry.size if not entry.is_directory else 0)
+
+
+def _same_content(old, new):
+    if old.md5 and new.md5:
+        return old.md5 == new.md5
+    return True
+
+
+def _pair_renames(removed, added):
+    """Match removed and added entries that share an inode via a sorted merge"""
+    candidates_old = sorted((e for e in removed if e.inode), key=_rename_key)
+    candidates_new = sorted((e for e in added if e.inode), key=_rename_key)
+    renamed = []
+    matched_old = set()
+    matched_new = set()
+
+    i = j = 0
+    while i < len(candidates_old) and j < len(candidates_new):
+        old = candidates_old[i]
+        new = candidates_new[j]
+        old_key = _rename_key(old)
+        new_key = _rename_key(new)
+        if old_key < new_key:
+            i += 1
+        elif old_key > new_key:
+            j += 1
+        else:
+            # Entries sharing a key (hard links, reused inodes) are paired with any
+            # of the other side's that has the same content, not just the next one
+            old_end = i
+            while old_end < len(candidates_old) and _rename_key(candidates_old[old_end]) == old_key:
+                old_end += 1
+            new_end = j
+            while new_end < len(candidates_new) and _rename_key(candidates_new[new_end]) == new_key:
+                new_end += 1
+            unpaired = candidates_new[j:new_end]
+            for old in candidates_old[i:old_end]:
+                for n, new in enumerate(unpaired):
+                    if _same_content(old, new):
+                        renamed.append(Change(RENAMED, old, new, changed_fields(old, new)))
+                        matched_old.add(old.path)
+                        matched_new.add(new.path)
+                        del unpaired[n]
+                        break
+            i = old_end
+            j = new_end
+
+    removed = [e for e in removed if e.path not in matched_old]
+    added = [e for e in added if e.path not in matched_new]
+    return renamed, removed, added
+
+
+def diff_entries(base, target, detect_renames=True):
+    """Yield Change tuples for two iterables of entries sorted by path
+
+    Modified entries are yielded as soon as the merge reaches them; added,
+    removed and renamed entries follow once both inputs are exhausted, since
+    a rename cannot be told apart from an add/remove pair before then.
+    """
+    added = []
+    removed = []
+    base_iter = iter(base)
+    target_iter = iter(target)
+    old = next(base_iter, None)
+    new = next(target_iter, None)
+
+    while old is not None or new is not None:
+        if new is None or (old is not None and old.path < new.path):
+            removed.append(old)
+            old = next(base_iter, None)
+        elif old is None or new.path < old.path:
+            added.append(new)
+            new = next(target_iter, None)
+        else:
+            fields = changed_fields(old, new)
+            if fields:
+                yield Change(MODIFIED, old, new, fields)
+            old = next(base_iter, None)
+            new = next(target_iter, None)
+
+    renamed = []
+    if detect_renames:
+        renamed, removed, added = _pair_renames(removed, added)
+
+    yield from renamed
+    for entry in added:
+        yield Change(ADDED, None, entry, [])
+    for entry in removed:
+        yield Change(REMOVED, entry, None, [])
+
+
+def change_to_dict(change):
+    """Serialize a Change for JSON responses and socket events"""
+    result = {'type': change.type}
+    if change.old is not None:
+        result['old'] = entry_to_dict(change.old)
+    if change.new is not None:
+        result['new'] = entry_to_dict(change.new)
+    result['path'] = (change.new or change.old).path
+    if change.fields:
+        result['fields'] = change.fields
+    return result
+
+
+def empty_summary():
+    return {ADDED: 0, REMOVED: 0, MODIFIED: 0, RENAMED: 0}
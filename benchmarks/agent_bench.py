@@ -0,0 +1,240 @@
+"""Micro-benchmarks for the agent's filesystem paths on a generated fixture.
+
+Builds (or reuses) an on-disk fixture with ``fsgen.py`` and calls the real
+``CIFAgent`` methods against it, with no server involved, so listing,
+indexing, metadata, hashing and chunk-reading regressions show up on their
+own instead of being hidden behind Socket.IO transport costs. It measures:
+
+* ``list_directory`` of the flat ``wide/`` directory, uncached and cached
+* ``list_directory`` of every directory in ``tree/``
+* ``walk_tree`` over ``tree/`` (what ``index_tree`` streams)
+* ``get_file_metadata`` (stat plus MD5) for a sample of ``tree/`` files
+* ``hash_file`` throughput over ``dense/``
+* sequential ``read_chunk`` throughput over a dense file and random chunk
+  latency on a sparse file
+
+Every benchmark runs ``--repeat`` times and the fastest run is reported,
+with the page cache warm. Reports go to the same directory as the load test,
+prefixed ``agent-``, and are compared with the same ``compare`` command.
+
+    python benchmarks/agent_bench.py run --files 1000000 --fixture /var/tmp/cif-fixture
+    python benchmarks/agent_bench.py compare bench-results/agent-a.json bench-results/agent-b.json
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from fsgen import add_fixture_arguments, fixture_params, generate, remove_tree
+from report import DEFAULT_OUTPUT, add_compare_command, percentiles, write_report
+from simagent import READ_CHUNK_SIZE, OfflineAgent
+
+
+def fastest(repeat, bench):
+    """Run bench() repeat times and keep the result with the lowest 'seconds'"""
+    results = [bench() for _ in range(max(repeat, 1))]
+    best = min(results, key=lambda result: result['seconds'])
+    best['runs'] = len(results)
+    return best
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+def scan_fixture(tree_root, sample_size, seed):
+    """Every directory under tree/ and a reproducible sample of its regular files"""
+    directories, files = [], []
+    for directory, _, filenames in os.walk(tree_root):
+        directories.append(directory)
+        files.extend(
+            os.path.join(directory, name) for name in filenames
+            if not os.path.islink(os.path.join(directory, name))
+        )
+    files.sort()
+    sample = random.Random(seed).sample(files, min(sample_size, len(files)))
+    return sorted(directories), sample
+
+
+def bench_listing_wide(agent, path, repeat):
+    def uncached():
+        started = time.perf_counter()
+        entries = agent.list_directory(path, use_cache=False)
+        seconds = time.perf_counter() - started
+        return {'seconds': round(seconds, 4), 'entries': len(entries), 'entries_per_second': rate(len(entries), seconds)}
+
+    result = fastest(repeat, uncached)
+    agent.list_directory(path)
+    latencies = []
+    for _ in range(max(repeat, 1) * 10):
+        started = time.perf_counter()
+        agent.list_directory(path)
+        latencies.append((time.perf_counter() - started) * 1000)
+    result['cached'] = percentiles(latencies)
+    return result
+
+
+def bench_listing_tree(agent, directories, repeat):
+    def run():
+        entries = errors = 0
+        started = time.perf_counter()
+        for directory in directories:
+            try:
+                listing = agent.list_directory(directory, use_cache=False)
+            except OSError:
+                errors += 1
+                continue
+            entries += len(listing)
+            errors += sum(1 for entry in listing if 'error' in entry)
+        seconds = time.perf_counter() - started
+        return {
+            'seconds': round(seconds, 3),
+            'directories': len(directories),
+            'entries': entries,
+            'errors': errors,
+            'directories_per_second': rate(len(directories), seconds),
+            'entries_per_second': rate(entries, seconds),
+        }
+    return fastest(repeat, run)
+
+
+def bench_walk(agent, tree_root, repeat):
+    def run():
+        entries = errors = 0
+        started = time.perf_counter()
+        for entry in agent.walk_tree(tree_root):
+            entries += 1
+            errors += 'error' in entry
+        seconds = time.perf_counter() - started
+        return {'seconds': round(seconds, 3), 'entries': entries, 'errors': errors, 'entries_per_second': rate(entries, seconds)}
+    return fastest(repeat, run)
+
+
+def bench_metadata(agent, files, repeat):
+    def run():
+        latencies, total_bytes, errors = [], 0, 0
+        started = time.perf_counter()
+        for path in files:
+            call_started = time.perf_counter()
+            try:
+                total_bytes += agent.get_file_metadata(path, use_cache=False)['size']
+            except OSError:
+                errors += 1
+            latencies.append((time.perf_counter() - call_started) * 1000)
+        seconds = time.perf_counter() - started
+        return {
+            'seconds': round(seconds, 3),
+            'files': len(files),
+            'errors': errors,
+            'files_per_second': rate(len(files), seconds),
+            'mb_per_second': rate(total_bytes / 1024 / 1024, seconds),
+            'latency': percentiles(latencies),
+        }
+    return fastest(repeat, run)
+
+
+def bench_hashing(agent, files, repeat):
+    total_bytes = sum(os.path.getsize(path) for path in files)
+
+    def run():
+        started = time.perf_counter()
+        for path in files:
+            agent.hash_file(path)
+        seconds = time.perf_counter() - started
+        return {'seconds': round(seconds, 3), 'bytes': total_bytes, 'mb_per_second': rate(total_bytes / 1024 / 1024, seconds)}
+    return fastest(repeat, run)
+
+
+def bench_read(agent, dense_file, sparse_file, random_chunks, seed, repeat):
+    def sequential():
+        chunk_number = total_bytes = 0
+        started = time.perf_counter()
+        while True:
+            chunk, _ = agent.read_chunk(dense_file, chunk_number)
+            if not chunk:
+                break
+            total_bytes += len(chunk)
+            chunk_number += 1
+        seconds = time.perf_counter() - started
+        return {'seconds': round(seconds, 3), 'bytes': total_bytes, 'mb_per_second': rate(total_bytes / 1024 / 1024, seconds)}
+
+    result = fastest(repeat, sequential)
+    if sparse_file:
+        chunks = os.path.getsize(sparse_file) // READ_CHUNK_SIZE
+        rng = random.Random(seed)
+        latencies = []
+        for _ in range(random_chunks):
+            started = time.perf_counter()
+            agent.read_chunk(sparse_file, rng.randrange(chunks))
+            latencies.append((time.perf_counter() - started) * 1000)
+        result['random_sparse'] = percentiles(latencies)
+    return result
+
+
+def run(args):
+    import jsonlog
+    jsonlog.configure(level='WARNING')
+    fixture_root = args.fixture or tempfile.mkdtemp(prefix='cif-fixture-')
+    workdir = tempfile.mkdtemp(prefix='cif-agent-bench-')
+    agent = None
+    try:
+        print(f'Preparing fixture at {fixture_root}')
+        manifest = generate(fixture_root, progress=lambda step: print(f'  building {step}/'), **fixture_params(args))
+        tree_root = os.path.join(fixture_root, 'tree')
+        dense = sorted(os.path.join(fixture_root, 'dense', name) for name in os.listdir(os.path.join(fixture_root, 'dense')))
+        sparse = sorted(os.path.join(fixture_root, 'sparse', name) for name in os.listdir(os.path.join(fixture_root, 'sparse')))
+        # Also warms the page cache, so every benchmark starts from the same state
+        directories, sample = scan_fixture(tree_root, args.metadata_sample, args.seed)
+        agent = OfflineAgent('http://127.0.0.1:9', workdir, name='agent-bench', max_workers=1)
+
+        results = {}
+        results['listing_wide'] = bench_listing_wide(agent, os.path.join(fixture_root, 'wide'), args.repeat)
+        print(f"  listing wide/: {results['listing_wide']['entries_per_second']} entries/s")
+        results['listing_tree'] = bench_listing_tree(agent, directories, args.repeat)
+        print(f"  listing tree/: {results['listing_tree']['directories_per_second']} directories/s")
+        results['walk'] = bench_walk(agent, tree_root, args.repeat)
+        print(f"  walk: {results['walk']['entries_per_second']} entries/s")
+        if sample:
+            results['metadata'] = bench_metadata(agent, sample, args.repeat)
+            print(f"  metadata: {results['metadata']['files_per_second']} files/s")
+        if dense:
+            results['hashing'] = bench_hashing(agent, dense, args.repeat)
+            print(f"  hashing: {results['hashing']['mb_per_second']} MB/s")
+            results['read'] = bench_read(agent, dense[0], sparse[0] if sparse else None, args.random_chunks, args.seed, args.repeat)
+            print(f"  read: {results['read']['mb_per_second']} MB/s")
+    finally:
+        if agent is not None:
+            agent.scheduler.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+        if args.fixture or args.keep_fixture:
+            print(f'Fixture kept at {fixture_root}')
+        else:
+            remove_tree(fixture_root)
+    return write_report(args, results, prefix='agent-', extra_params={'fixture_counts': manifest['counts']})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CIF agent filesystem micro-benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Generate a fixture and benchmark the agent against it')
+    run_parser.add_argument('--fixture', help='Fixture directory, reused if it matches (default: a temporary directory, removed afterwards)')
+    run_parser.add_argument('--keep-fixture', action='store_true', help='Keep the temporary fixture')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark; the fastest is reported (default: 3)')
+    run_parser.add_argument('--metadata-sample', type=int, default=2000, help='Files passed to get_file_metadata (default: 2000)')
+    run_parser.add_argument('--random-chunks', type=int, default=200, help='Random chunk reads on a sparse file (default: 200)')
+    run_parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Report directory')
+    add_fixture_arguments(run_parser)
+    run_parser.set_defaults(func=run)
+
+    add_compare_command(commands)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Reproducible on-disk filesystem fixtures for agent benchmarks.
+
+``generate()`` builds a real directory tree from a seed, so the agent's
+listing, metadata, hashing and indexing paths can be measured against the
+kernel's filesystem instead of the in-memory ``SyntheticFS``. The same
+parameters and seed always produce the same names, sizes and contents.
+
+A fixture has four parts, mirroring the fixed locations of ``SyntheticFS``:
+
+* ``tree/`` -- ``depth`` levels of ``fanout`` subdirectories holding
+  ``files`` files. Files are spread over directories with a Zipf-like skew
+  (a few directories are very large, most are small) and their sizes follow
+  a log-normal distribution around ``size_median``. A ``symlink_ratio``
+  share of the entries are symlinks -- to files, to ancestor directories
+  (loops) and dangling -- and a ``denied_ratio`` share of files and
+  directories have mode 000.
+* ``wide/`` -- one flat directory of ``wide_entries`` small files.
+* ``dense/`` -- ``dense_files`` files of ``dense_size`` random bytes for
+  hashing and chunk reads.
+* ``sparse/`` -- ``sparse_files`` sparse files of ``sparse_size`` bytes with
+  data only at their start, middle and end.
+
+A manifest (``.cif-fixture.json``) written after the last file records the
+parameters and counts. Generating into a directory that already holds a
+complete fixture with the same parameters reuses it, which matters for
+multi-million file trees. Mode 000 only denies access to unprivileged
+users; run as root, the denied entries are readable.
+
+    python benchmarks/fsgen.py generate /tmp/cif-fixture --files 1000000
+    python benchmarks/fsgen.py remove /tmp/cif-fixture
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+MANIFEST_NAME = '.cif-fixture.json'
+# Bump when the layout changes so old fixtures are regenerated
+FIXTURE_VERSION = 1
+# Random bytes that file contents are sliced from
+CONTENT_BLOCK_SIZE = 4 * 1024 * 1024
+SPARSE_DATA_SIZE = 64 * 1024
+EXTENSIONS = ('.txt', '.log', '.dat', '.bin', '.json', '.xml', '.dll', '.exe', '.jpg', '.pdf', '')
+
+DEFAULTS = {
+    'files': 100000,
+    'depth': 4,
+    'fanout': 8,
+    'skew': 1.0,
+    'size_median': 1024,
+    'size_sigma': 1.2,
+    'max_file_size': 1024 * 1024,
+    'symlink_ratio': 0.01,
+    'denied_ratio': 0.001,
+    'wide_entries': 20000,
+    'dense_files': 8,
+    'dense_size': 16 * 1024 * 1024,
+    'sparse_files': 2,
+    'sparse_size': 1024 * 1024 * 1024,
+    'seed': 0,
+}
+
+
+def load_manifest(root):
+    """Manifest of a complete fixture at root, or None"""
+    try:
+        with open(os.path.join(root, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_tree(root):
+    """Delete a fixture, restoring permissions on denied entries first"""
+    if not os.path.lexists(root):
+        return
+    os.chmod(root, 0o700)
+    for directory, dirnames, filenames in os.walk(root):
+        # Top-down, so denied subdirectories are opened up before they are listed
+        for name in dirnames + filenames:
+            path = os.path.join(directory, name)
+            if not os.path.islink(path):
+                os.chmod(path, 0o700)
+    shutil.rmtree(root)
+
+
+class _Content:
+    """Deterministic file contents sliced from one random block"""
+
+    def __init__(self, rng):
+        block = rng.randbytes(CONTENT_BLOCK_SIZE)
+        # Doubled so any window of up to one block can be sliced without wrapping
+        self.block = block + block
+
+    def write(self, fd, size, offset):
+        start = offset % CONTENT_BLOCK_SIZE
+        while size > 0:
+            step = min(size, CONTENT_BLOCK_SIZE)
+            os.write(fd, self.block[start:start + step])
+            size -= step
+
+
+def _write_file(path, size, content, offset, mode=0o644):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    try:
+        if size:
+            content.write(fd, size, offset)
+    finally:
+        os.close(fd)
+
+
+def _file_size(rng, params):
+    size = rng.lognormvariate(math.log(params['size_median']), params['size_sigma'])
+    return min(int(size), params['max_file_size'])
+
+
+def _build_directories(root, depth, fanout):
+    """Create the directory skeleton breadth-first and return every directory"""
+    directories = [root]
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                path = os.path.join(parent, f'd{i:03d}')
+                os.mkdir(path)
+                next_level.append(path)
+        directories.extend(next_level)
+        level = next_level
+    return directories
+
+
+def _build_tree(root, params, rng, content, counts):
+    os.mkdir(root)
+    directories = _build_directories(root, params['depth'], params['fanout'])
+    counts['directories'] += len(directories)
+    # Directories are shuffled before weighting so the large ones are not all at the top
+    order = directories[:]
+    rng.shuffle(order)
+    cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** params['skew'] for rank in range(len(order))))
+    total_weight = cumulative[-1]
+    serial = {}
+    files = []
+    for i in range(params['files']):
+        directory = order[min(bisect.bisect(cumulative, rng.random() * total_weight), len(order) - 1)]
+        n = serial.get(directory, 0)
+        serial[directory] = n + 1
+        path = os.path.join(directory, f'f{n:06d}{rng.choice(EXTENSIONS)}')
+        roll = rng.random()
+        if roll < params['symlink_ratio']:
+            kind = rng.random()
+            if kind < 0.6 and files:
+                target = os.path.relpath(rng.choice(files), directory)
+                counts['symlinks'] += 1
+            elif kind < 0.8:
+                # Points at the directory itself or an ancestor, so a walker that follows links loops
+                ancestors = [directory]
+                while ancestors[-1] != root:
+                    ancestors.append(os.path.dirname(ancestors[-1]))
+                target = os.path.relpath(rng.choice(ancestors), directory)
+                counts['symlink_loops'] += 1
+            else:
+                target = f'missing-{i}'
+                counts['dangling_symlinks'] += 1
+            os.symlink(target, path)
+            continue
+        size = _file_size(rng, params)
+        denied = roll < params['symlink_ratio'] + params['denied_ratio']
+        _write_file(path, size, content, i * 4099, mode=0o000 if denied else 0o644)
+        files.append(path)
+        counts['files'] += 1
+        counts['bytes'] += size
+        counts['denied_files'] += denied
+    # Deny directories last so their files could still be created
+    denied_dirs = [d for d in directories[1:] if rng.random() < params['denied_ratio']]
+    for directory in denied_dirs:
+        os.chmod(directory, 0o000)
+    counts['denied_directories'] += len(denied_dirs)
+
+
+def _build_wide(root, params, rng, content, counts):
+    os.mkdir(root)
+    counts['directories'] += 1
+    for i in range(params['wide_entries']):
+        size = min(_file_size(rng, params), 64 * 1024)
+        _write_file(os.path.join(root, f'w{i:07d}.dat'), size, content, i * 7919)
+        counts['files'] += 1
+        counts['bytes'] += size
+
+
+def _build_dense(root, params, content, counts):
+    os.mkdir(root)
+    counts['directories'] += 1
+    for i in range(params['dense_files']):
+        _write_file(os.path.join(root, f'dense{i:03d}.bin'), params['dense_size'], content, i * 1048573)
+        counts['files'] += 1
+        counts['bytes'] += params['dense_size']
+
+
+def _build_sparse(root, params, content, counts):
+    os.mkdir(root)
+    counts['directories'] += 1
+    size = params['sparse_size']
+    for i in range(params['sparse_files']):
+        path = os.path.join(root, f'sparse{i:03d}.img')
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            for offset in sorted({0, size // 2, max(size - SPARSE_DATA_SIZE, 0)}):
+                os.lseek(fd, offset, os.SEEK_SET)
+                content.write(fd, min(SPARSE_DATA_SIZE, size - offset), offset + i)
+        finally:
+            os.close(fd)
+        counts['files'] += 1
+        counts['sparse_files'] += 1
+        counts['apparent_bytes'] += size
+
+
+def generate(root=None, progress=None, **overrides):
+    """Build (or reuse) a fixture at root and return its manifest
+
+    ``root`` defaults to a new temporary directory. Unknown parameters raise
+    ``TypeError``; an existing non-fixture directory at root raises
+    ``FileExistsError`` rather than being deleted.
+    """
+    unknown = set(overrides) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"Unknown fixture parameters: {', '.join(sorted(unknown))}")
+    params = dict(DEFAULTS, **overrides)
+    root = os.path.abspath(root or tempfile.mkdtemp(prefix='cif-fixture-'))
+
+    manifest = load_manifest(root)
+    if manifest is not None:
+        if manifest.get('version') == FIXTURE_VERSION and manifest.get('params') == params:
+            return manifest
+        remove_tree(root)
+    elif os.path.isdir(root) and os.listdir(root):
+        raise FileExistsError(f'{root} is not empty and does not hold a fixture')
+
+    os.makedirs(root, exist_ok=True)
+    rng = random.Random(params['seed'])
+    content = _Content(rng)
+    counts = dict.fromkeys((
+        'files', 'directories', 'bytes', 'apparent_bytes', 'symlinks', 'symlink_loops',
+        'dangling_symlinks', 'denied_files', 'denied_directories', 'sparse_files'
+    ), 0)
+    started = time.monotonic()
+    steps = (
+        ('tree', lambda path: _build_tree(path, params, rng, content, counts)),
+        ('wide', lambda path: _build_wide(path, params, rng, content, counts)),
+        ('dense', lambda path: _build_dense(path, params, content, counts)),
+        ('sparse', lambda path: _build_sparse(path, params, content, counts)),
+    )
+    for name, build in steps:
+        if progress:
+            progress(name)
+        build(os.path.join(root, name))
+    counts['apparent_bytes'] += counts['bytes']
+
+    manifest = {
+        'version': FIXTURE_VERSION,
+        'root': root,
+        'params': params,
+        'counts': counts,
+        'generation_seconds': round(time.monotonic() - started, 3),
+        # Mode 000 is not enforced for root, so denied entries are only denied otherwise
+        'denied_enforced': hasattr(os, 'geteuid') and os.geteuid() != 0,
+    }
+    with open(os.path.join(root, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def add_fixture_arguments(parser):
+    """Command-line options for every fixture parameter"""
+    parser.add_argument('--files', type=int, default=DEFAULTS['files'], help='Files in tree/ (default: %(default)s)')
+    parser.add_argument('--depth', type=int, default=DEFAULTS['depth'], help='Directory levels in tree/ (default: %(default)s)')
+    parser.add_argument('--fanout', type=int, default=DEFAULTS['fanout'], help='Subdirectories per directory (default: %(default)s)')
+    parser.add_argument('--skew', type=float, default=DEFAULTS['skew'], help='Zipf exponent spreading files over directories; 0 is uniform (default: %(default)s)')
+    parser.add_argument('--size-median', type=int, default=DEFAULTS['size_median'], help='Median file size in bytes (default: %(default)s)')
+    parser.add_argument('--size-sigma', type=float, default=DEFAULTS['size_sigma'], help='Log-normal sigma of file sizes (default: %(default)s)')
+    parser.add_argument('--max-file-size', type=int, default=DEFAULTS['max_file_size'], help='Largest file in tree/ in bytes (default: %(default)s)')
+    parser.add_argument('--symlink-ratio', type=float, default=DEFAULTS['symlink_ratio'], help='Share of tree/ entries that are symlinks (default: %(default)s)')
+    parser.add_argument('--denied-ratio', type=float, default=DEFAULTS['denied_ratio'], help='Share of files and directories with mode 000 (default: %(default)s)')
+    parser.add_argument('--wide-entries', type=int, default=DEFAULTS['wide_entries'], help='Files in the flat wide/ directory (default: %(default)s)')
+    parser.add_argument('--dense-files', type=int, default=DEFAULTS['dense_files'], help='Files of random data in dense/ (default: %(default)s)')
+    parser.add_argument('--dense-mb', type=int, default=DEFAULTS['dense_size'] // (1024 * 1024), help='Size of each dense file in MB (default: %(default)s)')
+    parser.add_argument('--sparse-files', type=int, default=DEFAULTS['sparse_files'], help='Sparse files in sparse/ (default: %(default)s)')
+    parser.add_argument('--sparse-mb', type=int, default=DEFAULTS['sparse_size'] // (1024 * 1024), help='Apparent size of each sparse file in MB (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'], help='Random seed (default: %(default)s)')
+
+
+def fixture_params(args):
+    """Fixture parameters from parsed add_fixture_arguments() options"""
+    params = {name: getattr(args, name) for name in DEFAULTS if hasattr(args, name)}
+    params['dense_size'] = args.dense_mb * 1024 * 1024
+    params['sparse_size'] = args.sparse_mb * 1024 * 1024
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate reproducible filesystem fixtures for agent benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help='Build a fixture (or reuse a matching one)')
+    generate_parser.add_argument('root', nargs='?', help='Fixture directory (default: a new temporary directory)')
+    add_fixture_arguments(generate_parser)
+    remove_parser = commands.add_parser('remove', help='Delete a fixture, including denied entries')
+    remove_parser.add_argument('root')
+    args = parser.parse_args()
+
+    if args.command == 'remove':
+        if load_manifest(args.root) is None:
+            sys.exit(f'{args.root} does not hold a fixture')
+        remove_tree(args.root)
+        return
+    manifest = generate(args.root, progress=lambda step: print(f'  building {step}/'), **fixture_params(args))
+    counts = manifest['counts']
+    print(f"Fixture at {manifest['root']}: {counts['files']} files, {counts['directories']} directories, "
+          f"{counts['bytes'] / 1024 / 1024:.1f} MB on disk ({manifest['generation_seconds']}s)")
+    if not manifest['denied_enforced']:
+        print('Note: running as root, so mode 000 entries are still readable')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""End-to-end load test for the CIF server with simulated agents.
+
+Starts ``backend/server.py`` on a local port in a scratch directory, connects
+``--agents`` simulated agents spread over ``--processes`` worker processes,
+and drives the REST API the way the dashboard does while listening for the
+relayed replies on an analyst socket. It measures:
+
+* registrations per second while every agent connects at once
+* agent list reads (``/api/agents``): a walk through every page, then
+  repeated first-page reads as the dashboard makes them
+* listing latency for a large directory (``/large`` on the synthetic FS)
+* hex-view chunk throughput (``read_file`` on ``/big.bin``)
+* hashing throughput (``get_metadata`` on ``/hash/f*``)
+
+Each run writes a JSON report tagged with the current git commit, so two
+commits can be compared with ``loadtest.py compare OLD.json NEW.json``.
+
+    python benchmarks/loadtest.py run --agents 1000 --processes 4
+    python benchmarks/loadtest.py compare bench-results/a.json bench-results/b.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+
+from report import DEFAULT_OUTPUT, add_compare_command, percentiles, write_report
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+SERVER_BOOTSTRAP = '''
+import resource, sys
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+import server
+server.socketio.run(server.app, host='127.0.0.1', port=int(sys.argv[1]), log_output=False, max_size=int(sys.argv[2]))
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+class ServerProcess:
+    """backend/server.py running in a scratch directory"""
+
+    def __init__(self, workdir, port, max_connections):
+        self.url = f'http://127.0.0.1:{port}'
+        env = dict(os.environ, PYTHONPATH=BACKEND_DIR, CIF_LOG_LEVEL='WARNING',
+                   CIF_SNAPSHOT_DIR=os.path.join(workdir, 'snapshots'))
+        self.log = open(os.path.join(workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', SERVER_BOOTSTRAP, str(port), str(max_connections)],
+            cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited with code {self.process.returncode}; see {self.log.name}')
+            try:
+                urllib.request.urlopen(self.url + '/api/agents', timeout=1).read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError('Server did not start in time')
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def agent_worker(url, names, fs_params, workdir, go, stop, results):
+    """Run a share of the simulated agents in a child process"""
+    raise_fd_limit()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from simagent import SimulatedAgent, SyntheticFS
+    import jsonlog
+    jsonlog.configure(level='WARNING')
+
+    fs = SyntheticFS(**fs_params)
+    agents = [SimulatedAgent(url, fs, workdir, name=name) for name in names]
+    results.put(('ready', len(agents)))
+    go.wait()
+
+    def connect(agent):
+        started = time.time()
+        try:
+            agent.sio.connect(url, transports=['websocket'])
+            if not agent.registered.wait(60):
+                return agent.agent_id, started, None, 'timeout'
+            return agent.agent_id, started, time.time(), None
+        except Exception as e:
+            return agent.agent_id, started, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=min(64, len(agents) or 1)) as pool:
+        outcomes = list(pool.map(connect, agents))
+    results.put(('registered', outcomes))
+    stop.wait()
+    for agent in agents:
+        try:
+            agent.sio.disconnect()
+        except Exception:
+            pass
+        agent.scheduler.shutdown()
+
+
+class Analyst:
+    """Dashboard stand-in: sends REST commands and waits for relayed replies by request id"""
+
+    def __init__(self, url):
+        self.url = url
+        self.sio = socketio.Client(reconnection=False)
+        self._waiters = {}
+        # Replies that beat the REST response carrying their request id
+        self._early = {}
+        self._lock = threading.Lock()
+        for event in ('filesystem_list_response', 'file_content_response', 'file_metadata_response'):
+            self.sio.on(event, self._on_reply)
+        self.sio.connect(url, transports=['websocket'])
+
+    def _on_reply(self, data):
+        reply = {'received': time.perf_counter(), 'data': data}
+        request_id = data.get('request_id')
+        with self._lock:
+            waiter = self._waiters.pop(request_id, None)
+            if waiter is None:
+                self._early[request_id] = reply
+                return
+        waiter.update(reply)
+        waiter['event'].set()
+
+    def request(self, path, timeout=60):
+        """GET a command endpoint and wait for the agent's reply; returns (latency_ms, reply)"""
+        waiter = {'event': threading.Event()}
+        started = time.perf_counter()
+        with urllib.request.urlopen(self.url + path, timeout=timeout) as response:
+            request_id = json.load(response)['request_id']
+        with self._lock:
+            early = self._early.pop(request_id, None)
+            if early is None:
+                self._waiters[request_id] = waiter
+        if early is not None:
+            waiter.update(early)
+        elif not waiter['event'].wait(timeout):
+            with self._lock:
+                self._waiters.pop(request_id, None)
+            return None, None
+        return (waiter['received'] - started) * 1000, waiter['data']
+
+    def close(self):
+        self.sio.disconnect()
+
+
+def run_requests(analyst, paths, concurrency):
+    """Issue requests with a fixed number in flight; returns (elapsed seconds, [(latency_ms, reply)])"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(analyst.request, paths))
+    return time.perf_counter() - started, outcomes
+
+
+def summarize_requests(elapsed, outcomes, byte_count=None):
+    latencies = [latency for latency, reply in outcomes if latency is not None and not reply.get('error')]
+    result = {
+        'requests': len(outcomes),
+        'timeouts': sum(1 for latency, _ in outcomes if latency is None),
+        'errors': sum(1 for latency, reply in outcomes if latency is not None and reply.get('error')),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(outcomes) / elapsed, 2) if elapsed else None,
+        'latency': percentiles(latencies),
+    }
+    if byte_count is not None:
+        ok = [reply for latency, reply in outcomes if latency is not None and not reply.get('error')]
+        total = sum(byte_count(reply) for reply in ok)
+        result['bytes'] = total
+        result['mb_per_second'] = round(total / elapsed / (1024 * 1024), 2) if elapsed else None
+    return result
+
+
+def bench_registration(url, args, fs_params, workdir):
+    """Start the agent processes and connect every agent at once"""
+    ctx = multiprocessing.get_context('spawn')
+    go, stop, results = ctx.Event(), ctx.Event(), ctx.Queue()
+    names = [f'sim-{i:05d}' for i in range(args.agents)]
+    shares = [names[i::args.processes] for i in range(args.processes)]
+    workers = [
+        ctx.Process(target=agent_worker, args=(url, share, fs_params, workdir, go, stop, results), daemon=True)
+        for share in shares if share
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        results.get(timeout=300)
+
+    started = time.time()
+    go.set()
+    outcomes = []
+    for _ in workers:
+        kind, batch = results.get(timeout=600)
+        outcomes.extend(batch)
+    registered = [(agent_id, t0, t1) for agent_id, t0, t1, error in outcomes if error is None]
+    failures = [error for _, _, _, error in outcomes if error is not None]
+    finished = max((t1 for _, _, t1 in registered), default=started)
+    elapsed = finished - started
+    result = {
+        'agents': args.agents,
+        'registered': len(registered),
+        'failures': len(failures),
+        'seconds': round(elapsed, 3),
+        'registrations_per_second': round(len(registered) / elapsed, 2) if elapsed > 0 else None,
+        'latency': percentiles([(t1 - t0) * 1000 for _, t0, t1 in registered]),
+    }
+    if failures:
+        result['first_failure'] = failures[0]
+    return result, [agent_id for agent_id, _, _ in registered], workers, stop
+
+
+def bench_agent_list(url, args):
+    """Walk every page of /api/agents, then time repeated reads of the first page"""
+    pages = agents = 0
+    cursor = None
+    started = time.perf_counter()
+    while True:
+        query = {'limit': args.agent_list_limit}
+        if cursor:
+            query['cursor'] = cursor
+        with urllib.request.urlopen(url + '/api/agents?' + urllib.parse.urlencode(query), timeout=60) as response:
+            page = json.loads(response.read())
+        pages += 1
+        agents += len(page['agents'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    walk = time.perf_counter() - started
+    latencies = []
+    for _ in range(args.agent_list_requests):
+        request_started = time.perf_counter()
+        urllib.request.urlopen(f'{url}/api/agents?limit={args.agent_list_limit}', timeout=60).read()
+        latencies.append((time.perf_counter() - request_started) * 1000)
+    return {'agents': agents, 'pages': pages, 'walk_seconds': round(walk, 3), 'latency': percentiles(latencies)}
+
+
+def bench_listing(analyst, agent_ids, args):
+    paths = [f'/api/agents/{agent_ids[i % len(agent_ids)]}/filesystem?path=/large' for i in range(args.listing_requests)]
+    elapsed, outcomes = run_requests(analyst, paths, args.concurrency)
+    result = summarize_requests(elapsed, outcomes)
+    result['entries'] = args.listing_entries
+    return result
+
+
+def bench_chunks(analyst, agent_ids, args):
+    from simagent import READ_CHUNK_SIZE
+    chunks = args.chunk_mb * 1024 * 1024 // READ_CHUNK_SIZE
+    paths = [f'/api/agents/{agent_ids[i % len(agent_ids)]}/file?path=/big.bin&chunk_number={i}' for i in range(chunks)]
+    elapsed, outcomes = run_requests(analyst, paths, args.concurrency)
+    return summarize_requests(elapsed, outcomes, byte_count=lambda reply: reply.get('size', 0))
+
+
+def bench_hashing(analyst, agent_ids, args):
+    paths = [
+        f'/api/agents/{agent_ids[i % len(agent_ids)]}/metadata?path=/hash/f{i % args.hash_files}'
+        for i in range(args.hash_requests)
+    ]
+    elapsed, outcomes = run_requests(analyst, paths, args.concurrency)
+    return summarize_requests(elapsed, outcomes, byte_count=lambda reply: reply.get('metadata', {}).get('size', 0))
+
+
+def scrape_metrics(url):
+    """Per-event handler time from the server's /metrics, for comparing server-side cost"""
+    text = urllib.request.urlopen(url + '/metrics', timeout=10).read().decode()
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for suffix, target in (('_sum', sums), ('_count', counts)):
+            prefix = 'cif_socket_event_seconds' + suffix + '{event="'
+            if line.startswith(prefix):
+                event, value = line[len(prefix):].split('"} ')
+                target[event] = float(value)
+    return {
+        event: {'count': int(counts[event]), 'mean_ms': round(sums[event] / counts[event] * 1000, 3)}
+        for event in sums if counts.get(event)
+    }
+
+
+def run(args):
+    raise_fd_limit()
+    workdir = tempfile.mkdtemp(prefix='cif-bench-')
+    fs_params = {
+        'large_entries': args.listing_entries,
+        'big_file_size': args.chunk_mb * 1024 * 1024,
+        'hash_files': args.hash_files,
+        'hash_file_size': args.hash_mb * 1024 * 1024,
+    }
+    server = ServerProcess(workdir, args.port or free_port(), max_connections=args.agents * 2 + 100)
+    workers, stop, analyst = [], None, None
+    results = {}
+    try:
+        server.wait_ready()
+        print(f'Server up at {server.url}; connecting {args.agents} agents in {args.processes} processes')
+        results['registration'], agent_ids, workers, stop = bench_registration(server.url, args, fs_params, workdir)
+        print(f"  registration: {results['registration']['registrations_per_second']}/s")
+        if not agent_ids:
+            raise RuntimeError('No agents registered')
+        if args.agent_list_requests:
+            results['agent_list'] = bench_agent_list(server.url, args)
+            print(f"  agent list: p50 {results['agent_list']['latency'].get('p50_ms')} ms")
+        targets = agent_ids[:args.target_agents]
+        analyst = Analyst(server.url)
+        if args.listing_requests:
+            results['listing'] = bench_listing(analyst, targets, args)
+            print(f"  listing: p50 {results['listing']['latency'].get('p50_ms')} ms")
+        if args.chunk_mb:
+            results['chunks'] = bench_chunks(analyst, targets, args)
+            print(f"  chunks: {results['chunks'].get('mb_per_second')} MB/s")
+        if args.hash_requests:
+            results['hashing'] = bench_hashing(analyst, targets, args)
+            print(f"  hashing: {results['hashing'].get('mb_per_second')} MB/s")
+        results['server_events'] = scrape_metrics(server.url)
+    finally:
+        if analyst is not None:
+            analyst.close()
+        if stop is not None:
+            stop.set()
+        for worker in workers:
+            worker.join(30)
+        server.stop()
+
+    report = write_report(args, results, extra_params={'synthetic_fs': fs_params})
+    if args.keep_workdir:
+        print(f'Scratch directory kept at {workdir}')
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CIF end-to-end load test with simulated agents')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Start a server and simulated agents and measure them')
+    run_parser.add_argument('--agents', type=int, default=200, help='Simulated agents to connect (default: 200)')
+    run_parser.add_argument('--processes', type=int, default=max((os.cpu_count() or 2) - 1, 1),
+                            help='Worker processes hosting the agents (default: CPUs - 1)')
+    run_parser.add_argument('--target-agents', type=int, default=8, help='Agents that receive benchmark commands (default: 8)')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='Requests kept in flight (default: 8)')
+    run_parser.add_argument('--agent-list-requests', type=int, default=200, help='First-page /api/agents reads to time (default: 200)')
+    run_parser.add_argument('--agent-list-limit', type=int, default=500, help='Agents per /api/agents page (default: 500)')
+    run_parser.add_argument('--listing-entries', type=int, default=2000, help='Entries in the listed directory (default: 2000)')
+    run_parser.add_argument('--listing-requests', type=int, default=200, help='Directory listings to request (default: 200)')
+    run_parser.add_argument('--chunk-mb', type=int, default=32, help='MB of hex-view chunks to read (default: 32)')
+    run_parser.add_argument('--hash-files', type=int, default=16, help='Distinct files to hash (default: 16)')
+    run_parser.add_argument('--hash-mb', type=int, default=16, help='Size of each hashed file in MB (default: 16)')
+    run_parser.add_argument('--hash-requests', type=int, default=32, help='Metadata/hash requests to send (default: 32)')
+    run_parser.add_argument('--port', type=int, help='Server port (default: a free port)')
+    run_parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Report directory')
+    run_parser.add_argument('--keep-workdir', action='store_true', help='Keep the server scratch directory and log')
+    run_parser.set_defaults(func=run)
+
+    add_compare_command(commands)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""JSON benchmark reports shared by the load test and the agent benchmarks.
+
+A report records the commit, host and parameters alongside the results so
+that ``compare`` can line two runs up metric by metric and warn when they
+were not produced under the same conditions.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, 'bench-results')
+
+# Results where a smaller number is better; everything else is "higher is better"
+LOWER_IS_BETTER = ('_ms', 'seconds', 'failures', 'timeouts', 'errors')
+# Sizes of the workload rather than measurements; shown without a verdict
+WORKLOAD_FIELDS = ('count', 'requests', 'bytes', 'agents', 'entries', 'files', 'directories', 'runs')
+# Run options that do not change what is measured
+INCIDENTAL_PARAMS = ('output', 'port', 'keep_workdir', 'command', 'fixture', 'keep_fixture')
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             cwd=REPO_ROOT, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def percentiles(values):
+    """Summary of a list of latencies in milliseconds"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 3)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered), 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def write_report(args, results, prefix='', extra_params=None):
+    """Write a report for a run to args.output and return it"""
+    commit, dirty = git_commit()
+    params = dict(vars(args), **(extra_params or {}))
+    params.pop('func', None)
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'params': params,
+        'results': results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    name = f"{prefix}{report['timestamp'].replace(':', '')}-{(commit or 'unknown')[:10]}{'-dirty' if dirty else ''}.json"
+    path = os.path.join(args.output, name)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {path}')
+    return report
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    before, after = flatten(old['results']), flatten(new['results'])
+    print(f"{'metric':<48} {str(old.get('commit'))[:10]:>12} {str(new.get('commit'))[:10]:>12} {'change':>9}")
+    for name in sorted(set(before) | set(after)):
+        a, b = before.get(name), after.get(name)
+        change = ''
+        if a and b is not None:
+            delta = (b - a) / a * 100
+            if name.rsplit('.', 1)[-1] in WORKLOAD_FIELDS or abs(delta) < 1:
+                verdict = ' '
+            else:
+                better = delta < 0 if any(word in name for word in LOWER_IS_BETTER) else delta > 0
+                verdict = '+' if better else '-'
+            change = f'{delta:+.1f}%{verdict}'
+        print(f'{name:<48} {a if a is not None else "-":>12} {b if b is not None else "-":>12} {change:>9}')
+    old_params, new_params = old.get('params', {}), new.get('params', {})
+    differing = sorted(
+        key for key in set(old_params) | set(new_params)
+        if key not in INCIDENTAL_PARAMS and old_params.get(key) != new_params.get(key)
+    )
+    if differing:
+        print(f"Warning: reports were produced with different parameters: {', '.join(differing)}")
+    if old.get('host') != new.get('host'):
+        print('Warning: reports were produced on different hosts')
+
+
+def add_compare_command(commands):
+    compare_parser = commands.add_parser('compare', help='Compare two reports')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.set_defaults(func=compare)
@@ -0,0 +1,240 @@
+"""Simulated agents backed by a synthetic in-memory filesystem.
+
+``SimulatedAgent`` is a real ``CIFAgent`` -- same Socket.IO handlers,
+scheduler, governor and reply formats -- with the filesystem calls swapped
+for ``SyntheticFS``, so thousands of them can run on one machine without
+touching the disk and every agent serves identical, reproducible data.
+"""
+
+import hashlib
+import os
+import random
+import sys
+import threading
+import uuid
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'agent'))
+
+from agent import CIFAgent, HASH_CHUNK_SIZE, READ_CHUNK_SIZE  # noqa: E402
+from reconnect import CheckpointStore  # noqa: E402
+from scheduler import timed  # noqa: E402
+
+# Random bytes that file contents are sliced from
+CONTENT_BLOCK_SIZE = 1024 * 1024
+# Fixed timestamp so listings are identical across runs
+SYNTHETIC_TIME = '2023-11-14T22:13:20'
+
+
+class SyntheticFS:
+    """Deterministic tree generated on demand from the path
+
+    Every directory down to ``depth`` holds ``dirs`` subdirectories (d0, d1,
+    ...) and ``files`` files (f0, f1, ...) of ``file_size`` bytes. Three
+    fixed locations exist for benchmarks: ``/large`` with
+    ``large_entries`` files, ``/big.bin`` of ``big_file_size`` bytes, and
+    ``/hash`` with ``hash_files`` files of ``hash_file_size`` bytes.
+    """
+
+    def __init__(self, depth=3, dirs=10, files=100, file_size=4096, large_entries=2000,
+                 big_file_size=64 * 1024 * 1024, hash_files=32, hash_file_size=16 * 1024 * 1024, seed=0):
+        self.depth = depth
+        self.dirs = dirs
+        self.files = files
+        self.file_size = file_size
+        self.large_entries = large_entries
+        self.big_file_size = big_file_size
+        self.hash_files = hash_files
+        self.hash_file_size = hash_file_size
+        block = random.Random(seed).randbytes(CONTENT_BLOCK_SIZE)
+        # Doubled so any window of up to one block can be sliced without wrapping
+        self._content = block + block
+
+    def params(self):
+        return {
+            'depth': self.depth,
+            'dirs': self.dirs,
+            'files': self.files,
+            'file_size': self.file_size,
+            'large_entries': self.large_entries,
+            'big_file_size': self.big_file_size,
+            'hash_files': self.hash_files,
+            'hash_file_size': self.hash_file_size,
+        }
+
+    def _parts(self, path):
+        return [part for part in path.replace('\\', '/').split('/') if part]
+
+    def _index(self, name, prefix, limit):
+        if not name.startswith(prefix) or not name[1:].isdigit() or int(name[1:]) >= limit:
+            raise FileNotFoundError(f'No such file or directory: {name}')
+
+    def stat(self, path):
+        """Return (is_directory, size) or raise FileNotFoundError"""
+        parts = self._parts(path)
+        if not parts:
+            return True, 0
+        if parts[0] == 'large':
+            if len(parts) == 1:
+                return True, 0
+            if len(parts) == 2:
+                self._index(parts[1], 'f', self.large_entries)
+                return False, self.file_size
+        elif parts[0] == 'hash':
+            if len(parts) == 1:
+                return True, 0
+            if len(parts) == 2:
+                self._index(parts[1], 'f', self.hash_files)
+                return False, self.hash_file_size
+        elif parts == ['big.bin']:
+            return False, self.big_file_size
+        else:
+            for depth, name in enumerate(parts):
+                if name.startswith('d') and depth < self.depth:
+                    self._index(name, 'd', self.dirs)
+                    continue
+                if name.startswith('f') and depth == len(parts) - 1:
+                    self._index(name, 'f', self.files)
+                    return False, self.file_size
+                break
+            else:
+                return True, 0
+        raise FileNotFoundError(f'No such file or directory: {path}')
+
+    def list_directory(self, path):
+        is_dir, _ = self.stat(path)
+        if not is_dir:
+            raise NotADirectoryError(f'Not a directory: {path}')
+        parts = self._parts(path)
+        base = '/' + '/'.join(parts) if parts else ''
+        if parts == ['large']:
+            names = [('f%d' % i, False, self.file_size) for i in range(self.large_entries)]
+        elif parts == ['hash']:
+            names = [('f%d' % i, False, self.hash_file_size) for i in range(self.hash_files)]
+        else:
+            names = []
+            if len(parts) < self.depth:
+                names.extend(('d%d' % i, True, 0) for i in range(self.dirs))
+            names.extend(('f%d' % i, False, self.file_size) for i in range(self.files))
+            if not parts:
+                names.extend([('large', True, 0), ('hash', True, 0), ('big.bin', False, self.big_file_size)])
+        return [self.entry(f'{base}/{name}', name, is_dir, size) for name, is_dir, size in names]
+
+    def entry(self, path, name, is_dir, size):
+        """Listing entry in the same shape as CIFAgent.list_directory"""
+        return {
+            'name': name,
+            'path': path,
+            'is_directory': is_dir,
+            'size': size,
+            'created': SYNTHETIC_TIME,
+            'modified': SYNTHETIC_TIME,
+            'accessed': SYNTHETIC_TIME,
+            'mode': '755' if is_dir else '644',
+            'uid': 0,
+            'gid': 0,
+        }
+
+    def read(self, path, offset, size):
+        """Return file bytes; contents are a path-dependent rotation of one random block"""
+        is_dir, file_size = self.stat(path)
+        if is_dir:
+            raise IsADirectoryError(f'Is a directory: {path}')
+        size = max(min(size, file_size - offset), 0)
+        start = (zlib.crc32(path.encode()) + offset) % CONTENT_BLOCK_SIZE
+        if size <= CONTENT_BLOCK_SIZE:
+            return self._content[start:start + size]
+        out = bytearray()
+        while len(out) < size:
+            step = min(size - len(out), CONTENT_BLOCK_SIZE)
+            out += self._content[start:start + step]
+            start = (start + step) % CONTENT_BLOCK_SIZE
+        return bytes(out)
+
+
+class OfflineAgent(CIFAgent):
+    """CIFAgent with a throwaway identity kept in a scratch directory
+
+    Nothing is read from or written to the real agent's ID, identity or
+    checkpoint files, so benchmarks can create as many agents as they like.
+    """
+
+    def __init__(self, server_url, workdir, name=None, max_workers=2, **kwargs):
+        self.sim_name = name or f'sim-{uuid.uuid4().hex[:8]}'
+        self.workdir = workdir
+        self.registered = threading.Event()
+        super().__init__(
+            server_url,
+            max_workers=max_workers,
+            checkpoints=CheckpointStore(os.path.join(workdir, 'checkpoints', self.sim_name)),
+            **kwargs
+        )
+        # Wrap the real handler so the harness can tell when registration completed
+        handlers = self.sio.handlers['/']
+        on_registration_success = handlers['registration_success']
+
+        def registration_success(data):
+            on_registration_success(data)
+            self.registered.set()
+        handlers['registration_success'] = registration_success
+
+    def get_or_create_agent_id(self):
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f'cif-benchmark/{self.sim_name}'))
+
+    def get_identity_file(self):
+        return os.path.join(self.workdir, f'{self.sim_name}.identity.json')
+
+    def load_cached_identity(self):
+        return None
+
+    def save_cached_identity(self, identity):
+        pass
+
+    def get_quick_identity(self):
+        return {
+            'hostname': self.sim_name,
+            'computer_name': self.sim_name.upper(),
+            'domain_name': 'BENCH',
+            'ip_addresses': ['127.0.0.1'],
+        }
+
+    def start_identity_refresh(self):
+        # Synthetic identity never changes, so skip the refresh thread
+        pass
+
+
+class SimulatedAgent(OfflineAgent):
+    """CIFAgent serving a SyntheticFS instead of the local disk"""
+
+    def __init__(self, server_url, fs, workdir, name=None, max_workers=2):
+        self.fs = fs
+        super().__init__(server_url, workdir, name=name, max_workers=max_workers)
+
+    def list_directory(self, path, use_cache=True):
+        return self.fs.list_directory(path)
+
+    def read_chunk(self, file_path, chunk_number, chunk_size=None):
+        chunk_size = chunk_size or READ_CHUNK_SIZE
+        with timed('read'):
+            chunk = self.fs.read(file_path, chunk_number * chunk_size, chunk_size)
+        self.governor.throttle_read(len(chunk))
+        return chunk, self.fs.stat(file_path)[1]
+
+    def hash_file(self, file_path):
+        md5_hash = hashlib.md5()
+        _, size = self.fs.stat(file_path)
+        with timed('hash'):
+            for offset in range(0, size, HASH_CHUNK_SIZE):
+                chunk = self.fs.read(file_path, offset, HASH_CHUNK_SIZE)
+                self.governor.throttle_read(len(chunk))
+                md5_hash.update(chunk)
+        return md5_hash.hexdigest()
+
+    def get_file_metadata(self, file_path, use_cache=True, digests=None):
+        is_dir, size = self.fs.stat(file_path)
+        metadata = self.fs.entry(file_path, file_path.rsplit('/', 1)[-1], is_dir, size)
+        if digests:
+            metadata.update(digests)
+        elif not is_dir:
+            metadata['md5'] = self.hash_file(file_path)
+        return metadata
@@ -1,5 +1,5 @@
 import React from 'react';
-import { BrowserRouter as Router, Routes, Route, Navigate } from 'react-router-dom';
+import { BrowserRouter as Router, Routes, Route, Navigate, useParams } from 'react-router-dom';
 import { ThemeProvider, createTheme } from '@mui/material/styles';
 import CssBaseline from '@mui/material/CssBaseline';
 import Dashboard from './components/Dashboard';
@@ -18,6 +18,12 @@ const darkTheme = createTheme({
   },
 });
 
+// A fresh view per agent, so listings and selection never carry over from the previous one
+function AgentRoute() {
+  const { agentId } = useParams();
+  return <AgentView key={agentId} />;
+}
+
 function App() {
   return (
     <ThemeProvider theme={darkTheme}>
@@ -25,7 +31,7 @@ function App() {
       <Router>
         <Routes>
           <Route path="/" element={<Dashboard />} />
-          <Route path="/agent/:agentId" element={<AgentView />} />
+          <Route path="/agent/:agentId" element={<AgentRoute />} />
           <Route path="*" element={<Navigate to="/" replace />} />
         </Routes>
       </Router>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useDeferredValue } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import io from 'socket.io-client';
 import {
@@ -7,77 +7,120 @@ import {
   Toolbar,
   Typography,
   IconButton,
-  Paper,
-  List,
-  ListItem,
-  ListItemIcon,
-  ListItemText,
   Breadcrumbs,
   Link,
-  Divider,
   Grid,
-  CircularProgress,
+  LinearProgress,
   Chip,
+  TextField,
+  Select,
+  MenuItem,
+  Tooltip,
 } from '@mui/material';
 import {
   ArrowBack as ArrowBackIcon,
-  Folder as FolderIcon,
-  InsertDriveFile as FileIcon,
   Refresh as RefreshIcon,
+  History as HistoryIcon,
+  ArrowUpward as ArrowUpwardIcon,
+  ArrowDownward as ArrowDownwardIcon,
 } from '@mui/icons-material';
 import FileViewer from './FileViewer';
 import MetadataPanel from './MetadataPanel';
+import SnapshotDiff from './SnapshotDiff';
+import DirectoryList, { createListing, appendPage } from './DirectoryList';
 import axios from 'axios';
 
 const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
+// Entries per filesystem_list page; the first page is shown while the rest stream
+const LIST_PAGE_SIZE = 1000;
+// Directory listings kept for revisits; the least recently opened is dropped first
+const MAX_CACHED_LISTINGS = 50;
+// Cached listings older than this are flagged as stale
+const STALE_AFTER_MS = 5 * 60 * 1000;
+
+const formatAge = (ms) => {
+  const seconds = Math.floor(ms / 1000);
+  if (seconds < 60) return `${seconds}s ago`;
+  if (seconds < 3600) return `${Math.floor(seconds / 60)} min ago`;
+  return `${Math.floor(seconds / 3600)} h ago`;
+};
 
 function AgentView() {
   const { agentId } = useParams();
   const navigate = useNavigate();
   const [socket, setSocket] = useState(null);
+  const [connected, setConnected] = useState(false);
   const [agentInfo, setAgentInfo] = useState(null);
   const [currentPath, setCurrentPath] = useState('/');
-  const [entries, setEntries] = useState([]);
-  const [loading, setLoading] = useState(false);
+  // Bumped whenever a cached listing changes, since listings are updated in place
+  const [listingVersion, setListingVersion] = useState(0);
+  const [filter, setFilter] = useState('');
+  const [sortKey, setSortKey] = useState('name');
+  const [descending, setDescending] = useState(false);
+  const [now, setNow] = useState(Date.now());
   const [selectedFile, setSelectedFile] = useState(null);
-  const [fileContent, setFileContent] = useState(null);
   const [fileMetadata, setFileMetadata] = useState(null);
+  const [evidence, setEvidence] = useState(null);
+  // Set once the evidence lookup is done, so the viewer knows where to read from
+  const [sourceReady, setSourceReady] = useState(false);
+  const [diffOpen, setDiffOpen] = useState(false);
+  // Read by socket handlers, which are registered once per agent
+  const selectedPathRef = useRef(null);
+  const listingsRef = useRef(new Map());
+  // Pages that arrived before the request that asked for them returned its request_id
+  const earlyPagesRef = useRef(new Map());
+  const deferredFilter = useDeferredValue(filter);
 
   useEffect(() => {
     // Fetch agent information
     const fetchAgentInfo = async () => {
       try {
-        const response = await axios.get(`${API_BASE}/api/agents`);
-        const agent = response.data.find(a => a.id === agentId);
-        if (agent) {
-          setAgentInfo(agent);
-        }
+        const response = await axios.get(`${API_BASE}/api/agents/${agentId}`);
+        setAgentInfo(response.data);
       } catch (error) {
         console.error('Failed to fetch agent info:', error);
       }
     };
-    
+
     fetchAgentInfo();
-    
+    listingsRef.current = new Map();
+    earlyPagesRef.current = new Map();
+
     const newSocket = io(API_BASE);
     setSocket(newSocket);
 
+    newSocket.on('connect', () => setConnected(true));
+    newSocket.on('disconnect', () => setConnected(false));
+
     newSocket.on('filesystem_list_response', (data) => {
-      if (data.agent_id === agentId) {
-        setEntries(data.entries || []);
-        setLoading(false);
+      if (data.agent_id !== agentId) return;
+      const listing = listingsRef.current.get(data.path);
+      if (listing && listing.requestId === data.request_id) {
+        appendPage(listing, data);
+        setListingVersion((v) => v + 1);
+      } else if (listing && listing.requesting) {
+        const pages = earlyPagesRef.current.get(data.request_id) || [];
+        earlyPagesRef.current.set(data.request_id, pages.concat([data]));
+      }
+      // Pages of a superseded request are dropped
+    });
+
+    newSocket.on('file_metadata_response', (data) => {
+      if (data.agent_id === agentId && data.path === selectedPathRef.current) {
+        setFileMetadata(data.metadata);
       }
     });
 
-    newSocket.on('file_content_response', (data) => {
-      if (data.agent_id === agentId) {
-        setFileContent(data);
+    newSocket.on('agents_changed', (data) => {
+      const agent = data.agents.find(a => a.id === agentId);
+      if (agent) {
+        setAgentInfo(agent);
       }
     });
 
-    newSocket.on('file_metadata_response', (data) => {
-      if (data.agent_id === agentId) {
-        setFileMetadata(data.metadata);
+    newSocket.on('acquisition_complete', (data) => {
+      if (data.agent_id === agentId && data.status === 'complete' && data.path === selectedPathRef.current) {
+        setEvidence(data);
       }
     });
 
@@ -86,45 +129,118 @@ function AgentView() {
     };
   }, [agentId]);
 
+  // Keeps the staleness indicator current
   useEffect(() => {
-    if (socket && socket.connected) {
-      loadDirectory(currentPath);
-    }
-  }, [socket, currentPath]);
+    const timer = setInterval(() => setNow(Date.now()), 15000);
+    return () => clearInterval(timer);
+  }, []);
 
-  const loadDirectory = (path) => {
-    setLoading(true);
-    setEntries([]);
-    socket.emit('list_directory', { path });
+  const loadDirectory = async (path, refresh = false) => {
+    const listings = listingsRef.current;
+    // A refreshed listing keeps its old entries until the first new page replaces them
+    const listing = listings.get(path) || createListing(path);
+    listing.requesting = true;
+    listings.delete(path);
+    listings.set(path, listing);
+    while (listings.size > MAX_CACHED_LISTINGS) {
+      listings.delete(listings.keys().next().value);
+    }
+    setListingVersion((v) => v + 1);
+    try {
+      const response = await axios.get(`${API_BASE}/api/agents/${agentId}/filesystem`, {
+        params: { path, page_size: LIST_PAGE_SIZE, refresh },
+      });
+      listing.requestId = response.data.request_id;
+      listing.done = false;
+      const early = earlyPagesRef.current.get(listing.requestId) || [];
+      earlyPagesRef.current.delete(listing.requestId);
+      early.forEach((data) => appendPage(listing, data));
+    } catch (error) {
+      listing.error = error.response ? error.response.data.error : 'Agent unreachable';
+      listing.done = true;
+    }
+    listing.requesting = false;
+    setListingVersion((v) => v + 1);
   };
 
+  // Cached listings are shown without asking the agent again; incomplete ones are re-requested
+  useEffect(() => {
+    if (!connected) return;
+    const listing = listingsRef.current.get(currentPath);
+    if (listing && listing.done && !listing.error) {
+      listingsRef.current.delete(currentPath);
+      listingsRef.current.set(currentPath, listing);
+      setListingVersion((v) => v + 1);
+      return;
+    }
+    loadDirectory(currentPath);
+  }, [connected, currentPath]);
+
   const handleItemClick = (entry) => {
     if (entry.is_directory) {
       setCurrentPath(entry.path);
+      setFilter('');
       setSelectedFile(null);
-      setFileContent(null);
       setFileMetadata(null);
+      setEvidence(null);
+      selectedPathRef.current = null;
     } else {
       setSelectedFile(entry);
-      loadFile(entry.path);
+      openFile(entry.path);
     }
   };
 
-  const loadFile = (filePath, chunkNumber = 0) => {
-    socket.emit('read_file', { path: filePath, chunk_number: chunkNumber });
-    socket.emit('get_metadata', { path: filePath });
+  const openFile = async (filePath) => {
+    selectedPathRef.current = filePath;
+    setFileMetadata(null);
+    setEvidence(null);
+    setSourceReady(false);
+    axios.get(`${API_BASE}/api/agents/${agentId}/metadata`, { params: { path: filePath } })
+      .catch((error) => console.error('Failed to request metadata:', error));
+    // A verified copy on the server is read from there instead of from the agent
+    try {
+      const response = await axios.get(`${API_BASE}/api/agents/${agentId}/acquisitions`, {
+        params: { path: filePath, status: 'complete' },
+      });
+      if (selectedPathRef.current !== filePath) return;
+      if (response.data.length > 0) {
+        setEvidence(response.data[0]);
+      }
+    } catch (error) {
+      console.error('Failed to look up acquisitions:', error);
+    }
+    if (selectedPathRef.current === filePath) {
+      setSourceReady(true);
+    }
   };
 
-  const handleBreadcrumbClick = (path) => {
-    setCurrentPath(path);
+  // options.base_id re-acquires as a delta of that stored copy
+  const acquireFile = async (filePath, options = {}) => {
+    try {
+      await axios.post(`${API_BASE}/api/agents/${agentId}/acquisitions`, { path: filePath, ...options });
+    } catch (error) {
+      console.error('Failed to start acquisition:', error);
+    }
   };
 
-  const formatSize = (bytes) => {
-    if (bytes === 0) return '0 B';
-    const k = 1024;
-    const sizes = ['B', 'KB', 'MB', 'GB'];
-    const i = Math.floor(Math.log(bytes) / Math.log(k));
-    return Math.round(bytes / Math.pow(k, i) * 100) / 100 + ' ' + sizes[i];
+  // Verified evidence can be opened as a raw disk image, served by the server as another agent
+  const analyzeImage = async (acquisition) => {
+    try {
+      const response = await axios.post(`${API_BASE}/api/images`, { acquisition_id: acquisition.id });
+      navigate(`/agent/${response.data.id}`);
+    } catch (error) {
+      console.error('Failed to open disk image:', error);
+    }
+  };
+
+  // Archive members are listed by the agent under the archive's path followed by "!"
+  const browseArchive = (entry) => {
+    handleItemClick({ is_directory: true, path: `${entry.path}!` });
+  };
+
+  const handleBreadcrumbClick = (path) => {
+    setCurrentPath(path);
+    setFilter('');
   };
 
   const formatAgentName = () => {
@@ -135,13 +251,29 @@ function AgentView() {
     return agentInfo.computer_name || agentInfo.hostname || agentId;
   };
 
-  const formatDate = (dateString) => {
-    if (!dateString) return 'N/A';
-    return new Date(dateString).toLocaleString();
-  };
-
   const pathParts = currentPath.split('/').filter(p => p);
   const breadcrumbs = ['/'].concat(pathParts);
+  const listing = listingsRef.current.get(currentPath) || null;
+
+  const listingStatus = () => {
+    if (!listing) return null;
+    if (!listing.done) {
+      const progress = listing.total ? ` ${listing.loaded.toLocaleString()} of ${listing.total.toLocaleString()}` : '';
+      return <Chip label={`Loading${progress}`} size="small" />;
+    }
+    if (listing.error) {
+      return <Chip label={listing.error} color="error" size="small" />;
+    }
+    const age = Math.max(now - listing.fetchedAt, 0);
+    const stale = age >= STALE_AFTER_MS;
+    return (
+      <Chip
+        label={`${listing.loaded.toLocaleString()} entries · ${stale ? 'stale, ' : ''}listed ${formatAge(age)}`}
+        color={stale ? 'warning' : 'default'}
+        size="small"
+      />
+    );
+  };
 
   return (
     <Box sx={{ height: '100vh', display: 'flex', flexDirection: 'column' }}>
@@ -158,10 +290,10 @@ function AgentView() {
           <Typography variant="h6" component="div" sx={{ flexGrow: 1 }}>
             {formatAgentName()}
             {agentInfo && agentInfo.domain_name && (
-              <Chip 
-                label={agentInfo.domain_name} 
-                size="small" 
-                color="primary" 
+              <Chip
+                label={agentInfo.domain_name}
+                size="small"
+                color="primary"
                 sx={{ ml: 1 }}
               />
             )}
@@ -171,12 +303,17 @@ function AgentView() {
               {agentInfo.ip_addresses.join(', ')}
             </Typography>
           )}
-          <IconButton color="inherit" onClick={() => loadDirectory(currentPath)}>
+          <IconButton color="inherit" onClick={() => setDiffOpen(true)}>
+            <HistoryIcon />
+          </IconButton>
+          <IconButton color="inherit" onClick={() => loadDirectory(currentPath, true)}>
             <RefreshIcon />
           </IconButton>
         </Toolbar>
       </AppBar>
 
+      <SnapshotDiff socket={socket} agentId={agentId} open={diffOpen} onClose={() => setDiffOpen(false)} />
+
       <Box sx={{ flex: 1, display: 'flex', overflow: 'hidden' }}>
         {/* File System Browser */}
         <Box sx={{ width: '400px', display: 'flex', flexDirection: 'column', borderRight: 1, borderColor: 'divider' }}>
@@ -197,45 +334,39 @@ function AgentView() {
                 );
               })}
             </Breadcrumbs>
+            <Box sx={{ display: 'flex', alignItems: 'center', mt: 1 }}>
+              <TextField
+                size="small"
+                placeholder="Filter..."
+                value={filter}
+                onChange={(e) => setFilter(e.target.value)}
+                sx={{ flex: 1, mr: 1 }}
+              />
+              <Select size="small" value={sortKey} onChange={(e) => setSortKey(e.target.value)}>
+                <MenuItem value="name">Name</MenuItem>
+                <MenuItem value="size">Size</MenuItem>
+                <MenuItem value="modified">Modified</MenuItem>
+              </Select>
+              <Tooltip title={descending ? 'Descending' : 'Ascending'}>
+                <IconButton size="small" onClick={() => setDescending(!descending)}>
+                  {descending ? <ArrowDownwardIcon /> : <ArrowUpwardIcon />}
+                </IconButton>
+              </Tooltip>
+            </Box>
+            <Box sx={{ mt: 1 }}>{listingStatus()}</Box>
           </Box>
 
-          {loading ? (
-            <Box sx={{ display: 'flex', justifyContent: 'center', p: 4 }}>
-              <CircularProgress />
-            </Box>
-          ) : (
-            <List sx={{ flex: 1, overflow: 'auto' }}>
-              {entries.map((entry, index) => (
-                <React.Fragment key={index}>
-                  <ListItem
-                    button
-                    onClick={() => handleItemClick(entry)}
-                    selected={selectedFile && selectedFile.path === entry.path}
-                  >
-                    <ListItemIcon>
-                      {entry.is_directory ? <FolderIcon /> : <FileIcon />}
-                    </ListItemIcon>
-                    <ListItemText
-                      primary={entry.name}
-                      secondary={
-                        <Box>
-                          {!entry.is_directory && (
-                            <Typography variant="caption" display="block">
-                              {formatSize(entry.size)} • {formatDate(entry.modified)}
-                            </Typography>
-                          )}
-                          {entry.error && (
-                            <Chip label={entry.error} color="error" size="small" sx={{ mt: 0.5 }} />
-                          )}
-                        </Box>
-                      }
-                    />
-                  </ListItem>
-                  <Divider />
-                </React.Fragment>
-              ))}
-            </List>
-          )}
+          {listing && !listing.done && <LinearProgress />}
+          <DirectoryList
+            listing={listing}
+            version={listingVersion}
+            filter={deferredFilter}
+            sortKey={sortKey}
+            descending={descending}
+            selectedPath={selectedFile && selectedFile.path}
+            onSelect={handleItemClick}
+            onBrowseArchive={browseArchive}
+          />
         </Box>
 
         {/* Main Content Area */}
@@ -243,7 +374,17 @@ function AgentView() {
           {selectedFile ? (
             <Grid container sx={{ height: '100%' }}>
               <Grid item xs={12} md={fileMetadata ? 8 : 12} sx={{ height: '100%', overflow: 'hidden' }}>
-                <FileViewer file={selectedFile} fileContent={fileContent} onLoadChunk={loadFile} />
+                <FileViewer
+                  key={selectedFile.path}
+                  file={selectedFile}
+                  agentId={agentId}
+                  socket={socket}
+                  evidence={evidence}
+                  ready={sourceReady}
+                  fromImage={Boolean(agentInfo && agentInfo.status === 'image')}
+                  onAcquire={acquireFile}
+                  onAnalyzeImage={analyzeImage}
+                />
               </Grid>
               {fileMetadata && (
                 <Grid item xs={12} md={4} sx={{ height: '100%', overflow: 'auto', borderLeft: 1, borderColor: 'divider' }}>
@@ -266,4 +407,3 @@ function AgentView() {
 }
 
 export default AgentView;
-
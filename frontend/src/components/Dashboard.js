@@ -1,5 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
+import io from 'socket.io-client';
 import {
   Container,
   Typography,
@@ -17,45 +18,172 @@ import {
   Toolbar,
   CircularProgress,
   Tooltip,
+  TextField,
+  MenuItem,
+  Button,
 } from '@mui/material';
 import {
   Computer as ComputerIcon,
   CheckCircle as CheckCircleIcon,
   Cancel as CancelIcon,
+  Storage as StorageIcon,
   Refresh as RefreshIcon,
 } from '@mui/icons-material';
 import axios from 'axios';
 
 const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
+const PAGE_SIZE = 500;
+const MAX_PAGE_SIZE = 5000;
+const EMPTY_FILTERS = { name: '', status: '', platform: '', domain: '' };
+
+// The server orders the list by lower-cased computer name, then id
+const nameKey = (agent) => (agent.computer_name || '').toLowerCase();
+
+const compareAgents = (a, b) => {
+  const [keyA, keyB] = [nameKey(a), nameKey(b)];
+  if (keyA !== keyB) return keyA < keyB ? -1 : 1;
+  if (a.id === b.id) return 0;
+  return a.id < b.id ? -1 : 1;
+};
+
+// Same filters as the server applies to the list
+const matchesFilters = (agent, filters) => {
+  const statuses = filters.status.split(',').filter(Boolean);
+  return (statuses.length === 0 || statuses.includes(agent.status))
+    && (!filters.platform || agent.platform === filters.platform)
+    && (!filters.domain || agent.domain_name === filters.domain)
+    && (!filters.name || nameKey(agent).startsWith(filters.name.toLowerCase()));
+};
 
 function Dashboard() {
   const [agents, setAgents] = useState([]);
+  const [total, setTotal] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [filters, setFilters] = useState(EMPTY_FILTERS);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
+  // Read by socket handlers, which are registered once
+  const agentsRef = useRef([]);
+  const nextCursorRef = useRef(null);
+  const filtersRef = useRef(EMPTY_FILTERS);
+  // Bumped by every fetch of the first page, so responses to superseded ones are dropped
+  const fetchSeq = useRef(0);
 
   useEffect(() => {
-    fetchAgents();
-    const interval = setInterval(fetchAgents, 5000); // Refresh every 5 seconds
-    return () => clearInterval(interval);
+    agentsRef.current = agents;
+  }, [agents]);
+
+  useEffect(() => {
+    nextCursorRef.current = nextCursor;
+  }, [nextCursor]);
+
+  useEffect(() => {
+    // Status changes are pushed by the server instead of polled
+    const socket = io(API_BASE);
+    socket.on('connect', () => fetchAgents());
+    socket.on('agents_changed', (data) => {
+      // Applied here rather than refetched; changes past the last loaded agent
+      // are picked up when that part of the list is loaded
+      const current = agentsRef.current;
+      const last = nextCursorRef.current && current.length ? current[current.length - 1] : null;
+      const inView = (agent) => matchesFilters(agent, filtersRef.current) && (!last || compareAgents(agent, last) <= 0);
+      const changed = new Map(data.agents.map((agent) => [agent.id, agent]));
+      let added = 0;
+      const next = [];
+      current.forEach((agent) => {
+        const update = changed.get(agent.id);
+        changed.delete(agent.id);
+        if (!update) {
+          next.push(agent);
+        } else if (inView(update)) {
+          next.push(update);
+        } else if (!matchesFilters(update, filtersRef.current)) {
+          added -= 1;
+        }
+      });
+      changed.forEach((agent) => {
+        if (inView(agent)) {
+          next.push(agent);
+          added += 1;
+        }
+      });
+      next.sort(compareAgents);
+      agentsRef.current = next;
+      setAgents(next);
+      setTotal((count) => count + added);
+    });
+    return () => {
+      socket.close();
+    };
   }, []);
 
-  const fetchAgents = async () => {
+  useEffect(() => {
+    filtersRef.current = filters;
+    const timer = setTimeout(() => fetchAgents(), 300);
+    return () => clearTimeout(timer);
+  }, [filters]);
+
+  const queryParams = () => {
+    const params = {};
+    Object.entries(filtersRef.current).forEach(([key, value]) => {
+      if (value) params[key] = value;
+    });
+    return params;
+  };
+
+  const fetchAgents = async (count = PAGE_SIZE) => {
+    fetchSeq.current += 1;
+    const seq = fetchSeq.current;
     try {
-      const response = await axios.get(`${API_BASE}/api/agents`);
-      setAgents(response.data);
+      const response = await axios.get(`${API_BASE}/api/agents`, {
+        params: { ...queryParams(), limit: Math.min(Math.max(count, PAGE_SIZE), MAX_PAGE_SIZE) },
+      });
+      if (seq !== fetchSeq.current) return;
+      agentsRef.current = response.data.agents;
+      setAgents(response.data.agents);
+      setTotal(response.data.total);
+      setNextCursor(response.data.next_cursor);
       setLoading(false);
     } catch (error) {
+      if (seq !== fetchSeq.current) return;
       console.error('Failed to fetch agents:', error);
       setLoading(false);
     }
   };
 
+  const fetchMore = async () => {
+    const seq = fetchSeq.current;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API_BASE}/api/agents`, {
+        params: { ...queryParams(), limit: PAGE_SIZE, cursor: nextCursor },
+      });
+      // A page of a list that has since been fetched again does not follow it
+      if (seq === fetchSeq.current) {
+        agentsRef.current = agentsRef.current.concat(response.data.agents);
+        setAgents(agentsRef.current);
+        setTotal(response.data.total);
+        setNextCursor(response.data.next_cursor);
+      }
+    } catch (error) {
+      console.error('Failed to fetch agents:', error);
+    }
+    setLoadingMore(false);
+  };
+
+  const setFilter = (key) => (event) => {
+    setFilters((current) => ({ ...current, [key]: event.target.value }));
+  };
+
   const getStatusColor = (status) => {
     switch (status) {
       case 'active':
         return 'success';
       case 'offline':
         return 'default';
+      case 'image':
+        return 'info';
       case 'error':
         return 'error';
       default:
@@ -93,7 +221,7 @@ function Dashboard() {
           <Typography variant="h6" component="div" sx={{ flexGrow: 1 }}>
             Computer Investigations Framework
           </Typography>
-          <IconButton color="inherit" onClick={fetchAgents}>
+          <IconButton color="inherit" onClick={() => fetchAgents(agents.length)}>
             <RefreshIcon />
           </IconButton>
         </Toolbar>
@@ -104,6 +232,27 @@ function Dashboard() {
           Registered Agents
         </Typography>
 
+        <Box sx={{ display: 'flex', gap: 2, mb: 2, alignItems: 'center' }}>
+          <TextField size="small" label="Name starts with" value={filters.name} onChange={setFilter('name')} />
+          <TextField select size="small" label="Status" value={filters.status} onChange={setFilter('status')} sx={{ width: 140 }}>
+            <MenuItem value="">All</MenuItem>
+            <MenuItem value="active">Active</MenuItem>
+            <MenuItem value="offline">Offline</MenuItem>
+            <MenuItem value="error">Error</MenuItem>
+            <MenuItem value="image">Disk image</MenuItem>
+          </TextField>
+          <TextField select size="small" label="Platform" value={filters.platform} onChange={setFilter('platform')} sx={{ width: 140 }}>
+            <MenuItem value="">All</MenuItem>
+            <MenuItem value="Windows">Windows</MenuItem>
+            <MenuItem value="Linux">Linux</MenuItem>
+            <MenuItem value="Darwin">macOS</MenuItem>
+          </TextField>
+          <TextField size="small" label="Domain" value={filters.domain} onChange={setFilter('domain')} />
+          <Typography variant="body2" color="text.secondary" sx={{ ml: 'auto' }}>
+            Showing {agents.length} of {total}
+          </Typography>
+        </Box>
+
         {loading ? (
           <Box sx={{ display: 'flex', justifyContent: 'center', mt: 4 }}>
             <CircularProgress />
@@ -127,7 +276,9 @@ function Dashboard() {
                 {agents.length === 0 ? (
                   <TableRow>
                     <TableCell colSpan={8} align="center">
-                      No agents registered. Install an agent on an endpoint to begin.
+                      {Object.values(filters).some((value) => value)
+                        ? 'No agents match the filters.'
+                        : 'No agents registered. Install an agent on an endpoint to begin.'}
                     </TableCell>
                   </TableRow>
                 ) : (
@@ -181,6 +332,8 @@ function Dashboard() {
                           icon={
                             agent.status === 'active' ? (
                               <CheckCircleIcon />
+                            ) : agent.status === 'image' ? (
+                              <StorageIcon />
                             ) : (
                               <CancelIcon />
                             )
@@ -205,6 +358,13 @@ function Dashboard() {
                 )}
               </TableBody>
             </Table>
+            {nextCursor && (
+              <Box sx={{ display: 'flex', justifyContent: 'center', p: 2 }}>
+                <Button onClick={fetchMore} disabled={loadingMore}>
+                  {loadingMore ? 'Loading…' : 'Load more'}
+                </Button>
+              </Box>
+            )}
           </TableContainer>
         )}
       </Container>
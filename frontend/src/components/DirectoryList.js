@@ -0,0 +1,231 @@
+import React, { useState, useEffect, useRef, useMemo } from 'react';
+import {
+  Box,
+  IconButton,
+  Tooltip,
+  ListItem,
+  ListItemIcon,
+  ListItemText,
+  Typography,
+  Chip,
+} from '@mui/material';
+import {
+  Folder as FolderIcon,
+  InsertDriveFile as FileIcon,
+  Archive as ArchiveIcon,
+} from '@mui/icons-material';
+
+const ROW_HEIGHT = 56;
+// Rows rendered above and below the visible ones
+const OVERSCAN_ROWS = 10;
+
+/**
+ * Listing of one directory, filled in as filesystem_list pages arrive.
+ * Names, sizes and times are kept in flat arrays so sorting and filtering
+ * 100k entries does not touch the entry objects.
+ */
+export const createListing = (path, requestId) => ({
+  path,
+  requestId,
+  entries: [],
+  names: [],
+  isDirectory: new Uint8Array(0),
+  sizes: new Float64Array(0),
+  modified: new Float64Array(0),
+  loaded: 0,
+  total: null,
+  done: false,
+  error: null,
+  fetchedAt: null,
+});
+
+const grow = (array, length) => {
+  if (array.length >= length) return array;
+  const grown = new array.constructor(Math.max(length, array.length * 2));
+  grown.set(array);
+  return grown;
+};
+
+// Add a filesystem_list page; the first page of a request replaces what was there
+export const appendPage = (listing, data) => {
+  if (data.error) {
+    listing.error = data.error;
+    listing.done = true;
+    return;
+  }
+  const offset = data.offset || 0;
+  const entries = data.entries || [];
+  const total = data.total != null ? data.total : offset + entries.length;
+  if (offset === 0) {
+    listing.entries = [];
+    listing.names = [];
+    listing.isDirectory = new Uint8Array(total);
+    listing.sizes = new Float64Array(total);
+    listing.modified = new Float64Array(total);
+    listing.loaded = 0;
+    listing.error = null;
+  }
+  const end = offset + entries.length;
+  listing.isDirectory = grow(listing.isDirectory, end);
+  listing.sizes = grow(listing.sizes, end);
+  listing.modified = grow(listing.modified, end);
+  entries.forEach((entry, i) => {
+    listing.entries[offset + i] = entry;
+    listing.names[offset + i] = (entry.name || '').toLowerCase();
+    listing.isDirectory[offset + i] = entry.is_directory ? 1 : 0;
+    listing.sizes[offset + i] = entry.size || 0;
+    listing.modified[offset + i] = Date.parse(entry.modified) || 0;
+  });
+  listing.loaded = Math.max(listing.loaded, end);
+  listing.total = total;
+  listing.done = data.done !== false;
+  if (listing.done) listing.fetchedAt = Date.now();
+};
+
+// Indices of the loaded entries matching filter, directories first, in sort order
+const orderEntries = (listing, filter, sortKey, descending) => {
+  const { names, isDirectory } = listing;
+  const needle = filter.trim().toLowerCase();
+  let order;
+  if (needle) {
+    const matches = [];
+    for (let i = 0; i < listing.loaded; i++) {
+      if (names[i] !== undefined && names[i].includes(needle)) matches.push(i);
+    }
+    order = Uint32Array.from(matches);
+  } else {
+    order = new Uint32Array(listing.loaded);
+    for (let i = 0; i < order.length; i++) order[i] = i;
+  }
+  // Agents send listings directories first and by name, so that order needs no sort
+  if (sortKey === 'name' && !descending) return order;
+  const direction = descending ? -1 : 1;
+  const values = sortKey === 'size' ? listing.sizes : sortKey === 'modified' ? listing.modified : null;
+  return order.sort((a, b) => {
+    if (isDirectory[a] !== isDirectory[b]) return isDirectory[b] - isDirectory[a];
+    if (values) {
+      if (values[a] !== values[b]) return (values[a] - values[b]) * direction;
+      return a - b;
+    }
+    return a === b ? 0 : (a < b ? -direction : direction);
+  });
+};
+
+const formatSize = (bytes) => {
+  if (!bytes) return '0 B';
+  const k = 1024;
+  const sizes = ['B', 'KB', 'MB', 'GB', 'TB'];
+  const i = Math.min(Math.floor(Math.log(bytes) / Math.log(k)), sizes.length - 1);
+  return Math.round(bytes / Math.pow(k, i) * 100) / 100 + ' ' + sizes[i];
+};
+
+const formatDate = (dateString) => {
+  if (!dateString) return 'N/A';
+  return new Date(dateString).toLocaleString();
+};
+
+function DirectoryList({ listing, version, filter, sortKey, descending, selectedPath, onSelect, onBrowseArchive }) {
+  const [scrollTop, setScrollTop] = useState(0);
+  const [viewportHeight, setViewportHeight] = useState(600);
+  const viewportRef = useRef(null);
+
+  // version changes whenever a page is appended to the (mutable) listing
+  const order = useMemo(
+    () => (listing ? orderEntries(listing, filter, sortKey, descending) : new Uint32Array(0)),
+    [listing, version, filter, sortKey, descending]
+  );
+
+  useEffect(() => {
+    const measure = () => {
+      if (viewportRef.current) setViewportHeight(viewportRef.current.clientHeight);
+    };
+    measure();
+    window.addEventListener('resize', measure);
+    return () => window.removeEventListener('resize', measure);
+  }, []);
+
+  // A new directory starts at the top
+  useEffect(() => {
+    if (viewportRef.current) viewportRef.current.scrollTop = 0;
+    setScrollTop(0);
+  }, [listing && listing.path]);
+
+  const startRow = Math.max(Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN_ROWS, 0);
+  const endRow = Math.min(Math.ceil((scrollTop + viewportHeight) / ROW_HEIGHT) + OVERSCAN_ROWS, order.length);
+
+  const rows = [];
+  for (let row = startRow; row < endRow; row++) {
+    const entry = listing.entries[order[row]];
+    if (!entry) continue;
+    rows.push(
+      <ListItem
+        key={entry.path}
+        button
+        divider
+        onClick={() => onSelect(entry)}
+        selected={selectedPath === entry.path}
+        sx={{ position: 'absolute', top: row * ROW_HEIGHT, left: 0, right: 0, height: ROW_HEIGHT }}
+      >
+        <ListItemIcon>
+          {entry.is_directory ? <FolderIcon /> : <FileIcon />}
+        </ListItemIcon>
+        <ListItemText
+          primary={entry.name}
+          primaryTypographyProps={{ noWrap: true }}
+          secondary={
+            entry.error ? (
+              <Chip label={entry.error} color="error" size="small" component="span" />
+            ) : entry.deleted ? (
+              <>
+                <Chip
+                  label={entry.recoverable ? 'Deleted' : 'Deleted · not recoverable'}
+                  color="warning"
+                  size="small"
+                  component="span"
+                  sx={{ mr: 1 }}
+                />
+                {!entry.is_directory && formatSize(entry.size)}
+              </>
+            ) : (
+              !entry.is_directory && `${formatSize(entry.size)} • ${formatDate(entry.modified)}`
+            )
+          }
+          secondaryTypographyProps={{ noWrap: true, component: 'span' }}
+        />
+        {entry.archive && (
+          <Tooltip title="Browse archive">
+            <IconButton
+              edge="end"
+              onClick={(e) => {
+                e.stopPropagation();
+                onBrowseArchive(entry);
+              }}
+            >
+              <ArchiveIcon />
+            </IconButton>
+          </Tooltip>
+        )}
+      </ListItem>
+    );
+  }
+
+  return (
+    <Box
+      ref={viewportRef}
+      onScroll={(e) => setScrollTop(e.currentTarget.scrollTop)}
+      sx={{ flex: 1, overflow: 'auto' }}
+    >
+      {listing && listing.done && order.length === 0 ? (
+        <Box sx={{ p: 4, textAlign: 'center' }}>
+          <Typography color="text.secondary">
+            {listing.error || (filter ? 'No matching entries' : 'Empty directory')}
+          </Typography>
+        </Box>
+      ) : (
+        <Box sx={{ height: order.length * ROW_HEIGHT, position: 'relative' }}>{rows}</Box>
+      )}
+    </Box>
+  );
+}
+
+export default DirectoryList;
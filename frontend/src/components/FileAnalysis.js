@@ -0,0 +1,329 @@
+import React, { useState, useEffect, useRef, useMemo } from 'react';
+import {
+  Box,
+  Paper,
+  Typography,
+  TextField,
+  Button,
+  LinearProgress,
+  Tooltip,
+} from '@mui/material';
+import axios from 'axios';
+
+const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
+const MAP_HEIGHT = 80;
+const HISTOGRAM_HEIGHT = 80;
+const ROW_HEIGHT = 24;
+const OVERSCAN_ROWS = 10;
+// Blocks at or above this entropy (bits per byte) look compressed or encrypted
+const HIGH_ENTROPY = 7.2;
+
+const formatOffset = (offset) => `0x${offset.toString(16).toUpperCase().padStart(8, '0')}`;
+
+// Blue for low entropy through to red for random-looking data
+const entropyColor = (value) => `hsl(${Math.round(240 - (Math.min(value, 8) / 8) * 240)}, 80%, 50%)`;
+
+const drawEntropyMap = (canvas, entropy) => {
+  const context = canvas.getContext('2d');
+  const { width, height } = canvas;
+  context.clearRect(0, 0, width, height);
+  if (entropy.length === 0) return;
+  const barWidth = width / entropy.length;
+  entropy.forEach((value, i) => {
+    const barHeight = (value / 8) * height;
+    context.fillStyle = entropyColor(value);
+    context.fillRect(i * barWidth, height - barHeight, Math.max(barWidth, 1), barHeight);
+  });
+};
+
+// Counts are drawn on a log scale so rare byte values are still visible
+const drawHistogram = (canvas, histogram) => {
+  const context = canvas.getContext('2d');
+  const { width, height } = canvas;
+  context.clearRect(0, 0, width, height);
+  const peak = Math.log1p(Math.max(...histogram, 1));
+  const barWidth = width / 256;
+  context.fillStyle = '#1976d2';
+  histogram.forEach((count, value) => {
+    const barHeight = (Math.log1p(count) / peak) * height;
+    context.fillRect(value * barWidth, height - barHeight, Math.max(barWidth - 1, 1), barHeight);
+  });
+};
+
+const mergeAnalysis = (previous, data) => ({
+  size: data.size,
+  blockSize: data.block_size,
+  vectorized: data.vectorized,
+  entropy: previous ? previous.entropy.concat(data.entropy || []) : data.entropy || [],
+  histogram: data.histogram || null,
+  fileEntropy: data.file_entropy,
+  done: data.done,
+  error: data.error || null,
+});
+
+const mergeStrings = (previous, data) => ({
+  items: (previous ? previous.items : []).concat(data.strings || []),
+  done: data.done,
+  nextOffset: data.next_offset,
+  error: data.error || null,
+});
+
+/**
+ * Whole-file analytics computed on the agent: an entropy map and byte
+ * histogram from analyze_file, and the file's strings from extract_strings.
+ * Clicking a block or a string opens the hex view at its offset.
+ */
+function FileAnalysis({ file, agentId, socket, onJumpToOffset }) {
+  const [analysis, setAnalysis] = useState(null);
+  const [strings, setStrings] = useState(null);
+  const [minLength, setMinLength] = useState('4');
+  const [filter, setFilter] = useState('');
+  const [scrollTop, setScrollTop] = useState(0);
+  const [viewportHeight, setViewportHeight] = useState(400);
+  const [error, setError] = useState(null);
+  const analysisRequest = useRef(null);
+  const stringsRequest = useRef(null);
+  // Set while a POST is waiting for its request_id
+  const requesting = useRef({ analysis: false, strings: false });
+  // Replies that arrive before then, by request_id
+  const earlyReplies = useRef(new Map());
+  const mapRef = useRef(null);
+  const histogramRef = useRef(null);
+  const viewportRef = useRef(null);
+
+  // Results belong to one file
+  useEffect(() => {
+    analysisRequest.current = null;
+    stringsRequest.current = null;
+    earlyReplies.current.clear();
+    setAnalysis(null);
+    setStrings(null);
+    setError(null);
+  }, [agentId, file.path]);
+
+  useEffect(() => {
+    if (!socket) return undefined;
+    const keepEarly = (data) => {
+      const replies = earlyReplies.current.get(data.request_id) || [];
+      earlyReplies.current.set(data.request_id, replies.concat([data]));
+    };
+    // Replies of a superseded request are dropped
+    const onAnalysis = (data) => {
+      if (data.request_id === analysisRequest.current) {
+        setAnalysis((previous) => mergeAnalysis(previous, data));
+      } else if (requesting.current.analysis) {
+        keepEarly(data);
+      }
+    };
+    const onStrings = (data) => {
+      if (data.request_id === stringsRequest.current) {
+        setStrings((previous) => mergeStrings(previous, data));
+      } else if (requesting.current.strings) {
+        keepEarly(data);
+      }
+    };
+    socket.on('file_analysis_response', onAnalysis);
+    socket.on('file_strings_response', onStrings);
+    return () => {
+      socket.off('file_analysis_response', onAnalysis);
+      socket.off('file_strings_response', onStrings);
+    };
+  }, [socket]);
+
+  useEffect(() => {
+    if (mapRef.current && analysis) drawEntropyMap(mapRef.current, analysis.entropy);
+    if (histogramRef.current && analysis && analysis.histogram) drawHistogram(histogramRef.current, analysis.histogram);
+  }, [analysis]);
+
+  useEffect(() => {
+    const measure = () => {
+      if (viewportRef.current) setViewportHeight(viewportRef.current.clientHeight);
+    };
+    measure();
+    window.addEventListener('resize', measure);
+    return () => window.removeEventListener('resize', measure);
+  }, [strings !== null]);
+
+  const takeEarly = (requestId) => {
+    const replies = earlyReplies.current.get(requestId) || [];
+    earlyReplies.current.delete(requestId);
+    return replies;
+  };
+
+  const startAnalysis = async () => {
+    setError(null);
+    setAnalysis(null);
+    analysisRequest.current = null;
+    requesting.current.analysis = true;
+    try {
+      const response = await axios.post(`${API_BASE}/api/agents/${agentId}/analysis`, { path: file.path });
+      analysisRequest.current = response.data.request_id;
+      const early = takeEarly(analysisRequest.current);
+      setAnalysis(early.reduce(mergeAnalysis, { entropy: [], histogram: null, done: false, error: null }));
+    } catch (err) {
+      setError(err.response ? err.response.data.error : 'Agent unreachable');
+    }
+    requesting.current.analysis = false;
+  };
+
+  // offset continues a previous extraction that stopped at max_strings
+  const startStrings = async (offset) => {
+    setError(null);
+    stringsRequest.current = null;
+    requesting.current.strings = true;
+    try {
+      const response = await axios.post(`${API_BASE}/api/agents/${agentId}/strings`, {
+        path: file.path,
+        min_length: Number(minLength) || 4,
+        offset: offset || 0,
+      });
+      stringsRequest.current = response.data.request_id;
+      const early = takeEarly(stringsRequest.current);
+      setStrings((previous) => early.reduce(mergeStrings, {
+        items: offset && previous ? previous.items : [],
+        done: false,
+        nextOffset: null,
+        error: null,
+      }));
+    } catch (err) {
+      setError(err.response ? err.response.data.error : 'Agent unreachable');
+    }
+    requesting.current.strings = false;
+  };
+
+  const handleMapClick = (e) => {
+    if (!analysis || analysis.entropy.length === 0) return;
+    const rect = e.currentTarget.getBoundingClientRect();
+    const block = Math.floor(((e.clientX - rect.left) / rect.width) * analysis.entropy.length);
+    onJumpToOffset(block * analysis.blockSize);
+  };
+
+  const highBlocks = analysis ? analysis.entropy.filter((value) => value >= HIGH_ENTROPY).length : 0;
+
+  const matches = useMemo(() => {
+    if (!strings) return [];
+    const needle = filter.trim().toLowerCase();
+    return needle ? strings.items.filter((item) => item[2].toLowerCase().includes(needle)) : strings.items;
+  }, [strings, filter]);
+
+  const startRow = Math.max(Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN_ROWS, 0);
+  const endRow = Math.min(Math.ceil((scrollTop + viewportHeight) / ROW_HEIGHT) + OVERSCAN_ROWS, matches.length);
+  const rows = [];
+  for (let row = startRow; row < endRow; row++) {
+    const [offset, encoding, text, truncated] = matches[row];
+    rows.push(
+      <Box
+        key={`${offset}-${encoding}`}
+        onClick={() => onJumpToOffset(offset)}
+        sx={{
+          position: 'absolute',
+          top: row * ROW_HEIGHT,
+          left: 0,
+          right: 0,
+          height: ROW_HEIGHT,
+          lineHeight: `${ROW_HEIGHT}px`,
+          display: 'flex',
+          cursor: 'pointer',
+          '&:hover': { backgroundColor: 'action.hover' },
+        }}
+      >
+        <Box component="span" sx={{ width: 120, flexShrink: 0, color: 'text.secondary' }}>{formatOffset(offset)}</Box>
+        <Box component="span" sx={{ width: 80, flexShrink: 0, color: 'text.secondary' }}>
+          {encoding === 'ascii' ? 'ASCII' : 'UTF-16'}
+        </Box>
+        <Box component="span" sx={{ overflow: 'hidden', textOverflow: 'ellipsis', whiteSpace: 'pre' }}>
+          {text}{truncated ? '…' : ''}
+        </Box>
+      </Box>
+    );
+  }
+
+  return (
+    <Box sx={{ flex: 1, overflow: 'hidden', p: 2, display: 'flex', flexDirection: 'column' }}>
+      {error && <Typography color="error" gutterBottom>{error}</Typography>}
+
+      <Paper sx={{ p: 2, mb: 2 }}>
+        <Box sx={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', mb: 1 }}>
+          <Typography variant="subtitle1">Entropy map</Typography>
+          <Button variant="outlined" size="small" onClick={startAnalysis} disabled={analysis !== null && !analysis.done}>
+            {analysis ? 'Recompute' : 'Compute'}
+          </Button>
+        </Box>
+        {analysis && !analysis.done && <LinearProgress sx={{ mb: 1 }} />}
+        {analysis && analysis.error && <Typography color="error">{analysis.error}</Typography>}
+        {analysis && (
+          <>
+            <Tooltip title="Click a block to open it in the hex view" followCursor>
+              <canvas
+                ref={mapRef}
+                width={1024}
+                height={MAP_HEIGHT}
+                onClick={handleMapClick}
+                style={{ width: '100%', height: MAP_HEIGHT, cursor: 'pointer', background: '#f5f5f5' }}
+              />
+            </Tooltip>
+            {analysis.done && !analysis.error && (
+              <Typography variant="body2" color="text.secondary">
+                {analysis.entropy.length} blocks of {analysis.blockSize} bytes · file entropy {analysis.fileEntropy} bits/byte
+                {' · '}{highBlocks} blocks at or above {HIGH_ENTROPY} (compressed or encrypted)
+                {!analysis.vectorized && ' · computed without NumPy'}
+              </Typography>
+            )}
+            {analysis.histogram && (
+              <>
+                <Typography variant="subtitle2" sx={{ mt: 2 }}>Byte histogram (log scale, 0x00 to 0xFF)</Typography>
+                <canvas
+                  ref={histogramRef}
+                  width={1024}
+                  height={HISTOGRAM_HEIGHT}
+                  style={{ width: '100%', height: HISTOGRAM_HEIGHT, background: '#f5f5f5' }}
+                />
+              </>
+            )}
+          </>
+        )}
+      </Paper>
+
+      <Paper sx={{ p: 2, flex: 1, display: 'flex', flexDirection: 'column', minHeight: 0 }}>
+        <Box sx={{ display: 'flex', alignItems: 'center', mb: 1 }}>
+          <Typography variant="subtitle1" sx={{ flex: 1 }}>
+            Strings{strings && ` · ${matches.length}${filter ? ` of ${strings.items.length}` : ''}`}
+          </Typography>
+          <TextField
+            size="small"
+            label="Min length"
+            value={minLength}
+            onChange={(e) => setMinLength(e.target.value)}
+            sx={{ mr: 1, width: 100 }}
+          />
+          <TextField
+            size="small"
+            placeholder="Filter strings..."
+            value={filter}
+            onChange={(e) => setFilter(e.target.value)}
+            sx={{ mr: 1, width: 200 }}
+          />
+          {strings && strings.done && strings.nextOffset != null && (
+            <Button variant="outlined" size="small" onClick={() => startStrings(strings.nextOffset)} sx={{ mr: 1 }}>
+              More
+            </Button>
+          )}
+          <Button variant="outlined" size="small" onClick={() => startStrings(0)} disabled={strings !== null && !strings.done}>
+            Extract
+          </Button>
+        </Box>
+        {strings && !strings.done && <LinearProgress sx={{ mb: 1 }} />}
+        {strings && strings.error && <Typography color="error">{strings.error}</Typography>}
+        <Box
+          ref={viewportRef}
+          onScroll={(e) => setScrollTop(e.currentTarget.scrollTop)}
+          sx={{ flex: 1, overflow: 'auto', fontFamily: 'monospace', fontSize: 13 }}
+        >
+          <Box sx={{ height: matches.length * ROW_HEIGHT, position: 'relative' }}>{rows}</Box>
+        </Box>
+      </Paper>
+    </Box>
+  );
+}
+
+export default FileAnalysis;
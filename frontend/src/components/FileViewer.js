@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useMemo } from 'react';
 import {
   Box,
   Paper,
@@ -8,116 +8,404 @@ import {
   TextField,
   Button,
   IconButton,
-  Toolbar,
-  Divider,
-  Table,
-  TableBody,
-  TableCell,
-  TableContainer,
-  TableHead,
-  TableRow,
   Chip,
+  Tooltip,
 } from '@mui/material';
 import {
   ArrowUpward as ArrowUpwardIcon,
   ArrowDownward as ArrowDownwardIcon,
   Search as SearchIcon,
+  Download as DownloadIcon,
+  VerifiedUser as VerifiedUserIcon,
+  Storage as StorageIcon,
+  Sync as SyncIcon,
 } from '@mui/icons-material';
+import axios from 'axios';
+import FileAnalysis from './FileAnalysis';
 
-function FileViewer({ file, fileContent, onLoadChunk }) {
+const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
+// Same size as the agent's read_file chunks and the server's evidence pages
+const CHUNK_SIZE = 64 * 1024;
+const BYTES_PER_ROW = 16;
+const ROW_HEIGHT = 22;
+// Rows rendered above and below the visible ones
+const OVERSCAN_ROWS = 20;
+// Chunks fetched on each side of the visible ones, so scrolling across a boundary does not stall
+const PREFETCH_CHUNKS = 1;
+// Chunks kept in memory; those furthest from the view are dropped first
+const MAX_CACHED_CHUNKS = 256;
+// Browsers cap element heights, so very large files scroll through a scaled area
+const MAX_SCROLL_HEIGHT = 10000000;
+const MAX_SEARCH_HITS = 100000;
+
+const HEX = Array.from({ length: 256 }, (_, i) => i.toString(16).toUpperCase().padStart(2, '0'));
+const ASCII = Array.from({ length: 256 }, (_, i) => (i >= 32 && i <= 126 ? String.fromCharCode(i) : '.'));
+
+const hexToBytes = (hex) => {
+  const bytes = new Uint8Array(hex.length / 2);
+  for (let i = 0; i < bytes.length; i++) {
+    bytes[i] = parseInt(hex.substr(i * 2, 2), 16);
+  }
+  return bytes;
+};
+
+// "0x4d 5a" searches for bytes; anything else for its characters
+const parseSearchTerm = (term) => {
+  const hex = term.trim().toLowerCase();
+  if (hex.startsWith('0x')) {
+    const digits = hex.slice(2).replace(/\s+/g, '');
+    if (digits.length > 0 && digits.length % 2 === 0 && /^[0-9a-f]+$/.test(digits)) {
+      return hexToBytes(digits);
+    }
+  }
+  return Uint8Array.from(term, (c) => c.charCodeAt(0) & 0xff);
+};
+
+const findAll = (haystack, needle, base, hits) => {
+  const first = needle[0];
+  const last = haystack.length - needle.length;
+  for (let i = haystack.indexOf(first); i !== -1 && i <= last; i = haystack.indexOf(first, i + 1)) {
+    let j = 1;
+    while (j < needle.length && haystack[i + j] === needle[j]) j++;
+    if (j === needle.length) {
+      hits.push(base + i);
+      if (hits.length >= MAX_SEARCH_HITS) return;
+    }
+  }
+};
+
+// Index of the first hit >= offset in a sorted array
+const lowerBound = (hits, offset) => {
+  let lo = 0;
+  let hi = hits.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >> 1;
+    if (hits[mid] < offset) lo = mid + 1;
+    else hi = mid;
+  }
+  return lo;
+};
+
+const formatOffset = (offset) => `0x${offset.toString(16).toUpperCase().padStart(8, '0')}`;
+
+function FileViewer({ file, agentId, socket, evidence, ready, fromImage, onAcquire, onAnalyzeImage }) {
   const [activeTab, setActiveTab] = useState(0);
-  const [hexOffset, setHexOffset] = useState(0);
+  const [chunks, setChunks] = useState(new Map());
+  const [fileSize, setFileSize] = useState(file.size || 0);
+  const [error, setError] = useState(null);
+  const [scrollTop, setScrollTop] = useState(0);
+  const [viewportHeight, setViewportHeight] = useState(600);
   const [searchTerm, setSearchTerm] = useState('');
-  const [searchResults, setSearchResults] = useState([]);
+  const [searchHits, setSearchHits] = useState([]);
+  const [searchLength, setSearchLength] = useState(0);
+  const [hitIndex, setHitIndex] = useState(-1);
+  const [acquiring, setAcquiring] = useState(false);
+  const [gotoOffset, setGotoOffset] = useState('');
+  // Offset picked on the Analysis tab, scrolled to once the hex view is showing
+  const [pendingOffset, setPendingOffset] = useState(null);
+  const viewportRef = useRef(null);
+  // Chunks requested and not received, so each is asked for once
+  const requested = useRef(new Set());
+
+  const totalRows = Math.max(Math.ceil(fileSize / BYTES_PER_ROW), 1);
+  const visibleRows = Math.ceil(viewportHeight / ROW_HEIGHT);
+  const naturalHeight = totalRows * ROW_HEIGHT;
+  const scrollHeight = Math.min(naturalHeight, MAX_SCROLL_HEIGHT);
+  const scaled = naturalHeight > MAX_SCROLL_HEIGHT;
+  const maxFirstRow = Math.max(totalRows - visibleRows, 0);
+  const firstRow = scaled
+    ? Math.round((scrollTop / Math.max(scrollHeight - viewportHeight, 1)) * maxFirstRow)
+    : Math.floor(scrollTop / ROW_HEIGHT);
+  const startRow = Math.max(firstRow - OVERSCAN_ROWS, 0);
+  const endRow = Math.min(firstRow + visibleRows + OVERSCAN_ROWS, totalRows);
+  const firstChunk = Math.floor((firstRow * BYTES_PER_ROW) / CHUNK_SIZE);
+  const lastChunk = Math.floor((Math.min(firstRow + visibleRows, totalRows) * BYTES_PER_ROW - 1) / CHUNK_SIZE);
+  const lastFileChunk = Math.max(Math.ceil(fileSize / CHUNK_SIZE) - 1, 0);
+
+  const storeChunk = (chunkNumber, bytes, size) => {
+    requested.current.delete(chunkNumber);
+    setFileSize(size);
+    setChunks((current) => {
+      const next = new Map(current);
+      next.set(chunkNumber, bytes);
+      if (next.size > MAX_CACHED_CHUNKS) {
+        const farthest = [...next.keys()].sort((a, b) => Math.abs(b - chunkNumber) - Math.abs(a - chunkNumber));
+        farthest.slice(0, next.size - MAX_CACHED_CHUNKS).forEach((key) => next.delete(key));
+      }
+      return next;
+    });
+  };
 
+  // Start over when the source switches from the agent to stored evidence
   useEffect(() => {
-    if (fileContent && fileContent.chunk_number === 0) {
-      setHexOffset(0);
+    requested.current = new Set();
+    setChunks(new Map());
+    setError(null);
+    setSearchHits([]);
+    setHitIndex(-1);
+    setAcquiring(false);
+  }, [evidence && evidence.id]);
+
+  useEffect(() => {
+    if (!socket) return undefined;
+    const onContent = (data) => {
+      if (data.agent_id !== agentId || data.path !== file.path) return;
+      // A failed chunk stays marked as requested so it is not asked for again on every scroll
+      if (data.error) {
+        setError(data.error);
+        return;
+      }
+      storeChunk(data.chunk_number, hexToBytes(data.hex_data), data.file_size);
+    };
+    socket.on('file_content_response', onContent);
+    return () => socket.off('file_content_response', onContent);
+  }, [socket, agentId, file.path]);
+
+  const loadEvidencePage = async (page, acquisitionId) => {
+    try {
+      const response = await axios.get(
+        `${API_BASE}/api/agents/${agentId}/acquisitions/${acquisitionId}/pages/${page}`,
+        { params: { page_size: CHUNK_SIZE }, responseType: 'arraybuffer' }
+      );
+      storeChunk(page, new Uint8Array(response.data), Number(response.headers['x-file-size']));
+    } catch (err) {
+      setError('Failed to load evidence page');
     }
-  }, [fileContent]);
-
-  const formatHex = (hexString, offset = 0) => {
-    if (!hexString) return [];
-    const bytes = hexString.match(/.{1,2}/g) || [];
-    const rows = [];
-    const bytesPerRow = 16;
-
-    for (let i = 0; i < bytes.length; i += bytesPerRow) {
-      const rowBytes = bytes.slice(i, i + bytesPerRow);
-      const rowOffset = offset + i;
-      const hex = rowBytes.map((byte, idx) => {
-        const byteIndex = i + idx;
-        const isHighlighted = searchResults.includes(byteIndex);
-        return { value: byte, highlighted: isHighlighted };
-      }).join(' ');
-      const ascii = rowBytes.map(byte => {
-        const charCode = parseInt(byte, 16);
-        return charCode >= 32 && charCode <= 126 ? String.fromCharCode(charCode) : '.';
-      }).join('');
-
-      rows.push({
-        offset: rowOffset,
-        hex,
-        ascii,
-        bytes: rowBytes,
-      });
+  };
+
+  // Fetch the visible chunks and their neighbours
+  useEffect(() => {
+    if (!ready) return;
+    const from = Math.max(firstChunk - PREFETCH_CHUNKS, 0);
+    const to = Math.min(lastChunk + PREFETCH_CHUNKS, lastFileChunk);
+    for (let chunkNumber = from; chunkNumber <= to; chunkNumber++) {
+      if (chunks.has(chunkNumber) || requested.current.has(chunkNumber)) continue;
+      requested.current.add(chunkNumber);
+      if (evidence) {
+        loadEvidencePage(chunkNumber, evidence.id);
+      } else {
+        // The chunk arrives as file_content_response
+        axios.get(`${API_BASE}/api/agents/${agentId}/file`, { params: { path: file.path, chunk_number: chunkNumber } })
+          .catch((err) => setError(err.response ? err.response.data.error : 'Agent unreachable'));
+      }
     }
+  }, [ready, evidence, firstChunk, lastChunk, lastFileChunk, chunks]);
 
-    return rows;
+  useEffect(() => {
+    const measure = () => {
+      if (viewportRef.current) setViewportHeight(viewportRef.current.clientHeight);
+    };
+    measure();
+    window.addEventListener('resize', measure);
+    return () => window.removeEventListener('resize', measure);
+  }, [activeTab]);
+
+  const scrollToOffset = (offset) => {
+    const row = Math.floor(offset / BYTES_PER_ROW);
+    const top = scaled
+      ? (Math.min(row, maxFirstRow) / Math.max(maxFirstRow, 1)) * (scrollHeight - viewportHeight)
+      : row * ROW_HEIGHT;
+    if (viewportRef.current) viewportRef.current.scrollTop = top;
+    setScrollTop(top);
   };
 
+  useEffect(() => {
+    if (activeTab !== 0 || pendingOffset === null) return;
+    scrollToOffset(pendingOffset);
+    setPendingOffset(null);
+  }, [activeTab, pendingOffset]);
+
+  const showOffset = (offset) => {
+    setPendingOffset(Math.min(offset, Math.max(fileSize - 1, 0)));
+    setActiveTab(0);
+  };
+
+  const byteAt = (offset) => {
+    const chunk = chunks.get(Math.floor(offset / CHUNK_SIZE));
+    return chunk ? chunk[offset % CHUNK_SIZE] : undefined;
+  };
+
+  // Searches the loaded chunks; runs of adjacent chunks are joined so hits can span a boundary
   const handleSearch = () => {
-    if (!fileContent || !searchTerm) {
-      setSearchResults([]);
+    if (!searchTerm) {
+      setSearchHits([]);
+      setHitIndex(-1);
       return;
     }
+    const needle = parseSearchTerm(searchTerm);
+    const hits = [];
+    const loaded = [...chunks.keys()].sort((a, b) => a - b);
+    let run = [];
+    const flush = () => {
+      if (run.length === 0) return;
+      const length = run.reduce((sum, n) => sum + chunks.get(n).length, 0);
+      const joined = new Uint8Array(length);
+      let position = 0;
+      run.forEach((n) => {
+        joined.set(chunks.get(n), position);
+        position += chunks.get(n).length;
+      });
+      findAll(joined, needle, run[0] * CHUNK_SIZE, hits);
+      run = [];
+    };
+    loaded.forEach((n) => {
+      if (run.length > 0 && n !== run[run.length - 1] + 1) flush();
+      run.push(n);
+    });
+    flush();
+    setSearchLength(needle.length);
+    setSearchHits(hits);
+    setHitIndex(hits.length > 0 ? 0 : -1);
+    if (hits.length > 0) scrollToOffset(hits[0]);
+  };
 
-    const hexString = fileContent.hex_data || '';
-    const searchBytes = searchTerm
-      .split('')
-      .map(c => c.charCodeAt(0).toString(16).padStart(2, '0'))
-      .join('');
-
-    const results = [];
-    let index = hexString.indexOf(searchBytes);
-    while (index !== -1) {
-      results.push(Math.floor(index / 2));
-      index = hexString.indexOf(searchBytes, index + 1);
-    }
+  const jumpToHit = (step) => {
+    if (searchHits.length === 0) return;
+    const next = (hitIndex + step + searchHits.length) % searchHits.length;
+    setHitIndex(next);
+    scrollToOffset(searchHits[next]);
+  };
 
-    setSearchResults(results);
+  const handleGoto = () => {
+    const value = gotoOffset.trim().toLowerCase();
+    const offset = value.startsWith('0x') ? parseInt(value.slice(2), 16) : parseInt(value, 10);
+    if (Number.isNaN(offset) || offset < 0 || offset >= fileSize) return;
+    scrollToOffset(offset);
   };
 
-  const handlePrevChunk = () => {
-    if (fileContent && fileContent.chunk_number > 0) {
-      const newChunk = fileContent.chunk_number - 1;
-      onLoadChunk(file.path, newChunk);
-    }
+  const handleAcquire = (options) => {
+    setAcquiring(true);
+    onAcquire(file.path, options);
   };
 
-  const handleNextChunk = () => {
-    if (fileContent && fileContent.offset + fileContent.size < fileContent.file_size) {
-      const newChunk = fileContent.chunk_number + 1;
-      onLoadChunk(file.path, newChunk);
+  // Only the hits inside the rendered rows are expanded into highlighted offsets
+  const highlighted = useMemo(() => {
+    const marks = new Set();
+    if (searchHits.length === 0) return marks;
+    const start = startRow * BYTES_PER_ROW;
+    const end = endRow * BYTES_PER_ROW;
+    for (let i = lowerBound(searchHits, start - searchLength + 1); i < searchHits.length && searchHits[i] < end; i++) {
+      for (let offset = searchHits[i]; offset < searchHits[i] + searchLength; offset++) {
+        marks.add(offset);
+      }
+    }
+    return marks;
+  }, [searchHits, searchLength, startRow, endRow]);
+
+  const renderRow = (row) => {
+    const rowOffset = row * BYTES_PER_ROW;
+    const count = Math.min(BYTES_PER_ROW, fileSize - rowOffset);
+    const values = [];
+    for (let i = 0; i < count; i++) values.push(byteAt(rowOffset + i));
+    const loaded = values.every((value) => value !== undefined);
+    let hex;
+    if (!loaded) {
+      hex = '·· '.repeat(count);
+    } else if (values.some((_, i) => highlighted.has(rowOffset + i))) {
+      hex = values.map((value, i) => (
+        <span key={i} style={{ backgroundColor: highlighted.has(rowOffset + i) ? '#ffeb3b' : 'transparent' }}>
+          {HEX[value]}{' '}
+        </span>
+      ));
+    } else {
+      hex = values.map((value) => HEX[value]).join(' ') + ' ';
     }
+    return (
+      <Box key={row} sx={{ display: 'flex', height: ROW_HEIGHT, lineHeight: `${ROW_HEIGHT}px` }}>
+        <Box component="span" sx={{ width: 120, color: 'text.secondary' }}>{formatOffset(rowOffset)}</Box>
+        <Box component="span" sx={{ width: 420 }}>{hex}</Box>
+        <Box component="span">{loaded ? values.map((value) => ASCII[value]).join('') : ''}</Box>
+      </Box>
+    );
   };
 
-  const hexRows = fileContent ? formatHex(fileContent.hex_data, fileContent.offset || 0) : [];
+  const rows = [];
+  if (fileSize > 0) {
+    for (let row = startRow; row < endRow; row++) rows.push(renderRow(row));
+  }
+  // Rows are laid out from startRow; in a scaled area they follow the scroll position instead
+  const rowsTop = scaled ? Math.max(scrollTop - (firstRow - startRow) * ROW_HEIGHT, 0) : startRow * ROW_HEIGHT;
+  const textChunk = chunks.get(firstChunk);
 
   return (
     <Box sx={{ height: '100%', display: 'flex', flexDirection: 'column' }}>
       <Paper sx={{ p: 2 }}>
         <Box sx={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', mb: 2 }}>
-          <Typography variant="h6">{file.name}</Typography>
           <Box>
-            <TextField
-              size="small"
-              placeholder="Search..."
-              value={searchTerm}
-              onChange={(e) => setSearchTerm(e.target.value)}
-              onKeyPress={(e) => e.key === 'Enter' && handleSearch()}
-              sx={{ mr: 1, width: 200 }}
-            />
+            <Typography variant="h6">{file.name}</Typography>
+            {evidence ? (
+              <Chip
+                icon={<VerifiedUserIcon />}
+                label={`Verified evidence · SHA-256 ${evidence.sha256.slice(0, 16)}…`}
+                color="success"
+                size="small"
+              />
+            ) : (
+              <Chip label={fromImage ? 'From disk image' : 'Live from agent'} size="small" />
+            )}
+          </Box>
+          <Box sx={{ display: 'flex', alignItems: 'center' }}>
+            {evidence && (
+              <>
+                <Button
+                  variant="outlined"
+                  size="small"
+                  href={`${API_BASE}/api/agents/${agentId}/acquisitions/${evidence.id}/content`}
+                  startIcon={<DownloadIcon />}
+                  sx={{ mr: 1 }}
+                >
+                  Download
+                </Button>
+                <Tooltip title="Open this file as a raw disk image and browse its partitions">
+                  <Button
+                    variant="outlined"
+                    size="small"
+                    onClick={() => onAnalyzeImage(evidence)}
+                    startIcon={<StorageIcon />}
+                    sx={{ mr: 1 }}
+                  >
+                    Analyze image
+                  </Button>
+                </Tooltip>
+                {!fromImage && (
+                  <Tooltip title="Acquire the file again, sending only the blocks that changed since this copy">
+                    <span>
+                      <Button
+                        variant="outlined"
+                        size="small"
+                        onClick={() => handleAcquire({ base_id: evidence.id })}
+                        disabled={acquiring}
+                        startIcon={<SyncIcon />}
+                        sx={{ mr: 1 }}
+                      >
+                        {acquiring ? 'Acquiring…' : 'Re-acquire changes'}
+                      </Button>
+                    </span>
+                  </Tooltip>
+                )}
+              </>
+            )}
+            {!evidence && !fromImage && (
+              <Button
+                variant="outlined"
+                size="small"
+                onClick={() => handleAcquire()}
+                disabled={acquiring || Boolean(file.archive_member)}
+                sx={{ mr: 1 }}
+              >
+                {acquiring ? 'Acquiring…' : 'Acquire'}
+              </Button>
+            )}
+            <Tooltip title="Searches the loaded part of the file; prefix with 0x to search for bytes">
+              <TextField
+                size="small"
+                placeholder="Search..."
+                value={searchTerm}
+                onChange={(e) => setSearchTerm(e.target.value)}
+                onKeyPress={(e) => e.key === 'Enter' && handleSearch()}
+                sx={{ mr: 1, width: 200 }}
+              />
+            </Tooltip>
             <Button variant="outlined" size="small" onClick={handleSearch} startIcon={<SearchIcon />}>
               Search
             </Button>
@@ -127,120 +415,66 @@ function FileViewer({ file, fileContent, onLoadChunk }) {
         <Tabs value={activeTab} onChange={(e, newValue) => setActiveTab(newValue)}>
           <Tab label="Hex View" />
           <Tab label="Text View" />
+          {!fromImage && <Tab label="Analysis" />}
         </Tabs>
       </Paper>
 
-      <Box sx={{ flex: 1, overflow: 'auto', p: 2 }}>
-        {activeTab === 0 ? (
-          <Box>
-            <Box sx={{ mb: 2, display: 'flex', justifyContent: 'space-between', alignItems: 'center' }}>
-              <Box>
-                <Typography variant="body2" color="text.secondary">
-                  Offset: {fileContent ? `0x${(fileContent.offset || 0).toString(16).toUpperCase().padStart(8, '0')}` : 'N/A'}
-                  {' / '}
-                  Size: {fileContent ? `${fileContent.file_size} bytes (0x${fileContent.file_size.toString(16).toUpperCase()})` : 'N/A'}
-                </Typography>
-              </Box>
-              <Box>
-                <IconButton
-                  size="small"
-                  onClick={handlePrevChunk}
-                  disabled={!fileContent || (fileContent.offset || 0) === 0}
-                >
-                  <ArrowUpwardIcon />
-                </IconButton>
-                <IconButton
-                  size="small"
-                  onClick={handleNextChunk}
-                  disabled={!fileContent || fileContent.offset + fileContent.size >= fileContent.file_size}
-                >
-                  <ArrowDownwardIcon />
-                </IconButton>
-              </Box>
-            </Box>
-
-            <TableContainer>
-              <Table size="small">
-                <TableHead>
-                  <TableRow>
-                    <TableCell sx={{ width: 120 }}>Offset</TableCell>
-                    <TableCell sx={{ width: 400 }}>Hex</TableCell>
-                    <TableCell>ASCII</TableCell>
-                  </TableRow>
-                </TableHead>
-                <TableBody>
-                  {hexRows.map((row, index) => (
-                    <TableRow key={index} hover>
-                      <TableCell>
-                        <Typography variant="body2" fontFamily="monospace">
-                          0x{row.offset.toString(16).toUpperCase().padStart(8, '0')}
-                        </Typography>
-                      </TableCell>
-                      <TableCell>
-                        <Typography variant="body2" fontFamily="monospace" component="span">
-                          {row.hex.split(' ').map((byte, idx) => {
-                            const byteIndex = row.offset + idx;
-                            const isHighlighted = searchResults.includes(byteIndex);
-                            return (
-                              <span
-                                key={idx}
-                                style={{
-                                  backgroundColor: isHighlighted ? '#ffeb3b' : 'transparent',
-                                  padding: '2px 4px',
-                                  marginRight: '4px',
-                                }}
-                              >
-                                {byte}
-                              </span>
-                            );
-                          })}
-                        </Typography>
-                      </TableCell>
-                      <TableCell>
-                        <Typography variant="body2" fontFamily="monospace">
-                          {row.ascii}
-                        </Typography>
-                      </TableCell>
-                    </TableRow>
-                  ))}
-                </TableBody>
-              </Table>
-            </TableContainer>
-
-            {hexRows.length === 0 && (
-              <Box sx={{ textAlign: 'center', py: 4 }}>
-                <Typography color="text.secondary">No data available</Typography>
-              </Box>
-            )}
-          </Box>
-        ) : (
-          <Box>
-            <Typography variant="body2" color="text.secondary" gutterBottom>
-              Text View
-            </Typography>
-            <Paper sx={{ p: 2, fontFamily: 'monospace', whiteSpace: 'pre-wrap', backgroundColor: '#1e1e1e', color: '#d4d4d4' }}>
-              {fileContent ? (
-                (() => {
-                  try {
-                    const bytes = fileContent.hex_data.match(/.{1,2}/g) || [];
-                    return bytes.map(byte => {
-                      const charCode = parseInt(byte, 16);
-                      return charCode >= 32 && charCode <= 126 ? String.fromCharCode(charCode) : '.';
-                    }).join('');
-                  } catch (e) {
-                    return 'Unable to decode text content';
-                  }
-                })()
-              ) : (
-                'No content loaded'
-              )}
-            </Paper>
-          </Box>
-        )}
+      <Box sx={{ px: 2, py: 1, display: 'flex', justifyContent: 'space-between', alignItems: 'center' }}>
+        <Typography variant="body2" color="text.secondary">
+          Offset: {formatOffset(firstRow * BYTES_PER_ROW)}
+          {' / '}
+          Size: {`${fileSize} bytes (0x${fileSize.toString(16).toUpperCase()})`}
+          {searchHits.length > 0 && ` · Hit ${hitIndex + 1} of ${searchHits.length}`}
+          {error && ` · ${error}`}
+        </Typography>
+        <Box sx={{ display: 'flex', alignItems: 'center' }}>
+          <TextField
+            size="small"
+            placeholder="Go to offset (0x…)"
+            value={gotoOffset}
+            onChange={(e) => setGotoOffset(e.target.value)}
+            onKeyPress={(e) => e.key === 'Enter' && handleGoto()}
+            sx={{ mr: 1, width: 170 }}
+          />
+          <IconButton size="small" onClick={() => jumpToHit(-1)} disabled={searchHits.length === 0}>
+            <ArrowUpwardIcon />
+          </IconButton>
+          <IconButton size="small" onClick={() => jumpToHit(1)} disabled={searchHits.length === 0}>
+            <ArrowDownwardIcon />
+          </IconButton>
+        </Box>
       </Box>
+
+      {activeTab === 0 ? (
+        <Box
+          ref={viewportRef}
+          onScroll={(e) => setScrollTop(e.currentTarget.scrollTop)}
+          sx={{ flex: 1, overflow: 'auto', px: 2, fontFamily: 'monospace', fontSize: 14, whiteSpace: 'pre' }}
+        >
+          {fileSize === 0 ? (
+            <Box sx={{ textAlign: 'center', py: 4 }}>
+              <Typography color="text.secondary">No data available</Typography>
+            </Box>
+          ) : (
+            <Box sx={{ height: scrollHeight, position: 'relative' }}>
+              <Box sx={{ position: 'absolute', top: rowsTop, left: 0, right: 0 }}>{rows}</Box>
+            </Box>
+          )}
+        </Box>
+      ) : activeTab === 2 ? (
+        <FileAnalysis file={file} agentId={agentId} socket={socket} onJumpToOffset={showOffset} />
+      ) : (
+        <Box sx={{ flex: 1, overflow: 'auto', p: 2 }}>
+          <Typography variant="body2" color="text.secondary" gutterBottom>
+            Text View · {formatOffset(firstChunk * CHUNK_SIZE)}
+          </Typography>
+          <Paper sx={{ p: 2, fontFamily: 'monospace', whiteSpace: 'pre-wrap', backgroundColor: '#1e1e1e', color: '#d4d4d4' }}>
+            {textChunk ? Array.from(textChunk, (value) => ASCII[value]).join('') : 'No content loaded'}
+          </Paper>
+        </Box>
+      )}
     </Box>
   );
 }
 
 export default FileViewer;
-
@@ -0,0 +1,194 @@
+import React, { useState, useEffect } from 'react';
+import {
+  Box,
+  Button,
+  Chip,
+  Dialog,
+  DialogContent,
+  DialogTitle,
+  FormControl,
+  InputLabel,
+  LinearProgress,
+  MenuItem,
+  Select,
+  Table,
+  TableBody,
+  TableCell,
+  TableContainer,
+  TableHead,
+  TableRow,
+  Typography,
+} from '@mui/material';
+import axios from 'axios';
+
+const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
+
+// Only this many rows are rendered; the summary still counts every change
+const MAX_VISIBLE_CHANGES = 1000;
+
+const CHANGE_COLORS = {
+  added: 'success',
+  removed: 'error',
+  modified: 'warning',
+  renamed: 'info',
+};
+
+function SnapshotDiff({ socket, agentId, open, onClose }) {
+  const [snapshots, setSnapshots] = useState([]);
+  const [base, setBase] = useState('');
+  const [target, setTarget] = useState('');
+  const [changes, setChanges] = useState([]);
+  const [summary, setSummary] = useState(null);
+  const [running, setRunning] = useState(false);
+  const [error, setError] = useState(null);
+
+  const fetchSnapshots = async () => {
+    try {
+      const response = await axios.get(`${API_BASE}/api/agents/${agentId}/snapshots`);
+      setSnapshots(response.data);
+      if (response.data.length >= 2) {
+        setTarget(response.data[0].id);
+        setBase(response.data[1].id);
+      }
+    } catch (err) {
+      console.error('Failed to fetch snapshots:', err);
+    }
+  };
+
+  useEffect(() => {
+    if (open) {
+      fetchSnapshots();
+    }
+  }, [open, agentId]);
+
+  useEffect(() => {
+    if (!socket) return undefined;
+
+    const onBatch = (data) => {
+      if (data.agent_id !== agentId) return;
+      setChanges((previous) => (
+        previous.length >= MAX_VISIBLE_CHANGES
+          ? previous
+          : previous.concat(data.changes.slice(0, MAX_VISIBLE_CHANGES - previous.length))
+      ));
+    };
+    const onComplete = (data) => {
+      if (data.agent_id !== agentId) return;
+      setRunning(false);
+      if (data.error) {
+        setError(data.error);
+      } else {
+        setSummary(data.summary);
+      }
+    };
+
+    socket.on('snapshot_diff_batch', onBatch);
+    socket.on('snapshot_diff_complete', onComplete);
+    return () => {
+      socket.off('snapshot_diff_batch', onBatch);
+      socket.off('snapshot_diff_complete', onComplete);
+    };
+  }, [socket, agentId]);
+
+  const handleCompare = () => {
+    setChanges([]);
+    setSummary(null);
+    setError(null);
+    setRunning(true);
+    socket.emit('diff_snapshots', { agent_id: agentId, base, target });
+  };
+
+  const handleTakeSnapshot = async () => {
+    try {
+      await axios.post(`${API_BASE}/api/agents/${agentId}/snapshots`, { path: '/' });
+      fetchSnapshots();
+    } catch (err) {
+      setError('Failed to create snapshot');
+    }
+  };
+
+  const formatSnapshot = (snapshot) => (
+    `${new Date(snapshot.created_at).toLocaleString()} — ${snapshot.root} (${snapshot.entry_count} entries)`
+  );
+
+  return (
+    <Dialog open={open} onClose={onClose} maxWidth="lg" fullWidth>
+      <DialogTitle>Changes Between Snapshots</DialogTitle>
+      <DialogContent>
+        <Box sx={{ display: 'flex', gap: 2, alignItems: 'center', mt: 1, mb: 2 }}>
+          <FormControl size="small" sx={{ flex: 1 }}>
+            <InputLabel>Base</InputLabel>
+            <Select value={base} label="Base" onChange={(e) => setBase(e.target.value)}>
+              {snapshots.map((snapshot) => (
+                <MenuItem key={snapshot.id} value={snapshot.id}>{formatSnapshot(snapshot)}</MenuItem>
+              ))}
+            </Select>
+          </FormControl>
+          <FormControl size="small" sx={{ flex: 1 }}>
+            <InputLabel>Target</InputLabel>
+            <Select value={target} label="Target" onChange={(e) => setTarget(e.target.value)}>
+              {snapshots.map((snapshot) => (
+                <MenuItem key={snapshot.id} value={snapshot.id}>{formatSnapshot(snapshot)}</MenuItem>
+              ))}
+            </Select>
+          </FormControl>
+          <Button variant="outlined" onClick={handleTakeSnapshot}>
+            Take Snapshot
+          </Button>
+          <Button variant="contained" onClick={handleCompare} disabled={!base || !target || running}>
+            Compare
+          </Button>
+        </Box>
+
+        {running && <LinearProgress sx={{ mb: 2 }} />}
+        {error && (
+          <Typography color="error" sx={{ mb: 2 }}>{error}</Typography>
+        )}
+        {summary && (
+          <Box sx={{ display: 'flex', gap: 1, mb: 2 }}>
+            {Object.keys(CHANGE_COLORS).map((type) => (
+              <Chip key={type} label={`${type}: ${summary[type]}`} color={CHANGE_COLORS[type]} size="small" />
+            ))}
+          </Box>
+        )}
+
+        <TableContainer sx={{ maxHeight: 500 }}>
+          <Table size="small" stickyHeader>
+            <TableHead>
+              <TableRow>
+                <TableCell sx={{ width: 110 }}>Change</TableCell>
+                <TableCell>Path</TableCell>
+                <TableCell>Details</TableCell>
+              </TableRow>
+            </TableHead>
+            <TableBody>
+              {changes.map((change, index) => (
+                <TableRow key={index}>
+                  <TableCell>
+                    <Chip label={change.type} color={CHANGE_COLORS[change.type]} size="small" />
+                  </TableCell>
+                  <TableCell>
+                    <Typography variant="body2" fontFamily="monospace">{change.path}</Typography>
+                  </TableCell>
+                  <TableCell>
+                    <Typography variant="caption">
+                      {change.type === 'renamed' && `from ${change.old.path}`}
+                      {change.fields && change.fields.length > 0 && ` ${change.fields.join(', ')}`}
+                    </Typography>
+                  </TableCell>
+                </TableRow>
+              ))}
+            </TableBody>
+          </Table>
+        </TableContainer>
+        {summary && changes.length >= MAX_VISIBLE_CHANGES && (
+          <Typography variant="caption" color="text.secondary">
+            Showing the first {MAX_VISIBLE_CHANGES} changes.
+          </Typography>
+        )}
+      </DialogContent>
+    </Dialog>
+  );
+}
+
+export default SnapshotDiff;